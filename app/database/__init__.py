@@ -9,10 +9,13 @@ from app.database.filtering_repository import FilteringRepository
 from app.database.label_template_repository import LabelTemplateRepository
 from app.database.cluster_repository import ClusterRepository
 from app.database.cluster_unit_repository import ClusterUnitRepository
+from app.database.comment_repository import CommentRepository
 from app.database.experiment_repository import ExperimentRepository
 from app.database.openrouter_data_repository import OpenRouterDataRepository
 from app.database.post_repository import PostRepository
+from app.database.prediction_repository import PredictionRepository
 from app.database.prompt_repository import PromptRepository
+from app.database.reddit_search_repository import RedditSearchRepository
 from app.database.sample_repository import SampleRepository
 from app.database.scraper_cluster_repository import ScraperClusterRepository
 from app.database.scraper_repository import ScraperRepository
@@ -20,14 +23,27 @@ from app.database.user_repository import UserRepository
 
 
 DATABASE_OPTIONS = CodecOptions[Any](tz_aware=True)
+DATABASE_NAME = "reddit_scraper"
+from app.database.storage import STORAGE_BACKENDS, get_memory_database
+from app.utils.configuration import get_env_variable
 from app.utils.extensions import mongo
 
 
+def get_storage_backend() -> str:
+    storage_backend = get_env_variable("STORAGE_BACKEND", str, "mongodb")
+    if storage_backend not in STORAGE_BACKENDS:
+        raise Exception(f"Unknown STORAGE_BACKEND '{storage_backend}', expected one of {STORAGE_BACKENDS}")
+    return storage_backend
+
+
 def _get_db() -> Database:
     db = getattr(g, "_database", None)
 
     if db is None:
-        db = g._database = mongo.cx["reddit_scraper"]
+        if get_storage_backend() == "memory":
+            db = g._database = get_memory_database()
+        else:
+            db = g._database = mongo.cx[DATABASE_NAME]
 
     return db
 
@@ -37,6 +53,18 @@ def get_post_repository() -> PostRepository:
 
     return g.post_repository
 
+def get_comment_repository() -> CommentRepository:
+    if not hasattr(g, "comment_repository"):
+        g.comment_repository = CommentRepository(_get_db())
+
+    return g.comment_repository
+
+def get_reddit_search_repository() -> RedditSearchRepository:
+    if not hasattr(g, "reddit_search_repository"):
+        g.reddit_search_repository = RedditSearchRepository(_get_db())
+
+    return g.reddit_search_repository
+
 def get_user_repository() -> UserRepository:
     if not hasattr(g, "user_repository"):
         g.user_repository = UserRepository(_get_db())
@@ -101,4 +129,9 @@ def get_filtering_repository() -> FilteringRepository:
     if not hasattr(g, "filtering_repository"):
         g.filtering_repository = FilteringRepository(_get_db())
     
-    return g.filtering_repository
\ No newline at end of file
+    return g.filtering_repository
+def get_prediction_repository() -> PredictionRepository:
+    if not hasattr(g, "prediction_repository"):
+        g.prediction_repository = PredictionRepository(_get_db())
+
+    return g.prediction_repository
@@ -1,24 +1,75 @@
-from typing import Any, Dict, List, Literal, Mapping, Type, Optional
+import base64
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, ClassVar, Dict, Iterator, List, Literal, Mapping, Sequence, Tuple, Type, Optional
 
 import pymongo
+from bson import json_util
 from flask_pymongo.wrappers import Database
 from pydantic import BaseModel
 from pymongo.results import InsertOneResult, UpdateResult, InsertManyResult, BulkWriteResult
-from pymongo import ReplaceOne
+from pymongo import ASCENDING, IndexModel, ReplaceOne
 
-from app.database.entities.base_entity import BaseEntity, PyObjectId
+from app.database.entities.base_entity import BaseEntity, EntityView, PyObjectId
+from app.database.entity_cache import EntityCache
+from app.database.trusted_decode import decode_trusted
 from app.utils import utc_timestamp
 
 
+def soft_delete_index(keys: Sequence[Tuple[str, int]], **kwargs: Any) -> IndexModel:
+    """index for a query path that goes through BaseRepository._soft_delete_filter, deleted_at is added as the last key.
+    A partial index on deleted_at null cannot serve the `deleted_at: None` filter (it also matches a missing field),
+    an equality on the trailing key can"""
+    return IndexModel(list(keys) + [("deleted_at", ASCENDING)], **kwargs)
+
+
+class InvalidPageToken(ValueError):
+    """an "after" token that was not created by encode_after_token, a client error"""
+
+
+def encode_after_token(sort_value: Any, last_id: PyObjectId) -> str:
+    """the opaque "after" token of keyset pagination: the sort value and _id of the last document of a page"""
+    return base64.urlsafe_b64encode(json_util.dumps([sort_value, last_id]).encode()).decode()
+
+
+def decode_after_token(after: str) -> Tuple[Any, PyObjectId]:
+    try:
+        sort_value, last_id = json_util.loads(base64.urlsafe_b64decode(after.encode()))
+    except (ValueError, TypeError) as error:
+        raise InvalidPageToken(f"invalid pagination token: {after}") from error
+    return sort_value, last_id
+
+
 class PaginatedEntities[T: BaseEntity](BaseModel):
     content: List[T]
     total_size: int
 
 
+class KeysetPage[T: BaseModel](BaseModel):
+    content: List[T]
+    next_after: Optional[str] = None # None on the last page
+    estimated_total_size: Optional[int] = None # only if requested
+
+
 class BaseRepository[T: BaseEntity]:
+    # the indexes of the collection, applied once at startup by app.database.indexes
+    indexes: ClassVar[List[IndexModel]] = []
+    # decode documents with app.database.trusted_decode instead of model_validate. Only for entities whose validators
+    # only check or normalize input, as the validators are skipped
+    trusted_decode: ClassVar[bool] = False
+    # the count of find_after stops here, above it the exact number is not worth a scan
+    max_estimated_count: ClassVar[int] = 100_000
+    # process-wide read-through cache of find_by_id, only for entities that rarely change. The writes below invalidate it,
+    # so writes that bypass them (self.collection) must call _invalidate_cache themselves
+    cache: ClassVar[Optional[EntityCache]] = None
+
     def __init__(self, database: Database, model_class: Type[T], collection_name: str):
         self.db = database
         self.model_class = model_class
+        # debug: the fraction of trusted decodes that is also validated and compared
+        # read from the environment (loaded by the configuration at startup) so that a repository can also be created outside of flask
+        self.trusted_decode_verify_rate = float(os.getenv("TRUSTED_DECODE_VERIFY_RATE", "0")) if self.trusted_decode else 0.0
 
         from app.database import DATABASE_OPTIONS
         self.collection = self.db.get_collection(collection_name, DATABASE_OPTIONS)
@@ -27,9 +78,10 @@ class BaseRepository[T: BaseEntity]:
         data = item.dump_for_database()
         return self.collection.insert_one(data)
     
-    def insert_list_entities(self, items: List[T]) -> InsertManyResult:
+    def insert_list_entities(self, items: List[T], ordered: bool = True) -> InsertManyResult:
+        """with ordered=False mongodb inserts the documents in parallel and continues after a failed document"""
         data_list = [item.dump_for_database() for item in items]
-        return self.collection.insert_many(data_list)
+        return self.collection.insert_many(data_list, ordered=ordered)
     
     def upsert_list_entities(self, items: List[T]) -> BulkWriteResult:
         operations = [
@@ -40,7 +92,9 @@ class BaseRepository[T: BaseEntity]:
             )
             for item in items
         ]
-        return self.collection.bulk_write(operations)
+        result = self.collection.bulk_write(operations)
+        self._invalidate_cache([item.id for item in items])
+        return result
 
 
     def find(self, filter: Dict[str, Any]) -> List[T]:
@@ -73,6 +127,63 @@ class BaseRepository[T: BaseEntity]:
 
         return PaginatedEntities(content=entities, total_size=total_size)
 
+    def find_after[V: EntityView](self,
+                                   filter: Dict[str, Any],
+                                   sort_field: str = "_id",
+                                   direction: int = pymongo.ASCENDING,
+                                   after: Optional[str] = None,
+                                   size: int = 100,
+                                   with_count: bool = False,
+                                   view_class: Optional[Type[V]] = None) -> KeysetPage[T] | KeysetPage[V]:
+        """Keyset pagination: returns the page of size documents that comes after the "after" token of the previous page.
+        Unlike find_sort with skip, a deep page costs the same as the first page, the query continues from the (sort_field, _id)
+        of the last document with an index seek. _id is the tie breaker so that equal sort values are never skipped or repeated.
+        The total size is only counted if with_count, as an estimate: the collection metadata when there is no filter, otherwise a count capped at max_estimated_count"""
+        if size < 1:
+            raise ValueError(f"the page size must be at least 1, size = {size}")
+        filter_with_soft_delete = self._soft_delete_filter(filter)
+        page_filter = filter_with_soft_delete
+        if after:
+            sort_value, last_id = decode_after_token(after)
+            comparison = "$gt" if direction == pymongo.ASCENDING else "$lt"
+            if sort_field == "_id":
+                keyset_filter = {"_id": {comparison: last_id}}
+            else:
+                keyset_filter = {"$or": [{sort_field: {comparison: sort_value}},
+                                         {sort_field: sort_value, "_id": {comparison: last_id}}]}
+            page_filter = {"$and": [filter_with_soft_delete, keyset_filter]}
+
+        sort = [(sort_field, direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+        projection = view_class.projection() if view_class else None
+        if projection is not None and sort_field != "_id":
+            projection[sort_field] = 1
+        # one document more than the page to know whether there is a next page
+        documents = list(self.collection.find(page_filter, projection).sort(sort).limit(size + 1))
+        has_next_page = len(documents) > size
+        documents = documents[:size]
+
+        next_after = None
+        if has_next_page:
+            next_after = encode_after_token(documents[-1].get(sort_field), documents[-1]["_id"])
+
+        estimated_total_size = None
+        if with_count:
+            if filter:
+                estimated_total_size = self.collection.count_documents(filter_with_soft_delete, limit=self.max_estimated_count)
+            else:
+                estimated_total_size = self.collection.estimated_document_count()
+
+        return KeysetPage(content=self._decode_batch(documents, view_class), next_after=next_after, estimated_total_size=estimated_total_size)
+
+    def count_facets(self, filter: Dict[str, Any], facet_filters: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        """counts the documents of the filter that also match each of the facet filters, in one aggregation.
+        An empty facet filter counts all documents of the filter"""
+        facets = {facet_name: ([{"$match": facet_filter}] if facet_filter else []) + [{"$count": "count"}]
+                  for facet_name, facet_filter in facet_filters.items()}
+        pipeline = [{"$match": self._soft_delete_filter(filter)}, {"$facet": facets}]
+        result = next(self.collection.aggregate(pipeline), dict())
+        return {facet_name: (result.get(facet_name) or [{"count": 0}])[0]["count"] for facet_name in facet_filters}
+
     def find_one(self, filter: Dict[str, Any], fields: list[str] | None = None) -> T | None:
         projection = None
         if fields:
@@ -90,7 +201,16 @@ class BaseRepository[T: BaseEntity]:
         return self._convert_to_entity(document)
 
     def find_by_id(self, id: PyObjectId, fields: list[str] | None = None) -> T | None:
-        return self.find_one({"_id": id}, fields)
+        if self.cache is None or not self.cache.enabled or fields:
+            return self.find_one({"_id": id}, fields)
+
+        document = self.cache.get(id)
+        if document is None:
+            document = self.collection.find_one(self._soft_delete_filter({"_id": id}))
+            if not document:
+                return None
+            self.cache.set(id, document)
+        return self._convert_to_entity(document)
       
     def find_many_by_ids(self, ids: List[PyObjectId]) -> List[T]:
         filter = {"_id": {"$in": ids}}
@@ -99,6 +219,83 @@ class BaseRepository[T: BaseEntity]:
         
         return [self._convert_to_entity(document) for document in documents]
 
+    def find_documents_by_ids(self, ids: List[PyObjectId]) -> List[Mapping[str, Any]]:
+        """the raw documents of the ids in one query, for callers that decode them elsewhere (e.g. in a worker process)"""
+        return list(self.collection.find(self._soft_delete_filter({"_id": {"$in": ids}})))
+
+    def find_view[V: EntityView](self, filter: Dict[str, Any], view_class: Type[V]) -> List[V]:
+        """Finds the documents matching the filter, but only loads the fields of the view_class.
+        Use this when only a few (small) fields of the entity are needed"""
+        cursor = self.collection.find(self._soft_delete_filter(filter), view_class.projection())
+        return [view_class.model_validate(document) for document in cursor]
+
+    def find_many_by_ids_view[V: EntityView](self, ids: List[PyObjectId], view_class: Type[V]) -> List[V]:
+        """find_many_by_ids, but only loads the fields of the view_class"""
+        return self.find_view({"_id": {"$in": ids}}, view_class)
+
+    def iter_find[V: EntityView](self,
+                                  filter: Dict[str, Any],
+                                  batch_size: int = 500,
+                                  view_class: Optional[Type[V]] = None,
+                                  decode_workers: int = 0) -> Iterator[T] | Iterator[V]:
+        """Streams the documents matching the filter in _id order, instead of loading them all into a list like find.
+        Every batch of batch_size documents is its own query continuing after the last _id, so no cursor is kept open
+        while the caller works on a batch (a slow consumer cannot hit the cursor timeout). If view_class is given, only its
+        fields are projected. With decode_workers > 0 the batches are decoded in a thread pool while the next batch is fetched,
+        at most decode_workers + 1 batches are held in memory"""
+        projection = view_class.projection() if view_class else None
+        yield from self._iter_decoded_batches(self.iter_document_batches(filter, projection, batch_size), view_class, decode_workers)
+
+    def iter_document_batches(self,
+                              filter: Dict[str, Any],
+                              projection: Optional[Dict[str, Any]] = None,
+                              batch_size: int = 500) -> Iterator[List[Mapping[str, Any]]]:
+        """The raw documents of iter_find in batches of batch_size, for consumers that convert the documents themselves (e.g. the exports)"""
+        filter_with_soft_delete = self._soft_delete_filter(filter)
+        last_id = None
+        while True:
+            batch_filter = filter_with_soft_delete if last_id is None else {"$and": [filter_with_soft_delete, {"_id": {"$gt": last_id}}]}
+            batch = list(self.collection.find(batch_filter, projection).sort("_id", pymongo.ASCENDING).limit(batch_size))
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1]["_id"]
+
+    def iter_many_by_ids[V: EntityView](self,
+                                         ids: List[PyObjectId],
+                                         batch_size: int = 500,
+                                         view_class: Optional[Type[V]] = None,
+                                         decode_workers: int = 0) -> Iterator[T] | Iterator[V]:
+        """Streams the entities of the ids, the ids are queried per batch_size so the $in stays small"""
+        for batch_start in range(0, len(ids), batch_size):
+            yield from self.iter_find({"_id": {"$in": ids[batch_start:batch_start + batch_size]}},
+                                      batch_size=batch_size,
+                                      view_class=view_class,
+                                      decode_workers=decode_workers)
+
+    def _iter_decoded_batches(self, batches: Iterator[List[Mapping[str, Any]]], view_class: Optional[Type[EntityView]], decode_workers: int) -> Iterator[Any]:
+        if decode_workers <= 0:
+            for batch in batches:
+                yield from self._decode_batch(batch, view_class)
+            return
+
+        with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append(executor.submit(self._decode_batch, batch, view_class))
+                if len(pending) > decode_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def _decode_batch(self, documents: List[Mapping[str, Any]], view_class: Optional[Type[EntityView]] = None) -> List[Any]:
+        """decodes one batch of a stream, repositories that join data on read override this"""
+        if view_class:
+            return [view_class.model_validate(document) for document in documents]
+        return [self._convert_to_entity(document) for document in documents]
+
     def update(self, id: PyObjectId, to_update: Mapping[str, Any] | T) -> UpdateResult:
         if isinstance(to_update, BaseEntity):  # Cannot do 'isinstance(..., T)' so we use BaseEntity instead.
             to_update = dict(to_update.dump_for_database())
@@ -106,7 +303,9 @@ class BaseRepository[T: BaseEntity]:
         to_update["updated_at"] = utc_timestamp()
 
         filter = self._soft_delete_filter({"_id": id})
-        return self.collection.update_one(filter, {"$set": to_update})
+        result = self.collection.update_one(filter, {"$set": to_update})
+        self._invalidate_cache([id])
+        return result
     
     def update_many(self, filter: Dict[str, Any], to_update: Mapping[str, Any] | T) -> UpdateResult:
         """
@@ -125,12 +324,16 @@ class BaseRepository[T: BaseEntity]:
         to_update["updated_at"] = utc_timestamp()
 
         filter_with_soft_delete = self._soft_delete_filter(filter)
-        return self.collection.update_many(filter_with_soft_delete, {"$set": to_update})
+        result = self.collection.update_many(filter_with_soft_delete, {"$set": to_update})
+        self._invalidate_cache_filter(filter)
+        return result
 
     def delete(self, id: PyObjectId) -> UpdateResult:
         return self.update(id, {"deleted_at": utc_timestamp()})
 
     def _convert_to_entity(self, obj: Mapping[str, Any]) -> T:
+        if self.trusted_decode:
+            return decode_trusted(self.model_class, obj, self.trusted_decode_verify_rate)
         return self.model_class.model_validate(obj)
 
     def _soft_delete_filter(self, existing_filter: Dict[str, Any]) -> Dict[str, Any]:
@@ -160,7 +363,25 @@ class BaseRepository[T: BaseEntity]:
         """
         filter_with_soft_delete = self._soft_delete_filter(filter)
         if isinstance(list_element_to_append, (set, list)):
-            return self.collection.update_one(filter_with_soft_delete, {"$push": {mongo_db_variable_path: {"$each": list_element_to_append}}})
+            result = self.collection.update_one(filter_with_soft_delete, {"$push": {mongo_db_variable_path: {"$each": list_element_to_append}}})
+        else:
+            result = self.collection.update_one(filter_with_soft_delete, {"$push": {mongo_db_variable_path: list_element_to_append}})
+        self._invalidate_cache_filter(filter)
+        return result
+
+    def _invalidate_cache(self, ids: List[PyObjectId]) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(ids)
+
+    def _invalidate_cache_filter(self, filter: Dict[str, Any]) -> None:
+        """invalidates the ids of an _id filter, for any other filter the whole cache of the entity"""
+        if self.cache is None:
+            return
+        id_filter = filter.get("_id")
+        if isinstance(id_filter, str):
+            self.cache.invalidate([id_filter])
+        elif isinstance(id_filter, Mapping) and list(id_filter) == ["$in"]:
+            self.cache.invalidate(id_filter["$in"])
         else:
-            return self.collection.update_one(filter_with_soft_delete, {"$push": {mongo_db_variable_path: list_element_to_append}})
+            self.cache.clear()
 
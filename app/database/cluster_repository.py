@@ -1,10 +1,21 @@
+from typing import List
 
 from flask_pymongo.wrappers import Database
 
 from app.database.base_repository import BaseRepository
+from app.database.entities.base_entity import PyObjectId
 from app.database.entities.cluster_entity import ClusterEntity
+from app.utils.types import StatusType
 
 class ClusterRepository(BaseRepository[ClusterEntity]):
     def __init__(self, database: Database):
         super().__init__(database, ClusterEntity, "cluster")
 
+    def update_post_prep_statuses(self, cluster_entity_id: PyObjectId, post_ids: List[PyObjectId], status: StatusType):
+        """sets the prep status of the posts in post_entity_ids_prep_status in a single update, the checkpoint of a prepared batch of posts"""
+        if not post_ids:
+            return None
+        filter = self._soft_delete_filter({"_id": cluster_entity_id})
+        result = self.collection.update_one(filter, {"$set": {f"post_entity_ids_prep_status.{post_id}": status for post_id in post_ids}})
+        self._invalidate_cache([cluster_entity_id])
+        return result
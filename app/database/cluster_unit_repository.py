@@ -1,11 +1,14 @@
 
-from typing import Any, Dict, List, Mapping, Optional
+from typing import Any, Dict, List, Literal, Mapping, Optional, Set, Type
 from flask_pymongo.wrappers import Database
-from pymongo import UpdateOne
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.results import InsertManyResult, UpdateResult
 
-from app.database.base_repository import BaseRepository
-from app.database.entities.base_entity import PyObjectId
+from app.database.base_repository import BaseRepository, soft_delete_index
+from app.database.entities.base_entity import EntityView, PyObjectId
 from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitEntityPredictedCategory
+from app.database.entities.label_template import LabelTemplateTruthProjection
+from app.database.prediction_repository import PredictionRepository
 from app.utils import utc_timestamp
 from app.utils.logging_config import get_logger
 
@@ -14,43 +17,141 @@ logger = get_logger(__name__)
 
 
 class ClusterUnitRepository(BaseRepository[ClusterUnitEntity]):
+    """The predictions of the experiments live in the prediction collection (PredictionRepository), they are joined into
+    predicted_category when the cluster units are read. predicted_category that is still embedded in old cluster unit documents
+    is used as fallback for experiments that have no documents in the prediction collection"""
+    indexes = [
+        # all the cluster units of a cluster, of a post in a cluster (sampling) and of a type (bertopic)
+        soft_delete_index([("cluster_entity_id", ASCENDING), ("post_id", ASCENDING), ("type", ASCENDING)]),
+        soft_delete_index([("cluster_entity_id", ASCENDING), ("type", ASCENDING)]),
+        # keyset pages of the cluster units of a cluster, most upvoted first
+        soft_delete_index([("cluster_entity_id", ASCENDING), ("upvotes", DESCENDING), ("_id", DESCENDING)]),
+    ]
+
+    trusted_decode = True
+
     def __init__(self, database: Database):
         super().__init__(database, ClusterUnitEntity, "cluster_unit")
-        self.collection.create_index({"cluster_entity_id": 1}) # To speed up the lookup for to find all the cluster units
+        self.prediction_repository = PredictionRepository(database)
 
     def _convert_to_entity(self, obj: Mapping[str, Any]) -> ClusterUnitEntity:
         """Override to ensure None values in ground_truth nested fields are preserved during deserialization"""
+        if self.trusted_decode:
+            return super()._convert_to_entity(obj)
         # Use model_validate with context to preserve None values
         return ClusterUnitEntity.model_validate(obj, strict=False, context={"preserve_none": True})
 
+    def find(self, filter: Dict[str, Any]) -> List[ClusterUnitEntity]:
+        return self.attach_predictions(super().find(filter))
+
+    def find_many_by_ids(self, ids: List[PyObjectId]) -> List[ClusterUnitEntity]:
+        return self.attach_predictions(super().find_many_by_ids(ids))
+
+    def find_one(self, filter: Dict[str, Any], fields: list[str] | None = None) -> ClusterUnitEntity | None:
+        cluster_unit_entity = super().find_one(filter, fields)
+        if isinstance(cluster_unit_entity, ClusterUnitEntity):
+            self.attach_predictions([cluster_unit_entity])
+        return cluster_unit_entity
+
+    def _decode_batch(self, documents: List[Mapping[str, Any]], view_class: Optional[Type[EntityView]] = None) -> List[Any]:
+        decoded = super()._decode_batch(documents, view_class)
+        return decoded if view_class else self.attach_predictions(decoded)
+
+    def update(self, id: PyObjectId, to_update: Mapping[str, Any] | ClusterUnitEntity) -> UpdateResult:
+        """Override so that updating a cluster unit never writes the joined predictions back into the cluster unit document"""
+        if isinstance(to_update, ClusterUnitEntity):
+            to_update = dict(to_update.dump_for_database())
+            del to_update["_id"]
+            del to_update["predicted_category"]
+        return super().update(id, to_update)
+
+    def attach_predictions(self, cluster_unit_entities: List[ClusterUnitEntity], experiment_ids: Optional[List[PyObjectId]] = None) -> List[ClusterUnitEntity]:
+        """joins the predictions of the prediction collection into predicted_category of the cluster units (in place), for all experiments
+        when experiment_ids is None. Predictions in the prediction collection take precedence over the legacy embedded ones"""
+        if not cluster_unit_entities or experiment_ids == []:
+            return cluster_unit_entities
+
+        predicted_categories = self.prediction_repository.find_predicted_categories(cluster_unit_ids=[cluster_unit_entity.id for cluster_unit_entity in cluster_unit_entities],
+                                                                                    experiment_ids=experiment_ids)
+        for cluster_unit_entity in cluster_unit_entities:
+            unit_predicted_categories = predicted_categories.get(cluster_unit_entity.id)
+            if not unit_predicted_categories:
+                continue
+            if cluster_unit_entity.predicted_category is None:
+                cluster_unit_entity.predicted_category = dict()
+            cluster_unit_entity.predicted_category.update(unit_predicted_categories)
+        return cluster_unit_entities
+
+    def _predicted_category_projection(self, experiment_ids: List[PyObjectId]) -> Dict[str, Literal[1]]:
+        """projection of all the fields of the cluster unit, but only the (legacy embedded) predictions of the given experiments"""
+        projection = {field_info.alias or field_name: 1 for field_name, field_info in ClusterUnitEntity.model_fields.items() if field_name != "predicted_category"}
+        projection.update({f"predicted_category.{experiment_id}": 1 for experiment_id in experiment_ids})
+        return projection
+
+    def find_with_predictions(self, filter: Dict[str, Any], experiment_ids: List[PyObjectId]) -> List[ClusterUnitEntity]:
+        """find, but predicted_category only contains the predictions of the given experiment_ids (an empty list loads no predictions).
+        A cluster unit that has been through many experiments is mostly predictions, so this is much lighter than find"""
+        cursor = self.collection.find(self._soft_delete_filter(filter), self._predicted_category_projection(experiment_ids))
+        cluster_unit_entities = [self._convert_to_entity(document) for document in cursor]
+        return self.attach_predictions(cluster_unit_entities, experiment_ids)
+
+    def find_many_by_ids_with_predictions(self, ids: List[PyObjectId], experiment_ids: List[PyObjectId]) -> List[ClusterUnitEntity]:
+        """find_many_by_ids, but only with the predictions of the given experiment_ids"""
+        return self.find_with_predictions({"_id": {"$in": ids}}, experiment_ids)
+
+    @staticmethod
+    def _label_switch(label_expressions: Mapping[str, Any], default_expression: Any) -> Any:
+        """expression that picks the expression of the current label ($$label.k) of a $map over the ground truth values"""
+        if not label_expressions:
+            return default_expression
+        return {"$switch": {"branches": [{"case": {"$eq": ["$$label.k", label_name]}, "then": expression} for label_name, expression in label_expressions.items()],
+                            "default": default_expression}}
+
+    @staticmethod
+    def ground_truth_values_pipeline(label_template_id: PyObjectId,
+                                     set_values: Optional[Mapping[str, Any]] = None,
+                                     none_default_values: Optional[Mapping[str, Any]] = None,
+                                     none_default_value: Any = None) -> List[Dict[str, Any]]:
+        """aggregation pipeline update of the ground truth values of a label template, so that the server rewrites the values without a read first.
+        Labels in set_values get that value (and are created when missing), every other label with a None value gets its
+        value from none_default_values, or none_default_value when the label is not in there"""
+        set_values = set_values or dict()
+        values_path = f"ground_truth.{label_template_id}.values"
+
+        none_default_expression = ClusterUnitRepository._label_switch({label_name: {"$literal": value} for label_name, value in (none_default_values or dict()).items()},
+                                                                      {"$literal": none_default_value})
+        kept_or_default_expression = {"$cond": [{"$in": [{"$type": "$$label.v.value"}, ["missing", "null"]]}, none_default_expression, "$$label.v.value"]}
+        new_value_expression = ClusterUnitRepository._label_switch({label_name: {"$literal": value} for label_name, value in set_values.items()},
+                                                                   kept_or_default_expression)
+        updated_values = {"$arrayToObject": {"$map": {
+            "input": {"$objectToArray": {"$ifNull": [f"${values_path}", {}]}},
+            "as": "label",
+            "in": {"k": "$$label.k",
+                   "v": {"$cond": [{"$eq": [{"$type": "$$label.v"}, "object"]}, {"$mergeObjects": ["$$label.v", {"value": new_value_expression}]}, "$$label.v"]}}}}}
+        if set_values:
+            # labels that do not exist yet come from the first object, existing labels are overwritten by their updated version
+            updated_values = {"$mergeObjects": [{label_name: {"value": {"$literal": value}} for label_name, value in set_values.items()}, updated_values]}
+        return [{"$set": {values_path: updated_values}}]
+
     def update_ground_truth_category(self, cluster_unit_entity_id: PyObjectId, label_template_id: PyObjectId, ground_truth_category: str, ground_truth: bool, per_label_name: Optional[str]= None, per_label_value: Optional[Any] = None):
+        """sets the ground truth of a label and converts all other None values of the label template to False, in one pipeline update"""
         filter = {"_id": cluster_unit_entity_id}
-
-        # First, get the current document to find all None values
-        doc = self.collection.find_one(filter, {f"ground_truth.{label_template_id}.values": 1})
-
-        if not doc or "ground_truth" not in doc or str(label_template_id) not in doc["ground_truth"]:
-            # If the structure doesn't exist, just do a simple update
-            update_path = f"ground_truth.{label_template_id}.values.{ground_truth_category}.value"
-            return self.collection.update_one(filter, {"$set": {update_path: ground_truth}})
-
-        # Build update operations: set the target value and convert all None values to False
-        update_ops = {}
-        values = doc["ground_truth"][str(label_template_id)].get("values", {})
-
-        # Set the target category to the provided value
-        target_path = f"ground_truth.{label_template_id}.values.{ground_truth_category}.value"
-        update_ops[target_path] = ground_truth
-
-        # Convert all None values to False (excluding the target category we're updating)
-        for category, category_data in values.items():
-            if category != ground_truth_category and isinstance(category_data, dict):
-                if category_data.get("value") is None:
-                    none_path = f"ground_truth.{label_template_id}.values.{category}.value"
-                    update_ops[none_path] = False
-
-        # Perform single atomic update with all changes
-        return self.collection.update_one(filter, {"$set": update_ops})
+        pipeline = self.ground_truth_values_pipeline(label_template_id=label_template_id,
+                                                     set_values={ground_truth_category: ground_truth},
+                                                     none_default_value=False)
+        return self.collection.update_one(filter, pipeline)
+
+    def initialize_ground_truths(self, cluster_unit_ids: List[PyObjectId], label_template_id: PyObjectId, ground_truth_field: LabelTemplateTruthProjection) -> int:
+        """adds the empty ground truth field of the label template to the cluster units that do not have it yet, in one update_many.
+        Returns the number of cluster units that got the ground truth"""
+        if not cluster_unit_ids:
+            return 0
+        filter = {"_id": {"$in": cluster_unit_ids}, f"ground_truth.{label_template_id}": None}
+        # $mergeObjects ignores a null ground_truth, so this also works for cluster units without any ground truth
+        pipeline = [{"$set": {"ground_truth": {"$mergeObjects": ["$ground_truth", {"$literal": {str(label_template_id): ground_truth_field.model_dump()}}]}}}]
+        result = self.collection.update_many(self._soft_delete_filter(filter), pipeline)
+        logger.info(f"[initialize_ground_truths] initialized the ground truth of {result.modified_count} cluster units for label_template_id={label_template_id}")
+        return result.modified_count
     
     def update_ground_truth_category_per_label(self, cluster_unit_entity_id: PyObjectId, label_template_id: PyObjectId, ground_truth_category: str, per_label_name: str, per_label_value: Any):
         filter = {"_id": cluster_unit_entity_id}
@@ -60,35 +161,20 @@ class ClusterUnitRepository(BaseRepository[ClusterUnitEntity]):
         
     
     def insert_predicted_category(self, cluster_unit_entity_id: PyObjectId, experiment_id: PyObjectId, cluster_unit_predicted_categories: ClusterUnitEntityPredictedCategory):
-        filter = {"_id": cluster_unit_entity_id}
-
-        # First, check if the field is null and initialize it as an empty dictionary if needed
-        # This handles the case where predicted_category exists but is null
-        self.collection.update_one(
-            {"_id": cluster_unit_entity_id, "predicted_category": None},
-            {"$set": {"predicted_category": {}}}
-        )
-
-        # Now set the prediction for this specific experiment_id as a dictionary key
-        # This uses dot notation to set a specific key in the dictionary
-        update = {
-            "$set": {
-                f"predicted_category.{str(experiment_id)}": cluster_unit_predicted_categories.model_dump(by_alias=True)
-            }
-        }
-
-        return self.collection.update_one(filter, update)
-    
+        """writes the runs of a single cluster unit to the prediction collection"""
+        return self.prediction_repository.upsert_predicted_categories(experiment_id=experiment_id,
+                                                                      predictions_map={cluster_unit_entity_id: cluster_unit_predicted_categories})
 
     def delete_predicted_category(self, cluster_unit_entity_ids: List[PyObjectId], experiment_id: PyObjectId):
-        filter = {"_id": {"$in": cluster_unit_entity_ids}}
-        
-        # check if the predicted category even 
-        deleted_result =  self.collection.update_many(
+        """deletes all predictions of the experiment with one indexed delete_many, and unsets the legacy embedded predictions of the cluster units"""
+        deleted_result = self.prediction_repository.delete_many_by_experiment_id(experiment_id=experiment_id)
+
+        filter = {"_id": {"$in": cluster_unit_entity_ids}, f"predicted_category.{experiment_id}": {"$exists": True}}
+        legacy_deleted_result = self.collection.update_many(
             filter,
             {"$unset": { f"predicted_category.{experiment_id}": ""}}
         )
-        return deleted_result.modified_count
+        return deleted_result.deleted_count + legacy_deleted_result.modified_count
 
     async def insert_many_predicted_categories(
         self,
@@ -96,44 +182,47 @@ class ClusterUnitRepository(BaseRepository[ClusterUnitEntity]):
         predictions_map: Dict[PyObjectId, ClusterUnitEntityPredictedCategory]
     ):
         """
-        Insert many predicted categories
+        Insert many predicted categories, one document per run in the prediction collection
         """
       
         logger.info(f"inserting predictions_map of unit length = {len(predictions_map)}")
-        # Use a single bulk write with upsert to handle both init and update
-        bulk_ops = [
-            UpdateOne(
-                {"_id": cluster_unit_id},
-                [  # Using pipeline update for conditional logic
-                    {
-                        "$set": {
-                            "predicted_category": {
-                                "$mergeObjects": [
-                                    {"$ifNull": ["$predicted_category", {}]},
-                                    {str(experiment_id): predictions.model_dump(by_alias=True)}
-                                ]
-                            }
-                        }
-                    }
-                ],
-                upsert=False
-            )
-            for cluster_unit_id, predictions in predictions_map.items()
-        ]
-        
         # Single database call for everything!
-        result_write = self.collection.bulk_write(bulk_ops, ordered=False)
-        inserted_count = result_write.inserted_count
-        logger.info(f"inserted a total of {inserted_count} predictions. During {experiment_id} experiment")
+        result_write = self.prediction_repository.upsert_predicted_categories(experiment_id=experiment_id, predictions_map=predictions_map)
+        upserted_count = result_write.upserted_count if result_write else 0
+        logger.info(f"inserted a total of {upserted_count} predictions. During {experiment_id} experiment")
         return 
     
+    def find_predicted_label_values(self, cluster_unit_ids: List[PyObjectId], experiment_ids: List[PyObjectId]) -> List[Dict[str, Any]]:
+        """loads the predicted label values of multiple experiments for the given units in a single query per collection.
+        Only the label values of the runs are projected, the rest of the cluster unit is left out.
+        Returns raw documents: {_id, predicted_category: {experiment_id: {predicted_categories: [{labels_prediction: {values}}]}}}"""
+        projection = {"_id": 1}
+        projection.update({f"predicted_category.{experiment_id}.predicted_categories.labels_prediction.values": 1 for experiment_id in experiment_ids})
+        filter = {"_id": {"$in": cluster_unit_ids}}
+        documents = list(self.collection.find(self._soft_delete_filter(filter), projection))
+
+        # runs in the prediction collection replace the legacy embedded runs of the same experiment
+        runs_per_unit_experiment: Dict[PyObjectId, Dict[PyObjectId, List[Dict[str, Any]]]] = dict()
+        for prediction_document in sorted(self.prediction_repository.find_label_values(cluster_unit_ids=cluster_unit_ids, experiment_ids=experiment_ids),
+                                          key=lambda prediction_document: prediction_document["run_index"]):
+            unit_runs = runs_per_unit_experiment.setdefault(prediction_document["cluster_unit_id"], dict())
+            unit_runs.setdefault(prediction_document["experiment_id"], list()).append(prediction_document.get("prediction") or {})
+
+        for document in documents:
+            for experiment_id, runs in runs_per_unit_experiment.get(document["_id"], {}).items():
+                if not isinstance(document.get("predicted_category"), dict):
+                    document["predicted_category"] = dict()
+                document["predicted_category"][str(experiment_id)] = {"predicted_categories": runs}
+        return documents
+
     def set_none_ground_truths_to_false(self, cluster_unit_ids: List[PyObjectId], label_template_id: PyObjectId, labels_default_values: Dict[str, bool | str | int]):
         """
-        Set all ground truth values that are None to False for multiple cluster units.
+        Set all ground truth values that are None to False for multiple cluster units, with a single pipeline update_many.
 
         Args:
             cluster_unit_ids: List of cluster unit IDs to update
             label_template_id: The label template ID to update ground truths for
+            labels_default_values: The value per label name that replaces None
 
         Returns:
             Number of cluster units updated
@@ -147,39 +236,25 @@ class ClusterUnitRepository(BaseRepository[ClusterUnitEntity]):
             f"with label_template_id={label_template_id}"
         )
 
-        updated_count = 0
-
-        # Process each cluster unit
-        for cluster_unit_id in cluster_unit_ids:
-            # Get the current document to find None values
-            doc = self.collection.find_one(
-                {"_id": cluster_unit_id},
-                {f"ground_truth.{label_template_id}.values": 1}
-            )
-
-            if not doc or "ground_truth" not in doc or str(label_template_id) not in doc["ground_truth"]:
-                # No ground truth exists for this label template, skip
-                continue
+        filter = {"_id": {"$in": cluster_unit_ids}, f"ground_truth.{label_template_id}": {"$exists": True}}
+        pipeline = self.ground_truth_values_pipeline(label_template_id=label_template_id, none_default_values=labels_default_values)
+        result = self.collection.update_many(filter, pipeline)
+        updated_count = result.modified_count
 
-            # Find all None values and build update operations
-            update_ops = {}
-            values = doc["ground_truth"][str(label_template_id)].get("values", {})
+        logger.info(f"Updated {updated_count} cluster units (set None ground truths to False)")
+        return updated_count
 
-            for category, category_data in values.items():
-                if isinstance(category_data, dict) and category_data.get("value") is None:
-                    update_path = f"ground_truth.{label_template_id}.values.{category}.value"
-                    update_ops[update_path] = labels_default_values.get(category)
+    def find_converted_post_ids(self, cluster_entity_id: PyObjectId) -> Set[PyObjectId]:
+        """the ids of the posts that already have cluster units in the cluster, only the post_id values are read"""
+        return set(self.collection.distinct("post_id", self._soft_delete_filter({"cluster_entity_id": cluster_entity_id})))
 
-            # If there are updates to make, execute them
-            if update_ops:
-                self.collection.update_one(
-                    {"_id": cluster_unit_id},
-                    {"$set": update_ops}
-                )
-                updated_count += 1
+    def count_by_cluster_entity_id(self, cluster_entity_id: PyObjectId) -> int:
+        return self.collection.count_documents(self._soft_delete_filter({"cluster_entity_id": cluster_entity_id}))
 
-        logger.info(f"Updated {updated_count} cluster units (set None ground truths to False)")
-        return updated_count
+    def insert_documents(self, documents: List[Mapping[str, Any]]) -> InsertManyResult:
+        """inserts cluster units that are already dumped for the database (dump_for_database), e.g. by worker processes,
+        unordered so mongodb inserts them in parallel"""
+        return self.collection.insert_many(documents, ordered=False)
 
     def delete_many_by_cluster_enity_id(self, cluster_entity_id: PyObjectId):
         """Delete all cluster units associated with a specific cluster entity"""
@@ -213,8 +288,8 @@ class ClusterUnitRepository(BaseRepository[ClusterUnitEntity]):
         current_time = utc_timestamp()
 
         for unit in cluster_units:
-            # Get entity data and remove _id
-            update_data = {k: v for k, v in unit.dump_for_database().items() if k != "_id"}
+            # Get entity data and remove _id, the predictions are stored in the prediction collection
+            update_data = {k: v for k, v in unit.dump_for_database().items() if k not in ("_id", "predicted_category")}
             # Add updated_at timestamp
             update_data["updated_at"] = current_time
 
@@ -0,0 +1,62 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Mapping
+
+from flask_pymongo.wrappers import Database
+
+from pymongo import ASCENDING, DeleteMany, InsertOne, UpdateOne
+
+from app.database.base_repository import BaseRepository, soft_delete_index
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.comment_row_entity import CommentRowEntity, subtree_path_range
+
+
+class CommentRepository(BaseRepository[CommentRowEntity]):
+    """the comment rows of the posts with the flat comments layout"""
+    indexes = [
+        soft_delete_index([("post_id", ASCENDING), ("path", ASCENDING)]), # find_post_rows, find_subtree_rows
+    ]
+
+    def __init__(self, database: Database):
+        super().__init__(database, CommentRowEntity, "comment")
+
+    def find_post_rows(self, post_id: PyObjectId) -> List[CommentRowEntity]:
+        """all the comment rows of the post in thread order"""
+        cursor = self.collection.find(self._soft_delete_filter({"post_id": post_id})).sort("path", ASCENDING)
+        return self._decode_batch(list(cursor))
+
+    def find_post_rows_documents(self, post_ids: List[PyObjectId]) -> Dict[PyObjectId, List[Mapping[str, Any]]]:
+        """the raw documents of the comment rows of the posts in thread order by post, in one query.
+        For consumers that decode the rows themselves, e.g. in the worker processes of the cluster preparation"""
+        rows_per_post: Dict[PyObjectId, List[Mapping[str, Any]]] = defaultdict(list)
+        if not post_ids:
+            return rows_per_post
+        cursor = self.collection.find(self._soft_delete_filter({"post_id": {"$in": post_ids}})).sort([("post_id", ASCENDING), ("path", ASCENDING)])
+        for document in cursor:
+            rows_per_post[document["post_id"]].append(document)
+        return rows_per_post
+
+    def find_subtree_rows(self, post_id: PyObjectId, path: str) -> List[CommentRowEntity]:
+        """the comment at path and all its nested replies in thread order, a range scan on the (post_id, path) index"""
+        lower_path, upper_path = subtree_path_range(path)
+        filter = {"post_id": post_id, "path": {"$gte": lower_path, "$lt": upper_path}}
+        cursor = self.collection.find(self._soft_delete_filter(filter)).sort("path", ASCENDING)
+        return self._decode_batch(list(cursor))
+
+    def replace_post_rows(self, post_ids: List[PyObjectId], rows: List[CommentRowEntity]):
+        """replaces all the comment rows of the posts with rows in one bulk write, e.g. when the posts are inserted or renewed"""
+        operations = [DeleteMany({"post_id": {"$in": post_ids}})] + [InsertOne(row.dump_for_database()) for row in rows]
+        return self.collection.bulk_write(operations, ordered=True)
+
+    def replace_subtree_rows(self, post_id: PyObjectId, path: str, rows: List[CommentRowEntity]):
+        """replaces the rows of the subtree at path with rows (e.g. from flatten_comment_subtree), the rest of the post is not touched"""
+        lower_path, upper_path = subtree_path_range(path)
+        operations = [DeleteMany({"post_id": post_id, "path": {"$gte": lower_path, "$lt": upper_path}})] + [InsertOne(row.dump_for_database()) for row in rows]
+        return self.collection.bulk_write(operations, ordered=True)
+
+    def update_rows(self, row_updates: Mapping[PyObjectId, Mapping[str, Any]], new_rows: List[CommentRowEntity]):
+        """sets the changed fields of existing rows and inserts the new rows in one bulk write, the other rows are not touched"""
+        operations = [UpdateOne({"_id": row_id}, {"$set": dict(to_update)}) for row_id, to_update in row_updates.items()]
+        operations += [InsertOne(row.dump_for_database()) for row in new_rows]
+        if not operations:
+            return None
+        return self.collection.bulk_write(operations, ordered=False)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Any, Mapping, Optional
+from typing import Any, Dict, Literal, Mapping, Optional
 
 from bson import ObjectId
 from pydantic import BaseModel, Field
@@ -24,3 +24,20 @@ class BaseEntity(BaseModel):
 
     class Config:
         populate_by_name = True
+
+
+class EntityView(BaseModel):
+    """
+    A lightweight, read only subset of the fields of an entity.
+    Subclasses declare only the fields they need, the repository projects on exactly those fields
+    so that the rest of the document is never sent over the wire nor validated.
+    """
+    id: PyObjectId = Field(alias='_id')
+
+    @classmethod
+    def projection(cls) -> Dict[str, Literal[1]]:
+        """The mongodb projection of the view, based on the (aliased) field names"""
+        return {field_info.alias or field_name: 1 for field_name, field_info in cls.model_fields.items()}
+
+    class Config:
+        populate_by_name = True
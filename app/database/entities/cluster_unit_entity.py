@@ -6,7 +6,7 @@ import json
 from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
-from app.database.entities.base_entity import BaseEntity, PyObjectId
+from app.database.entities.base_entity import BaseEntity, EntityView, PyObjectId
 from app.database.entities.label_template import LabelTemplateEntity, LabelTemplateTruthProjection, LabelTemplateLLMProjection, LabelValueField, ProjectionLabelField, labelName
 from app.database.entities.post_entity import PostEntity, CommentEntity
 
@@ -326,4 +326,23 @@ class ClusterUnitEntity(BaseEntity):
         if predicted_category is None:
             return None
         
-        return predicted_category.get_errors()
\ No newline at end of file
+        return predicted_category.get_errors()
+
+
+class ClusterUnitPostIdView(EntityView):
+    """only the post the cluster unit belongs to, e.g. to find which posts are already converted"""
+    post_id: PyObjectId
+
+
+class ClusterUnitSummaryView(EntityView):
+    """the small scalar fields of a cluster unit, used for sampling and filtering without the texts and predictions"""
+    cluster_entity_id: PyObjectId
+    post_id: PyObjectId
+    replied_to_cluster_unit_id: Optional[PyObjectId] = None
+    type: Literal["post", "comment"]
+    upvotes: int
+    downvotes: int
+    depth: int = 0
+    created_utc: int
+    total_nested_replies: Optional[int] = None
+    includes_media: Optional[bool] = None
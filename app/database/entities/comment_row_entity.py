@@ -0,0 +1,91 @@
+from typing import List, Optional, Tuple
+
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.post_entity import CommentEntity, RedditBaseEntity
+
+
+# the position of a comment among its siblings in the path, fixed width so that the paths sort in the order of the thread
+PATH_SEGMENT_WIDTH = 5
+PATH_SEPARATOR = "."
+
+
+class CommentRowEntity(RedditBaseEntity):
+    """a single comment of the flattened comment layout of a post, stored in its own document instead of nested in the replies of its parent.
+    The path is the materialized path of the positions of the comment and its ancestors among their siblings (e.g. "00002.00000"),
+    so sorting the rows of a post on path gives the comments in thread order, and the rows of a subtree share the prefix of its path"""
+    post_id: PyObjectId
+    parent_id: Optional[PyObjectId] = None # the _id of the parent comment row, None for a reply to the post
+    path: str
+    controversiality: float
+    depth: int # How many nests are above this comment
+    enriched_text: Optional[str] = None
+
+    @classmethod
+    def from_comment(cls, comment: CommentEntity, post_id: PyObjectId, parent_id: Optional[PyObjectId], path: str) -> "CommentRowEntity":
+        """the row keeps the id of the comment entity, so the cluster units point to the same comment in both layouts"""
+        return cls.model_validate({
+            **comment.model_dump(exclude={"replies"}, by_alias=True),
+            "post_id": post_id,
+            "parent_id": parent_id,
+            "path": path,
+        })
+
+    def has_media(self) -> bool:
+        return bool(self.media_metadata)
+
+    def to_comment_entity(self) -> CommentEntity:
+        """the comment without its replies"""
+        return CommentEntity.model_validate({
+            **self.model_dump(exclude={"post_id", "parent_id", "path"}, by_alias=True),
+            "replies": [],
+        })
+
+    def is_in_subtree(self, path: str) -> bool:
+        return self.path == path or self.path.startswith(path + PATH_SEPARATOR)
+
+
+def child_path(parent_path: Optional[str], position: int) -> str:
+    segment = str(position).zfill(PATH_SEGMENT_WIDTH)
+    return segment if parent_path is None else f"{parent_path}{PATH_SEPARATOR}{segment}"
+
+
+def subtree_path_range(path: str) -> Tuple[str, str]:
+    """the [lower, upper) bounds of the paths of the subtree at path (including the comment at path itself).
+    All segments have the same width, so these are the paths that start with path followed by the separator"""
+    return path, path + chr(ord(PATH_SEPARATOR) + 1)
+
+
+def flatten_comment_tree(post_id: PyObjectId, comments: List[CommentEntity]) -> List[CommentRowEntity]:
+    """the rows of the comment tree of a post in thread order (a comment before its replies)"""
+    return _flatten(post_id, [(comment, None, child_path(None, position)) for position, comment in enumerate(comments)])
+
+
+def flatten_comment_subtree(post_id: PyObjectId, comment: CommentEntity, parent_id: Optional[PyObjectId], path: str) -> List[CommentRowEntity]:
+    """the rows of a single comment and its replies, with the comment at path, e.g. to replace a subtree that was refreshed"""
+    return _flatten(post_id, [(comment, parent_id, path)])
+
+
+def _flatten(post_id: PyObjectId, comments: List[Tuple[CommentEntity, Optional[PyObjectId], str]]) -> List[CommentRowEntity]:
+    rows: List[CommentRowEntity] = list()
+    # iterative depth first walk, so deep threads do not hit the recursion limit
+    stack = list(reversed(comments))
+    while stack:
+        comment, parent_id, path = stack.pop()
+        rows.append(CommentRowEntity.from_comment(comment, post_id, parent_id, path))
+        replies = comment.replies or []
+        stack.extend((reply, comment.id, child_path(path, position)) for position, reply in reversed(list(enumerate(replies))))
+    return rows
+
+
+def build_comment_tree(rows: List[CommentRowEntity]) -> List[CommentEntity]:
+    """reassembles the nested comment tree from the rows of a post or of a subtree, the roots are the rows whose parent is not in rows"""
+    rows = sorted(rows, key=lambda row: row.path)
+    comments = {row.id: row.to_comment_entity() for row in rows}
+    roots: List[CommentEntity] = list()
+    for row in rows:
+        parent_comment = comments.get(row.parent_id) if row.parent_id else None
+        if parent_comment is None:
+            roots.append(comments[row.id])
+        else:
+            parent_comment.replies.append(comments[row.id])
+    return roots
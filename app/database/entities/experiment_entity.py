@@ -24,6 +24,14 @@ class PrevelanceUnitDistribution(BaseModel):
     value_key: Optional[ValueKey] = None
     runs_predicted: int
     is_ground_truth: bool
+    unit_index: Optional[int] = None # the position of the cluster unit among the units of the label, the rows of one unit share it. None for results from before it was stored
+
+
+def next_unit_index(individual_prediction_truth_label_list: List[PrevelanceUnitDistribution]) -> int:
+    """the unit_index of the next cluster unit that is added to the list, distinct from the units (and the rows without unit_index) already in it"""
+    if individual_prediction_truth_label_list and individual_prediction_truth_label_list[-1].unit_index is not None:
+        return individual_prediction_truth_label_list[-1].unit_index + 1
+    return len(individual_prediction_truth_label_list)
 
 
 class CombinedPredictionResult(BaseModel):
@@ -33,14 +41,64 @@ class CombinedPredictionResult(BaseModel):
        new_prevelance_unit = PrevelanceUnitDistribution(value_key=str(True),
                                                         runs_predicted=combined_min_true_count,
                                                         ground_truth_value=is_combined_ground_truth,
-                                                        is_ground_truth=is_combined_ground_truth)
+                                                        is_ground_truth=is_combined_ground_truth,
+                                                        unit_index=next_unit_index(self.individual_prediction_truth_label_list))
        self.individual_prediction_truth_label_list.append(new_prevelance_unit)
 
 
+class ConfusionCounts(BaseModel):
+    """running confusion counts of a label for a single threshold (minimum runs that must be true)"""
+    tp: int = 0
+    fp: int = 0
+    fn: int = 0
+    tn: int = 0
+
+    def insert_prediction(self, predicted_val: Optional[bool], is_ground_truth: bool):
+        if predicted_val == True and is_ground_truth == True:
+            self.tp += 1
+        elif predicted_val == False and is_ground_truth == True:
+            self.fn += 1
+        elif predicted_val == True and is_ground_truth == False:
+            self.fp += 1
+        elif predicted_val == False and is_ground_truth == False:
+            self.tn += 1
+
+
+class InterRunAgreement(BaseModel):
+    """keeps track of how consistent the runs of the same cluster unit are for a label"""
+    unit_count: int = 0
+    unanimous_unit_count: int = 0 # units where all runs predicted the same value
+    majority_runs_sum: int = 0 # summed number of runs that predicted the most predicted value of each unit
+    total_runs: int = 0
+
+    def insert_value_counter(self, value_counter: Dict[str, int]):
+        runs = sum(value_counter.values())
+        if runs == 0:
+            return
+        majority_runs = max(value_counter.values())
+        self.unit_count += 1
+        self.total_runs += runs
+        self.majority_runs_sum += majority_runs
+        if majority_runs == runs:
+            self.unanimous_unit_count += 1
+
+    def get_unanimous_rate(self) -> float | None:
+        if self.unit_count == 0:
+            return None
+        return self.unanimous_unit_count / self.unit_count
+
+    def get_mean_majority_share(self) -> float | None:
+        if self.total_runs == 0:
+            return None
+        return self.majority_runs_sum / self.total_runs
+
+
 class PredictionResult(BaseModel):
     prevelance_distribution: Dict[ValueKey, Dict[ValueCount, int]] = Field(default_factory=dict)  # e.g. {"True": {"3": 120, "2": 40, "1": 10, "0": 100}} -> Key is number of cluster units with the specific runs that have scored true
     individual_prediction_truth_label_list: List[PrevelanceUnitDistribution] = Field(default_factory=list)
     sum_ground_truth: int = 0
+    confusion_counts_per_threshold: Dict[ValueCount, ConfusionCounts] = Field(default_factory=dict) # key is the threshold of runs that must be true, kept up to date while units are inserted
+    inter_run_agreement: InterRunAgreement = Field(default_factory=InterRunAgreement)
 
     # @field_validator('prevelance_distribution')
     # @classmethod
@@ -51,8 +109,10 @@ class PredictionResult(BaseModel):
     #             raise ValueError(f"Dictionary keys must be numeric strings, got: {key}")
     #     return v
     
-    def insert_cluster_unit_label_prediction_counter(self, cluster_unit_label_prediction_counter: LabelPredictionCounter, ground_truth_value: Any):
-        
+    def insert_cluster_unit_label_prediction_counter(self, cluster_unit_label_prediction_counter: LabelPredictionCounter, ground_truth_value: Any, runs_per_unit: Optional[int] = None):
+        """adds the runs of a single cluster unit. If runs_per_unit is given, the confusion counts of every possible threshold are updated as well"""
+        self.inter_run_agreement.insert_value_counter(cluster_unit_label_prediction_counter.value_counter)
+        unit_index = next_unit_index(self.individual_prediction_truth_label_list)
         for value_key, value_count in cluster_unit_label_prediction_counter.value_counter.items():
             value_key = str(value_key)
             value_count = str(value_count)
@@ -69,10 +129,29 @@ class PredictionResult(BaseModel):
             self.individual_prediction_truth_label_list.append(
                 PrevelanceUnitDistribution(value_key=value_key, 
                                            runs_predicted=value_count, 
-                                           is_ground_truth= prediction_is_ground_truth)
+                                           is_ground_truth= prediction_is_ground_truth,
+                                           unit_index=unit_index)
             )
             if prediction_is_ground_truth:
                 self.sum_ground_truth += 1
+            if runs_per_unit is not None:
+                self.insert_confusion_counts(value_key, int(value_count), prediction_is_ground_truth, runs_per_unit)
+
+    def insert_confusion_counts(self, value_key: ValueKey, runs_predicted: int, is_ground_truth: bool, runs_per_unit: int):
+        """same rules as ExperimentService.calculate_confusion_matrix, but applied for each threshold at once"""
+        for threshold in range(runs_per_unit + 1):
+            if value_key == str(True):
+                predicted_val = runs_predicted >= threshold
+            elif value_key == str(False):
+                predicted_val = False
+            else:
+                predicted_val = None
+            if self.confusion_counts_per_threshold.get(str(threshold)) is None:
+                self.confusion_counts_per_threshold[str(threshold)] = ConfusionCounts()
+            self.confusion_counts_per_threshold[str(threshold)].insert_prediction(predicted_val, is_ground_truth)
+
+    def get_confusion_counts(self, threshold: int) -> ConfusionCounts | None:
+        return self.confusion_counts_per_threshold.get(str(threshold))
 
     @classmethod
     def from_combined_prediction_result(cls, combined_predition_result: CombinedPredictionResult):
@@ -102,6 +181,7 @@ class AggregateResult(BaseModel):
     labels: Dict[LabelName, PredictionResult] = Field(default_factory=dict)
     combined_labels: Dict[str, CombinedPredictionResult] = Field(default_factory=dict)
     errors: Optional[List[str]] = None
+    aggregated_unit_count: int = 0 # number of cluster units that are folded into the aggregate result
 
 
     @classmethod
@@ -224,7 +304,7 @@ class ExperimentEntity(BaseEntity):
     
     def insert_label_prediction_counter(self, label_prediction_counter: LabelPredictionCounter, ground_truth_value: Any):
         prediction_counter = self.get_label_aggregate_result(label_prediction_counter.label_name)
-        prediction_counter.insert_cluster_unit_label_prediction_counter(label_prediction_counter, ground_truth_value)
+        prediction_counter.insert_cluster_unit_label_prediction_counter(label_prediction_counter, ground_truth_value, runs_per_unit=self.runs_per_unit)
         
 
 
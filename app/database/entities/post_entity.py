@@ -1,7 +1,8 @@
 # database/entities/post_entity.py
+from datetime import datetime
 import json
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
@@ -73,6 +74,12 @@ class PostEntity (RedditBaseEntity):
     url: str = ""
     upvote_ratio: float = None
     comments: List[CommentEntity]
+    # "flat": the comments are stored as rows in the comment collection and comments is empty in the post document
+    comments_layout: Literal["nested", "flat"] = "nested"
+    # the renewal schedule of PostRenewalService, posts that were never renewed are due right away
+    last_renewed_at: Optional[datetime] = None
+    next_renewal_at: Optional[datetime] = None
+    comment_velocity: Optional[float] = None # new comments per day between the last two renewals
 
     def has_media(self) -> bool:
         if self.media_metadata:
@@ -117,4 +124,3 @@ class PostEntity (RedditBaseEntity):
             send_replies=post.send_replies,
             comments=comments
             )
-    
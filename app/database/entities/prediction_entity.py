@@ -0,0 +1,36 @@
+from typing import List, Optional
+
+from app.database.entities.base_entity import BaseEntity, PyObjectId
+from app.database.entities.cluster_unit_entity import ClusterUnitEntityPredictedCategory, PredictionCategoryTokens
+
+
+class PredictionEntity(BaseEntity):
+    """
+    A single run of an experiment on a single cluster unit.
+    Stored in its own collection, keyed by (experiment_id, cluster_unit_id, run_index), so that the cluster unit documents
+    do not grow with every experiment that is run on them
+    """
+    experiment_id: PyObjectId
+    cluster_unit_id: PyObjectId
+    run_index: int # the index of the run in ClusterUnitEntityPredictedCategory.predicted_categories
+    prediction: PredictionCategoryTokens
+    errors: Optional[List[str]] = None # the errors of the experiment in this cluster unit, only stored on run_index 0
+
+    @classmethod
+    def from_predicted_category(cls, cluster_unit_id: PyObjectId, predicted_category: ClusterUnitEntityPredictedCategory) -> List["PredictionEntity"]:
+        """splits the runs of the embedded predicted category into one prediction entity per run"""
+        return [cls(experiment_id=predicted_category.experiment_id,
+                    cluster_unit_id=cluster_unit_id,
+                    run_index=run_index,
+                    prediction=prediction,
+                    errors=predicted_category.errors if run_index == 0 else None)
+                for run_index, prediction in enumerate(predicted_category.predicted_categories)]
+
+    @staticmethod
+    def to_predicted_category(experiment_id: PyObjectId, prediction_entities: List["PredictionEntity"]) -> ClusterUnitEntityPredictedCategory:
+        """groups the runs of one experiment on one cluster unit back into the embedded format, ordered by run_index"""
+        prediction_entities = sorted(prediction_entities, key=lambda prediction_entity: prediction_entity.run_index)
+        errors = next((prediction_entity.errors for prediction_entity in prediction_entities if prediction_entity.errors is not None), None)
+        return ClusterUnitEntityPredictedCategory(experiment_id=experiment_id,
+                                                  predicted_categories=[prediction_entity.prediction for prediction_entity in prediction_entities],
+                                                  errors=errors)
@@ -0,0 +1,27 @@
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel
+
+from app.database.entities.base_entity import BaseEntity
+
+
+class RedditSearchListing(BaseModel):
+    """a post found by a reddit search, only what is needed to dedupe and scrape it"""
+    reddit_id: str
+    permalink: str
+
+
+class RedditSearchEntity(BaseEntity):
+    """the cached result of a reddit search of a keyword in a subreddit, shared by all scrapers that repeat the same search"""
+    subreddit: str # lowercase, reddit searches are case insensitive
+    keyword: str # lowercase
+    filter: str
+    age: str
+    limit: int # the limit the search was done with, it can serve the searches with the same or a lower limit
+    listings: List[RedditSearchListing]
+    expires_at: datetime
+
+    def can_serve(self, limit: int) -> bool:
+        """a search with fewer listings than its limit found every post, so it also serves a higher limit"""
+        return self.limit >= limit or len(self.listings) < self.limit
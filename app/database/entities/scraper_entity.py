@@ -1,5 +1,6 @@
 
 
+from datetime import datetime
 from typing import Dict, List, Literal, Optional, Tuple
 
 from pydantic import BaseModel
@@ -10,6 +11,7 @@ class KeyWordSearch(BaseModel):
     keyword: str
     found_post_ids: List[PyObjectId] = list()
     status: Literal["pending", "ongoing", "done"] = "pending"
+    claimed_at: Optional[datetime] = None # when a scraping run claimed the search, a claim older than the stale timeout can be taken over
 
 
 class KeyWordSearchSubreddit(BaseModel):
@@ -0,0 +1,112 @@
+"""
+Process-wide read-through cache of find_by_id for entities that rarely change (users, prompts, label templates, samples).
+
+The repositories are created again for every request, so the cache lives on the repository class and is shared by all
+requests of the process. Entries are least recently used evicted above ENTITY_CACHE_MAX_SIZE and expire after
+ENTITY_CACHE_TTL_SECONDS (0 disables the caches). The writes of BaseRepository invalidate the entries they touch, the
+TTL bounds how long another process (e.g. another gunicorn worker) can serve a stale entity.
+The raw documents are cached and decoded on every hit, so a caller that changes the returned entity never changes the cache.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from app.database.entities.base_entity import PyObjectId
+
+
+class EntityCache:
+    """LRU + TTL cache of documents by _id, thread safe"""
+    def __init__(self, name: str, max_size: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.name = name
+        # None: read from the environment on first use, after the configuration is loaded
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[PyObjectId, Tuple[float, Mapping[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        _caches.append(self)
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size is None:
+            self._max_size = int(os.getenv("ENTITY_CACHE_MAX_SIZE", "1024"))
+        return self._max_size
+
+    @property
+    def ttl_seconds(self) -> float:
+        if self._ttl_seconds is None:
+            self._ttl_seconds = float(os.getenv("ENTITY_CACHE_TTL_SECONDS", "60"))
+        return self._ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_size > 0
+
+    def get(self, id: PyObjectId) -> Optional[Mapping[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, document = entry
+            if expires_at <= time.monotonic():
+                del self._entries[id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(id)
+            self.hits += 1
+            return document
+
+    def set(self, id: PyObjectId, document: Mapping[str, Any]) -> None:
+        with self._lock:
+            self._entries[id] = (time.monotonic() + self.ttl_seconds, document)
+            self._entries.move_to_end(id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, ids: Iterable[PyObjectId]) -> None:
+        with self._lock:
+            for id in ids:
+                if self._entries.pop(id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+_caches: List[EntityCache] = list()
+
+
+def report_entity_caches() -> Dict[str, Dict[str, Any]]:
+    """the hit rate and size of every entity cache of the process"""
+    return {cache.name: cache.stats() for cache in _caches}
+
+
+def clear_entity_caches() -> None:
+    for cache in _caches:
+        cache.clear()
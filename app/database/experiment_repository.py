@@ -1,9 +1,16 @@
 from typing import List
-from app.database.base_repository import BaseRepository
+from pymongo import ASCENDING
+
+from app.database.base_repository import BaseRepository, soft_delete_index
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.experiment_entity import ExperimentEntity
 from flask_pymongo.wrappers import Database
 
 class ExperimentRepository(BaseRepository[ExperimentEntity]):
+    indexes = [
+        soft_delete_index([("scraper_cluster_id", ASCENDING)]),
+        soft_delete_index([("label_template_id", ASCENDING)]),
+    ]
+
     def __init__(self, database: Database):
         super().__init__(database, ExperimentEntity, "experiment")
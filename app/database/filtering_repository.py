@@ -2,11 +2,17 @@
 from typing import List
 from flask_pymongo.wrappers import Database
 
-from app.database.base_repository import BaseRepository
+from pymongo import ASCENDING
+
+from app.database.base_repository import BaseRepository, soft_delete_index
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.filtering_entity import FilteringEntity
 
 class FilteringRepository(BaseRepository[FilteringEntity]):
+    indexes = [
+        soft_delete_index([("scraper_cluster_id", ASCENDING)]),
+    ]
+
     def __init__(self, database: Database):
         super().__init__(database, FilteringEntity, "filtering")
 
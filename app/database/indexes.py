@@ -0,0 +1,103 @@
+"""
+Central registry of the indexes of all collections.
+
+Every repository declares its indexes in the class attribute `indexes`. They are applied once when the app starts
+(or with `python migrate_indexes.py`) instead of in the repository constructors, because the repositories are
+created again for every request. Indexes are pymongo IndexModels, so options such as unique or a
+partialFilterExpression are passed as keyword arguments.
+"""
+from typing import Any, Dict, List, Optional, Type
+
+from flask_pymongo.wrappers import Database
+from pymongo.errors import OperationFailure
+
+from app.database.base_repository import BaseRepository
+from app.database.cluster_repository import ClusterRepository
+from app.database.cluster_unit_repository import ClusterUnitRepository
+from app.database.comment_repository import CommentRepository
+from app.database.experiment_repository import ExperimentRepository
+from app.database.filtering_repository import FilteringRepository
+from app.database.label_template_repository import LabelTemplateRepository
+from app.database.openrouter_data_repository import OpenRouterDataRepository
+from app.database.post_repository import PostRepository
+from app.database.prediction_repository import PredictionRepository
+from app.database.prompt_repository import PromptRepository
+from app.database.reddit_search_repository import RedditSearchRepository
+from app.database.sample_repository import SampleRepository
+from app.database.scraper_cluster_repository import ScraperClusterRepository
+from app.database.scraper_repository import ScraperRepository
+from app.database.user_repository import UserRepository
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+
+REGISTERED_REPOSITORIES: List[Type[BaseRepository]] = [
+    ClusterRepository,
+    ClusterUnitRepository,
+    CommentRepository,
+    ExperimentRepository,
+    FilteringRepository,
+    LabelTemplateRepository,
+    OpenRouterDataRepository,
+    PostRepository,
+    PredictionRepository,
+    PromptRepository,
+    RedditSearchRepository,
+    SampleRepository,
+    ScraperClusterRepository,
+    ScraperRepository,
+    UserRepository,
+]
+
+
+def _repositories(database: Database) -> List[BaseRepository]:
+    return [repository_class(database) for repository_class in REGISTERED_REPOSITORIES]
+
+
+def apply_indexes(database: Database, drop_undeclared: bool = False) -> Dict[str, List[str]]:
+    """creates the declared indexes that do not exist yet. Returns the names of the declared indexes per collection.
+    An index that conflicts with an existing index of the same name is logged and skipped, so that the app still starts"""
+    applied_indexes: Dict[str, List[str]] = dict()
+    for repository in _repositories(database):
+        collection = repository.collection
+        declared_names = [index_model.document["name"] for index_model in repository.indexes]
+        if repository.indexes:
+            try:
+                collection.create_indexes(repository.indexes)
+            except OperationFailure as e:
+                logger.error(f"[apply_indexes] could not create the indexes of {collection.name}: {e}")
+        if drop_undeclared:
+            for index_name in collection.index_information().keys():
+                if index_name != "_id_" and index_name not in declared_names:
+                    logger.info(f"[apply_indexes] dropping undeclared index {collection.name}.{index_name}")
+                    collection.drop_index(index_name)
+        applied_indexes[collection.name] = declared_names
+    logger.info(f"[apply_indexes] applied {sum(len(names) for names in applied_indexes.values())} indexes on {len(applied_indexes)} collections")
+    return applied_indexes
+
+
+def _index_operations(repository: BaseRepository) -> Optional[Dict[str, int]]:
+    """number of times every index has been used since the last restart of the server, None if $indexStats is not allowed"""
+    try:
+        return {index_stats["name"]: index_stats["accesses"]["ops"] for index_stats in repository.collection.aggregate([{"$indexStats": {}}])}
+    except OperationFailure as e:
+        logger.warning(f"[report_indexes] $indexStats is not available for {repository.collection.name}: {e}")
+        return None
+
+
+def report_indexes(database: Database) -> Dict[str, Dict[str, Any]]:
+    """compares the declared indexes with the indexes in the database.
+    missing: declared but not created, undeclared: created but not declared, unused: created but never used (None if unknown)"""
+    report: Dict[str, Dict[str, Any]] = dict()
+    for repository in _repositories(database):
+        declared_names = {index_model.document["name"] for index_model in repository.indexes}
+        existing_names = set(repository.collection.index_information().keys()) - {"_id_"}
+        index_operations = _index_operations(repository)
+        report[repository.collection.name] = {
+            "missing": sorted(declared_names - existing_names),
+            "undeclared": sorted(existing_names - declared_names),
+            "unused": None if index_operations is None else sorted(name for name, ops in index_operations.items() if ops == 0 and name != "_id_"),
+        }
+    return report
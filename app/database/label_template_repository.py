@@ -5,8 +5,11 @@ from flask_pymongo.wrappers import Database
 from app.database.base_repository import BaseRepository
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.label_template import LabelTemplateEntity
+from app.database.entity_cache import EntityCache
 
 class LabelTemplateRepository(BaseRepository[LabelTemplateEntity]):
+    cache = EntityCache("label_template")
+
     def __init__(self, database: Database):
         super().__init__(database, LabelTemplateEntity, "label_template")
 
@@ -1,15 +1,88 @@
-from typing import Any, Dict, List, Literal, Tuple
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Mapping, Tuple
 
 from flask_pymongo.wrappers import Database
 
-from app.database.base_repository import BaseRepository
+from pymongo import ASCENDING, UpdateOne
+from pymongo.results import BulkWriteResult, InsertManyResult, InsertOneResult
+
+from app.database.base_repository import BaseRepository, soft_delete_index
+from app.database.comment_repository import CommentRepository
 # from app.database.entities.base_entity import PyObjectId
 from app.database.entities.base_entity import PyObjectId
+from app.database.entities.comment_row_entity import CommentRowEntity, build_comment_tree, flatten_comment_tree
 from app.database.entities.post_entity import PostEntity
 
+COMMENTS_LAYOUTS = ("nested", "flat")
+
 class PostRepository(BaseRepository[PostEntity]):
+    indexes = [
+        soft_delete_index([("reddit_id", ASCENDING)]), # find_existing_post_entities_from_reddit_post_ids
+        soft_delete_index([("next_renewal_at", ASCENDING)]), # find_due_for_renewal
+    ]
+
     def __init__(self, database: Database):
         super().__init__(database, PostEntity, "post")
+        # the layout of newly written posts, posts that are already stored keep their own layout (PostEntity.comments_layout)
+        self.comments_layout = os.getenv("POST_COMMENTS_LAYOUT", "nested")
+        if self.comments_layout not in COMMENTS_LAYOUTS:
+            raise Exception(f"Unknown POST_COMMENTS_LAYOUT '{self.comments_layout}', expected one of {COMMENTS_LAYOUTS}")
+        self.comment_repository = CommentRepository(database)
+
+    def insert(self, item: PostEntity) -> InsertOneResult:
+        return super().insert(self._write_comment_rows([item])[0])
+
+    def insert_list_entities(self, items: List[PostEntity], ordered: bool = True) -> InsertManyResult:
+        return super().insert_list_entities(self._write_comment_rows(items), ordered=ordered)
+
+    def upsert_list_entities(self, items: List[PostEntity]) -> BulkWriteResult:
+        return super().upsert_list_entities(self._write_comment_rows(items))
+
+    def _write_comment_rows(self, posts: List[PostEntity]) -> List[PostEntity]:
+        """with the flat layout the comments of the posts are written as rows first, and the posts are returned without their comments.
+        The rows are replaced, so writing a post again does not leave the rows of its old comments behind"""
+        if self.comments_layout != "flat":
+            return posts
+        rows = [row for post in posts for row in flatten_comment_tree(post.id, post.comments)]
+        self.comment_repository.replace_post_rows([post.id for post in posts], rows)
+        return [post.model_copy(update={"comments": [], "comments_layout": "flat"}) for post in posts]
+
+    def find_by_id_with_comments(self, post_id: PyObjectId) -> PostEntity | None:
+        """the post with its nested comment tree, reassembled from the comment rows for a post with the flat layout"""
+        post = self.find_by_id(post_id)
+        if post is not None and post.comments_layout == "flat":
+            post.comments = build_comment_tree(self.comment_repository.find_post_rows(post_id))
+        return post
+
+    def find_comment_rows(self, post: PostEntity) -> List[CommentRowEntity]:
+        """the comments of the post as rows in thread order, for both layouts"""
+        if post.comments_layout == "flat":
+            return self.comment_repository.find_post_rows(post.id)
+        return flatten_comment_tree(post.id, post.comments)
+
+    def convert_to_flat_layout(self, post_id: PyObjectId) -> int:
+        """moves the comments of a stored post with the nested layout into comment rows. Returns the number of rows"""
+        post = self.find_by_id(post_id)
+        if post is None or post.comments_layout == "flat":
+            return 0
+        rows = flatten_comment_tree(post.id, post.comments)
+        self.comment_repository.replace_post_rows([post.id], rows)
+        self.update(post.id, {"comments": [], "comments_layout": "flat"})
+        return len(rows)
+
+    def find_due_for_renewal(self, now: datetime, limit: int) -> List[PostEntity]:
+        """the posts whose next renewal is due, the posts that were never renewed (next_renewal_at null) first"""
+        filter = {"$or": [{"next_renewal_at": None}, {"next_renewal_at": {"$lte": now}}]}
+        cursor = self.collection.find(self._soft_delete_filter(filter)).sort("next_renewal_at", ASCENDING).limit(limit)
+        return self._decode_batch(list(cursor))
+
+    def update_renewed_posts(self, post_updates: Mapping[PyObjectId, Mapping[str, Any]]) -> BulkWriteResult | None:
+        """sets the changed fields of every renewed post in one bulk write"""
+        if not post_updates:
+            return None
+        operations = [UpdateOne({"_id": post_id}, {"$set": dict(to_update)}) for post_id, to_update in post_updates.items()]
+        return self.collection.bulk_write(operations, ordered=False)
 
     def find_by_author_sort(self, author: str) -> List[PostEntity]:
         data = super().find({"author": author})
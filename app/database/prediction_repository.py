@@ -0,0 +1,95 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from flask_pymongo.wrappers import Database
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult
+
+from app.database.base_repository import BaseRepository
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.cluster_unit_entity import ClusterUnitEntityPredictedCategory
+from app.database.entities.prediction_entity import PredictionEntity
+from app.utils import utc_timestamp
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class PredictionRepository(BaseRepository[PredictionEntity]):
+    indexes = [
+        # one document per run, upserts of a rerun replace the same document
+        IndexModel([("experiment_id", ASCENDING), ("cluster_unit_id", ASCENDING), ("run_index", ASCENDING)], unique=True),
+        # join on read: all predictions of a set of cluster units
+        IndexModel([("cluster_unit_id", ASCENDING), ("experiment_id", ASCENDING)]),
+    ]
+
+    trusted_decode = True
+
+    def __init__(self, database: Database):
+        super().__init__(database, PredictionEntity, "prediction")
+
+    def upsert_predicted_categories(self, experiment_id: PyObjectId, predictions_map: Dict[PyObjectId, ClusterUnitEntityPredictedCategory]) -> BulkWriteResult | None:
+        """writes every run of every cluster unit as its own document. Runs of a unit that was predicted before are replaced"""
+        operations = list()
+        for cluster_unit_id, predicted_category in predictions_map.items():
+            for prediction_entity in PredictionEntity.from_predicted_category(cluster_unit_id=cluster_unit_id, predicted_category=predicted_category):
+                prediction_entity.experiment_id = experiment_id
+                data = dict(prediction_entity.dump_for_database())
+                # the _id and created_at of an existing run are kept, the rest is replaced
+                set_on_insert = {"_id": data.pop("_id"), "created_at": data.pop("created_at")}
+                data["updated_at"] = utc_timestamp()
+                operations.append(UpdateOne({"experiment_id": experiment_id,
+                                             "cluster_unit_id": cluster_unit_id,
+                                             "run_index": prediction_entity.run_index},
+                                            {"$set": data, "$setOnInsert": set_on_insert},
+                                            upsert=True))
+        if not operations:
+            return None
+        return self.collection.bulk_write(operations, ordered=False)
+
+    def find_predicted_categories(self, cluster_unit_ids: List[PyObjectId], experiment_ids: Optional[List[PyObjectId]] = None) -> Dict[PyObjectId, Dict[PyObjectId, ClusterUnitEntityPredictedCategory]]:
+        """loads the predictions of the cluster units, for all experiments when experiment_ids is None.
+        Returns {cluster_unit_id: {experiment_id: ClusterUnitEntityPredictedCategory}}"""
+        filter: Dict[str, Any] = {"cluster_unit_id": {"$in": cluster_unit_ids}}
+        if experiment_ids is not None:
+            filter["experiment_id"] = {"$in": experiment_ids}
+
+        grouped_prediction_entities: Dict[PyObjectId, Dict[PyObjectId, List[PredictionEntity]]] = defaultdict(lambda: defaultdict(list))
+        for document in self.collection.find(self._soft_delete_filter(filter)):
+            prediction_entity = self._convert_to_entity(document)
+            grouped_prediction_entities[prediction_entity.cluster_unit_id][prediction_entity.experiment_id].append(prediction_entity)
+
+        return {cluster_unit_id: {experiment_id: PredictionEntity.to_predicted_category(experiment_id, prediction_entities)
+                                  for experiment_id, prediction_entities in experiments_prediction_entities.items()}
+                for cluster_unit_id, experiments_prediction_entities in grouped_prediction_entities.items()}
+
+    def find_label_values(self, cluster_unit_ids: List[PyObjectId], experiment_ids: List[PyObjectId]) -> List[Dict[str, Any]]:
+        """loads only the predicted label values of the runs, as raw documents {experiment_id, cluster_unit_id, run_index, prediction: {labels_prediction: {values}}}"""
+        filter = {"cluster_unit_id": {"$in": cluster_unit_ids}, "experiment_id": {"$in": experiment_ids}}
+        projection = {"_id": 0, "experiment_id": 1, "cluster_unit_id": 1, "run_index": 1, "prediction.labels_prediction.values": 1}
+        return list(self.collection.find(self._soft_delete_filter(filter), projection))
+
+    def has_predictions(self, experiment_id: PyObjectId) -> bool:
+        return self.collection.find_one(self._soft_delete_filter({"experiment_id": experiment_id}), {"_id": 1}) is not None
+
+    def find_cluster_unit_ids_matching_runs(self, experiment_id: PyObjectId, run_filters: List[Any], min_matching_runs: int) -> List[PyObjectId]:
+        """the cluster units of the experiment for which every run filter (an aggregation expression on a prediction document)
+        matches in at least min_matching_runs runs, counted on the server with a single $group"""
+        matching_runs = {f"matching_runs_{index}": {"$sum": {"$cond": [run_filter, 1, 0]}} for index, run_filter in enumerate(run_filters)}
+        pipeline = [
+            {"$match": self._soft_delete_filter({"experiment_id": experiment_id})},
+            {"$group": {"_id": "$cluster_unit_id", **matching_runs}},
+            {"$match": {field_name: {"$gte": min_matching_runs} for field_name in matching_runs}},
+            {"$project": {"_id": 1}},
+        ]
+        return [document["_id"] for document in self.collection.aggregate(pipeline)]
+
+    def delete_many_by_experiment_id(self, experiment_id: PyObjectId, cluster_unit_ids: Optional[List[PyObjectId]] = None) -> DeleteResult:
+        """hard deletes the predictions of an experiment, optionally only of the given cluster units"""
+        filter: Dict[str, Any] = {"experiment_id": experiment_id}
+        if cluster_unit_ids is not None:
+            filter["cluster_unit_id"] = {"$in": cluster_unit_ids}
+        result = self.collection.delete_many(filter)
+        logger.info(f"[delete_many_by_experiment_id] Deleted {result.deleted_count} predictions for experiment_id={experiment_id}")
+        return result
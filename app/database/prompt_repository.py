@@ -2,9 +2,12 @@ from typing import List
 from app.database.base_repository import BaseRepository
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.prompt_entity import PromptEntity
+from app.database.entity_cache import EntityCache
 from flask_pymongo.wrappers import Database
 
 class PromptRepository(BaseRepository[PromptEntity]):
+    cache = EntityCache("prompt")
+
     def __init__(self, database: Database):
         super().__init__(database, PromptEntity, "prompt")
 
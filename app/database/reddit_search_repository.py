@@ -0,0 +1,51 @@
+import os
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from flask_pymongo.wrappers import Database
+
+from pymongo import ASCENDING, IndexModel
+
+from app.database.base_repository import BaseRepository
+from app.database.entities.reddit_search_entity import RedditSearchEntity, RedditSearchListing
+from app.utils import utc_timestamp
+
+
+class RedditSearchRepository(BaseRepository[RedditSearchEntity]):
+    """the cache of reddit search results, one document per (subreddit, keyword, filter, age).
+    The entries are not soft deleted: mongodb removes them once expires_at has passed"""
+    indexes = [
+        IndexModel([("subreddit", ASCENDING), ("keyword", ASCENDING), ("filter", ASCENDING), ("age", ASCENDING)], unique=True), # find_search
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ]
+
+    def __init__(self, database: Database):
+        super().__init__(database, RedditSearchEntity, "reddit_search")
+        # how long a search result is used before reddit is searched again, 0 disables the cache
+        self.ttl_seconds = float(os.getenv("REDDIT_SEARCH_CACHE_TTL_SECONDS", "86400"))
+
+    @staticmethod
+    def _key(subreddit: str, keyword: str, filter: str, age: str) -> Dict[str, str]:
+        return {"subreddit": subreddit.lower(), "keyword": keyword.strip().lower(), "filter": filter, "age": age}
+
+    def find_search(self, subreddit: str, keyword: str, filter: str, age: str, limit: int) -> Optional[List[RedditSearchListing]]:
+        """the cached listings of the search, None if there is no fresh result for the limit.
+        The expired entries are filtered here as well, as mongodb only removes them about once a minute"""
+        if self.ttl_seconds <= 0:
+            return None
+        document = self.collection.find_one({**self._key(subreddit, keyword, filter, age), "expires_at": {"$gt": utc_timestamp()}})
+        if document is None:
+            return None
+        search = self._convert_to_entity(document)
+        return search.listings[:limit] if search.can_serve(limit) else None
+
+    def save_search(self, subreddit: str, keyword: str, filter: str, age: str, limit: int, listings: List[RedditSearchListing]) -> None:
+        """replaces the cached result of the search"""
+        if self.ttl_seconds <= 0:
+            return
+        key = self._key(subreddit, keyword, filter, age)
+        search = RedditSearchEntity(**key, limit=limit, listings=listings, expires_at=utc_timestamp() + timedelta(seconds=self.ttl_seconds))
+        document = dict(search.dump_for_database())
+        on_insert = {"_id": document.pop("_id"), "created_at": document.pop("created_at")}
+        document["updated_at"] = utc_timestamp()
+        self.collection.update_one(key, {"$set": document, "$setOnInsert": on_insert}, upsert=True)
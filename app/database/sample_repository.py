@@ -2,8 +2,11 @@ from typing import List
 from app.database.base_repository import BaseRepository
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.sample_entity import SampleEntity
+from app.database.entity_cache import EntityCache
 from flask_pymongo.wrappers import Database
 
 class SampleRepository(BaseRepository[SampleEntity]):
+    cache = EntityCache("sample")
+
     def __init__(self, database: Database):
         super().__init__(database, SampleEntity, "sample")
@@ -1,12 +1,24 @@
 
-from typing import List
+from datetime import datetime
+from typing import Dict, List, Tuple
 from flask_pymongo.wrappers import Database
 
-from app.database.base_repository import BaseRepository
+from pymongo import ASCENDING
+
+from app.database.base_repository import BaseRepository, soft_delete_index
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.scraper_entity import KeyWordSearch, KeyWordSearchSubreddit, ScraperEntity
+from app.utils import utc_timestamp
+
+
+def keyword_search_path(subreddit: str, keyword: str) -> str:
+    return f"keyword_search_objective.keyword_subreddit_searches.{subreddit}.keyword_searches.{keyword}"
 
 class ScraperRepository(BaseRepository[ScraperEntity]):
+    indexes = [
+        soft_delete_index([("user_id", ASCENDING), ("scraper_cluster_id", ASCENDING)]),
+    ]
+
     def __init__(self, database: Database):
         super().__init__(database, ScraperEntity, "scraper")
 
@@ -29,6 +41,18 @@ class ScraperRepository(BaseRepository[ScraperEntity]):
         update_path = f"keyword_search_objective.keyword_subreddit_searches.{subreddit}.keyword_searches.{keyword}.found_post_ids"
         return super().insert_list_element(filter, update_path, post_id)
     
+    def append_postids_to_keyword_searches(self, scraper_id: PyObjectId, post_ids_per_keyword_search: Dict[Tuple[str, str], List[PyObjectId]]):
+        """adds the internal post ids to the search results of several (subreddit, keyword) searches in a single update"""
+        post_ids_per_keyword_search = {keyword_search: post_ids for keyword_search, post_ids in post_ids_per_keyword_search.items() if post_ids}
+        if not post_ids_per_keyword_search:
+            return None
+        filter = self._soft_delete_filter({"_id": scraper_id})
+        update = {"$push": {
+            f"keyword_search_objective.keyword_subreddit_searches.{subreddit}.keyword_searches.{keyword}.found_post_ids": {"$each": post_ids}
+            for (subreddit, keyword), post_ids in post_ids_per_keyword_search.items()
+        }}
+        return self.collection.update_one(filter, update)
+
     def update_keyword_search_status(self, scraper_id: PyObjectId, subreddit: str, keyword_search: KeyWordSearch):
         filter = {"_id": scraper_id}
         update_path = f"keyword_search_objective.keyword_subreddit_searches.{subreddit}.keyword_searches.{keyword_search.keyword}.status"
@@ -54,5 +78,40 @@ class ScraperRepository(BaseRepository[ScraperEntity]):
 
         return self.collection.update_one(filter, update)
 
+    def claim_keyword_search(self, scraper_id: PyObjectId, subreddit: str, keyword: str, stale_claim_before: datetime) -> bool:
+        """atomically moves the (subreddit, keyword) search from pending to ongoing, so concurrent scraping runs never search the same pair.
+        An ongoing search whose claim is older than stale_claim_before (or that has no claim) was left by a run that crashed and is claimed again.
+        Returns whether this call claimed the search"""
+        path = keyword_search_path(subreddit, keyword)
+        filter = self._soft_delete_filter({"_id": scraper_id, "$or": [
+            {f"{path}.status": "pending"},
+            {f"{path}.status": "ongoing", f"{path}.claimed_at": None},
+            {f"{path}.status": "ongoing", f"{path}.claimed_at": {"$lt": stale_claim_before}},
+        ]})
+        update = {"$set": {
+            f"{path}.status": "ongoing",
+            f"{path}.claimed_at": utc_timestamp(),
+            f"keyword_search_objective.keyword_subreddit_searches.{subreddit}.status": "ongoing",
+        }}
+        return self.collection.find_one_and_update(filter, update, projection={"_id": 1}) is not None
 
+    def release_keyword_searches(self, scraper_id: PyObjectId, keyword_searches: List[Tuple[str, str]]):
+        """puts the claimed (subreddit, keyword) searches back to pending, e.g. when the scraper is paused, the found post ids are kept"""
+        if not keyword_searches:
+            return None
+        update = {"$set": dict()}
+        for subreddit, keyword in keyword_searches:
+            update["$set"][f"{keyword_search_path(subreddit, keyword)}.status"] = "pending"
+            update["$set"][f"{keyword_search_path(subreddit, keyword)}.claimed_at"] = None
+        return self.collection.update_one(self._soft_delete_filter({"_id": scraper_id}), update)
 
+    def complete_keyword_searches(self, scraper_id: PyObjectId, keyword_searches: List[Tuple[str, str]], done_subreddits: List[str]):
+        """marks the (subreddit, keyword) searches and the subreddits without searches left as done in a single update"""
+        if not keyword_searches and not done_subreddits:
+            return None
+        update = {"$set": dict()}
+        for subreddit, keyword in keyword_searches:
+            update["$set"][f"{keyword_search_path(subreddit, keyword)}.status"] = "done"
+        for subreddit in done_subreddits:
+            update["$set"][f"keyword_search_objective.keyword_subreddit_searches.{subreddit}.status"] = "done"
+        return self.collection.update_one(self._soft_delete_filter({"_id": scraper_id}), update)
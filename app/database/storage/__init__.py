@@ -0,0 +1,25 @@
+"""
+Storage backends of the repositories, selected with the STORAGE_BACKEND environment variable:
+"mongodb" (default) uses the flask_pymongo client, "memory" uses a process wide InMemoryDatabase,
+so that services can be tested and benchmarked without a running MongoDB
+"""
+import threading
+from typing import Optional
+
+from app.database.storage.memory import InMemoryCollection, InMemoryCursor, InMemoryDatabase
+
+
+STORAGE_BACKENDS = ("mongodb", "memory")
+
+_memory_database: Optional[InMemoryDatabase] = None
+_memory_database_lock = threading.Lock()
+
+
+def get_memory_database() -> InMemoryDatabase:
+    """the in-memory database shared by all requests of the process"""
+    global _memory_database
+    with _memory_database_lock:
+        if _memory_database is None:
+            _memory_database = InMemoryDatabase()
+        return _memory_database
+
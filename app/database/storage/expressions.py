@@ -0,0 +1,299 @@
+"""
+The aggregation expressions of the in-memory storage backend: the expressions that are used in $expr, pipeline updates,
+$project and $group of the repositories. Values are compared with the mongodb order of types
+"""
+import datetime
+import functools
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from bson import ObjectId
+
+
+class _Missing:
+    """a field that does not exist, which is not the same as a field with a null value"""
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def type_name(value: Any) -> str:
+    """the name of the type of a value, as returned by $type"""
+    if value is MISSING:
+        return "missing"
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -2 ** 31 <= value < 2 ** 31 else "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, Mapping):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    if isinstance(value, datetime.datetime):
+        return "date"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, bytes):
+        return "binData"
+    return type(value).__name__
+
+
+# the order of the types when values of different types are compared or sorted
+_TYPE_RANKS = {"missing": 0, "null": 1, "int": 2, "long": 2, "double": 2, "string": 3, "object": 4, "array": 5,
+               "binData": 6, "objectId": 7, "bool": 8, "date": 9}
+
+
+def type_rank(value: Any) -> int:
+    return _TYPE_RANKS.get(type_name(value), 10)
+
+
+def compare_values(left: Any, right: Any) -> int:
+    """-1, 0 or 1, with the mongodb comparison order (first on the type, then on the value)"""
+    left_rank, right_rank = type_rank(left), type_rank(right)
+    if left_rank != right_rank:
+        return -1 if left_rank < right_rank else 1
+    if left_rank <= 1:
+        return 0
+    if isinstance(left, Mapping):
+        for (left_key, left_value), (right_key, right_value) in zip(left.items(), right.items()):
+            key_comparison = compare_values(left_key, right_key) or compare_values(left_value, right_value)
+            if key_comparison:
+                return key_comparison
+        return compare_values(len(left), len(right))
+    if isinstance(left, (list, tuple)):
+        for left_item, right_item in zip(left, right):
+            item_comparison = compare_values(left_item, right_item)
+            if item_comparison:
+                return item_comparison
+        return compare_values(len(left), len(right))
+    if isinstance(left, datetime.datetime) and (left.tzinfo is None) != (right.tzinfo is None):
+        # naive datetimes are stored as utc
+        left, right = [value.replace(tzinfo=datetime.timezone.utc) if value.tzinfo is None else value for value in (left, right)]
+    if left == right:
+        return 0
+    return -1 if left < right else 1
+
+
+def values_equal(left: Any, right: Any) -> bool:
+    return compare_values(left, right) == 0
+
+
+@functools.total_ordering
+class SortKey:
+    """wraps a value so that python sorts it in the mongodb order"""
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __eq__(self, other: "SortKey") -> bool:
+        return compare_values(self.value, other.value) == 0
+
+    def __lt__(self, other: "SortKey") -> bool:
+        return compare_values(self.value, other.value) < 0
+
+
+def get_path(value: Any, path: List[str]) -> Any:
+    """the value at the dotted path for aggregation expressions, an array in the path maps the rest of the path over its elements"""
+    for index, key in enumerate(path):
+        if isinstance(value, Mapping):
+            value = value.get(key, MISSING)
+        elif isinstance(value, list):
+            rest_of_path = path[index:]
+            return [item for item in (get_path(element, rest_of_path) for element in value if isinstance(element, Mapping)) if item is not MISSING]
+        else:
+            return MISSING
+    return value
+
+
+def is_true(value: Any) -> bool:
+    """the truthiness of aggregation expressions: false, null, missing and 0 are false, everything else (also an empty array) is true"""
+    if value is MISSING or value is None or value is False:
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0
+    return True
+
+
+def evaluate(expression: Any, document: Any, variables: Optional[Dict[str, Any]] = None) -> Any:
+    """evaluates an aggregation expression on the document, variables holds the $$ variables ($$ROOT and those of $map/$filter)"""
+    variables = variables if variables is not None else {"ROOT": document, "CURRENT": document}
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            name, *path = expression[2:].split(".")
+            if name not in variables:
+                raise Exception(f"use of undefined variable: {name}")
+            return get_path(variables[name], path)
+        if expression.startswith("$"):
+            return get_path(variables.get("CURRENT", document), expression[1:].split("."))
+        return expression
+
+    if isinstance(expression, list):
+        return [evaluate(item, document, variables) for item in expression]
+
+    if isinstance(expression, Mapping):
+        if len(expression) == 1:
+            operator, arguments = next(iter(expression.items()))
+            if operator.startswith("$"):
+                operator_function = _OPERATORS.get(operator)
+                if operator_function is None:
+                    raise Exception(f"the in-memory storage does not support the expression operator {operator}")
+                return operator_function(arguments, document, variables)
+        evaluated_object = dict()
+        for key, value in expression.items():
+            evaluated_value = evaluate(value, document, variables)
+            if evaluated_value is not MISSING:
+                evaluated_object[key] = evaluated_value
+        return evaluated_object
+
+    return expression
+
+
+def _arguments(arguments: Any, document: Any, variables: Dict[str, Any]) -> List[Any]:
+    if not isinstance(arguments, list):
+        arguments = [arguments]
+    return [evaluate(argument, document, variables) for argument in arguments]
+
+
+def _comparison(predicate: Callable[[int], bool]) -> Callable[[Any, Any, Dict[str, Any]], bool]:
+    def compare(arguments: Any, document: Any, variables: Dict[str, Any]) -> bool:
+        left, right = _arguments(arguments, document, variables)
+        return predicate(compare_values(left, right))
+    return compare
+
+
+def _cond(arguments: Any, document: Any, variables: Dict[str, Any]) -> Any:
+    if isinstance(arguments, Mapping):
+        arguments = [arguments["if"], arguments["then"], arguments["else"]]
+    condition, then_expression, else_expression = arguments
+    return evaluate(then_expression if is_true(evaluate(condition, document, variables)) else else_expression, document, variables)
+
+
+def _switch(arguments: Mapping[str, Any], document: Any, variables: Dict[str, Any]) -> Any:
+    for branch in arguments["branches"]:
+        if is_true(evaluate(branch["case"], document, variables)):
+            return evaluate(branch["then"], document, variables)
+    if "default" not in arguments:
+        raise Exception("$switch could not find a matching branch for an input, and no default was specified")
+    return evaluate(arguments["default"], document, variables)
+
+
+def _if_null(arguments: Any, document: Any, variables: Dict[str, Any]) -> Any:
+    for argument in arguments[:-1]:
+        value = evaluate(argument, document, variables)
+        if value is not None and value is not MISSING:
+            return value
+    return evaluate(arguments[-1], document, variables)
+
+
+def _in(arguments: Any, document: Any, variables: Dict[str, Any]) -> bool:
+    value, array = _arguments(arguments, document, variables)
+    if not isinstance(array, list):
+        raise Exception(f"$in requires an array as a second argument, found: {type_name(array)}")
+    return any(values_equal(value, item) for item in array)
+
+
+def _with_variable(arguments: Mapping[str, Any], variables: Dict[str, Any], item: Any) -> Dict[str, Any]:
+    return {**variables, arguments.get("as", "this"): item}
+
+
+def _map(arguments: Mapping[str, Any], document: Any, variables: Dict[str, Any]) -> Any:
+    array = evaluate(arguments["input"], document, variables)
+    if array is None or array is MISSING:
+        return None
+    return [evaluate(arguments["in"], document, _with_variable(arguments, variables, item)) for item in array]
+
+
+def _filter(arguments: Mapping[str, Any], document: Any, variables: Dict[str, Any]) -> Any:
+    array = evaluate(arguments["input"], document, variables)
+    if array is None or array is MISSING:
+        return None
+    return [item for item in array if is_true(evaluate(arguments["cond"], document, _with_variable(arguments, variables, item)))]
+
+
+def _size(arguments: Any, document: Any, variables: Dict[str, Any]) -> int:
+    array = evaluate(arguments[0] if isinstance(arguments, list) else arguments, document, variables)
+    if not isinstance(array, list):
+        raise Exception(f"The argument to $size must be an array. Type of argument is {type_name(array)}")
+    return len(array)
+
+
+def _merge_objects(arguments: Any, document: Any, variables: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict()
+    for value in _arguments(arguments, document, variables):
+        if value is None or value is MISSING:
+            continue
+        if not isinstance(value, Mapping):
+            raise Exception(f"$mergeObjects requires object inputs, but input is of type {type_name(value)}")
+        merged.update(value)
+    return merged
+
+
+def _object_to_array(arguments: Any, document: Any, variables: Dict[str, Any]) -> Any:
+    value = evaluate(arguments, document, variables)
+    if value is None or value is MISSING:
+        return None
+    return [{"k": key, "v": item} for key, item in value.items()]
+
+
+def _array_to_object(arguments: Any, document: Any, variables: Dict[str, Any]) -> Any:
+    array = evaluate(arguments[0] if isinstance(arguments, list) and len(arguments) == 1 else arguments, document, variables)
+    if array is None or array is MISSING:
+        return None
+    return dict((item["k"], item["v"]) if isinstance(item, Mapping) else (item[0], item[1]) for item in array)
+
+
+def _get_field(arguments: Any, document: Any, variables: Dict[str, Any]) -> Any:
+    if isinstance(arguments, str):
+        return variables.get("CURRENT", document).get(arguments, MISSING)
+    source = evaluate(arguments.get("input", "$$CURRENT"), document, variables)
+    if not isinstance(source, Mapping):
+        return MISSING if source is MISSING else None
+    return source.get(evaluate(arguments["field"], document, variables), MISSING)
+
+
+def _sum(arguments: Any, document: Any, variables: Dict[str, Any]) -> Any:
+    values = _arguments(arguments, document, variables)
+    if len(values) == 1 and isinstance(values[0], list):
+        values = values[0]
+    return sum(value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+_OPERATORS: Dict[str, Callable[[Any, Any, Dict[str, Any]], Any]] = {
+    "$literal": lambda arguments, document, variables: arguments,
+    "$and": lambda arguments, document, variables: all(is_true(evaluate(argument, document, variables)) for argument in arguments),
+    "$or": lambda arguments, document, variables: any(is_true(evaluate(argument, document, variables)) for argument in arguments),
+    "$not": lambda arguments, document, variables: not is_true(_arguments(arguments, document, variables)[0]),
+    "$eq": _comparison(lambda comparison: comparison == 0),
+    "$ne": _comparison(lambda comparison: comparison != 0),
+    "$gt": _comparison(lambda comparison: comparison > 0),
+    "$gte": _comparison(lambda comparison: comparison >= 0),
+    "$lt": _comparison(lambda comparison: comparison < 0),
+    "$lte": _comparison(lambda comparison: comparison <= 0),
+    "$cmp": _comparison(lambda comparison: comparison),
+    "$in": _in,
+    "$cond": _cond,
+    "$switch": _switch,
+    "$ifNull": _if_null,
+    "$type": lambda arguments, document, variables: type_name(_arguments(arguments, document, variables)[0]),
+    "$isNumber": lambda arguments, document, variables: type_name(_arguments(arguments, document, variables)[0]) in ("int", "long", "double"),
+    "$isArray": lambda arguments, document, variables: isinstance(_arguments(arguments, document, variables)[0], list),
+    "$size": _size,
+    "$map": _map,
+    "$filter": _filter,
+    "$mergeObjects": _merge_objects,
+    "$objectToArray": _object_to_array,
+    "$arrayToObject": _array_to_object,
+    "$getField": _get_field,
+    "$sum": _sum,
+    "$concat": lambda arguments, document, variables: "".join(_arguments(arguments, document, variables)),
+    "$concatArrays": lambda arguments, document, variables: [item for array in _arguments(arguments, document, variables) for item in array],
+    "$toString": lambda arguments, document, variables: str(_arguments(arguments, document, variables)[0]),
+}
@@ -0,0 +1,420 @@
+"""
+In-memory storage backend with the subset of the pymongo Database / Collection api that the repositories use.
+Documents are deep copied on the way in and out, so entities can never change the stored documents by reference,
+exactly like with a real database. Indexes are recorded (for apply_indexes / report_indexes) but only _id is unique and
+only _id lookups are accelerated, every other query scans the collection in insertion order
+"""
+import copy
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+from app.database.storage.expressions import MISSING, SortKey, evaluate, values_equal
+from app.database.storage.query import add_fields, apply_update, equality_fields, matches, normalize_sort, project, sort_documents, unset_field
+
+
+class InMemoryCursor:
+    """the cursor of find and aggregate: sort, skip and limit are applied when the cursor is iterated"""
+
+    def __init__(self, documents_factory, projection: Optional[Mapping[str, Any]] = None):
+        self._documents_factory = documents_factory
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = list()
+        self._skip = 0
+        self._limit = 0
+        self._iterator: Optional[Iterator[Dict[str, Any]]] = None
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "InMemoryCursor":
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "InMemoryCursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "InMemoryCursor":
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int) -> "InMemoryCursor":
+        return self
+
+    def _documents(self) -> Iterator[Dict[str, Any]]:
+        documents = self._documents_factory()
+        if self._sort:
+            documents = sort_documents(list(documents), self._sort)
+        end = self._skip + self._limit if self._limit else None
+        for document in list(documents)[self._skip:end]:
+            yield project(document, self._projection)
+
+    def __iter__(self) -> "InMemoryCursor":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self._iterator is None:
+            self._iterator = self._documents()
+        return next(self._iterator)
+
+    def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        documents = list(self)
+        return documents[:length] if length else documents
+
+    def close(self) -> None:
+        self._iterator = iter(())
+
+
+class InMemoryCollection:
+
+    def __init__(self, database: "InMemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._documents: Dict[Any, Dict[str, Any]] = dict()
+        self._indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", 1)]}}
+        self._lock = threading.RLock()
+
+    # --- reads ---
+
+    def _candidates(self, filter: Optional[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+        """the stored documents that match the filter (not copied). An equality or $in on _id is a lookup instead of a scan"""
+        with self._lock:
+            id_condition = (filter or {}).get("_id", MISSING)
+            if id_condition is not MISSING and not isinstance(id_condition, Mapping):
+                documents = [self._documents[id_condition]] if id_condition in self._documents else []
+            elif isinstance(id_condition, Mapping) and set(id_condition) == {"$in"}:
+                documents = [self._documents[id] for id in dict.fromkeys(id_condition["$in"]) if id in self._documents]
+            else:
+                documents = list(self._documents.values())
+        return [document for document in documents if matches(document, filter)]
+
+    def find(self, filter: Optional[Mapping[str, Any]] = None, projection: Optional[Mapping[str, Any] | Sequence[str]] = None, **kwargs: Any) -> InMemoryCursor:
+        if projection is not None and not isinstance(projection, Mapping):
+            projection = {field_name: 1 for field_name in projection}
+        cursor = InMemoryCursor(lambda: self._candidates(filter), projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("skip"):
+            cursor.skip(kwargs["skip"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    def find_one(self, filter: Optional[Mapping[str, Any]] = None, projection: Optional[Mapping[str, Any]] = None, **kwargs: Any) -> Optional[Dict[str, Any]]:
+        return next(self.find(filter, projection, **kwargs).limit(1), None)
+
+    def count_documents(self, filter: Mapping[str, Any], skip: int = 0, limit: int = 0, **kwargs: Any) -> int:
+        count = max(len(self._candidates(filter)) - skip, 0)
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self, **kwargs: Any) -> int:
+        return len(self._documents)
+
+    def distinct(self, key: str, filter: Optional[Mapping[str, Any]] = None, **kwargs: Any) -> List[Any]:
+        distinct_values: List[Any] = list()
+        for document in self._candidates(filter):
+            value = evaluate(f"${key}", document)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not MISSING and not any(values_equal(item, existing) for existing in distinct_values):
+                    distinct_values.append(copy.deepcopy(item))
+        return distinct_values
+
+    def aggregate(self, pipeline: Sequence[Mapping[str, Any]], **kwargs: Any) -> InMemoryCursor:
+        documents = run_pipeline(self, [copy.deepcopy(document) for document in self._candidates(None)], pipeline)
+        return InMemoryCursor(lambda: documents)
+
+    # --- writes ---
+
+    def _insert(self, document: Mapping[str, Any]) -> Any:
+        stored = copy.deepcopy(dict(document))
+        if "_id" not in stored:
+            stored = {"_id": ObjectId(), **stored}
+        with self._lock:
+            if stored["_id"] in self._documents:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_ dup key: {{ _id: {stored['_id']!r} }}")
+            self._documents[stored["_id"]] = stored
+        return stored["_id"]
+
+    def insert_one(self, document: Mapping[str, Any], **kwargs: Any) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents: Iterable[Mapping[str, Any]], ordered: bool = True, **kwargs: Any) -> InsertManyResult:
+        inserted_ids: List[Any] = list()
+        write_errors: List[Dict[str, Any]] = list()
+        for index, document in enumerate(documents):
+            try:
+                inserted_ids.append(self._insert(document))
+            except DuplicateKeyError as error:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(error), "op": document})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": [], "nInserted": len(inserted_ids),
+                                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(inserted_ids, True)
+
+    def _update(self, filter: Mapping[str, Any], update: Any, upsert: bool, multi: bool, replace: bool = False,
+                sort: Optional[Any] = None) -> Tuple[int, int, Any, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """returns (matched, modified, upserted_id, document before, document after) of the first updated document"""
+        with self._lock:
+            candidates = self._candidates(filter)
+            if sort:
+                candidates = sort_documents(candidates, normalize_sort(sort))
+            if not multi:
+                candidates = candidates[:1]
+
+            if not candidates:
+                if not upsert:
+                    return 0, 0, None, None, None
+                base = copy.deepcopy(equality_fields(filter))
+                new_document = dict(update) if replace else apply_update(base, update, is_insert=True)
+                if "_id" in base and "_id" not in new_document:
+                    new_document["_id"] = base["_id"]
+                upserted_id = self._insert(new_document)
+                return 0, 0, upserted_id, None, self._documents[upserted_id]
+
+            modified = 0
+            first_before, first_after = candidates[0], None
+            for document in candidates:
+                if replace:
+                    updated = {"_id": document["_id"], **{key: copy.deepcopy(value) for key, value in update.items() if key != "_id"}}
+                else:
+                    updated = apply_update(document, update)
+                if updated.get("_id", document["_id"]) != document["_id"]:
+                    raise Exception("Performing an update on the path '_id' would modify the immutable field '_id'")
+                if updated != document:
+                    modified += 1
+                    self._documents[document["_id"]] = updated
+                if first_after is None:
+                    first_after = self._documents[document["_id"]]
+            return len(candidates), modified, None, first_before, first_after
+
+    @staticmethod
+    def _update_result(matched: int, modified: int, upserted_id: Any) -> UpdateResult:
+        raw_result = {"n": matched if upserted_id is None else 1, "nModified": modified, "updatedExisting": matched > 0}
+        if upserted_id is not None:
+            raw_result["upserted"] = upserted_id
+        return UpdateResult(raw_result, True)
+
+    def update_one(self, filter: Mapping[str, Any], update: Any, upsert: bool = False, **kwargs: Any) -> UpdateResult:
+        matched, modified, upserted_id, _, _ = self._update(filter, update, upsert=upsert, multi=False, sort=kwargs.get("sort"))
+        return self._update_result(matched, modified, upserted_id)
+
+    def update_many(self, filter: Mapping[str, Any], update: Any, upsert: bool = False, **kwargs: Any) -> UpdateResult:
+        matched, modified, upserted_id, _, _ = self._update(filter, update, upsert=upsert, multi=True)
+        return self._update_result(matched, modified, upserted_id)
+
+    def replace_one(self, filter: Mapping[str, Any], replacement: Mapping[str, Any], upsert: bool = False, **kwargs: Any) -> UpdateResult:
+        matched, modified, upserted_id, _, _ = self._update(filter, replacement, upsert=upsert, multi=False, replace=True)
+        return self._update_result(matched, modified, upserted_id)
+
+    def find_one_and_update(self, filter: Mapping[str, Any], update: Any, projection: Optional[Mapping[str, Any]] = None,
+                            sort: Optional[Any] = None, upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                            **kwargs: Any) -> Optional[Dict[str, Any]]:
+        _, _, _, before, after = self._update(filter, update, upsert=upsert, multi=False, sort=sort)
+        document = after if return_document == ReturnDocument.AFTER else before
+        return None if document is None else project(document, projection)
+
+    def _delete(self, filter: Mapping[str, Any], multi: bool) -> int:
+        with self._lock:
+            candidates = self._candidates(filter)
+            if not multi:
+                candidates = candidates[:1]
+            for document in candidates:
+                del self._documents[document["_id"]]
+            return len(candidates)
+
+    def delete_one(self, filter: Mapping[str, Any], **kwargs: Any) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, multi=False)}, True)
+
+    def delete_many(self, filter: Mapping[str, Any], **kwargs: Any) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, multi=True)}, True)
+
+    def bulk_write(self, requests: Sequence[Any], ordered: bool = True, **kwargs: Any) -> BulkWriteResult:
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    matched, modified, upserted_id, _, _ = self._update(request._filter, request._doc, upsert=bool(request._upsert),
+                                                                        multi=isinstance(request, UpdateMany), replace=isinstance(request, ReplaceOne))
+                    result["nMatched"] += matched
+                    result["nModified"] += modified
+                    if upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": upserted_id})
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result["nRemoved"] += self._delete(request._filter, multi=isinstance(request, DeleteMany))
+                else:
+                    raise Exception(f"the in-memory storage does not support the bulk write operation {type(request).__name__}")
+            except DuplicateKeyError as error:
+                result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(error)})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def drop(self) -> None:
+        self.database.drop_collection(self.name)
+
+    # --- indexes ---
+
+    def create_indexes(self, indexes: Sequence[IndexModel], **kwargs: Any) -> List[str]:
+        with self._lock:
+            for index_model in indexes:
+                index_document = dict(index_model.document)
+                self._indexes[index_document["name"]] = {"key": list(index_document["key"].items()), **{key: value for key, value in index_document.items() if key not in ("key", "name")}}
+        return [index_model.document["name"] for index_model in indexes]
+
+    def create_index(self, keys: Any, **kwargs: Any) -> str:
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+
+    def index_information(self) -> Dict[str, Dict[str, Any]]:
+        return copy.deepcopy(self._indexes)
+
+    def list_indexes(self) -> InMemoryCursor:
+        indexes = [{"name": name, **information} for name, information in self._indexes.items()]
+        return InMemoryCursor(lambda: indexes)
+
+    def drop_index(self, index_name: str, **kwargs: Any) -> None:
+        with self._lock:
+            self._indexes.pop(index_name, None)
+
+
+class InMemoryDatabase:
+    """a process wide in-memory database, collections are created on first use like in mongodb"""
+
+    def __init__(self, name: str = "in_memory"):
+        self.name = name
+        self._collections: Dict[str, InMemoryCollection] = dict()
+        self._lock = threading.Lock()
+
+    def get_collection(self, name: str, codec_options: Any = None, **kwargs: Any) -> InMemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = InMemoryCollection(self, name)
+            return self._collections[name]
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        return self.get_collection(name)
+
+    def __getattr__(self, name: str) -> InMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def list_collection_names(self, **kwargs: Any) -> List[str]:
+        return list(self._collections.keys())
+
+    def drop_collection(self, name: str, **kwargs: Any) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+
+    def clear(self) -> None:
+        """drops all collections, e.g. between two tests or benchmark runs"""
+        with self._lock:
+            self._collections.clear()
+
+
+def _group(documents: List[Dict[str, Any]], specification: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    groups: Dict[Any, Dict[str, Any]] = dict()
+    accumulated: Dict[Any, Dict[str, List[Any]]] = defaultdict(lambda: defaultdict(list))
+    for document in documents:
+        group_id = evaluate(specification["_id"], document)
+        group_key = _group_key(group_id)
+        if group_key not in groups:
+            groups[group_key] = {"_id": None if group_id is MISSING else group_id}
+        for field_name, accumulator in specification.items():
+            if field_name == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            accumulated[group_key][field_name].append(MISSING if operator == "$count" else evaluate(expression, document))
+
+    results = list()
+    for group_key, group in groups.items():
+        for field_name, accumulator in specification.items():
+            if field_name == "_id":
+                continue
+            operator = next(iter(accumulator))
+            values = accumulated[group_key][field_name]
+            present_values = [value for value in values if value is not MISSING]
+            if operator == "$sum":
+                group[field_name] = sum(value for value in present_values if isinstance(value, (int, float)) and not isinstance(value, bool))
+            elif operator == "$count":
+                group[field_name] = len(values)
+            elif operator == "$avg":
+                numbers = [value for value in present_values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+                group[field_name] = sum(numbers) / len(numbers) if numbers else None
+            elif operator == "$first":
+                group[field_name] = None if values[0] is MISSING else values[0]
+            elif operator == "$last":
+                group[field_name] = None if values[-1] is MISSING else values[-1]
+            elif operator == "$push":
+                group[field_name] = present_values
+            elif operator == "$addToSet":
+                group[field_name] = [value for index, value in enumerate(present_values) if not any(values_equal(value, other) for other in present_values[:index])]
+            elif operator in ("$min", "$max"):
+                comparable_values = [value for value in present_values if value is not None]
+                group[field_name] = (min if operator == "$min" else max)(comparable_values, key=SortKey) if comparable_values else None
+            else:
+                raise Exception(f"the in-memory storage does not support the accumulator {operator}")
+        results.append(group)
+    return results
+
+
+def _group_key(value: Any) -> str:
+    """a hashable representation of a group _id, dicts and lists are not hashable"""
+    if isinstance(value, Mapping):
+        return "{" + ",".join(f"{key!r}:{_group_key(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(_group_key(item) for item in value) + "]"
+    return f"{type(value).__name__}:{value!r}"
+
+
+def run_pipeline(collection: InMemoryCollection, documents: List[Dict[str, Any]], pipeline: Sequence[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+    """runs the aggregation stages on the (copied) documents"""
+    for stage in pipeline:
+        (stage_name, argument), = stage.items()
+        if stage_name == "$match":
+            documents = [document for document in documents if matches(document, argument)]
+        elif stage_name == "$sort":
+            documents = sort_documents(documents, normalize_sort(argument))
+        elif stage_name == "$limit":
+            documents = documents[:argument]
+        elif stage_name == "$skip":
+            documents = documents[argument:]
+        elif stage_name == "$project":
+            documents = [project(document, argument) for document in documents]
+        elif stage_name in ("$set", "$addFields"):
+            documents = [add_fields(document, argument) for document in documents]
+        elif stage_name == "$unset":
+            for document in documents:
+                for dotted_path in ([argument] if isinstance(argument, str) else argument):
+                    unset_field(document, dotted_path)
+        elif stage_name == "$group":
+            documents = _group(documents, argument)
+        elif stage_name == "$count":
+            documents = [{argument: len(documents)}] if documents else []
+        elif stage_name == "$facet":
+            documents = [{facet_name: run_pipeline(collection, copy.deepcopy(documents), facet_pipeline) for facet_name, facet_pipeline in argument.items()}]
+        elif stage_name == "$unwind":
+            path = (argument if isinstance(argument, str) else argument["path"])[1:]
+            unwound = list()
+            for document in documents:
+                value = evaluate(f"${path}", document)
+                for item in (value if isinstance(value, list) else [] if value in (MISSING, None) else [value]):
+                    unwound.append(add_fields(document, {path: {"$literal": item}}))
+            documents = unwound
+        elif stage_name in ("$replaceRoot", "$replaceWith"):
+            documents = [evaluate(argument["newRoot"] if stage_name == "$replaceRoot" else argument, document) for document in documents]
+        elif stage_name == "$indexStats":
+            documents = [{"name": name, "key": dict(information["key"]), "accesses": {"ops": 0}} for name, information in collection.index_information().items()]
+        else:
+            raise Exception(f"the in-memory storage does not support the aggregation stage {stage_name}")
+    return documents
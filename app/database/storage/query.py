@@ -0,0 +1,347 @@
+"""
+The query language of the in-memory storage backend: filters, update operators, pipeline updates, projections and sorts
+"""
+import copy
+import re
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from app.database.storage.expressions import MISSING, SortKey, compare_values, evaluate, is_true, type_name, values_equal
+
+
+def query_values(document: Any, path: List[str]) -> List[Any]:
+    """all the values a query on the dotted path compares with: an array in the path is traversed, an array at the end
+    of the path is compared as a whole and per element. An empty list means the field is missing"""
+    if not path:
+        if isinstance(document, list):
+            return [document] + document
+        return [document]
+    if isinstance(document, Mapping):
+        if path[0] not in document:
+            return []
+        return query_values(document[path[0]], path[1:])
+    if isinstance(document, list):
+        if path[0].isdigit() and int(path[0]) < len(document):
+            return query_values(document[int(path[0])], path[1:])
+        return [value for element in document if isinstance(element, Mapping) for value in query_values(element, path)]
+    return []
+
+
+def _type_class(value: Any) -> str:
+    name = type_name(value)
+    return "number" if name in ("int", "long", "double") else name
+
+
+def _matches_operator(operator: str, argument: Any, values: List[Any]) -> bool:
+    if operator == "$eq":
+        return _matches_equality(argument, values)
+    if operator == "$ne":
+        return not _matches_equality(argument, values)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        for value in values:
+            # range operators only compare values of the same type class (type bracketing)
+            if _type_class(value) != _type_class(argument):
+                continue
+            comparison = compare_values(value, argument)
+            if ((operator == "$gt" and comparison > 0) or (operator == "$gte" and comparison >= 0)
+                    or (operator == "$lt" and comparison < 0) or (operator == "$lte" and comparison <= 0)):
+                return True
+        return False
+    if operator == "$in":
+        return _matches_any(argument, values)
+    if operator == "$nin":
+        return not _matches_any(argument, values)
+    if operator == "$exists":
+        return bool(values) == bool(argument)
+    if operator == "$not":
+        return not _matches_condition(argument, values)
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == argument for value in values)
+    if operator == "$regex":
+        return any(isinstance(value, str) and re.search(argument, value) for value in values)
+    if operator == "$elemMatch":
+        return any(isinstance(value, list) and any(isinstance(element, Mapping) and matches(element, argument) for element in value) for value in values)
+    if operator == "$type":
+        type_names = argument if isinstance(argument, list) else [argument]
+        return any(type_name(value) in type_names for value in values)
+    raise Exception(f"the in-memory storage does not support the query operator {operator}")
+
+
+def _matches_any(arguments: List[Any], values: List[Any]) -> bool:
+    if all(type(argument) is str for argument in arguments):
+        # a string only equals a string, so a list of ids is a set lookup instead of a comparison with every id
+        string_arguments = set(arguments)
+        return any(type(value) is str and value in string_arguments for value in values)
+    return any(_matches_equality(argument, values) for argument in arguments)
+
+
+def _matches_equality(argument: Any, values: List[Any]) -> bool:
+    if argument is None:
+        # null matches a missing field as well
+        return not values or any(value is None for value in values)
+    if isinstance(argument, re.Pattern):
+        return any(isinstance(value, str) and argument.search(value) for value in values)
+    return any(values_equal(value, argument) for value in values)
+
+
+def _matches_condition(condition: Any, values: List[Any]) -> bool:
+    if isinstance(condition, Mapping) and condition and all(key.startswith("$") for key in condition):
+        options = condition.get("$options", "")
+        return all(_matches_operator(operator, re.compile(argument, re.IGNORECASE if "i" in options else 0) if operator == "$regex" else argument, values)
+                   for operator, argument in condition.items() if operator != "$options")
+    return _matches_equality(condition, values)
+
+
+def matches(document: Mapping[str, Any], filter: Optional[Mapping[str, Any]]) -> bool:
+    """whether the document matches the query filter"""
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif key == "$expr":
+            if not is_true(evaluate(condition, document)):
+                return False
+        elif key.startswith("$"):
+            raise Exception(f"the in-memory storage does not support the query operator {key}")
+        elif not _matches_condition(condition, query_values(document, key.split("."))):
+            return False
+    return True
+
+
+def _parent(document: Dict[str, Any], path: List[str], create: bool) -> Tuple[Any, str]:
+    """the container of the last key of the path, intermediate documents are created if create"""
+    container: Any = document
+    for key in path[:-1]:
+        if isinstance(container, list):
+            index = int(key)
+            container = container[index] if index < len(container) else None
+        elif key not in container or not isinstance(container[key], (dict, list)):
+            if not create:
+                return None, path[-1]
+            container[key] = dict()
+            container = container[key]
+        else:
+            container = container[key]
+        if container is None:
+            return None, path[-1]
+    return container, path[-1]
+
+
+def get_field(document: Mapping[str, Any], dotted_path: str) -> Any:
+    value: Any = document
+    for key in dotted_path.split("."):
+        if isinstance(value, Mapping):
+            value = value.get(key, MISSING)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return MISSING
+    return value
+
+
+def set_field(document: Dict[str, Any], dotted_path: str, value: Any) -> None:
+    container, key = _parent(document, dotted_path.split("."), create=True)
+    if isinstance(container, list):
+        index = int(key)
+        container.extend([None] * (index + 1 - len(container)))
+        container[index] = value
+    else:
+        container[key] = value
+
+
+def unset_field(document: Dict[str, Any], dotted_path: str) -> None:
+    container, key = _parent(document, dotted_path.split("."), create=False)
+    if isinstance(container, dict):
+        container.pop(key, None)
+    elif isinstance(container, list) and key.isdigit() and int(key) < len(container):
+        container[int(key)] = None
+
+
+def _each(argument: Any) -> List[Any]:
+    if isinstance(argument, Mapping) and "$each" in argument:
+        return list(argument["$each"])
+    return [argument]
+
+
+def apply_update(document: Dict[str, Any], update: Mapping[str, Any] | Sequence[Mapping[str, Any]], is_insert: bool = False) -> Dict[str, Any]:
+    """returns a copy of the document with the update operators or the update pipeline applied"""
+    if isinstance(update, (list, tuple)):
+        return apply_pipeline_update(document, update)
+
+    updated = copy.deepcopy(document)
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not is_insert:
+            continue
+        for dotted_path, argument in fields.items():
+            if operator in ("$set", "$setOnInsert"):
+                set_field(updated, dotted_path, copy.deepcopy(argument))
+            elif operator == "$unset":
+                unset_field(updated, dotted_path)
+            elif operator == "$inc":
+                current = get_field(updated, dotted_path)
+                set_field(updated, dotted_path, (0 if current is MISSING or current is None else current) + argument)
+            elif operator in ("$min", "$max"):
+                current = get_field(updated, dotted_path)
+                comparison = compare_values(argument, current)
+                if current is MISSING or (operator == "$min" and comparison < 0) or (operator == "$max" and comparison > 0):
+                    set_field(updated, dotted_path, copy.deepcopy(argument))
+            elif operator in ("$push", "$addToSet"):
+                current = get_field(updated, dotted_path)
+                array = list() if current is MISSING or current is None else current
+                if not isinstance(array, list):
+                    raise Exception(f"The field '{dotted_path}' must be an array but is of type {type_name(array)}")
+                for item in _each(argument):
+                    if operator == "$push" or not any(values_equal(item, element) for element in array):
+                        array.append(copy.deepcopy(item))
+                set_field(updated, dotted_path, array)
+            elif operator == "$pull":
+                current = get_field(updated, dotted_path)
+                if isinstance(current, list):
+                    set_field(updated, dotted_path, [element for element in current if not _pull_matches(element, argument)])
+            else:
+                raise Exception(f"the in-memory storage does not support the update operator {operator}")
+    return updated
+
+
+def _pull_matches(element: Any, condition: Any) -> bool:
+    if isinstance(condition, Mapping) and not all(key.startswith("$") for key in condition):
+        return isinstance(element, Mapping) and matches(element, condition)
+    return _matches_condition(condition, [element])
+
+
+def apply_pipeline_update(document: Dict[str, Any], pipeline: Sequence[Mapping[str, Any]]) -> Dict[str, Any]:
+    updated = copy.deepcopy(document)
+    for stage in pipeline:
+        (stage_name, argument), = stage.items()
+        if stage_name in ("$set", "$addFields"):
+            updated = add_fields(updated, argument)
+        elif stage_name in ("$unset", "$project") and (stage_name == "$unset" or all(value in (0, False) for value in argument.values())):
+            for dotted_path in ([argument] if isinstance(argument, str) else list(argument)):
+                unset_field(updated, dotted_path)
+        elif stage_name in ("$replaceRoot", "$replaceWith"):
+            updated = evaluate(argument["newRoot"] if stage_name == "$replaceRoot" else argument, updated)
+        else:
+            raise Exception(f"the in-memory storage does not support the pipeline update stage {stage_name}")
+    return updated
+
+
+def add_fields(document: Dict[str, Any], fields: Mapping[str, Any]) -> Dict[str, Any]:
+    """$set / $addFields: every expression is evaluated on the document before the stage"""
+    evaluated = [(dotted_path, evaluate(expression, document)) for dotted_path, expression in fields.items()]
+    updated = copy.deepcopy(document)
+    for dotted_path, value in evaluated:
+        if value is MISSING:
+            unset_field(updated, dotted_path)
+        else:
+            set_field(updated, dotted_path, copy.deepcopy(value))
+    return updated
+
+
+_DROPPED = object()
+
+
+def project(document: Mapping[str, Any], projection: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """applies an inclusion or exclusion projection (with computed fields for inclusions) to a copy of the document"""
+    if not projection:
+        return copy.deepcopy(dict(document))
+
+    id_projection = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if fields and all(value in (0, False) for value in fields.values()):
+        projected = copy.deepcopy(dict(document))
+        for dotted_path in fields:
+            unset_field(projected, dotted_path)
+    else:
+        projected = dict()
+        for dotted_path, value in fields.items():
+            if value in (1, True):
+                _include(projected, document, dotted_path.split("."))
+            else:
+                computed_value = evaluate(value, document)
+                if computed_value is not MISSING:
+                    set_field(projected, dotted_path, copy.deepcopy(computed_value))
+        projected = _drop_placeholders(projected)
+
+    if id_projection in (0, False):
+        projected.pop("_id", None)
+    elif id_projection in (1, True):
+        if "_id" in document:
+            projected = {"_id": document["_id"], **{key: value for key, value in projected.items() if key != "_id"}}
+    else:
+        projected["_id"] = evaluate(id_projection, document)
+    return projected
+
+
+def _include(projected: Dict[str, Any], source: Mapping[str, Any], path: List[str]) -> None:
+    """copies the value at the path of source into projected, keeping the structure of the embedded documents and arrays"""
+    key = path[0]
+    if key not in source:
+        return
+    value = source[key]
+    if len(path) == 1:
+        projected[key] = copy.deepcopy(value)
+    elif isinstance(value, Mapping):
+        if not isinstance(projected.get(key), dict):
+            projected[key] = dict()
+        _include(projected[key], value, path[1:])
+    elif isinstance(value, list):
+        # elements that are not documents are left out, as mongodb does
+        if not isinstance(projected.get(key), list):
+            projected[key] = [dict() if isinstance(element, Mapping) else _DROPPED for element in value]
+        for element, projected_element in zip(value, projected[key]):
+            if isinstance(element, Mapping):
+                _include(projected_element, element, path[1:])
+
+
+def _drop_placeholders(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _drop_placeholders(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_drop_placeholders(item) for item in value if item is not _DROPPED]
+    return value
+
+
+def normalize_sort(key_or_list: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, Mapping):
+        return list(key_or_list.items())
+    return [tuple(item) if isinstance(item, (list, tuple)) else (item, 1) for item in key_or_list]
+
+
+def sort_documents(documents: List[Mapping[str, Any]], sort: List[Tuple[str, int]]) -> List[Mapping[str, Any]]:
+    """a stable sort on the keys from the last to the first, every key in its own direction"""
+    for dotted_path, direction in reversed(sort):
+        documents = sorted(documents,
+                           key=lambda document: SortKey(_sort_value(document, dotted_path)),
+                           reverse=direction < 0)
+    return documents
+
+
+def _sort_value(document: Mapping[str, Any], dotted_path: str) -> Any:
+    value = get_field(document, dotted_path)
+    return None if value is MISSING else value
+
+
+def equality_fields(filter: Mapping[str, Any]) -> Dict[str, Any]:
+    """the fields of a filter that an upsert copies into the inserted document"""
+    fields: Dict[str, Any] = dict()
+    for key, condition in filter.items():
+        if key == "$and":
+            for sub_filter in condition:
+                fields.update(equality_fields(sub_filter))
+        elif key.startswith("$"):
+            continue
+        elif isinstance(condition, Mapping) and any(operator.startswith("$") for operator in condition):
+            if "$eq" in condition:
+                fields[key] = condition["$eq"]
+        else:
+            fields[key] = condition
+    return fields
@@ -0,0 +1,86 @@
+"""
+Fast decoding of documents that were written by our own dump_for_database.
+
+model_validate runs the python validators of every nested model of a document (e.g. LabelValueField.delist_value
+for every label of every run of every experiment). For documents that we wrote ourselves these validators already
+ran before the document was stored, so the trusted decoder skips them: the core schema of the entity is compiled
+once per entity type into a pydantic-core validator without the "after" validators. The types are still
+checked and coerced in rust, only the python validators are skipped. Only use it for entities whose after
+validators check or normalize input, not for validators that fill in fields (e.g. LabelTemplateEntity).
+"""
+import random
+import threading
+from typing import Any, Callable, Dict, Mapping, Type
+
+from pydantic import BaseModel
+from pydantic_core import SchemaValidator
+
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+# keys of a core schema that do not contain validation schemas
+_SKIPPED_SCHEMA_KEYS = {"cls", "function", "metadata", "serialization", "config"}
+
+_decoders: Dict[Type[BaseModel], Callable[[Mapping[str, Any]], BaseModel]] = dict()
+_compile_lock = threading.Lock()
+
+
+def _instance_factory(model_class: Type[BaseModel]) -> type:
+    """a private stand-in for the model class in the stripped schema, that creates (uninitialized) instances of the model class.
+    pydantic-core reuses the validator of a complete model class (with its validators) for a model schema of that class,
+    the stand-in is not a pydantic model so the stripped schema is compiled as it is, without changing the model class"""
+    return type(f"_Trusted{model_class.__name__}", (), {"__new__": staticmethod(lambda cls, *args, **kwargs: object.__new__(model_class)),
+                                                         "__module__": __name__})
+
+
+def _strip_after_validators(schema: Any, instance_factories: Dict[Type[BaseModel], type]) -> Any:
+    """returns a copy of the core schema without the function-after validators, the ref of a removed validator moves to the schema it wrapped.
+    The model classes of the model schemas are replaced by their instance factory"""
+    if isinstance(schema, list):
+        return [_strip_after_validators(item, instance_factories) for item in schema]
+
+    if not isinstance(schema, dict):
+        return schema
+
+    if schema.get("type") == "function-after":
+        inner_schema = _strip_after_validators(schema["schema"], instance_factories)
+        if "ref" in schema and "ref" not in inner_schema:
+            inner_schema = {**inner_schema, "ref": schema["ref"]}
+        return inner_schema
+
+    stripped_schema = {key: value if key in _SKIPPED_SCHEMA_KEYS else _strip_after_validators(value, instance_factories) for key, value in schema.items()}
+    if schema.get("type") == "model":
+        model_class = schema["cls"]
+        if model_class not in instance_factories:
+            instance_factories[model_class] = _instance_factory(model_class)
+        stripped_schema["cls"] = instance_factories[model_class]
+    return stripped_schema
+
+
+def _compile_decoder(model_class: Type[BaseModel]) -> Callable[[Mapping[str, Any]], BaseModel]:
+    schema = _strip_after_validators(model_class.__pydantic_core_schema__, dict())
+    return SchemaValidator(schema).validate_python
+
+
+def get_trusted_decoder[M: BaseModel](model_class: Type[M]) -> Callable[[Mapping[str, Any]], M]:
+    """returns the decoder of the entity type, compiled on first use"""
+    decoder = _decoders.get(model_class)
+    if decoder is None:
+        with _compile_lock:
+            decoder = _decoders.get(model_class)
+            if decoder is None:
+                decoder = _decoders[model_class] = _compile_decoder(model_class)
+    return decoder
+
+
+def decode_trusted[M: BaseModel](model_class: Type[M], document: Mapping[str, Any], verify_rate: float = 0.0) -> M:
+    """decodes the document without the python validators. With verify_rate > 0 that fraction of the documents is also
+    decoded with model_validate, and a difference between the two is logged, to check in debug that the fast path is still correct"""
+    entity = get_trusted_decoder(model_class)(document)
+    if verify_rate > 0 and random.random() < verify_rate:
+        validated_entity = model_class.model_validate(document)
+        if validated_entity.model_dump() != entity.model_dump():
+            logger.warning(f"[decode_trusted] trusted decode of {model_class.__name__} differs from model_validate for _id = {document.get('_id')}")
+    return entity
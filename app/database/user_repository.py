@@ -1,10 +1,18 @@
 
 from flask_pymongo.wrappers import Database
 
-from app.database.base_repository import BaseRepository
+from pymongo import ASCENDING
+
+from app.database.base_repository import BaseRepository, soft_delete_index
 from app.database.entities.user_entity import UserEntity
+from app.database.entity_cache import EntityCache
 
 class UserRepository(BaseRepository[UserEntity]):
+    cache = EntityCache("user")
+    indexes = [
+        soft_delete_index([("email", ASCENDING)]), # login
+    ]
+
     def __init__(self, database: Database):
         super().__init__(database, UserEntity, "user")
 
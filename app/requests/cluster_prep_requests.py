@@ -1,5 +1,5 @@
-from typing import Any, Dict, Literal, Optional
-from pydantic import BaseModel
+from typing import Any, Dict, List, Literal, Optional
+from pydantic import BaseModel, Field
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.label_template import ProjectionLabelField, labelName
 from app.utils.types import MediaStrategySkipType
@@ -17,6 +17,18 @@ class GetClusterUnitsRequest(BaseModel):
     scraper_cluster_id: PyObjectId
     reddit_message_type: Literal["post", "comment", "all"] = "all"
     cluster_entity_id: Optional[PyObjectId] = None
+    page_size: Optional[int] = Field(None, ge=1, le=1000) # keyset pagination when set, otherwise all cluster units are returned
+    after: Optional[str] = None # next_after token of the previous page
+    with_count: bool = False # also return an estimated total size
+
+
+class ExportClusterUnitsRequest(BaseModel):
+    scraper_cluster_id: PyObjectId
+    reddit_message_type: Literal["post", "comment", "all"] = "all"
+    columns: Optional[List[str]] = None # the cluster unit columns, all of them if not set
+    label_template_id: Optional[PyObjectId] = None # adds a ground_truth.<label> column per label of the label template
+    only_sample: bool = False # only the cluster units of the sample of the scraper cluster
+    file_format: Literal["parquet", "arrow"] = "parquet"
 
 
 class UpdateGroundTruthRequest(BaseModel):
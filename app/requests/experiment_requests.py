@@ -30,6 +30,23 @@ class TestPrediction(BaseModel):
 
 
 
+class GetExperimentConfidenceIntervals(BaseModel):
+    experiment_id: PyObjectId
+    user_threshold: Optional[float] = None #  0-1 threshold proportion, same meaning as in GetExperiments
+    n_resamples: int = 2000
+    confidence_level: float = 0.95
+
+
+class GetExperimentAgreementMatrix(BaseModel):
+    experiment_ids: List[PyObjectId]
+    user_threshold: Optional[float] = None #  0-1 threshold proportion, applied to each experiment with its own runs_per_unit
+
+
+class ExportExperimentPredictions(BaseModel):
+    experiment_id: PyObjectId
+    file_format: Literal["parquet", "arrow"] = "parquet"
+
+
 class UpdateExperimentThreshold(BaseModel):
     experiment_id: PyObjectId
     threshold_runs_true: int = 1
@@ -3,14 +3,16 @@
 
 from typing import Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.filtering_entity import FilteringFields
 
 
 class FilteringRequest(FilteringFields):
     return_type: Literal["count", "cluster_units"] = "cluster_units"
-    limit: Optional[int] = 1000
+    limit: Optional[int] = Field(1000, ge=1, le=1000) # the page size with paginate, otherwise the first limit matches in the order of the input (every match if None)
+    paginate: bool = False # page through the input with after tokens instead of filtering the whole input
+    after: Optional[str] = None # next_after token of the previous page
 
 class FilteringCreateRequest(BaseModel):
     filtering_fields: FilteringFields
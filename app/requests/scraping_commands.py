@@ -1,4 +1,4 @@
-from typing import Literal
+from typing import Literal, Optional
 from pydantic import BaseModel
 from app.database.entities.base_entity import PyObjectId
 
@@ -8,3 +8,6 @@ class ScrapingId(BaseModel):
 
 class ScraperClusterId(BaseModel):
     scraper_cluster_id: PyObjectId
+
+class RenewPostsRequest(BaseModel):
+    max_posts: Optional[int] = None # at most this many posts are renewed in the call, all due posts if None
@@ -667,6 +667,49 @@ class PredictionMetric(BaseModel):
     kappa: float
     prevelance_distribution: Optional[Dict[ValueKey, Dict[ValueCount, int]]] = None #PrevalenceDistribution
     confusion_matrix: ConfusionMatrix
+    inter_run_unanimous_rate: Optional[float] = None # share of units where all runs predicted the same value
+    inter_run_majority_share: Optional[float] = None # average share of runs that agree with the majority of their unit
+
+
+class ConfidenceInterval(BaseModel):
+    estimate: float # point estimate on the full sample, equal to the value in the PredictionMetric
+    lower: float
+    upper: float
+
+    @property
+    def width(self) -> float:
+        return self.upper - self.lower
+
+
+class PredictionMetricConfidenceInterval(BaseModel):
+    """bootstrap confidence interval of the accuracy and kappa of a single label of an experiment"""
+    prediction_category_name: str
+    total_samples: int # number of packed prediction/truth rows that are resampled
+    n_resamples: int
+    confidence_level: float
+    accuracy: ConfidenceInterval
+    kappa: ConfidenceInterval
+
+
+class ExperimentConfidenceIntervalsResponse(BaseModel):
+    experiment_id: PyObjectId
+    user_threshold: int # minimum number of runs that must be true, used for the confusion matrix
+    prediction_metrics: List[PredictionMetricConfidenceInterval]
+    combined_labels_prediction_metrics: Optional[List[PredictionMetricConfidenceInterval]] = None
+
+
+class ExperimentAgreementMatrixResponse(BaseModel):
+    """pairwise agreement between experiments on their shared cluster units. Every matrix is indexed as
+    [experiment_i][experiment_j][label] in the order of experiment_ids and label_names. None when there are no units to compare"""
+    experiment_ids: List[PyObjectId]
+    label_names: List[LabelName]
+    shared_unit_count: int
+    compared_unit_count: List[List[List[int]]]
+    percent_agreement: List[List[List[Optional[float]]]]
+    kappa: List[List[List[Optional[float]]]]
+    mcnemar_b: List[List[List[int]]] # units where experiment_i predicts True and experiment_j predicts False
+    mcnemar_c: List[List[List[int]]] # units where experiment_i predicts False and experiment_j predicts True
+    mcnemar_statistic: List[List[List[float]]] # (b - c)^2 / (b + c), chi-squared with one degree of freedom
 
 
 class ProgressBar(BaseModel):
@@ -710,6 +753,7 @@ class GetExperimentsResponse(BaseModel):
     status: StatusType
     experiment_type: PromptCategory
     progress_bar: ProgressBar
+    aggregated_unit_count: Optional[int] = None # units in the (partial) metrics, lower than total_cluster_units while the experiment runs
 
 
 class ClusterEntityInputCount(ClusterEntity):
@@ -1,16 +1,18 @@
+import os
 
-
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, send_file
 from flask_jwt_extended import get_jwt_identity, jwt_required
 
 # from flask_jwt_extended import get_jwt_identity, jwt_required
 
 from app.database import get_cluster_unit_repository, get_label_template_repository, get_sample_repository, get_scraper_repository, get_user_repository, get_scraper_cluster_repository
-from app.requests.cluster_prep_requests import GetClusterUnitsRequest, PrepareClusterRequest, ScraperClusterId, UpdateGroundTruthPerLabelRequest, UpdateGroundTruthRequest
+from app.database.base_repository import InvalidPageToken
+from app.requests.cluster_prep_requests import ExportClusterUnitsRequest, GetClusterUnitsRequest, PrepareClusterRequest, ScraperClusterId, UpdateGroundTruthPerLabelRequest, UpdateGroundTruthRequest
 from app.requests.scraping_commands import ScrapingId
 from app.requests.scraper_requests import CreateScraperRequest
 from app.responses.reddit_post_comments_response import RedditResponse
 from app.services.cluster_prep_service import ClusterPrepService
+from app.services.export_service import ExportService
 from app.services.label_template_service import LabelTemplateService
 from app.services.scraper_service import ScraperService
 
@@ -145,6 +147,21 @@ def get_cluster_units(query: GetClusterUnitsRequest):
         logger.warning(f"[get_cluster_units] Cluster preparation not completed: scraper_cluster_id={query.scraper_cluster_id}, status={scraper_cluster_entity.stages.cluster_prep}")
         return jsonify(error="Cluster preparation is no completed"), 409
 
+    if query.page_size is not None:
+        logger.info(f"[get_cluster_units] Retrieving page of {query.page_size} cluster units: scraper_cluster_id={query.scraper_cluster_id}, after={query.after}")
+        try:
+            cluster_units_page = ClusterPrepService.find_cluster_units_page(cluster_entity_id=scraper_cluster_entity.cluster_entity_id,
+                                                                           reddit_message_type=query.reddit_message_type,
+                                                                           after=query.after,
+                                                                           page_size=query.page_size,
+                                                                           with_count=query.with_count)
+        except InvalidPageToken as error:
+            logger.warning(f"[get_cluster_units] Invalid after token: scraper_cluster_id={query.scraper_cluster_id}, after={query.after}")
+            return jsonify(error=str(error)), 400
+        return jsonify(cluster_units=[cluster_unit_entity.model_dump() for cluster_unit_entity in cluster_units_page.content],
+                       next_after=cluster_units_page.next_after,
+                       estimated_total_size=cluster_units_page.estimated_total_size), 200
+
     logger.info(f"[get_cluster_units] Converting cluster units to documents: scraper_cluster_id={query.scraper_cluster_id}, message_type={query.reddit_message_type}")
     returnable_cluster_units = ClusterPrepService.convert_cluster_units_to_bertopic_ready_documents(scraper_cluster_entity, query.reddit_message_type)
 
@@ -156,6 +173,57 @@ def get_cluster_units(query: GetClusterUnitsRequest):
         return jsonify(error="There are no cluster unit entities for the scraper cluster instance"), 400
     
 
+@clustering_bp.route("/export_cluster_units", methods=["GET"])
+@validate_query_params(ExportClusterUnitsRequest)
+@jwt_required()
+def export_cluster_units(query: ExportClusterUnitsRequest):
+    """the cluster units as a Parquet / Arrow file, for offline analysis instead of the JSON of get_cluster_units"""
+    user_id = get_jwt_identity()
+    logger.info(f"[export_cluster_units] Request received for user_id={user_id}, scraper_cluster_id={query.scraper_cluster_id}, file_format={query.file_format}")
+
+    current_user = get_user_repository().find_by_id(user_id)
+    if not current_user:
+        logger.warning(f"[export_cluster_units] User not found: user_id={user_id}")
+        return jsonify(error="No such user"), 401
+
+    scraper_cluster_entity = get_scraper_cluster_repository().find_by_id_and_user(user_id, query.scraper_cluster_id)
+    if not scraper_cluster_entity:
+        logger.error(f"[export_cluster_units] Scraper cluster not found: scraper_cluster_id={query.scraper_cluster_id}, user_id={user_id}")
+        return jsonify(error=f"Could not find associated scraper_cluster_instance for id= {query.scraper_cluster_id}"), 400
+
+    if not scraper_cluster_entity.stages.cluster_prep == StatusType.Completed:
+        logger.warning(f"[export_cluster_units] Cluster preparation not completed: scraper_cluster_id={query.scraper_cluster_id}, status={scraper_cluster_entity.stages.cluster_prep}")
+        return jsonify(error="Cluster preparation is no completed"), 409
+
+    label_template_entity = None
+    if query.label_template_id:
+        label_template_entity = get_label_template_repository().find_by_id(query.label_template_id)
+        if not label_template_entity:
+            return jsonify(error=f"No label template found for label_template_id = {query.label_template_id}"), 404
+
+    cluster_unit_ids = None
+    if query.only_sample:
+        sample_entity = get_sample_repository().find_by_id(scraper_cluster_entity.sample_id) if scraper_cluster_entity.sample_id else None
+        if not sample_entity:
+            return jsonify(error="you must first create a sample entity"), 400
+        cluster_unit_ids = sample_entity.sample_cluster_unit_ids
+
+    try:
+        export_path = ExportService.export_cluster_units(cluster_entity_id=scraper_cluster_entity.cluster_entity_id,
+                                                         columns=query.columns,
+                                                         label_template_entity=label_template_entity,
+                                                         reddit_message_type=query.reddit_message_type,
+                                                         cluster_unit_ids=cluster_unit_ids,
+                                                         file_format=query.file_format)
+    except Exception as e:
+        logger.error(f"[export_cluster_units] Export failed: scraper_cluster_id={query.scraper_cluster_id}, error={e}")
+        return jsonify(error=str(e)), 400
+
+    response = send_file(os.path.abspath(export_path), as_attachment=True, download_name=os.path.basename(export_path))
+    response.call_on_close(lambda: ExportService.remove_export_file(export_path))
+    return response
+
+
 @clustering_bp.route("/update_ground_truth", methods=["PUT"])
 @validate_request_body(UpdateGroundTruthRequest)
 @jwt_required()
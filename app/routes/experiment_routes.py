@@ -1,8 +1,9 @@
 
 
 import asyncio
+import os
 from typing import List
-from flask import Blueprint, Response, jsonify
+from flask import Blueprint, Response, jsonify, send_file
 from flask_jwt_extended import get_jwt_identity, jwt_required
 import random
 
@@ -12,10 +13,12 @@ from app.database.entities.prompt_entity import PromptCategory, PromptEntity
 from app.database.entities.sample_entity import SampleEntity
 from app.database.entities.scraper_cluster_entity import StageStatus
 from app.requests.cluster_prep_requests import ScraperClusterId
-from app.requests.experiment_requests import CreateExperiment, CreatePrompt, CreateSample, ExperimentId, GetExperiments, GetInputEntities, GetSample, GetSampleUnits, GetSampleUnitsLabelingFormat, GetSampleUnitsStandaloneFormat, ParsePrompt, ParseRawPrompt, TestPrediction, UpdateExperimentThreshold, UpdateSample
+from app.requests.experiment_requests import CreateExperiment, CreatePrompt, CreateSample, ExperimentId, ExportExperimentPredictions, GetExperimentAgreementMatrix, GetExperimentConfidenceIntervals, GetExperiments, GetInputEntities, GetSample, GetSampleUnits, GetSampleUnitsLabelingFormat, GetSampleUnitsStandaloneFormat, ParsePrompt, ParseRawPrompt, TestPrediction, UpdateExperimentThreshold, UpdateSample
 from app.responses.get_experiments_response import ClusterEntityInputCount, GetExperimentsResponse, InputEntitiesExperimentsResponse, PredictionsGroupedOutputFormat
 from app.services.cluster_prep_service import ClusterPrepService
 from app.services.experiment_service import ExperimentService
+from app.services.experiment_statistics_service import ExperimentStatisticsService
+from app.services.export_service import ExportService
 from app.services.filtering_service import FilteringService
 from app.services.label_template_service import LabelTemplateService
 from app.services.openrouter_analytics_service import OpenRouterDataService
@@ -113,6 +116,96 @@ def update_experiment_threshold(body: UpdateExperimentThreshold):
         return jsonify(message="successfully updated the threshold"), 200
 
 
+@experiment_bp.route("/confidence_intervals", methods=["GET"])
+@validate_query_params(GetExperimentConfidenceIntervals)
+@jwt_required()
+def get_experiment_confidence_intervals(query: GetExperimentConfidenceIntervals):
+    user_id = get_jwt_identity()
+    current_user = get_user_repository().find_by_id(user_id)
+    if not current_user:
+        return jsonify(error="No such user"), 401
+
+    if query.user_threshold is not None and (query.user_threshold > 1 or query.user_threshold < 0):
+        return jsonify(error=f"user_threshold must be between 0 and 1 | NOT {query.user_threshold}"), 400
+
+    if not 0 < query.confidence_level < 1:
+        return jsonify(error=f"confidence_level must be between 0 and 1 | NOT {query.confidence_level}"), 400
+
+    if query.n_resamples < 1 or query.n_resamples > 100_000:
+        return jsonify(error=f"n_resamples must be between 1 and 100000 | NOT {query.n_resamples}"), 400
+
+    experiment_entity = get_experiment_repository().find_by_id(query.experiment_id)
+    if not experiment_entity or experiment_entity.user_id != user_id:
+        return jsonify(error=f"No experiment entity found for experiment id : {query.experiment_id}"), 404
+
+    confidence_intervals = ExperimentStatisticsService.calculate_confidence_intervals(experiment_entity=experiment_entity,
+                                                                                      user_threshold=query.user_threshold,
+                                                                                      n_resamples=query.n_resamples,
+                                                                                      confidence_level=query.confidence_level)
+    if confidence_intervals is None:
+        return jsonify(error=f"experiment {experiment_entity.id} has no aggregate results yet"), 409
+
+    return jsonify(confidence_intervals.model_dump()), 200
+
+
+@experiment_bp.route("/agreement_matrix", methods=["GET"])
+@validate_query_params(GetExperimentAgreementMatrix)
+@jwt_required()
+def get_experiment_agreement_matrix(query: GetExperimentAgreementMatrix):
+    user_id = get_jwt_identity()
+    current_user = get_user_repository().find_by_id(user_id)
+    if not current_user:
+        return jsonify(error="No such user"), 401
+
+    if query.user_threshold is not None and (query.user_threshold > 1 or query.user_threshold < 0):
+        return jsonify(error=f"user_threshold must be between 0 and 1 | NOT {query.user_threshold}"), 400
+
+    experiment_ids = list(dict.fromkeys(query.experiment_ids))
+    if len(experiment_ids) < 2:
+        return jsonify(error="at least two different experiment_ids are needed to compare"), 400
+
+    experiment_entities = get_experiment_repository().find_many_by_ids(experiment_ids)
+    experiment_entities = [experiment_entity for experiment_entity in experiment_entities if experiment_entity.user_id == user_id]
+    if len(experiment_entities) != len(experiment_ids):
+        found_ids = {experiment_entity.id for experiment_entity in experiment_entities}
+        return jsonify(error=f"No experiment entities found for experiment ids : {[experiment_id for experiment_id in experiment_ids if experiment_id not in found_ids]}"), 404
+
+    # keep the order of the request, find_many_by_ids does not guarantee it
+    experiment_entities_map = {experiment_entity.id: experiment_entity for experiment_entity in experiment_entities}
+    try:
+        agreement_matrix = ExperimentStatisticsService.calculate_agreement_matrix(
+            experiment_entities=[experiment_entities_map[experiment_id] for experiment_id in experiment_ids],
+            user_threshold=query.user_threshold)
+    except Exception as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(agreement_matrix.model_dump()), 200
+
+
+@experiment_bp.route("/export_predictions", methods=["GET"])
+@validate_query_params(ExportExperimentPredictions)
+@jwt_required()
+def export_experiment_predictions(query: ExportExperimentPredictions):
+    """every run of the experiment with its predicted label values as a Parquet / Arrow file"""
+    user_id = get_jwt_identity()
+    current_user = get_user_repository().find_by_id(user_id)
+    if not current_user:
+        return jsonify(error="No such user"), 401
+
+    experiment_entity = get_experiment_repository().find_by_id(query.experiment_id)
+    if not experiment_entity or experiment_entity.user_id != user_id:
+        return jsonify(error=f"No experiment entity found for experiment id : {query.experiment_id}"), 404
+
+    label_template_entity = get_label_template_repository().find_by_id(experiment_entity.label_template_id)
+    if not label_template_entity:
+        return jsonify(error=f"No label template found for label_template_id = {experiment_entity.label_template_id}"), 404
+
+    export_path = ExportService.export_predictions(experiment_entity, label_template_entity, file_format=query.file_format)
+    response = send_file(os.path.abspath(export_path), as_attachment=True, download_name=os.path.basename(export_path))
+    response.call_on_close(lambda: ExportService.remove_export_file(export_path))
+    return response
+
+
 @experiment_bp.route("/", methods=["POST"])
 @validate_request_body(CreateExperiment)
 @jwt_required()
@@ -723,7 +816,7 @@ def test_prediction(body: TestPrediction) -> PredictionsGroupedOutputFormat:
         cluster_unit_entities_remain = cluster_unit_entities[:body.nr_to_predict]
     else:
         
-        cluster_unit_entities_remain = get_cluster_unit_repository().find_many_by_ids(body.cluster_unit_ids)
+        cluster_unit_entities_remain = get_cluster_unit_repository().find_many_by_ids_with_predictions(body.cluster_unit_ids, [experiment_entity.id])
 
     max_concurrent = 100
     label_template_entity.labels_llm_prompt_response_format = label_template_entity.create_labels_llm_prompt_response_format_field()
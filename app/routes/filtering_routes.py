@@ -3,6 +3,7 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from app.database import get_filtering_repository, get_user_repository
+from app.database.base_repository import InvalidPageToken
 from app.database.entities.filtering_entity import FilteringEntity, FilteringFields
 from app.requests.filtering_requests import FilteringCreateRequest, FilteringEntityId, FilteringRequest, GetFilteringEntities
 from app.services.filtering_service import FilteringService
@@ -25,13 +26,8 @@ def get_filtering_count(body: FilteringFields):
     if not current_user:
         return jsonify(error="No such user"), 401
     
-    cluster_unit_entities, experiment_entity = FilteringService().get_input_cluster_units(input_id=body.input_id, input_type=body.input_type)
-    print("cluster_unit_entities = ", len(cluster_unit_entities))
-    print("body= ", body)
-    filtered_cluster_unit_entities = FilteringService().filter_cluster_units(cluster_unit_entities=cluster_unit_entities,
-                                                                             filtering_fields=body,
-                                                                             experiment_entity=experiment_entity)
-    return jsonify(after_filtering=len(filtered_cluster_unit_entities), before_filtering=len(cluster_unit_entities)), 200
+    before_filtering, after_filtering = FilteringService().count_filtered_cluster_units(filtering_fields=body)
+    return jsonify(after_filtering=after_filtering, before_filtering=before_filtering), 200
     
     
 @filtering_bp.route("/cluster_units", methods=["POST"])
@@ -43,13 +39,18 @@ def get_filtering_cluster_units(body: FilteringRequest):
     if not current_user:
         return jsonify(error="No such user"), 401
     
-    cluster_unit_entities, experiment_entity = FilteringService().get_input_cluster_units(input_id=body.input_id, 
-                                                                                          input_type=body.input_type)
-        
-    filtered_cluster_unit_entities = FilteringService().filter_cluster_units(cluster_unit_entities=cluster_unit_entities,
-                                                                             filtering_fields=body,
-                                                                             experiment_entity=experiment_entity)
-    returnable_entities = [cluster_unit_entity.model_dump() for cluster_unit_entity in filtered_cluster_unit_entities[:body.limit]]
+    if body.paginate or body.after:
+        try:
+            filtered_cluster_unit_entities, next_after = FilteringService().find_filtered_cluster_units_page(filtering_fields=body,
+                                                                                                            limit=body.limit or 1000,
+                                                                                                            after=body.after)
+        except InvalidPageToken as error:
+            return jsonify(error=str(error)), 400
+        returnable_entities = [cluster_unit_entity.model_dump() for cluster_unit_entity in filtered_cluster_unit_entities]
+        return jsonify(filtered_cluster_units=returnable_entities, next_after=next_after), 200
+
+    filtered_cluster_unit_entities = FilteringService().find_filtered_cluster_units(filtering_fields=body, limit=body.limit)
+    returnable_entities = [cluster_unit_entity.model_dump() for cluster_unit_entity in filtered_cluster_unit_entities]
     return jsonify(filtered_cluster_units=returnable_entities), 200
     
     
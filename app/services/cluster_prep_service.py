@@ -1,13 +1,20 @@
 
 
+import os
 import random
-from typing import List, Literal, Optional, Set
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Any, List, Literal, Mapping, Optional, Set, Tuple
 
 from flask import Response, jsonify
+from pymongo import DESCENDING
+
+from app.database.base_repository import KeysetPage
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.cluster_entity import ClusterEntity, ClusterTextThreadModeType
-from app.database.entities.cluster_unit_entity import ClusterUnitEntity
-from app.database.entities.post_entity import CommentEntity
+from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitPostIdView, ClusterUnitSummaryView
+from app.database.entities.comment_row_entity import CommentRowEntity, flatten_comment_tree
+from app.database.entities.post_entity import PostEntity
 from app.database.entities.scraper_cluster_entity import ScraperClusterEntity
 from app.database.entities.scraper_entity import ScraperEntity
 from app.database import get_cluster_repository, get_cluster_unit_repository, get_post_repository, get_scraper_cluster_repository, get_scraper_repository
@@ -18,10 +25,26 @@ from app.utils.types import MediaStrategySkipType, StatusType
 logger = get_logger(__name__)
 
 
+def prepare_post_cluster_units_worker(arguments: Tuple[Mapping[str, Any], List[Mapping[str, Any]], PyObjectId, MediaStrategySkipType]) -> Tuple[PyObjectId, List[Mapping[str, Any]]]:
+    """top level function so that it can be pickled to a process pool. Decodes a post document (and the comment row documents of a post
+    with the flat layout), flattens its comment tree and returns the post id with its cluster units dumped for the database"""
+    post_document, comment_row_documents, cluster_entity_id, media_strategy_skip_type = arguments
+    post_entity = PostEntity.model_validate(post_document)
+    if post_entity.comments_layout == "flat":
+        comment_rows = [CommentRowEntity.model_validate(comment_row_document) for comment_row_document in comment_row_documents]
+    else:
+        comment_rows = flatten_comment_tree(post_entity.id, post_entity.comments)
+    cluster_unit_entities = ClusterPrepService.build_post_cluster_units(post_entity, comment_rows, cluster_entity_id, media_strategy_skip_type)
+    return post_entity.id, [cluster_unit_entity.dump_for_database() for cluster_unit_entity in cluster_unit_entities]
+
+
 class ClusterPrepService:
     """the service that prepares the clusterable stuff te be ready for clustering. 
     
     """
+    # Below this number of posts the overhead of starting worker processes is larger than converting the posts
+    _min_posts_for_process_pool: int = 200
+
     @staticmethod
     def prepare_cluster_entity(scraper_cluster_entity: ScraperClusterEntity, media_strategy_skip_type: MediaStrategySkipType, text_thread_mode=ClusterTextThreadModeType.LlmParsedText) -> ClusterEntity:
         logger.info(f"[prepare_cluster_entity] Starting: scraper_cluster_id={scraper_cluster_entity.id}, media_strategy={media_strategy_skip_type}, text_thread_mode={text_thread_mode}")
@@ -64,9 +87,15 @@ class ClusterPrepService:
             return cluster_entity
 
     @staticmethod
-    def start_preparing_clustering(scraper_cluster_entity: ScraperClusterEntity, media_strategy_skip_type: MediaStrategySkipType) -> int:
+    def start_preparing_clustering(scraper_cluster_entity: ScraperClusterEntity,
+                                   media_strategy_skip_type: MediaStrategySkipType,
+                                   batch_size: int = 500,
+                                   max_workers: Optional[int] = None) -> int:
         """Converts the found posts into cluster units. It checks whether a post is already converted, if so it skips it
-        normally this is never the case, but happened frequently during testing. Also if it goes wrong, we can restart it so it is good to have
+        normally this is never the case, but happened frequently during testing. Also if it goes wrong, we can restart it so it is good to have.
+        The posts are read in batches of batch_size with one $in query, their comment trees are converted in a process pool (max_workers, the cpu count by default)
+        and the cluster units of the whole batch are inserted unordered in one insert_many. Every prepared batch is checkpointed as completed
+        in post_entity_ids_prep_status, so a restart continues with the next batch
         """
         logger.info(f"[start_preparing_clustering] Starting for scraper_cluster_id={scraper_cluster_entity.id}, media_strategy={media_strategy_skip_type}")
 
@@ -78,151 +107,168 @@ class ClusterPrepService:
             
             deleted = get_cluster_unit_repository().delete_many_by_cluster_enity_id(cluster_entity.id)
             logger.info(f"deleted a total of {deleted} cluster units")
-            get_cluster_repository().update(cluster_entity.id, {"media_strategy_skip_type": media_strategy_skip_type})
-
-
-        # Retrieve all cluster units that have already been created
-        all_previously_added_cluster_units = get_cluster_unit_repository().find({"cluster_entity_id": cluster_entity.id})
-        previous_found_post_ids_set = set([cluster_unit.post_id for cluster_unit in all_previously_added_cluster_units])
-        logger.info(f"[start_preparing_clustering] Found {len(all_previously_added_cluster_units)} existing cluster units from {len(previous_found_post_ids_set)} different posts")
-
-        all_inserted_cluster_unit_entities = [] # contains only a list of the inserted ids
-        total_posts = len(cluster_entity.post_entity_ids_prep_status)
-        processed_count = 0
-
-        for post_id, post_prep_status  in cluster_entity.post_entity_ids_prep_status.items():
-            processed_count += 1
-            logger.info(f"[start_preparing_clustering] Processing post {processed_count}/{total_posts}: post_id={post_id}, status={post_prep_status}")
-
-            if post_prep_status == StatusType.Initialized:
-                if post_id in previous_found_post_ids_set:
-                    logger.info(f"[start_preparing_clustering] Skipping already converted post: post_id={post_id}")
-                    continue
-                inserted_cluster_unit_entities = ClusterPrepService.convert_post_entity_to_cluster_units(cluster_entity, post_id, cluster_entity.media_strategy_skip_type)
-                all_inserted_cluster_unit_entities.extend(inserted_cluster_unit_entities)
-                logger.info(f"[start_preparing_clustering] Created {len(inserted_cluster_unit_entities)} cluster units for post_id={post_id}")
-            elif post_prep_status == StatusType.Ongoing:
-                # TODO what do we do here, it is probably not finished correctly?
-                logger.error(f"[start_preparing_clustering] Post in ongoing state: cluster_entity_id={cluster_entity.id}, post_id={post_id}")
-                raise Exception(f"We are with {cluster_entity.id} in a problem with post: {post_id} | we are ongoing???")
-            elif post_prep_status == StatusType.Completed:
-                logger.info(f"[start_preparing_clustering] Post already completed: cluster_entity_id={cluster_entity.id}, post_id={post_id}")
-            else:
-                logger.error(f"[start_preparing_clustering] Unknown post status: cluster_entity_id={cluster_entity.id}, post_id={post_id}, status={post_prep_status}")
-
-        logger.info(f"[start_preparing_clustering] Completed: scraper_cluster_id={scraper_cluster_entity.id}, newly created cluster_units_entities ={len(all_inserted_cluster_unit_entities)}")
-        all_cluster_unit_entities_count = len(all_previously_added_cluster_units) + len(all_inserted_cluster_unit_entities)
+            # the posts are prepared again with the new strategy
+            cluster_entity.post_entity_ids_prep_status = {post_id: StatusType.Initialized for post_id in cluster_entity.post_entity_ids_prep_status}
+            get_cluster_repository().update(cluster_entity.id, {"media_strategy_skip_type": media_strategy_skip_type,
+                                                                "post_entity_ids_prep_status": cluster_entity.post_entity_ids_prep_status})
+
+        ongoing_post_ids = [post_id for post_id, post_prep_status in cluster_entity.post_entity_ids_prep_status.items() if post_prep_status == StatusType.Ongoing]
+        if ongoing_post_ids:
+            # TODO what do we do here, it is probably not finished correctly?
+            logger.error(f"[start_preparing_clustering] Posts in ongoing state: cluster_entity_id={cluster_entity.id}, post_ids={ongoing_post_ids}")
+            raise Exception(f"We are with {cluster_entity.id} in a problem with post: {ongoing_post_ids[0]} | we are ongoing???")
+
+        # the posts that already have cluster units, only their post_id is read
+        previous_found_post_ids_set = get_cluster_unit_repository().find_converted_post_ids(cluster_entity.id)
+        previous_cluster_unit_count = get_cluster_unit_repository().count_by_cluster_entity_id(cluster_entity.id)
+        logger.info(f"[start_preparing_clustering] Found {previous_cluster_unit_count} existing cluster units from {len(previous_found_post_ids_set)} different posts")
+
+        initialized_post_ids = [post_id for post_id, post_prep_status in cluster_entity.post_entity_ids_prep_status.items() if post_prep_status == StatusType.Initialized]
+        converted_post_ids = [post_id for post_id in initialized_post_ids if post_id in previous_found_post_ids_set]
+        post_ids_to_convert = [post_id for post_id in initialized_post_ids if post_id not in previous_found_post_ids_set]
+        if converted_post_ids:
+            logger.info(f"[start_preparing_clustering] Skipping {len(converted_post_ids)} already converted posts")
+            ClusterPrepService.checkpoint_prepared_posts(cluster_entity, converted_post_ids)
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        use_process_pool = max_workers > 1 and len(post_ids_to_convert) >= ClusterPrepService._min_posts_for_process_pool
+        logger.info(f"[start_preparing_clustering] Converting {len(post_ids_to_convert)} posts in batches of {batch_size}"
+                    f"{f' with {max_workers} processes' if use_process_pool else ''}")
+
+        # a few chunks per worker and batch, so a worker with long threads does not hold up the batch
+        chunksize = max(1, batch_size // (4 * max_workers))
+        inserted_cluster_unit_count = 0
+        with (ProcessPoolExecutor(max_workers=max_workers) if use_process_pool else nullcontext()) as executor:
+            for batch_start in range(0, len(post_ids_to_convert), batch_size):
+                batch_post_ids = post_ids_to_convert[batch_start:batch_start + batch_size]
+                prepared_post_ids, batch_cluster_unit_count = ClusterPrepService.prepare_post_batch(cluster_entity, batch_post_ids, executor, chunksize)
+                ClusterPrepService.checkpoint_prepared_posts(cluster_entity, prepared_post_ids)
+                inserted_cluster_unit_count += batch_cluster_unit_count
+                logger.info(f"[start_preparing_clustering] Prepared {batch_start + len(batch_post_ids)}/{len(post_ids_to_convert)} posts, "
+                            f"{inserted_cluster_unit_count} cluster units created")
+
+        logger.info(f"[start_preparing_clustering] Completed: scraper_cluster_id={scraper_cluster_entity.id}, newly created cluster_units_entities ={inserted_cluster_unit_count}")
+        all_cluster_unit_entities_count = previous_cluster_unit_count + inserted_cluster_unit_count
         cluster_entity.cluster_unit_count = all_cluster_unit_entities_count
         get_cluster_repository().update(cluster_entity.id, cluster_entity)
         logger.info(f"ClusterEntity with Id : {cluster_entity.id} has a total of {all_cluster_unit_entities_count} cluster unit entities")
         return all_cluster_unit_entities_count
 
     @staticmethod
-    def convert_post_entity_to_cluster_units(cluster_entity: ClusterEntity, post_id: PyObjectId, media_strategy_skip_type: MediaStrategySkipType) -> List[PyObjectId]:
-        post_entity = get_post_repository().find_by_id(post_id)
-        logger.info(f"[convert_post_entity_to_cluster_units] Converting post_id={post_entity.id}, has_media={post_entity.has_media()}, comments_count={len(post_entity.comments)}")
+    def prepare_post_batch(cluster_entity: ClusterEntity,
+                           post_ids: List[PyObjectId],
+                           executor: Optional[Executor] = None,
+                           chunksize: int = 1) -> Tuple[List[PyObjectId], int]:
+        """converts a batch of posts into cluster units and inserts them, in the executor if given.
+        Returns the ids of the prepared posts (a post that no longer exists is left out) and the number of inserted cluster units"""
+        post_documents = get_post_repository().find_documents_by_ids(post_ids)
+        if len(post_documents) < len(post_ids):
+            logger.warning(f"[prepare_post_batch] {len(post_ids) - len(post_documents)} of {len(post_ids)} posts were not found for cluster_entity_id={cluster_entity.id}")
+
+        flat_post_ids = [document["_id"] for document in post_documents if document.get("comments_layout") == "flat"]
+        comment_rows_per_post = get_post_repository().comment_repository.find_post_rows_documents(flat_post_ids)
+        worker_arguments = [(document, comment_rows_per_post.get(document["_id"], []), cluster_entity.id, cluster_entity.media_strategy_skip_type)
+                            for document in post_documents]
+        if executor is not None:
+            results = list(executor.map(prepare_post_cluster_units_worker, worker_arguments, chunksize=chunksize))
+        else:
+            results = list(map(prepare_post_cluster_units_worker, worker_arguments))
+
+        cluster_unit_documents = [cluster_unit_document for _, post_cluster_unit_documents in results for cluster_unit_document in post_cluster_unit_documents]
+        if cluster_unit_documents:
+            get_cluster_unit_repository().insert_documents(cluster_unit_documents)
+        return [post_id for post_id, _ in results], len(cluster_unit_documents)
+
+    @staticmethod
+    def checkpoint_prepared_posts(cluster_entity: ClusterEntity, post_ids: List[PyObjectId]) -> None:
+        for post_id in post_ids:
+            cluster_entity.post_entity_ids_prep_status[post_id] = StatusType.Completed
+        get_cluster_repository().update_post_prep_statuses(cluster_entity.id, post_ids, StatusType.Completed)
 
+    @staticmethod
+    def build_post_cluster_units(post_entity: PostEntity,
+                                 comment_rows: List[CommentRowEntity],
+                                 cluster_entity_id: PyObjectId,
+                                 media_strategy_skip_type: MediaStrategySkipType) -> List[ClusterUnitEntity]:
+        """the cluster units of the post and its comment rows (in thread order) that remain after the media strategy, without touching the database"""
         # First we add the post as text by itself. since it is already valuable. Should we also add metadata of the replies/ comments?
         cluster_unit_entities: List[ClusterUnitEntity] = []
 
         # skip the whole thread if post has media and that MediaStrategySkipType in SkipPostsUnits, SkipThreadUnits
         if post_entity.has_media():
             if media_strategy_skip_type == MediaStrategySkipType.SkipPostsUnits or media_strategy_skip_type == MediaStrategySkipType.SkipThreadUnits:
-                logger.info(f"[convert_post_entity_to_cluster_units] Skipping post with media: post_id={post_entity.id}, media_strategy={media_strategy_skip_type}")
+                logger.info(f"[build_post_cluster_units] Skipping post with media: post_id={post_entity.id}, media_strategy={media_strategy_skip_type}")
                 return []
 
-        cluster_unit_entity_post = ClusterUnitEntity.from_post(post_entity, cluster_entity.id)
+        cluster_unit_entity_post = ClusterUnitEntity.from_post(post_entity, cluster_entity_id)
         cluster_unit_entities.append(cluster_unit_entity_post)
 
-        # now we loop over each comment. To convert them into cluster unit entities. It also takes care of the replies
-        skipped_comments = 0
-        for comment in post_entity.comments:
-            # Skip the whole thread below a has media type
-            if comment.has_media() and media_strategy_skip_type == MediaStrategySkipType.SkipThreadUnits:
-                skipped_comments += 1
-                continue
-            
-            cluster_unit_entity = ClusterUnitEntity.from_comment(
-                comment_entity=comment,
-                cluster_entity_id=cluster_entity.id,
-                post_id=post_id,
-                post_permalink=post_entity.permalink,
-                subreddit=post_entity.subreddit,
-                reply_to_cluster_unit=cluster_unit_entity_post)
-            cluster_unit_entities.append(cluster_unit_entity)
-            comment_index = len(cluster_unit_entities) -1
-            if comment.replies:
-                ClusterPrepService.convert_comment_entity_to_cluster_units(
-                    replies=comment.replies,
-                    post_id=post_id,
-                    post_permalink=post_entity.permalink,
-                    cluster_entity=cluster_entity,
-                    cluster_unit_entities=cluster_unit_entities,
-                    subreddit=post_entity.subreddit,
-                    reply_to_cluster_unit=cluster_unit_entity,
-                    media_strategy_skip_type=media_strategy_skip_type)
-
-            cluster_unit_entities[comment_index].total_nested_replies = len(cluster_unit_entities) - comment_index - 1
+        # now we convert each comment, in thread order so that a reply comes after the comment it replies to
+        skipped_comments = ClusterPrepService.convert_comment_rows_to_cluster_units(
+            comment_rows=comment_rows,
+            post_entity=post_entity,
+            cluster_entity_id=cluster_entity_id,
+            cluster_unit_entities=cluster_unit_entities,
+            media_strategy_skip_type=media_strategy_skip_type)
 
         cluster_unit_entities[0].total_nested_replies = len(cluster_unit_entities) - 1
 
         if skipped_comments > 0:
-            logger.info(f"[convert_post_entity_to_cluster_units] Skipped {skipped_comments} comments with media for post_id={post_entity.id}")
-
-        logger.info(f"[convert_post_entity_to_cluster_units] Created {len(cluster_unit_entities)} cluster units for post_id={post_entity.id}")
+            logger.info(f"[build_post_cluster_units] Skipped {skipped_comments} comments with media for post_id={post_entity.id}")
 
         cluster_unit_entities_remain = ClusterPrepService.process_cluster_units_media_type(cluster_unit_entities, media_strategy_skip_type)
         filtered_count = len(cluster_unit_entities) - len(cluster_unit_entities_remain)
 
         if filtered_count > 0:
-            logger.info(f"[convert_post_entity_to_cluster_units] Media filtering reduced units by {filtered_count} for post_id={post_entity.id}")
-
-        if cluster_unit_entities_remain:
-            # we must store the inserted_ids first in this variable. Some issue pertains to the object lifetime if we chain
-            # the result of the insertMany
-            inserted_ids = get_cluster_unit_repository().insert_list_entities(cluster_unit_entities_remain).inserted_ids
-            logger.info(f"[convert_post_entity_to_cluster_units] Inserted {len(inserted_ids)} cluster units into database for post_id={post_entity.id}")
-            return inserted_ids
-        else:
-            logger.warning(f"[convert_post_entity_to_cluster_units] No cluster units remained after filtering for post_id={post_entity.id}")
-            return []
+            logger.info(f"[build_post_cluster_units] Media filtering reduced units by {filtered_count} for post_id={post_entity.id}")
+        return cluster_unit_entities_remain
 
     @staticmethod
-    def convert_comment_entity_to_cluster_units(
-        replies: List[CommentEntity], 
-        post_id: PyObjectId,
-        post_permalink: str,
-        cluster_entity: ClusterEntity, 
-        cluster_unit_entities:List[ClusterUnitEntity], 
-        subreddit: str,
-        reply_to_cluster_unit: ClusterUnitEntity,
-        media_strategy_skip_type: MediaStrategySkipType):
-        """recursively calls until there are no more replies left to convert into cluster_unit entities"""
-        for reply in replies:
-            if reply.has_media() and media_strategy_skip_type == MediaStrategySkipType.SkipThreadUnits:
+    def convert_comment_rows_to_cluster_units(
+        comment_rows: List[CommentRowEntity],
+        post_entity: PostEntity,
+        cluster_entity_id: PyObjectId,
+        cluster_unit_entities: List[ClusterUnitEntity],
+        media_strategy_skip_type: MediaStrategySkipType) -> int:
+        """converts the comment rows (in thread order) into cluster units that reply to the cluster unit of their parent,
+        cluster_unit_entities starts with the cluster unit of the post. Iterative instead of recursive over the comment tree,
+        the ancestors of the current row are kept on a stack. Returns the number of skipped top level comments"""
+        cluster_unit_entity_post = cluster_unit_entities[0]
+        skipped_comments = 0
+        skipped_path: Optional[str] = None
+        # (path of the comment, index of its cluster unit) of the ancestors of the current row
+        ancestors: List[Tuple[str, int]] = []
+
+        def close_ancestor():
+            _, ancestor_index = ancestors.pop()
+            cluster_unit_entities[ancestor_index].total_nested_replies = len(cluster_unit_entities) - ancestor_index - 1
+
+        for comment_row in comment_rows:
+            # Skip the whole thread below a has media type
+            if skipped_path is not None and comment_row.is_in_subtree(skipped_path):
                 continue
+            while ancestors and not comment_row.is_in_subtree(ancestors[-1][0]):
+                close_ancestor()
+            if comment_row.has_media() and media_strategy_skip_type == MediaStrategySkipType.SkipThreadUnits:
+                skipped_path = comment_row.path
+                if comment_row.parent_id is None:
+                    skipped_comments += 1
+                continue
+
             cluster_unit_entity = ClusterUnitEntity.from_comment(
-                comment_entity=reply, 
-                cluster_entity_id=cluster_entity.id, 
-                post_id=post_id, 
-                subreddit=subreddit, 
-                post_permalink=post_permalink,
-                reply_to_cluster_unit=reply_to_cluster_unit
-                )
+                comment_entity=comment_row.to_comment_entity(),
+                cluster_entity_id=cluster_entity_id,
+                post_id=post_entity.id,
+                subreddit=post_entity.subreddit,
+                post_permalink=post_entity.permalink,
+                reply_to_cluster_unit=cluster_unit_entities[ancestors[-1][1]] if ancestors else cluster_unit_entity_post)
             cluster_unit_entities.append(cluster_unit_entity)
-            reply_index = len(cluster_unit_entities) -1
-            if reply.replies:
-                ClusterPrepService.convert_comment_entity_to_cluster_units(
-                    replies=reply.replies, 
-                    post_id=post_id, 
-                    post_permalink=post_permalink,
-                    cluster_entity=cluster_entity, 
-                    cluster_unit_entities=cluster_unit_entities, 
-                    subreddit=subreddit, 
-                    reply_to_cluster_unit=cluster_unit_entity,
-                    media_strategy_skip_type=media_strategy_skip_type)
-
-            cluster_unit_entities[reply_index].total_nested_replies = len(cluster_unit_entities) - reply_index - 1
+            ancestors.append((comment_row.path, len(cluster_unit_entities) - 1))
+
+        while ancestors:
+            close_ancestor()
+        return skipped_comments
 
     @staticmethod
     def find_cluster_units_from_cluster_id_message_type(cluster_entity_id: PyObjectId, reddit_message_type: Literal["post", "comment", "all"] = "all") -> List[ClusterUnitEntity]:
@@ -234,6 +280,23 @@ class ClusterPrepService:
         
         return cluster_unit_entities
     @staticmethod
+    def find_cluster_units_page(cluster_entity_id: PyObjectId,
+                                reddit_message_type: Literal["post", "comment", "all"] = "all",
+                                after: Optional[str] = None,
+                                page_size: int = 100,
+                                with_count: bool = False) -> KeysetPage[ClusterUnitEntity]:
+        """a page of the cluster units of the cluster, most upvoted first (the order of convert_cluster_units_to_bertopic_ready_documents)"""
+        filter = {"cluster_entity_id": cluster_entity_id}
+        if reddit_message_type != "all":
+            filter["type"] = reddit_message_type
+        return get_cluster_unit_repository().find_after(filter,
+                                                        sort_field="upvotes",
+                                                        direction=DESCENDING,
+                                                        after=after,
+                                                        size=page_size,
+                                                        with_count=with_count)
+
+    @staticmethod
     def convert_cluster_units_to_bertopic_ready_documents(scraper_cluster_entity: ScraperClusterEntity, reddit_message_type: Literal["post", "comment", "all"] = "all") -> List:#[response]:
         logger.info(f"[convert_cluster_units_to_bertopic_ready_documents] Starting: scraper_cluster_id={scraper_cluster_entity.id}, message_type={reddit_message_type}")
 
@@ -317,7 +380,7 @@ class ClusterPrepService:
     def get_cluster_unit_ids_for_sample(picked_posts_cluster_unit_ids: List[PyObjectId], sample_size: int, cluster_entity: ClusterEntity, smart_sampling: bool) -> List[PyObjectId] | Response:
         """gets all the cluster unit ids from the database. set sample_size = -1, to take everything
         smart sampling makes sure that sample units are accompanied by the parent units"""
-        selected_cluster_units = get_cluster_unit_repository().find_many_by_ids(picked_posts_cluster_unit_ids)
+        selected_cluster_units = get_cluster_unit_repository().find_many_by_ids_view(picked_posts_cluster_unit_ids, ClusterUnitPostIdView)
         selected_cluster_unit_post_ids = [cluster_unit.post_id for cluster_unit in selected_cluster_units]
 
         filter = {"post_id": {"$in": selected_cluster_unit_post_ids}, "cluster_entity_id": cluster_entity.id}
@@ -345,7 +408,7 @@ class ClusterPrepService:
     def retrieve_cluster_unit_ids_thread(cluster_unit_entity_id: PyObjectId, current_unit_ids: Optional[List[PyObjectId]] = None) -> List[PyObjectId]:
         if current_unit_ids is None:
             current_unit_ids = list()
-        cluster_unit_entity = get_cluster_unit_repository().find_by_id(cluster_unit_entity_id)
+        cluster_unit_entity = get_cluster_unit_repository().find_many_by_ids_view([cluster_unit_entity_id], ClusterUnitSummaryView)[0]
         current_unit_ids.append(cluster_unit_entity.id)
         if cluster_unit_entity.replied_to_cluster_unit_id:
             return ClusterPrepService().retrieve_cluster_unit_ids_thread(cluster_unit_entity_id=cluster_unit_entity.replied_to_cluster_unit_id,
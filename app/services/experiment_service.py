@@ -61,14 +61,18 @@ class ExperimentService:
                 label_template_entity=label_template_entity,
                 prompt_entity=prompt_entity,
                 cluster_unit_enities=cluster_unit_entities_remain, 
-                max_concurrent=max_concurrent)
+                max_concurrent=max_concurrent,
+                aggregate_incrementally=True)
             # If there were any cluster unit entities remaining & there was at least a single failure of prediction. We set experiment status to error
             success_count, failed_count = predictions_grouped_output_format_object.get_count_successful_failure_predictions()
             cluster_unit_entities_successfully_done = predictions_grouped_output_format_object.get_cluster_units()
             cluster_unit_entities_done.extend(cluster_unit_entities_successfully_done)
         if experiment_entity.experiment_type == PromptCategory.Classify_cluster_units and LabelTemplateService().cluster_unit_entities_done_labeling_ground_truth(cluster_unit_entities=cluster_unit_entities_done,
                                                                                                                                                                   label_template_entity=label_template_entity):
-            ExperimentService.convert_total_predicted_into_aggregate_results(cluster_unit_entities_done, experiment_entity, label_template_entity=label_template_entity)       
+            # The batches are folded into the aggregate result while they come in. Only if that did not cover every unit
+            # (e.g. experiments that were started before incremental aggregation, or units labeled afterwards) we do the full pass
+            if experiment_entity.aggregate_result is None or experiment_entity.aggregate_result.aggregated_unit_count != len(cluster_unit_entities_done):
+                ExperimentService.convert_total_predicted_into_aggregate_results(cluster_unit_entities_done, experiment_entity, label_template_entity=label_template_entity)       
         
         if len(cluster_unit_entities_remain) > 0 and failed_count > 0:
             logger.error(f"THere is an error we have {failed_count} predictions")
@@ -87,7 +91,11 @@ class ExperimentService:
         cluster_unit_enities: List[ClusterUnitEntity],
         max_concurrent=1000,
         max_retries=3,
-        max_retry_attempts_rate_limter: int = 5) -> PredictionsGroupedOutputFormat:
+        max_retry_attempts_rate_limter: int = 5,
+        aggregate_incrementally: bool = False) -> PredictionsGroupedOutputFormat:
+        """runs all predictions of the cluster units. The runs of a unit are only handed to the batch processing once all runs
+        of that unit are done, so every batch holds complete units. If aggregate_incrementally is set, every batch is also folded
+        into the aggregate result of the experiment"""
         
          # Create semaphore for concurrency control
         semaphore = asyncio.Semaphore(max_concurrent)
@@ -167,18 +175,25 @@ class ExperimentService:
         # Execute with gather # Run the async predictions -> Results in one dimensional list of predictions
 
         # Execute async computation. And process in batches.
+        batch_label_template_entity = label_template_entity if aggregate_incrementally else None
         full_list_predictions_output_format: List[SinglePredictionOutputFormat] = list()
         batch_predictions_output_format:  List[SinglePredictionOutputFormat] = list()
+        unit_runs_in_progress: Dict[PyObjectId, List[SinglePredictionOutputFormat]] = defaultdict(list)
         for prediction_task in  asyncio.as_completed(
             tasks):
             try:
                 prediction_result = await prediction_task
-                batch_predictions_output_format.append(prediction_result)
+                unit_runs = unit_runs_in_progress[prediction_result.cluster_unit_entity.id]
+                unit_runs.append(prediction_result)
+                if len(unit_runs) >= experiment_entity_runs_per_unit:
+                    batch_predictions_output_format.extend(unit_runs_in_progress.pop(prediction_result.cluster_unit_entity.id))
                 # :TODO make this time based instead. So every 10 seconds instead
                 if len(batch_predictions_output_format) >= 10:
                     logger.info(f"final batch processing to store in database. Total predictions = {len(batch_predictions_output_format)}")
 
-                    await ExperimentService.process_batch_predicted_categories(batch_predictions_output_format=batch_predictions_output_format, experiment_entity=experiment_entity)
+                    await ExperimentService.process_batch_predicted_categories(batch_predictions_output_format=batch_predictions_output_format,
+                                                                               experiment_entity=experiment_entity,
+                                                                               label_template_entity=batch_label_template_entity)
                     
                     # add current list to the full list and reset the list length
                     full_list_predictions_output_format.extend(batch_predictions_output_format)
@@ -197,12 +212,15 @@ class ExperimentService:
             
         
         # Now also process the remaining predictions that have not yet been processed as a batch
+        for unit_runs in unit_runs_in_progress.values():
+            batch_predictions_output_format.extend(unit_runs)
         if len(batch_predictions_output_format) > 0:
             # There is a batch remaining. so process it!
             try:
                 logger.info(f"final batch processing to store in database. Total predictions = {len(batch_predictions_output_format)}")
                 await ExperimentService.process_batch_predicted_categories(batch_predictions_output_format=batch_predictions_output_format,
-                                                                    experiment_entity=experiment_entity)
+                                                                    experiment_entity=experiment_entity,
+                                                                    label_template_entity=batch_label_template_entity)
                 logger.info(f"completed the batch processing and storing to database")
                 # add current list to the full list and reset the list length
                 full_list_predictions_output_format.extend(batch_predictions_output_format)
@@ -219,10 +237,8 @@ class ExperimentService:
                     }
                 )
 
-        predictions_output_format = PredictionsGroupedOutputFormat.parse_from_predicted_units(
-            list_predictions_output_format=full_list_predictions_output_format,
-            cluster_unit_enities=cluster_unit_enities,
-            runs_per_unit=experiment_entity_runs_per_unit)
+        # the runs are grouped on cluster unit id, the order of completion does not match the order of cluster_unit_enities
+        predictions_output_format = PredictionsGroupedOutputFormat.parse_batch_from_single_prediction_output(full_list_predictions_output_format)
         # Filter out None results and count failures
         successful_predictions, failed_count = predictions_output_format.get_count_successful_failure_predictions()
         logger.info(f"successful_predictions = {successful_predictions}, failed_count = , {failed_count}")
@@ -236,10 +252,13 @@ class ExperimentService:
 
 
     @staticmethod
-    async def process_batch_predicted_categories(batch_predictions_output_format: List[SinglePredictionOutputFormat], experiment_entity: ExperimentEntity):
+    async def process_batch_predicted_categories(batch_predictions_output_format: List[SinglePredictionOutputFormat],
+                                                 experiment_entity: ExperimentEntity,
+                                                 label_template_entity: Optional[LabelTemplateEntity] = None):
         """process the batch of predicted categories to be saved inside the cluster unit entities. 
         Also processes the predicted categories to update the experiment entity, so that the results are added for token statistics
-        we do not calculate the aggregate result. because we determine that later. After all predictions are completed """
+        If the label template entity is given, the successfully predicted units are folded into the running aggregate result,
+        so that partial metrics are available while the experiment is still running"""
         logger.info(f"processing batch predicted categories of size: {len(batch_predictions_output_format)}")
         predictions_output_format = PredictionsGroupedOutputFormat.parse_batch_from_single_prediction_output(batch_predictions_output_format)
         cluster_unit_entities_successfully_done = await ExperimentService.update_add_to_db_cluster_unit_predictions(
@@ -250,6 +269,10 @@ class ExperimentService:
 
         # Calculate and store aggregate token statistics
         ExperimentService.calculate_and_store_batch_single_prediction_format(batch_predictions_output_format, experiment_entity)           
+        if label_template_entity is not None and experiment_entity.experiment_type == PromptCategory.Classify_cluster_units:
+            ExperimentService.fold_cluster_units_into_aggregate_result(cluster_unit_entities=cluster_unit_entities_successfully_done,
+                                                                       experiment_entity=experiment_entity,
+                                                                       label_template_entity=label_template_entity)
         success_count, failed_count = predictions_output_format.get_count_successful_failure_predictions()
 
         if len(cluster_unit_entities_successfully_done) > 0 and failed_count > 0:
@@ -380,47 +403,83 @@ class ExperimentService:
                                                        label_template_entity: LabelTemplateEntity) -> ExperimentEntity:
         """Coonverts the experiment into aggrate results. Measures how often it is correct in its prediction and how often it is not"""
         
-        prevelance_distribution_list_all_entities = []
         experiment_entity.reset_aggregate_result()
         for cluster_unit_entity in cluster_unit_entities:
-            if cluster_unit_entity.predicted_category is None:
-                raise Exception(f"We cannot calculate the predicted category if this category is None, an issue must be there \n experiment_id: {experiment_entity.id} \n cluster_unit_entity: {cluster_unit_entity.id}")
-            prediction_counter_single_unit: ClusterUnitPredictionCounter = ExperimentService.create_prediction_counter_from_cluster_unit(cluster_unit_entity=cluster_unit_entity, experiment_entity=experiment_entity, combined_labels=label_template_entity.combined_labels)
-            prediction_erros = cluster_unit_entity.get_errors_single_experiment(experiment_id=experiment_entity.id)
-            experiment_entity.aggregate_result.insert_errors(prediction_erros)
-            # Below we go over the possible categories, and how often they have been counted. Then we find the corresponding variable in aggregate results
-            # Then we increase the counter of aggregate results with 1. This allows us to track how many runs have predicted that label.
-            if label_template_entity.combined_labels:
-                prediction_is_ground_truth_combined_labels: Dict[str, bool] = {combined_label_name: False for combined_label_name in label_template_entity.combined_labels.keys()}
-                prediction_predicted_true_combined_labels_min_count: Dict[str, int] = {combined_label_name: 0 for combined_label_name in label_template_entity.combined_labels.keys()}
-            for prediction_category_name, label_prediction_counter in prediction_counter_single_unit.labels_prediction_counter.items():
-                ground_truth_value: bool = cluster_unit_entity.get_value_of_ground_truth_variable(label_template_id=label_template_entity.id, variable_name=prediction_category_name)
-                experiment_entity.insert_label_prediction_counter(label_prediction_counter, ground_truth_value)
-                
+            ExperimentService.insert_cluster_unit_into_aggregate_result(cluster_unit_entity=cluster_unit_entity,
+                                                                        experiment_entity=experiment_entity,
+                                                                        label_template_entity=label_template_entity)
 
-                # Only execute the combined labels logic if combined labels is set and 
-                if label_template_entity.combined_labels:
-                    for combined_label_name, combined_label_labels in label_template_entity.combined_labels.items():
-                        if prediction_category_name in combined_label_labels:
-                            
-                            if ground_truth_value:
-                                prediction_is_ground_truth_combined_labels[combined_label_name] = True
+        return experiment_entity
+
+    @staticmethod
+    def fold_cluster_units_into_aggregate_result(cluster_unit_entities: List[ClusterUnitEntity],
+                                                 experiment_entity: ExperimentEntity,
+                                                 label_template_entity: LabelTemplateEntity) -> int:
+        """folds a batch of freshly predicted cluster units into the running aggregate result of the experiment.
+        Units of which the ground truth is not labeled yet are skipped. Returns the number of folded units"""
+        aggregate_result = experiment_entity.aggregate_result
+        if aggregate_result is not None and aggregate_result.aggregated_unit_count == 0 and aggregate_result.labels:
+            # aggregate result from before incremental aggregation, it lacks the running counters so we start over
+            experiment_entity.reset_aggregate_result()
+
+        folded_count = 0
+        for cluster_unit_entity in cluster_unit_entities:
+            if not cluster_unit_entity.ground_truth or not LabelTemplateService.cluster_unit_entities_done_labeling_ground_truth(
+                    cluster_unit_entities=[cluster_unit_entity], label_template_entity=label_template_entity):
+                continue
+            predicted_category = cluster_unit_entity.predicted_category.get(experiment_entity.id) if cluster_unit_entity.predicted_category else None
+            if predicted_category is None or len(predicted_category.predicted_categories) < experiment_entity.runs_per_unit:
+                # incomplete units are left to the full pass at the end of the experiment
+                continue
+            ExperimentService.insert_cluster_unit_into_aggregate_result(cluster_unit_entity=cluster_unit_entity,
+                                                                        experiment_entity=experiment_entity,
+                                                                        label_template_entity=label_template_entity)
+            folded_count += 1
 
-                            # only if true is predicted, at least number of thresholds of runs must have true to become combined labels true
-                            # :TODO only works for booleans, make all categories and int! 
-                            if label_prediction_counter.value_counter.get(str(True), 0) >= prediction_predicted_true_combined_labels_min_count.get(combined_label_name, 0):
-                                prediction_predicted_true_combined_labels_min_count[combined_label_name] = label_prediction_counter.value_counter.get(str(True), 0)
+        logger.info(f"[fold_cluster_units_into_aggregate_result] folded {folded_count}/{len(cluster_unit_entities)} units into experiment {experiment_entity.id}")
+        return folded_count
+
+    @staticmethod
+    def insert_cluster_unit_into_aggregate_result(cluster_unit_entity: ClusterUnitEntity,
+                                                  experiment_entity: ExperimentEntity,
+                                                  label_template_entity: LabelTemplateEntity) -> None:
+        """adds the predictions of a single cluster unit to the aggregate result of the experiment"""
+        if experiment_entity.aggregate_result is None:
+            experiment_entity.reset_aggregate_result()
+        if cluster_unit_entity.predicted_category is None:
+            raise Exception(f"We cannot calculate the predicted category if this category is None, an issue must be there \n experiment_id: {experiment_entity.id} \n cluster_unit_entity: {cluster_unit_entity.id}")
+        prediction_counter_single_unit: ClusterUnitPredictionCounter = ExperimentService.create_prediction_counter_from_cluster_unit(cluster_unit_entity=cluster_unit_entity, experiment_entity=experiment_entity, combined_labels=label_template_entity.combined_labels)
+        prediction_erros = cluster_unit_entity.get_errors_single_experiment(experiment_id=experiment_entity.id)
+        experiment_entity.aggregate_result.insert_errors(prediction_erros)
+        # Below we go over the possible categories, and how often they have been counted. Then we find the corresponding variable in aggregate results
+        # Then we increase the counter of aggregate results with 1. This allows us to track how many runs have predicted that label.
+        if label_template_entity.combined_labels:
+            prediction_is_ground_truth_combined_labels: Dict[str, bool] = {combined_label_name: False for combined_label_name in label_template_entity.combined_labels.keys()}
+            prediction_predicted_true_combined_labels_min_count: Dict[str, int] = {combined_label_name: 0 for combined_label_name in label_template_entity.combined_labels.keys()}
+        for prediction_category_name, label_prediction_counter in prediction_counter_single_unit.labels_prediction_counter.items():
+            ground_truth_value: bool = cluster_unit_entity.get_value_of_ground_truth_variable(label_template_id=label_template_entity.id, variable_name=prediction_category_name)
+            experiment_entity.insert_label_prediction_counter(label_prediction_counter, ground_truth_value)
+
+
+            # Only execute the combined labels logic if combined labels is set and 
             if label_template_entity.combined_labels:
-                
-                experiment_entity.aggregate_result.insert_combined_labels_unit_prediction(
-                    list(label_template_entity.combined_labels.keys()),
-                    prediction_is_ground_truth_combined_labels,
-                    prediction_predicted_true_combined_labels_min_count)
-        
-                        
-                
+                for combined_label_name, combined_label_labels in label_template_entity.combined_labels.items():
+                    if prediction_category_name in combined_label_labels:
 
-        return experiment_entity
+                        if ground_truth_value:
+                            prediction_is_ground_truth_combined_labels[combined_label_name] = True
+
+                        # only if true is predicted, at least number of thresholds of runs must have true to become combined labels true
+                        # :TODO only works for booleans, make all categories and int! 
+                        if label_prediction_counter.value_counter.get(str(True), 0) >= prediction_predicted_true_combined_labels_min_count.get(combined_label_name, 0):
+                            prediction_predicted_true_combined_labels_min_count[combined_label_name] = label_prediction_counter.value_counter.get(str(True), 0)
+        if label_template_entity.combined_labels:
+
+            experiment_entity.aggregate_result.insert_combined_labels_unit_prediction(
+                list(label_template_entity.combined_labels.keys()),
+                prediction_is_ground_truth_combined_labels,
+                prediction_predicted_true_combined_labels_min_count)
+        experiment_entity.aggregate_result.aggregated_unit_count += 1
 
 
     @staticmethod
@@ -560,7 +619,9 @@ class ExperimentService:
             combined_labels_accuracy = None
             combined_labels_kappa = None
             print("experiment status = ", experiment.status)
-            if experiment.status != StatusType.Completed:
+            # Experiments that are still running show partial metrics, as soon as the first batches are folded into the aggregate result
+            has_partial_aggregate_result = experiment.aggregate_result is not None and experiment.aggregate_result.aggregated_unit_count > 0
+            if experiment.status != StatusType.Completed and not has_partial_aggregate_result:
                 prediction_metrics = None
                 overall_accuracy = None
                 overall_kappa = None
@@ -611,7 +672,8 @@ class ExperimentService:
                                                          errors=experiment.get_experiment_errors(),
                                                          status=experiment.status,
                                                          experiment_type=experiment.experiment_type,
-                                                         progress_bar=progress_bar)
+                                                         progress_bar=progress_bar,
+                                                         aggregated_unit_count=experiment.aggregate_result.aggregated_unit_count if experiment.aggregate_result else None)
             
             returnable_experiments.append(experiment_response)  
         
@@ -723,13 +785,20 @@ class ExperimentService:
         formatted_user_threshold = ExperimentService.get_user_threshold(experiment_entity=experiment_entity, user_threshold=user_threshold)
         total_times_predicted = ExperimentService.calculate_total_times_predicted(prediction_result)
 
-        total_sample_runs = experiment_entity.input.cluster_unit_count * experiment_entity.runs_per_unit
+        # partial experiments only have the folded units in the aggregate result
+        aggregated_unit_count = experiment_entity.aggregate_result.aggregated_unit_count if experiment_entity.aggregate_result else 0
+        total_sample_runs = (aggregated_unit_count or experiment_entity.input.cluster_unit_count) * experiment_entity.runs_per_unit
         logger.info(f" experiment_entity.input.cluster_unit_count = { experiment_entity.input.cluster_unit_count}")
         prevelance = {value_key: times_predicted/total_sample_runs for value_key, times_predicted in total_times_predicted.items()}
         
-        confusion_matrix = ExperimentService.calculate_confusion_matrix(prediction_result=prediction_result,
-                                                                        user_threshold=formatted_user_threshold,
-        )
+        confusion_counts = prediction_result.get_confusion_counts(formatted_user_threshold)
+        if confusion_counts is not None:
+            # kept up to date while the units were folded in, so no pass over the individual predictions is needed
+            confusion_matrix = ConfusionMatrix(tp=confusion_counts.tp, fp=confusion_counts.fp, fn=confusion_counts.fn, tn=confusion_counts.tn)
+        else:
+            confusion_matrix = ExperimentService.calculate_confusion_matrix(prediction_result=prediction_result,
+                                                                            user_threshold=formatted_user_threshold,
+            )
                                                
         prediction_metric = PredictionMetric(prediction_category_name=prediction_result_name, 
                                               prevalence_count=total_times_predicted,
@@ -739,6 +808,8 @@ class ExperimentService:
                                               kappa=confusion_matrix.get_cohens_kappa(),
                                               prevelance_distribution=prediction_result.prevelance_distribution,
                                               confusion_matrix=confusion_matrix,
+                                              inter_run_unanimous_rate=prediction_result.inter_run_agreement.get_unanimous_rate(),
+                                              inter_run_majority_share=prediction_result.inter_run_agreement.get_mean_majority_share(),
                                               )
         return prediction_metric
         
@@ -801,7 +872,8 @@ class ExperimentService:
         
     
     @staticmethod
-    def get_cluster_units_from_sample_entity(sample_id: PyObjectId, only_return_ids: Optional[bool]=False) -> List[ClusterUnitEntity] | List[PyObjectId]:
+    def get_cluster_units_from_sample_entity(sample_id: PyObjectId, only_return_ids: Optional[bool]=False, predicted_category_experiment_ids: Optional[List[PyObjectId]] = None) -> List[ClusterUnitEntity] | List[PyObjectId]:
+        """if predicted_category_experiment_ids is given, only the predictions of those experiments are loaded"""
         sample_entity = get_sample_repository().find_by_id(sample_id)
 
         if not sample_entity:
@@ -813,7 +885,10 @@ class ExperimentService:
         if only_return_ids:
             return sample_entity.sample_cluster_unit_ids
         
-        cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(sample_entity.sample_cluster_unit_ids)
+        if predicted_category_experiment_ids is None:
+            cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(sample_entity.sample_cluster_unit_ids)
+        else:
+            cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids_with_predictions(sample_entity.sample_cluster_unit_ids, predicted_category_experiment_ids)
 
         if not cluster_unit_entities or not len(cluster_unit_entities) == len(sample_entity.sample_cluster_unit_ids):
             print()
@@ -823,10 +898,11 @@ class ExperimentService:
 
     @staticmethod
     def get_input_cluster_unit_entities_from_expertiment(experiment_entity: ExperimentEntity, only_return_ids: Optional[bool]=False) -> List[ClusterUnitEntity] | List[PyObjectId]:
-        """if only_returns_ids is True, return only the ids of the cluster units"""
+        """if only_returns_ids is True, return only the ids of the cluster units.
+        The cluster units only contain the predictions of this experiment, not of the other experiments run on them"""
         if experiment_entity.input.input_type == "sample":
         
-            cluster_unit_entities = ExperimentService().get_cluster_units_from_sample_entity(experiment_entity.input.input_id, only_return_ids)
+            cluster_unit_entities = ExperimentService().get_cluster_units_from_sample_entity(experiment_entity.input.input_id, only_return_ids, [experiment_entity.id])
 
         elif experiment_entity.input.input_type == "filtering":
             
@@ -841,7 +917,7 @@ class ExperimentService:
             if only_return_ids:
                 return filtering_entity.output_cluster_unit_ids
 
-            cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(filtering_entity.output_cluster_unit_ids)
+            cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids_with_predictions(filtering_entity.output_cluster_unit_ids, [experiment_entity.id])
 
             if not cluster_unit_entities or not len(cluster_unit_entities) == len(filtering_entity.output_cluster_unit_ids):
                 raise Exception(f"not all Cluster unit ids are found cannot be found for filtering entity in experiment: {experiment_entity.id}")
@@ -855,7 +931,7 @@ class ExperimentService:
             if only_return_ids:
                 cluster_unit_entities = get_cluster_unit_repository().find_ids({"cluster_entity_id": experiment_entity.input.input_id})
             else:
-                cluster_unit_entities = get_cluster_unit_repository().find({"cluster_entity_id": experiment_entity.input.input_id})
+                cluster_unit_entities = get_cluster_unit_repository().find_with_predictions({"cluster_entity_id": experiment_entity.input.input_id}, [experiment_entity.id])
             
             if not cluster_unit_entities:
                 raise Exception(f"Cluster unit ids are not found cannot be found for cluster entity in experiment: {experiment_entity.id}")
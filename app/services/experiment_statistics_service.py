@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.database import get_cluster_unit_repository
+from app.database.entities.experiment_entity import ExperimentEntity, PredictionResult
+from app.responses.get_experiments_response import ConfidenceInterval, ExperimentAgreementMatrixResponse, ExperimentConfidenceIntervalsResponse, PredictionMetricConfidenceInterval
+from app.services.experiment_service import ExperimentService
+from app.utils.logging_config import get_logger
+from app.utils.metric_statistics import bootstrap_label_worker, pack_prediction_truth_arrays, pairwise_agreement_tensor
+
+
+logger = get_logger(__name__)
+
+
+class ExperimentStatisticsService:
+    """Statistics on top of the experiment metrics: bootstrap uncertainty and agreement between experiments.
+    Results are cached per experiment version, the updated_at of the experiment is part of the key so that new predictions invalidate the cached result"""
+    _confidence_interval_cache: "OrderedDict[Tuple, ExperimentConfidenceIntervalsResponse]" = OrderedDict()
+    _agreement_matrix_cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+    _max_cache_entries: int = 256
+    # Below this number of labels the overhead of starting worker processes is larger than the bootstrap itself
+    _min_labels_for_process_pool: int = 8
+
+    @staticmethod
+    def calculate_confidence_intervals(experiment_entity: ExperimentEntity,
+                                       user_threshold: Optional[float] = None,
+                                       n_resamples: int = 2000,
+                                       confidence_level: float = 0.95,
+                                       max_workers: Optional[int] = None) -> ExperimentConfidenceIntervalsResponse | None:
+        """bootstraps the accuracy and kappa of every label (and combined label) of the experiment.
+        Returns None if the experiment has no aggregate result yet"""
+        if experiment_entity.aggregate_result is None:
+            return None
+
+        formatted_user_threshold = ExperimentService.get_user_threshold(experiment_entity=experiment_entity, user_threshold=user_threshold)
+        cache_key = (experiment_entity.id, experiment_entity.updated_at, formatted_user_threshold, n_resamples, confidence_level)
+        cached_result = ExperimentStatisticsService._confidence_interval_cache.get(cache_key)
+        if cached_result is not None:
+            ExperimentStatisticsService._confidence_interval_cache.move_to_end(cache_key)
+            logger.info(f"[calculate_confidence_intervals] cache hit for experiment {experiment_entity.id}")
+            return cached_result
+
+        prediction_results: Dict[str, PredictionResult] = dict(experiment_entity.aggregate_result.labels)
+        combined_label_names = list(experiment_entity.aggregate_result.combined_labels.keys()) if experiment_entity.aggregate_result.combined_labels else []
+        for combined_label_name in combined_label_names:
+            prediction_results[combined_label_name] = PredictionResult.from_combined_prediction_result(
+                experiment_entity.aggregate_result.combined_labels[combined_label_name])
+
+        label_confidence_intervals = ExperimentStatisticsService.bootstrap_prediction_results(
+            prediction_results=prediction_results,
+            user_threshold=formatted_user_threshold,
+            n_resamples=n_resamples,
+            confidence_level=confidence_level,
+            max_workers=max_workers)
+
+        confidence_intervals_response = ExperimentConfidenceIntervalsResponse(
+            experiment_id=experiment_entity.id,
+            user_threshold=formatted_user_threshold,
+            prediction_metrics=[label_confidence_intervals[label_name] for label_name in experiment_entity.aggregate_result.labels.keys()],
+            combined_labels_prediction_metrics=[label_confidence_intervals[label_name] for label_name in combined_label_names] or None)
+
+        ExperimentStatisticsService._confidence_interval_cache[cache_key] = confidence_intervals_response
+        if len(ExperimentStatisticsService._confidence_interval_cache) > ExperimentStatisticsService._max_cache_entries:
+            ExperimentStatisticsService._confidence_interval_cache.popitem(last=False)
+
+        return confidence_intervals_response
+
+    @staticmethod
+    def bootstrap_prediction_results(prediction_results: Dict[str, PredictionResult],
+                                     user_threshold: int,
+                                     n_resamples: int,
+                                     confidence_level: float,
+                                     max_workers: Optional[int] = None) -> Dict[str, PredictionMetricConfidenceInterval]:
+        """packs every label into prediction/truth arrays and bootstraps them over the cluster units. When there are many labels the labels
+        are spread over a process pool, every label is a single vectorized job"""
+        worker_arguments = list()
+        total_samples_per_label: Dict[str, int] = dict()
+        for label_name, prediction_result in prediction_results.items():
+            predicted, truth, units = pack_prediction_truth_arrays(prediction_result.individual_prediction_truth_label_list, user_threshold)
+            total_samples_per_label[label_name] = int(predicted.shape[0])
+            worker_arguments.append((label_name, predicted, truth, units, n_resamples, confidence_level, 0))
+
+        if max_workers is None:
+            max_workers = min(os.cpu_count() or 1, len(worker_arguments))
+
+        if max_workers > 1 and len(worker_arguments) >= ExperimentStatisticsService._min_labels_for_process_pool:
+            logger.info(f"[bootstrap_prediction_results] bootstrapping {len(worker_arguments)} labels with {max_workers} processes")
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                bootstrap_results = dict(executor.map(bootstrap_label_worker, worker_arguments))
+        else:
+            bootstrap_results = dict(map(bootstrap_label_worker, worker_arguments))
+
+        return {label_name: PredictionMetricConfidenceInterval(
+                    prediction_category_name=label_name,
+                    total_samples=total_samples_per_label[label_name],
+                    n_resamples=n_resamples,
+                    confidence_level=confidence_level,
+                    accuracy=ConfidenceInterval(**bootstrap_result["accuracy"]),
+                    kappa=ConfidenceInterval(**bootstrap_result["kappa"]))
+                for label_name, bootstrap_result in bootstrap_results.items()}
+
+    @staticmethod
+    def calculate_agreement_matrix(experiment_entities: List[ExperimentEntity],
+                                   user_threshold: Optional[float] = None) -> ExperimentAgreementMatrixResponse:
+        """compares the binary predictions of every pair of experiments on the cluster units that all experiments share.
+        The result is computed in a fixed (sorted) experiment order and cached on the versions of the experiments,
+        the requested order is only a permutation of the cached tensor"""
+        canonical_experiment_entities = sorted(experiment_entities, key=lambda experiment_entity: experiment_entity.id)
+        cache_key = (tuple((experiment_entity.id, experiment_entity.updated_at) for experiment_entity in canonical_experiment_entities), user_threshold)
+        agreement = ExperimentStatisticsService._agreement_matrix_cache.get(cache_key)
+        if agreement is not None:
+            ExperimentStatisticsService._agreement_matrix_cache.move_to_end(cache_key)
+            logger.info(f"[calculate_agreement_matrix] cache hit for {len(experiment_entities)} experiments")
+        else:
+            agreement = ExperimentStatisticsService.compute_agreement_tensor(canonical_experiment_entities, user_threshold)
+            ExperimentStatisticsService._agreement_matrix_cache[cache_key] = agreement
+            if len(ExperimentStatisticsService._agreement_matrix_cache) > ExperimentStatisticsService._max_cache_entries:
+                ExperimentStatisticsService._agreement_matrix_cache.popitem(last=False)
+
+        canonical_experiment_ids = [experiment_entity.id for experiment_entity in canonical_experiment_entities]
+        order = np.array([canonical_experiment_ids.index(experiment_entity.id) for experiment_entity in experiment_entities])
+
+        def to_nested_list(metric_tensor: np.ndarray) -> List[List[List[Any]]]:
+            permuted = metric_tensor[np.ix_(order, order)]
+            if permuted.dtype.kind == "f":
+                return [[[None if np.isnan(value) else float(value) for value in label_values] for label_values in row] for row in permuted]
+            return permuted.tolist()
+
+        return ExperimentAgreementMatrixResponse(
+            experiment_ids=[experiment_entity.id for experiment_entity in experiment_entities],
+            label_names=agreement["label_names"],
+            shared_unit_count=agreement["shared_unit_count"],
+            compared_unit_count=to_nested_list(agreement["compared_unit_count"]),
+            percent_agreement=to_nested_list(agreement["percent_agreement"]),
+            kappa=to_nested_list(agreement["kappa"]),
+            mcnemar_b=to_nested_list(agreement["mcnemar_b"]),
+            mcnemar_c=to_nested_list(agreement["mcnemar_c"]),
+            mcnemar_statistic=to_nested_list(agreement["mcnemar_statistic"]))
+
+    @staticmethod
+    def compute_agreement_tensor(experiment_entities: List[ExperimentEntity],
+                                 user_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """loads the label values of all experiments for their shared units in one projected query and packs them into
+        (experiments, labels, units) arrays. A unit counts as predicted True when the runs that predicted True reach the threshold of that experiment"""
+        shared_unit_ids: Optional[List] = None
+        for experiment_entity in experiment_entities:
+            input_unit_ids = ExperimentService.get_input_cluster_unit_entities_from_expertiment(experiment_entity=experiment_entity, only_return_ids=True)
+            if shared_unit_ids is None:
+                shared_unit_ids = list(input_unit_ids)
+            else:
+                input_unit_ids_set = set(input_unit_ids)
+                shared_unit_ids = [unit_id for unit_id in shared_unit_ids if unit_id in input_unit_ids_set]
+        shared_unit_ids = shared_unit_ids or []
+
+        experiment_ids = [experiment_entity.id for experiment_entity in experiment_entities]
+        documents = get_cluster_unit_repository().find_predicted_label_values(cluster_unit_ids=shared_unit_ids, experiment_ids=experiment_ids)
+        logger.info(f"[compute_agreement_tensor] loaded predictions of {len(documents)} shared units for {len(experiment_ids)} experiments")
+
+        # true_runs[experiment][unit][label] -> number of runs that predicted True
+        true_runs: List[List[Dict[str, int]]] = [[dict() for _ in documents] for _ in experiment_ids]
+        label_names_set = set()
+        for unit_index, document in enumerate(documents):
+            predicted_category = document.get("predicted_category") or {}
+            for experiment_index, experiment_id in enumerate(experiment_ids):
+                runs = (predicted_category.get(str(experiment_id)) or {}).get("predicted_categories") or []
+                unit_true_runs = true_runs[experiment_index][unit_index]
+                for run in runs:
+                    for label_name, label_value in ((run.get("labels_prediction") or {}).get("values") or {}).items():
+                        value = label_value.get("value") if isinstance(label_value, dict) else None
+                        unit_true_runs[label_name] = unit_true_runs.get(label_name, 0) + int(str(value) == str(True))
+                        label_names_set.add(label_name)
+
+        label_names = sorted(label_names_set)
+        label_index = {label_name: index for index, label_name in enumerate(label_names)}
+        true_runs_array = np.zeros((len(experiment_ids), len(label_names), len(documents)), dtype=np.int64)
+        available = np.zeros(true_runs_array.shape, dtype=bool)
+        for experiment_index, units_true_runs in enumerate(true_runs):
+            for unit_index, unit_true_runs in enumerate(units_true_runs):
+                for label_name, runs_true in unit_true_runs.items():
+                    true_runs_array[experiment_index, label_index[label_name], unit_index] = runs_true
+                    available[experiment_index, label_index[label_name], unit_index] = True
+
+        thresholds = np.array([ExperimentService.get_user_threshold(experiment_entity=experiment_entity, user_threshold=user_threshold)
+                               for experiment_entity in experiment_entities], dtype=np.int64)
+        predicted = true_runs_array >= thresholds[:, None, None]
+
+        agreement = pairwise_agreement_tensor(predicted=predicted, available=available)
+        agreement["label_names"] = label_names
+        agreement["shared_unit_count"] = len(documents)
+        return agreement
@@ -0,0 +1,230 @@
+import os
+from typing import Any, Dict, Iterator, List, Literal, Mapping, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.database import get_cluster_unit_repository, get_prediction_repository
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.experiment_entity import ExperimentEntity
+from app.database.entities.label_template import LabelTemplateEntity
+from app.utils import utc_timestamp
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+ExportFileFormat = Literal["parquet", "arrow"]
+
+# the columns of a cluster unit export, the key is the field of the cluster unit document
+CLUSTER_UNIT_COLUMNS: Dict[str, pa.DataType] = {
+    "_id": pa.string(),
+    "cluster_entity_id": pa.string(),
+    "post_id": pa.string(),
+    "comment_post_id": pa.string(),
+    "replied_to_cluster_unit_id": pa.string(),
+    "type": pa.string(),
+    "reddit_id": pa.string(),
+    "permalink": pa.string(),
+    "author": pa.string(),
+    "usertag": pa.string(),
+    "upvotes": pa.int64(),
+    "downvotes": pa.int64(),
+    "depth": pa.int32(),
+    "created_utc": pa.int64(),
+    "thread_path_text": pa.list_(pa.string()),
+    "thread_path_author": pa.list_(pa.string()),
+    "text": pa.string(),
+    "enriched_comment_thread_text": pa.string(),
+    "total_nested_replies": pa.int32(),
+    "subreddit": pa.string(),
+    "includes_media": pa.bool_(),
+}
+
+PREDICTION_COLUMNS: Dict[str, pa.DataType] = {
+    "cluster_unit_id": pa.string(),
+    "experiment_id": pa.string(),
+    "run_index": pa.int32(),
+}
+
+# the arrow type of the values of a label, by LabelValueField.type
+LABEL_VALUE_TYPES: Dict[str, pa.DataType] = {
+    "boolean": pa.bool_(),
+    "integer": pa.int64(),
+    "float": pa.float64(),
+    "category": pa.string(),
+    "string": pa.string(),
+}
+
+
+def _label_types(label_template_entity: LabelTemplateEntity) -> Dict[str, str]:
+    return {label_name: label_value_field.type for label_name, label_value_field in label_template_entity.ground_truth_field.values.items()}
+
+
+def _coerce_label_value(value: Any, label_type: str) -> Any:
+    """the value in the type of the label column, None for a value that does not fit (e.g. a list the LLM answered with)"""
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if value is None:
+        return None
+    if label_type == "boolean":
+        return value if isinstance(value, bool) else None
+    if label_type == "integer":
+        return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) and float(value).is_integer() else None
+    if label_type == "float":
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+    return value if isinstance(value, str) else str(value)
+
+
+class ExportService:
+    """exports cluster units, their ground truth and the predictions of experiments to Parquet or Arrow IPC files.
+    The documents are streamed from the database in batches and every batch is written as its own record batch (row group),
+    so an export never holds more than one batch in memory. The files can be memory mapped, e.g. pq.read_table(path, memory_map=True)"""
+
+    @staticmethod
+    def cluster_unit_schema(columns: Optional[List[str]] = None, label_template_entity: Optional[LabelTemplateEntity] = None) -> pa.Schema:
+        """the schema of a cluster unit export, with a ground_truth.<label> column per label of the label template"""
+        columns = columns or list(CLUSTER_UNIT_COLUMNS)
+        unknown_columns = [column for column in columns if column not in CLUSTER_UNIT_COLUMNS]
+        if unknown_columns:
+            raise Exception(f"unknown cluster unit columns: {unknown_columns}, the columns are: {list(CLUSTER_UNIT_COLUMNS)}")
+        if "_id" not in columns:
+            columns = ["_id"] + columns
+
+        fields = [pa.field(column, CLUSTER_UNIT_COLUMNS[column]) for column in columns]
+        if label_template_entity:
+            fields.extend(pa.field(f"ground_truth.{label_name}", LABEL_VALUE_TYPES[label_type])
+                          for label_name, label_type in _label_types(label_template_entity).items())
+        return pa.schema(fields, metadata={"label_template_id": label_template_entity.id} if label_template_entity else None)
+
+    @staticmethod
+    def prediction_schema(label_template_entity: LabelTemplateEntity) -> pa.Schema:
+        """one row per run of a cluster unit, with a column per label of the label template"""
+        fields = [pa.field(column, column_type) for column, column_type in PREDICTION_COLUMNS.items()]
+        fields.extend(pa.field(label_name, LABEL_VALUE_TYPES[label_type]) for label_name, label_type in _label_types(label_template_entity).items())
+        return pa.schema(fields, metadata={"label_template_id": label_template_entity.id})
+
+    @staticmethod
+    def iter_cluster_unit_batches(schema: pa.Schema,
+                                  cluster_entity_id: PyObjectId,
+                                  label_template_entity: Optional[LabelTemplateEntity] = None,
+                                  reddit_message_type: Literal["post", "comment", "all"] = "all",
+                                  cluster_unit_ids: Optional[List[PyObjectId]] = None,
+                                  batch_size: int = 5000) -> Iterator[pa.RecordBatch]:
+        """the cluster units of the cluster as record batches of the schema, optionally only the cluster units of cluster_unit_ids (e.g. of a sample)"""
+        filter: Dict[str, Any] = {"cluster_entity_id": cluster_entity_id}
+        if reddit_message_type != "all":
+            filter["type"] = reddit_message_type
+        if cluster_unit_ids is not None:
+            filter["_id"] = {"$in": cluster_unit_ids}
+
+        document_columns = [field.name for field in schema if not field.name.startswith("ground_truth.")]
+        projection = {column: 1 for column in document_columns}
+        label_types = _label_types(label_template_entity) if label_template_entity else dict()
+        if label_template_entity:
+            projection[f"ground_truth.{label_template_entity.id}.values"] = 1
+
+        for documents in get_cluster_unit_repository().iter_document_batches(filter, projection, batch_size):
+            columns: Dict[str, List[Any]] = {column: [document.get(column) for document in documents] for column in document_columns}
+            if label_template_entity:
+                ground_truth_values = [((document.get("ground_truth") or dict()).get(label_template_entity.id) or dict()).get("values") or dict()
+                                       for document in documents]
+                for label_name, label_type in label_types.items():
+                    columns[f"ground_truth.{label_name}"] = [_coerce_label_value((values.get(label_name) or dict()).get("value"), label_type)
+                                                             for values in ground_truth_values]
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+    @staticmethod
+    def iter_prediction_batches(schema: pa.Schema,
+                                experiment_entity: ExperimentEntity,
+                                label_template_entity: LabelTemplateEntity,
+                                batch_size: int = 5000) -> Iterator[pa.RecordBatch]:
+        """the runs of the experiment as record batches of the schema, from the prediction collection or, for experiments from before
+        the prediction collection, from the predictions embedded in predicted_category of the cluster units"""
+        label_types = _label_types(label_template_entity)
+        for run_documents in ExportService.iter_run_document_batches(experiment_entity.id, batch_size):
+            columns: Dict[str, List[Any]] = {column: [document.get(column) for document in run_documents] for column in PREDICTION_COLUMNS}
+            label_values: List[Mapping[str, Any]] = [((document.get("prediction") or dict()).get("labels_prediction") or dict()).get("values") or dict()
+                                                     for document in run_documents]
+            for label_name, label_type in label_types.items():
+                columns[label_name] = [_coerce_label_value((values.get(label_name) or dict()).get("value"), label_type) for values in label_values]
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+    @staticmethod
+    def iter_run_document_batches(experiment_id: PyObjectId, batch_size: int = 5000) -> Iterator[List[Mapping[str, Any]]]:
+        """the runs of the experiment as prediction documents {cluster_unit_id, experiment_id, run_index, prediction: {labels_prediction: {values}}}.
+        The legacy embedded runs are only read when the prediction collection has no runs of the experiment (as in FilteringService.compile_filtering_query)"""
+        prediction_repository = get_prediction_repository()
+        if prediction_repository.has_predictions(experiment_id):
+            projection = {"cluster_unit_id": 1, "experiment_id": 1, "run_index": 1, "prediction.labels_prediction.values": 1}
+            yield from prediction_repository.iter_document_batches({"experiment_id": experiment_id}, projection, batch_size)
+            return
+
+        filter = {f"predicted_category.{experiment_id}": {"$exists": True}}
+        projection = {f"predicted_category.{experiment_id}.predicted_categories.labels_prediction.values": 1}
+        for documents in get_cluster_unit_repository().iter_document_batches(filter, projection, batch_size):
+            yield [{"cluster_unit_id": document["_id"], "experiment_id": experiment_id, "run_index": run_index, "prediction": run}
+                   for document in documents
+                   for run_index, run in enumerate(document["predicted_category"][str(experiment_id)].get("predicted_categories") or [])]
+
+    @staticmethod
+    def write_record_batches(path: str, schema: pa.Schema, record_batches: Iterator[pa.RecordBatch], file_format: ExportFileFormat = "parquet", compression: str = "zstd") -> int:
+        """writes the record batches to path, every record batch becomes a row group of the Parquet file. Returns the number of rows"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        row_count = 0
+        if file_format == "parquet":
+            with pq.ParquetWriter(path, schema, compression=compression) as writer:
+                for record_batch in record_batches:
+                    writer.write_batch(record_batch)
+                    row_count += record_batch.num_rows
+        elif file_format == "arrow":
+            with pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+                for record_batch in record_batches:
+                    writer.write_batch(record_batch)
+                    row_count += record_batch.num_rows
+        else:
+            raise Exception(f"unknown export file format {file_format}")
+        return row_count
+
+    @staticmethod
+    def export_path(name: str, file_format: ExportFileFormat) -> str:
+        export_directory = os.getenv("EXPORT_DIRECTORY", os.path.join("data", "exports"))
+        extension = "parquet" if file_format == "parquet" else "arrow"
+        return os.path.join(export_directory, f"{name}_{utc_timestamp().strftime('%Y%m%dT%H%M%S%f')}.{extension}")
+
+    @staticmethod
+    def remove_export_file(path: str) -> None:
+        """deletes an export file once it has been sent, so that the exports do not pile up in EXPORT_DIRECTORY"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            logger.warning(f"[remove_export_file] Export file was already removed: {path}")
+
+    @staticmethod
+    def export_cluster_units(cluster_entity_id: PyObjectId,
+                             columns: Optional[List[str]] = None,
+                             label_template_entity: Optional[LabelTemplateEntity] = None,
+                             reddit_message_type: Literal["post", "comment", "all"] = "all",
+                             cluster_unit_ids: Optional[List[PyObjectId]] = None,
+                             file_format: ExportFileFormat = "parquet",
+                             batch_size: int = 5000) -> str:
+        """exports the cluster units of the cluster (with the ground truth of the label template) and returns the path of the file"""
+        schema = ExportService.cluster_unit_schema(columns, label_template_entity)
+        path = ExportService.export_path(f"cluster_units_{cluster_entity_id}", file_format)
+        record_batches = ExportService.iter_cluster_unit_batches(schema, cluster_entity_id, label_template_entity, reddit_message_type, cluster_unit_ids, batch_size)
+        row_count = ExportService.write_record_batches(path, schema, record_batches, file_format)
+        logger.info(f"[export_cluster_units] Exported {row_count} cluster units of cluster_entity_id={cluster_entity_id} to {path}")
+        return path
+
+    @staticmethod
+    def export_predictions(experiment_entity: ExperimentEntity,
+                           label_template_entity: LabelTemplateEntity,
+                           file_format: ExportFileFormat = "parquet",
+                           batch_size: int = 5000) -> str:
+        """exports every run of the experiment with its predicted label values and returns the path of the file"""
+        schema = ExportService.prediction_schema(label_template_entity)
+        path = ExportService.export_path(f"predictions_{experiment_entity.id}", file_format)
+        record_batches = ExportService.iter_prediction_batches(schema, experiment_entity, label_template_entity, batch_size)
+        row_count = ExportService.write_record_batches(path, schema, record_batches, file_format)
+        logger.info(f"[export_predictions] Exported {row_count} prediction runs of experiment_id={experiment_entity.id} to {path}")
+        return path
@@ -1,7 +1,8 @@
 
 
 from typing import Dict, List, Literal, Optional, Tuple
-from app.database import get_cluster_repository, get_cluster_unit_repository, get_experiment_repository, get_filtering_repository, get_sample_repository
+from app.database import get_cluster_repository, get_cluster_unit_repository, get_experiment_repository, get_filtering_repository, get_prediction_repository, get_sample_repository
+from app.database.base_repository import encode_after_token
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.cluster_unit_entity import ClusterUnitEntity
 from app.database.entities.experiment_entity import ExperimentEntity
@@ -10,6 +11,7 @@ from app.database.entities.label_template import LabelTemplateEntity
 from app.requests.filtering_requests import FilteringCreateRequest
 from app.services.cluster_prep_service import ClusterPrepService
 from app.services.experiment_service import ExperimentService
+from app.utils.filtering_query import compile_filter_misc, compile_run_filters, embedded_runs_expression
 from app.utils.logging_config import get_logger
 
 logger = get_logger(__name__)
@@ -53,23 +55,143 @@ class FilteringService:
         
 
     @staticmethod
-    def get_input_cluster_units(input_id: PyObjectId, input_type: Literal["experiment", "sample", "filtering", "cluster"]) -> Tuple[List[ClusterUnitEntity], ExperimentEntity | None]:
+    def get_input_cluster_units(input_id: PyObjectId, input_type: Literal["experiment", "sample", "filtering", "cluster"], load_predictions: bool = True) -> Tuple[List[ClusterUnitEntity], ExperimentEntity | None]:
+        """if load_predictions is False, the predictions are not loaded for the sample, filtering and cluster inputs (they are not used to filter those).
+        For an experiment input only the predictions of that experiment are loaded"""
         filter = dict()
         experiment_entity = None
         if input_type == "experiment":
             cluster_unit_entities, experiment_entity = FilteringService().get_input_cluster_units_from_experiment_entity(experiment_id=input_id)
         elif input_type == "sample":
             sample_enity = get_sample_repository().find_by_id(input_id)
-            cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(sample_enity.sample_cluster_unit_ids)
+            if load_predictions:
+                cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(sample_enity.sample_cluster_unit_ids)
+            else:
+                cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids_with_predictions(sample_enity.sample_cluster_unit_ids, [])
         elif input_type == "filtering":
             filtering_entity = get_filtering_repository().find_by_id(input_id)
-            cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(filtering_entity.output_cluster_unit_ids)
+            if load_predictions:
+                cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids(filtering_entity.output_cluster_unit_ids)
+            else:
+                cluster_unit_entities = get_cluster_unit_repository().find_many_by_ids_with_predictions(filtering_entity.output_cluster_unit_ids, [])
            
         elif input_type == "cluster":
-            cluster_unit_entities = ClusterPrepService().find_cluster_units_from_cluster_id_message_type(cluster_entity_id=input_id, reddit_message_type="all")
+            if load_predictions:
+                cluster_unit_entities = ClusterPrepService().find_cluster_units_from_cluster_id_message_type(cluster_entity_id=input_id, reddit_message_type="all")
+            else:
+                cluster_unit_entities = get_cluster_unit_repository().find_with_predictions({"cluster_entity_id": input_id}, [])
         
         return cluster_unit_entities, experiment_entity
     
+    @staticmethod
+    def get_input_cluster_unit_filter(input_id: PyObjectId, input_type: Literal["experiment", "sample", "filtering", "cluster"]) -> Tuple[Dict, ExperimentEntity | None]:
+        """the cluster unit filter of the input, so that the input can be paged through instead of loaded at once"""
+        experiment_entity = None
+        if input_type == "experiment":
+            experiment_entity = get_experiment_repository().find_by_id(input_id)
+            if not experiment_entity:
+                raise Exception(f"Experiment entity not found! id = {input_id}")
+            filter = {"_id": {"$in": ExperimentService().get_input_cluster_unit_entities_from_expertiment(experiment_entity=experiment_entity, only_return_ids=True)}}
+        elif input_type == "sample":
+            filter = {"_id": {"$in": get_sample_repository().find_by_id(input_id).sample_cluster_unit_ids}}
+        elif input_type == "filtering":
+            filter = {"_id": {"$in": get_filtering_repository().find_by_id(input_id).output_cluster_unit_ids}}
+        elif input_type == "cluster":
+            filter = {"cluster_entity_id": input_id}
+        else:
+            raise Exception(f"input type is not implemented! input_type = {input_type}")
+        return filter, experiment_entity
+
+    @staticmethod
+    def find_filtered_cluster_units(filtering_fields: FilteringFields, limit: Optional[int] = None) -> List[ClusterUnitEntity]:
+        """the first limit cluster units of the input that match the filter (all of them if limit is None), in the order in which the input is found.
+        The filter runs in the database when it can be translated, otherwise the whole input is loaded and filtered in python"""
+        filter, experiment_entity = FilteringService.get_input_cluster_unit_filter(input_id=filtering_fields.input_id, input_type=filtering_fields.input_type)
+        filtering_query = FilteringService.compile_filtering_query(filtering_fields=filtering_fields, experiment_entity=experiment_entity)
+        if filtering_query is not None:
+            return get_cluster_unit_repository().find({"$and": [filter, filtering_query]})[:limit]
+
+        cluster_unit_entities, experiment_entity = FilteringService.get_input_cluster_units(input_id=filtering_fields.input_id, input_type=filtering_fields.input_type)
+        return FilteringService.filter_cluster_units(cluster_unit_entities=cluster_unit_entities,
+                                                     filtering_fields=filtering_fields,
+                                                     experiment_entity=experiment_entity)[:limit]
+
+    @staticmethod
+    def find_filtered_cluster_units_page(filtering_fields: FilteringFields,
+                                         limit: int,
+                                         after: Optional[str] = None,
+                                         scan_batch_size: int = 500) -> Tuple[List[ClusterUnitEntity], Optional[str]]:
+        """the next limit cluster units of the input (in _id order) that match the filter, from the after token.
+        The filter runs in the database when it can be translated, otherwise the input is paged through and every page is filtered in python.
+        Returns the matching cluster units and the after token to continue from, None when the whole input has been scanned"""
+        filter, experiment_entity = FilteringService.get_input_cluster_unit_filter(input_id=filtering_fields.input_id, input_type=filtering_fields.input_type)
+        filtering_query = FilteringService.compile_filtering_query(filtering_fields=filtering_fields, experiment_entity=experiment_entity)
+        if filtering_query is not None:
+            cluster_units_page = get_cluster_unit_repository().find_after({"$and": [filter, filtering_query]}, after=after, size=limit)
+            return cluster_units_page.content, cluster_units_page.next_after
+
+        # python fallback for filters that cannot be translated into a query
+        filtered_cluster_units: List[ClusterUnitEntity] = list()
+        scan_after = after
+        while True:
+            cluster_units_page = get_cluster_unit_repository().find_after(filter, after=scan_after, size=scan_batch_size)
+            filtered_cluster_units.extend(FilteringService.filter_cluster_units(cluster_unit_entities=cluster_units_page.content,
+                                                                                filtering_fields=filtering_fields,
+                                                                                experiment_entity=experiment_entity))
+            scan_after = cluster_units_page.next_after
+            if scan_after is None or len(filtered_cluster_units) >= limit:
+                break
+
+        if len(filtered_cluster_units) > limit or (scan_after is not None and filtered_cluster_units):
+            # continue right after the last returned unit, not after the scanned page, so that no match is skipped
+            filtered_cluster_units = filtered_cluster_units[:limit]
+            if filtered_cluster_units:
+                last_id = filtered_cluster_units[-1].id
+                return filtered_cluster_units, encode_after_token(last_id, last_id)
+            return filtered_cluster_units, after
+        return filtered_cluster_units, scan_after
+
+    @staticmethod
+    def compile_filtering_query(filtering_fields: FilteringFields | FilteringEntity, experiment_entity: ExperimentEntity | None = None) -> Optional[Dict]:
+        """the mongodb filter on the cluster units with the same result as filter_cluster_units, or None if a filter cannot be translated.
+        The label filters only apply to an experiment input (as in apply_filtering_label_template): the runs that match are counted
+        in the prediction collection, or with $expr on the embedded predictions for experiments from before the prediction collection"""
+        filtering_query = compile_filter_misc(filtering_fields.filter_misc)
+        if experiment_entity is None or not (filtering_fields.label_template_filter_and or filtering_fields.label_template_filter_or):
+            return filtering_query
+
+        prediction_repository = get_prediction_repository()
+        if prediction_repository.has_predictions(experiment_entity.id):
+            run_filters = compile_run_filters(filtering_fields, "$prediction.labels_prediction.values")
+            if run_filters is None:
+                return None
+            matching_cluster_unit_ids = prediction_repository.find_cluster_unit_ids_matching_runs(experiment_id=experiment_entity.id,
+                                                                                                  run_filters=run_filters,
+                                                                                                  min_matching_runs=experiment_entity.runs_per_unit)
+            label_query = {"_id": {"$in": matching_cluster_unit_ids}}
+        else:
+            run_filters = compile_run_filters(filtering_fields, "$$run.labels_prediction.values")
+            if run_filters is None:
+                return None
+            label_query = embedded_runs_expression(experiment_id=experiment_entity.id, run_filters=run_filters, min_matching_runs=experiment_entity.runs_per_unit)
+
+        return {"$and": [filtering_query, label_query]} if filtering_query else label_query
+
+    @staticmethod
+    def count_filtered_cluster_units(filtering_fields: FilteringFields) -> Tuple[int, int]:
+        """returns the number of input cluster units before and after filtering, counted with a single $facet aggregation"""
+        filter, experiment_entity = FilteringService.get_input_cluster_unit_filter(input_id=filtering_fields.input_id, input_type=filtering_fields.input_type)
+        filtering_query = FilteringService.compile_filtering_query(filtering_fields=filtering_fields, experiment_entity=experiment_entity)
+        if filtering_query is None:
+            cluster_unit_entities, experiment_entity = FilteringService.get_input_cluster_units(input_id=filtering_fields.input_id, input_type=filtering_fields.input_type, load_predictions=False)
+            filtered_cluster_unit_entities = FilteringService.filter_cluster_units(cluster_unit_entities=cluster_unit_entities,
+                                                                                   filtering_fields=filtering_fields,
+                                                                                   experiment_entity=experiment_entity)
+            return len(cluster_unit_entities), len(filtered_cluster_unit_entities)
+
+        counts = get_cluster_unit_repository().count_facets(filter, {"before_filtering": dict(), "after_filtering": filtering_query})
+        return counts["before_filtering"], counts["after_filtering"]
+
     @staticmethod
     def apply_filtering_label_template(cluster_unit_entity: ClusterUnitEntity, 
                         filtering_fields: FilteringFields | FilteringEntity,
@@ -174,13 +296,22 @@ class FilteringService:
                                                                           user_id=user_id,
                                                                           scraper_cluster_id=scraper_cluster_id)
         
-        input_cluster_units, experiment_entity = FilteringService().get_input_cluster_units(input_id=filtering_entity.input_id, 
-                                                                                            input_type=filtering_entity.input_type)
-        if not input_cluster_units or not experiment_entity:
-            raise Exception("no input inputs found or experiment found")
-        filtering_entity.input_cluster_unit_ids = [cluster_unit.id for cluster_unit in input_cluster_units]
-        filtered_cluster_units = FilteringService.filter_cluster_units(cluster_unit_entities=input_cluster_units, filtering_fields=filtering_entity, experiment_entity=experiment_entity)
-        filtering_entity.output_cluster_unit_ids = [cluster_unit.id for cluster_unit in filtered_cluster_units]
+        filter, experiment_entity = FilteringService.get_input_cluster_unit_filter(input_id=filtering_entity.input_id, input_type=filtering_entity.input_type)
+        filtering_query = FilteringService.compile_filtering_query(filtering_fields=filtering_entity, experiment_entity=experiment_entity)
+        if filtering_query is not None:
+            input_cluster_unit_ids = get_cluster_unit_repository().find_ids(filter)
+            if not input_cluster_unit_ids or not experiment_entity:
+                raise Exception("no input inputs found or experiment found")
+            filtering_entity.input_cluster_unit_ids = input_cluster_unit_ids
+            filtering_entity.output_cluster_unit_ids = get_cluster_unit_repository().find_ids({"$and": [filter, filtering_query]})
+        else:
+            input_cluster_units, experiment_entity = FilteringService().get_input_cluster_units(input_id=filtering_entity.input_id, 
+                                                                                                input_type=filtering_entity.input_type)
+            if not input_cluster_units or not experiment_entity:
+                raise Exception("no input inputs found or experiment found")
+            filtering_entity.input_cluster_unit_ids = [cluster_unit.id for cluster_unit in input_cluster_units]
+            filtered_cluster_units = FilteringService.filter_cluster_units(cluster_unit_entities=input_cluster_units, filtering_fields=filtering_entity, experiment_entity=experiment_entity)
+            filtering_entity.output_cluster_unit_ids = [cluster_unit.id for cluster_unit in filtered_cluster_units]
         inserted_id = get_filtering_repository().insert(filtering_entity).inserted_id
         logger.info(f"Inserted filtering_entity with id: {inserted_id}")
         return inserted_id
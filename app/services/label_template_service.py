@@ -42,18 +42,29 @@ class LabelTemplateService:
         for label_template_entity in label_template_entities:
           label_template_entity._create_ground_truth_field()
           get_label_template_repository().update(label_template_entity.id, label_template_entity)
-          for cluster_unit_entity in cluster_unit_entities:
-              if cluster_unit_entity.ground_truth is None:
-                  cluster_unit_entity.ground_truth = dict()
-              if label_template_entity.id not in cluster_unit_entity.ground_truth:
-                  logger.info(f"the label_template ground trut doesn't yet exist for cluster unit entity id {(cluster_unit_entity.id)}, so we create it and add to db for label_template_id : {label_template_entity.id}")
-                  #logger.info(f"label_template_entity.ground_truth_field.copy() = ", label_template_entity.model_dump_json(indent=4))
-                  cluster_unit_entity.ground_truth[label_template_entity.id] = label_template_entity.ground_truth_field.model_copy()
-                  get_cluster_unit_repository().update(cluster_unit_entity.id, cluster_unit_entity)
+          LabelTemplateService.initialize_missing_ground_truths(cluster_unit_entities=cluster_unit_entities, label_template_entity=label_template_entity)
               
         returnable_cluster_units = [cluster_unit_entity.model_dump() for cluster_unit_entity in cluster_unit_entities]
         return returnable_cluster_units
     
+    @staticmethod
+    def initialize_missing_ground_truths(cluster_unit_entities: List[ClusterUnitEntity], label_template_entity: LabelTemplateEntity) -> int:
+        """adds the ground truth field of the label template to the cluster units that do not have it yet, in memory and with one bulk update in the database"""
+        missing_cluster_unit_ids = list()
+        for cluster_unit_entity in cluster_unit_entities:
+            if cluster_unit_entity.ground_truth is None:
+                cluster_unit_entity.ground_truth = dict()
+            if label_template_entity.id not in cluster_unit_entity.ground_truth:
+                cluster_unit_entity.ground_truth[label_template_entity.id] = label_template_entity.ground_truth_field.model_copy()
+                missing_cluster_unit_ids.append(cluster_unit_entity.id)
+
+        if not missing_cluster_unit_ids:
+            return 0
+        logger.info(f"the label_template ground truth doesn't yet exist for {len(missing_cluster_unit_ids)} cluster units, so we create it and add to db for label_template_id : {label_template_entity.id}")
+        return get_cluster_unit_repository().initialize_ground_truths(cluster_unit_ids=missing_cluster_unit_ids,
+                                                                      label_template_id=label_template_entity.id,
+                                                                      ground_truth_field=label_template_entity.ground_truth_field)
+
     @staticmethod
     def create_ground_truth_cluster_unit_entities(cluster_unit_entities: List[ClusterUnitEntity], label_template_entity: LabelTemplateEntity) -> int:
         updated_count = 0
@@ -76,14 +87,7 @@ class LabelTemplateService:
         get_label_template_repository().update(label_template_entity.id, label_template_entity)
 
 
-        for cluster_unit_entity in cluster_unit_entities:
-            if cluster_unit_entity.ground_truth is None:
-                cluster_unit_entity.ground_truth = dict()
-            if label_template_entity.id not in cluster_unit_entity.ground_truth:
-                logger.info(f"the label_template ground trut doesn't yet exist for cluster unit entity id {(cluster_unit_entity.id)}, so we create it and add to db for label_template_id : {label_template_entity.id}")
-                #logger.info(f"label_template_entity.ground_truth_field.copy() = ", label_template_entity.model_dump_json(indent=4))
-                cluster_unit_entity.ground_truth[label_template_entity.id] = label_template_entity.ground_truth_field.model_copy()
-                get_cluster_unit_repository().update(cluster_unit_entity.id, cluster_unit_entity)
+        LabelTemplateService.initialize_missing_ground_truths(cluster_unit_entities=cluster_unit_entities, label_template_entity=label_template_entity)
 
         
         sample_units_return_format_labeling: GetSampleUnitsLabelingFormatResponse = GetSampleUnitsLabelingFormatResponse.create_from_cluster_units_label_template_id(
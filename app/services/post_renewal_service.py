@@ -0,0 +1,166 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.database import get_post_repository
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.comment_row_entity import PATH_SEPARATOR, CommentRowEntity, build_comment_tree, child_path
+from app.database.entities.post_entity import CommentEntity, PostEntity
+from app.responses.reddit_post_comments_response import RedditComment, RedditPost
+from app.services.post_service import PostService
+from app.utils import utc_timestamp
+from app.utils.logging_config import get_logger
+from app.utils.reddit_scraper_api import RedditAPIManager
+
+
+logger = get_logger(__name__)
+
+# the fields that can change on reddit after a post or comment is scraped, only these are compared and written on a renewal
+POST_RENEWED_FIELDS = ("title", "text", "upvotes", "downvotes", "upvote_ratio", "user_tag", "media_metadata")
+COMMENT_RENEWED_FIELDS = ("text", "upvotes", "downvotes", "controversiality", "user_tag", "media_metadata")
+
+
+class PostRenewalDiff(BaseModel):
+    """what changed on reddit since a post was stored"""
+    post_changes: Dict[str, Any]
+    changed_rows: Dict[PyObjectId, Dict[str, Any]] # the changed fields of the comments that were already stored, by the _id of their row
+    new_rows: List[CommentRowEntity]
+    rows: List[CommentRowEntity] # all comments after the renewal, the comments that are no longer on reddit are kept
+
+    def has_changes(self) -> bool:
+        return bool(self.post_changes or self.changed_rows or self.new_rows)
+
+
+class PostRenewalReport(BaseModel):
+    renewed: int = 0
+    changed_posts: int = 0
+    changed_comments: int = 0
+    new_comments: int = 0
+    failed: int = 0
+
+
+class PostRenewalService:
+    """keeps the stored posts fresh by renewing only the posts that are due, instead of re-scraping every post.
+    The next renewal of a post is scheduled from its age and comment velocity: young and active posts are renewed every few hours,
+    old and quiet posts at most once every MAX_RENEWAL_INTERVAL. The due posts are fetched concurrently in batches and diffed with the
+    stored version by reddit_id, only the changed fields and new comments are written, existing comments keep their _id (and so their cluster units).
+    The schedule is written with every batch, so it is also the checkpoint: an interrupted run continues with the posts that are still due"""
+    MIN_RENEWAL_INTERVAL = timedelta(hours=6)
+    MAX_RENEWAL_INTERVAL = timedelta(days=30)
+    FAILED_RETRY_INTERVAL = timedelta(hours=1)
+
+    @staticmethod
+    def renewal_interval(created_utc: float, comment_velocity: float, now: datetime) -> timedelta:
+        """a quarter of the age of the post, divided by 1 + the new comments per day, between the minimum and maximum interval"""
+        age_hours = max(0.0, now.timestamp() - created_utc) / 3600
+        interval = timedelta(hours=age_hours / 4 / (1 + comment_velocity))
+        return min(max(interval, PostRenewalService.MIN_RENEWAL_INTERVAL), PostRenewalService.MAX_RENEWAL_INTERVAL)
+
+    @staticmethod
+    def changed_fields(stored: BaseModel, renewed: BaseModel, fields: Tuple[str, ...]) -> Dict[str, Any]:
+        """the dumped values of the fields that differ between the stored and the renewed version"""
+        stored_values = stored.model_dump(by_alias=True, include=set(fields))
+        renewed_values = renewed.model_dump(by_alias=True, include=set(fields))
+        return {field: renewed_values[field] for field in fields if renewed_values[field] != stored_values[field]}
+
+    @staticmethod
+    def diff_post(stored_post: PostEntity, stored_rows: List[CommentRowEntity], renewed_post: PostEntity) -> PostRenewalDiff:
+        """compares the renewed post from reddit with the stored post and its comment rows by reddit_id.
+        A new comment is added after the stored replies of its parent, so the paths of the stored comments never change.
+        The changes are the dumped values (e.g. media_metadata as plain dicts), so they can be written as they are"""
+        post_changes = PostRenewalService.changed_fields(stored_post, renewed_post, POST_RENEWED_FIELDS)
+
+        rows_by_reddit_id: Dict[str, CommentRowEntity] = {row.reddit_id: row for row in stored_rows}
+        # the next free position among the replies of a parent path, None for the replies to the post
+        next_positions: Dict[Optional[str], int] = defaultdict(int)
+        for row in stored_rows:
+            parent_path, _, segment = row.path.rpartition(PATH_SEPARATOR)
+            next_positions[parent_path or None] = max(next_positions[parent_path or None], int(segment) + 1)
+
+        changed_rows: Dict[PyObjectId, Dict[str, Any]] = dict()
+        new_rows: List[CommentRowEntity] = list()
+        stack: List[tuple[CommentEntity, Optional[CommentRowEntity]]] = [(comment, None) for comment in reversed(renewed_post.comments)]
+        while stack:
+            comment, parent_row = stack.pop()
+            row = rows_by_reddit_id.get(comment.reddit_id)
+            if row is None:
+                parent_path = parent_row.path if parent_row else None
+                row = CommentRowEntity.from_comment(comment, stored_post.id, parent_row.id if parent_row else None, child_path(parent_path, next_positions[parent_path]))
+                next_positions[parent_path] += 1
+                new_rows.append(row)
+            else:
+                comment_changes = PostRenewalService.changed_fields(row, comment, COMMENT_RENEWED_FIELDS)
+                if comment_changes:
+                    changed_rows[row.id] = comment_changes
+                    row = row.model_copy(update={field: getattr(comment, field) for field in comment_changes})
+            rows_by_reddit_id[comment.reddit_id] = row
+            stack.extend((reply, row) for reply in reversed(comment.replies or []))
+
+        return PostRenewalDiff(post_changes=post_changes, changed_rows=changed_rows, new_rows=new_rows, rows=list(rows_by_reddit_id.values()))
+
+    @staticmethod
+    def renew_posts(stored_posts: List[PostEntity], renewed_posts: Mapping[str, PostEntity], report: PostRenewalReport) -> None:
+        """writes the changes of the renewed posts (by reddit_id) and schedules their next renewal.
+        The stored posts that are missing in renewed_posts could not be fetched and are retried after FAILED_RETRY_INTERVAL"""
+        post_repository = get_post_repository()
+        now = utc_timestamp()
+        post_updates: Dict[PyObjectId, Dict[str, Any]] = dict()
+        row_updates: Dict[PyObjectId, Dict[str, Any]] = dict()
+        new_rows: List[CommentRowEntity] = list()
+
+        for stored_post in stored_posts:
+            renewed_post = renewed_posts.get(stored_post.reddit_id)
+            if renewed_post is None:
+                post_updates[stored_post.id] = {"next_renewal_at": now + PostRenewalService.FAILED_RETRY_INTERVAL}
+                report.failed += 1
+                continue
+
+            diff = PostRenewalService.diff_post(stored_post, post_repository.find_comment_rows(stored_post), renewed_post)
+            days_since_last_renewal = max((now - (stored_post.last_renewed_at or stored_post.created_at)).total_seconds() / 86400, 1 / 24)
+            comment_velocity = len(diff.new_rows) / days_since_last_renewal
+            post_update = {
+                **diff.post_changes,
+                "last_renewed_at": now,
+                "next_renewal_at": now + PostRenewalService.renewal_interval(stored_post.created_utc, comment_velocity, now),
+                "comment_velocity": comment_velocity,
+            }
+            if diff.has_changes():
+                post_update["updated_at"] = now
+                report.changed_posts += 1
+            if stored_post.comments_layout == "flat":
+                row_updates.update(diff.changed_rows)
+                new_rows.extend(diff.new_rows)
+            elif diff.changed_rows or diff.new_rows:
+                post_update["comments"] = [comment.model_dump(by_alias=True) for comment in build_comment_tree(diff.rows)]
+            post_updates[stored_post.id] = post_update
+
+            report.renewed += 1
+            report.changed_comments += len(diff.changed_rows)
+            report.new_comments += len(diff.new_rows)
+
+        post_repository.comment_repository.update_rows(row_updates, new_rows)
+        post_repository.update_renewed_posts(post_updates)
+
+    @staticmethod
+    def renew_due_posts(max_posts: Optional[int] = None, batch_size: int = 50) -> PostRenewalReport:
+        """renews the posts that are due, in batches of batch_size whose comments are scraped concurrently"""
+        reddit_scraper_manager = RedditAPIManager(number_posts_per_keyword=10)
+        report = PostRenewalReport()
+        run_started_at = utc_timestamp()
+        while max_posts is None or report.renewed + report.failed < max_posts:
+            limit = batch_size if max_posts is None else min(batch_size, max_posts - report.renewed - report.failed)
+            # every post of a batch is scheduled after run_started_at, so a batch never selects a post of an earlier batch again
+            stored_posts = get_post_repository().find_due_for_renewal(run_started_at, limit)
+            if not stored_posts:
+                break
+
+            renewed_posts: Dict[str, PostEntity] = dict()
+            def add_renewed_post(full_reddit_post: RedditPost, reddit_comments: List[RedditComment]):
+                renewed_posts[full_reddit_post.id] = PostService.create_reddit_post_entity(full_reddit_post, reddit_comments)
+
+            reddit_scraper_manager.scrape_comments_of_posts([post.permalink for post in stored_posts], add_renewed_post)
+            PostRenewalService.renew_posts(stored_posts, renewed_posts, report)
+            logger.info(f"[renew_due_posts] Renewed {report.renewed} posts so far: {report.changed_posts} changed, {report.new_comments} new comments, {report.failed} failed")
+        return report
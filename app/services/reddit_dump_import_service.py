@@ -0,0 +1,287 @@
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import BulkWriteError
+
+from app.database import get_post_repository, get_scraper_repository
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.post_entity import CommentEntity, PostEntity
+from app.database.entities.scraper_entity import ScraperEntity
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+# the reddit dumps are compressed with a long window, the decompressor must be allowed to use it
+ZSTD_MAX_WINDOW_SIZE = 2**31
+
+
+class KeywordMatcher:
+    """matches keywords as whole words (case insensitive) in the title and text of a submission"""
+    def __init__(self, keywords: List[str]):
+        self.patterns = [(keyword, re.compile(rf"(?<!\w){re.escape(keyword.strip())}(?!\w)", re.IGNORECASE)) for keyword in keywords]
+
+    def match(self, text: str) -> List[str]:
+        """the keywords that occur in text"""
+        return [keyword for keyword, pattern in self.patterns if pattern.search(text)]
+
+
+class RedditDumpImportReport(BaseModel):
+    submissions_read: int = 0
+    posts_matched: int = 0
+    comments_read: int = 0
+    comments_matched: int = 0
+    posts_inserted: int = 0
+    posts_existing: int = 0 # already in the database, they are only added to the keyword searches of the scraper
+    posts_invalid: int = 0
+    malformed_lines: int = 0
+
+
+@contextmanager
+def _open_dump(path: str) -> Iterator[io.TextIOBase]:
+    if path.endswith(".zst"):
+        import zstandard
+        with open(path, "rb") as file:
+            reader = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE).stream_reader(file)
+            yield io.TextIOWrapper(reader, encoding="utf-8", errors="replace")
+    else:
+        with open(path, encoding="utf-8", errors="replace") as file:
+            yield file
+
+
+def iter_dump_records(path: str, report: RedditDumpImportReport) -> Iterator[Dict[str, Any]]:
+    """the records of a NDJSON dump file (zstd compressed with the .zst extension), decompressed and parsed one line at a time"""
+    with _open_dump(path) as lines:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                report.malformed_lines += 1
+
+
+class _DumpSpill:
+    """the matched submissions and their comments in a temporary sqlite file, so that the comments of a dump can be grouped
+    by post while only the comments of a single post are in memory"""
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = tempfile.TemporaryDirectory(prefix="reddit_dump_", dir=directory)
+        self.connection = sqlite3.connect(os.path.join(self.directory.name, "spill.sqlite"))
+        self.connection.execute("CREATE TABLE post (id TEXT PRIMARY KEY, subreddit TEXT, keywords TEXT, record TEXT)")
+        self.connection.execute("CREATE TABLE comment (id TEXT PRIMARY KEY, link_id TEXT, record TEXT)")
+
+    def add_post(self, record: Dict[str, Any], subreddit: str, keywords: List[str]) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO post VALUES (?, ?, ?, ?)", (record["id"], subreddit, json.dumps(keywords), json.dumps(record)))
+
+    def add_comments(self, rows: List[Tuple[str, str, str]]) -> None:
+        self.connection.executemany("INSERT OR REPLACE INTO comment VALUES (?, ?, ?)", rows)
+
+    def post_ids(self) -> Set[str]:
+        return {row[0] for row in self.connection.execute("SELECT id FROM post")}
+
+    def index_comments(self) -> None:
+        """after the comments are loaded, indexing at the end is faster than maintaining the index on every insert"""
+        self.connection.execute("CREATE INDEX comment_link_id ON comment (link_id)")
+        self.connection.commit()
+
+    def iter_posts(self) -> Iterator[Tuple[Dict[str, Any], str, List[str]]]:
+        for record, subreddit, keywords in self.connection.execute("SELECT record, subreddit, keywords FROM post ORDER BY id"):
+            yield json.loads(record), subreddit, json.loads(keywords)
+
+    def post_comments(self, post_id: str) -> List[Dict[str, Any]]:
+        return [json.loads(record) for (record,) in self.connection.execute("SELECT record FROM comment WHERE link_id = ?", (post_id,))]
+
+    def close(self) -> None:
+        self.connection.close()
+        self.directory.cleanup()
+
+
+def _upvotes(record: Dict[str, Any]) -> int:
+    return int(record.get("ups", record.get("score", 0)) or 0)
+
+
+def _comment_entity(record: Dict[str, Any], depth: int) -> CommentEntity:
+    return CommentEntity(
+        reddit_id=record["id"],
+        text=record.get("body", ""),
+        author=record.get("author") or "[deleted]",
+        upvotes=_upvotes(record),
+        downvotes=int(record.get("downs", 0) or 0),
+        user_tag=record.get("author_flair_text"),
+        media_metadata=record.get("media_metadata"),
+        created_utc=float(record.get("created_utc", 0)),
+        controversiality=float(record.get("controversiality", 0) or 0),
+        depth=depth,
+        replies=[])
+
+
+def build_comment_entities(post_id: str, comment_records: List[Dict[str, Any]]) -> List[CommentEntity]:
+    """reassembles the comment tree of a post from the flat comment records of a dump by parent_id, the replies ordered by score.
+    The dumps have no depth, it follows from the tree. A comment whose parent is not in the dump (e.g. removed) becomes a reply to the post"""
+    post_name = f"t3_{post_id}"
+    comment_names = {f"t1_{record['id']}" for record in comment_records}
+    replies_per_parent: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in comment_records:
+        parent_id = record.get("parent_id")
+        replies_per_parent[parent_id if parent_id in comment_names else post_name].append(record)
+    for replies in replies_per_parent.values():
+        replies.sort(key=_upvotes, reverse=True)
+
+    comments: List[CommentEntity] = list()
+    # iterative build, so deep threads do not hit the recursion limit
+    stack = [(record, 0, comments) for record in reversed(replies_per_parent[post_name])]
+    while stack:
+        record, depth, siblings = stack.pop()
+        comment = _comment_entity(record, depth)
+        siblings.append(comment)
+        stack.extend((reply, depth + 1, comment.replies) for reply in reversed(replies_per_parent[f"t1_{record['id']}"]))
+    return comments
+
+
+def post_entity_from_submission(record: Dict[str, Any], comments: List[CommentEntity]) -> PostEntity:
+    return PostEntity(
+        reddit_id=record["id"],
+        title=record.get("title", ""),
+        permalink=record.get("permalink") or f"/r/{record.get('subreddit')}/comments/{record['id']}/",
+        text=record.get("selftext", ""),
+        author=record.get("author") or "[deleted]",
+        upvotes=_upvotes(record),
+        downvotes=int(record.get("downs", 0) or 0),
+        media_metadata=record.get("media_metadata"),
+        is_video=bool(record.get("is_video", False)),
+        preview=record.get("preview"),
+        media=record.get("media"),
+        media_embed=record.get("media_embed"),
+        secure_media=record.get("secure_media"),
+        secure_media_embed=record.get("secure_media_embed"),
+        url=record.get("url") or "",
+        upvote_ratio=float(record.get("upvote_ratio", 1.0)), # older dumps do not have it
+        user_tag=record.get("link_flair_text"),
+        created_utc=float(record.get("created_utc", 0)),
+        subreddit=record.get("subreddit", ""),
+        send_replies=bool(record.get("send_replies", True)),
+        comments=comments)
+
+
+class RedditDumpImportService:
+    """imports posts from offline reddit dumps (NDJSON submission and comment files, e.g. RS_2023-01.zst and RC_2023-01.zst)
+    instead of scraping them through the quota bound reddit API. The import streams the files in three passes:
+    1. the submissions of the subreddits that match a keyword are spilled to a temporary sqlite file,
+    2. the comments of those submissions (by link_id) are spilled as well,
+    3. every post is rebuilt with its comment tree and the posts are inserted in batches, the posts that are already stored are skipped.
+    With a scraper entity, the posts are also added to the keyword searches of the scraper, like a scrape would"""
+
+    @staticmethod
+    def import_dumps(submission_paths: List[str],
+                     comment_paths: List[str],
+                     subreddits: Optional[List[str]] = None,
+                     keywords: Optional[List[str]] = None,
+                     scraper_entity: Optional[ScraperEntity] = None,
+                     batch_size: int = 500,
+                     spill_directory: Optional[str] = None) -> RedditDumpImportReport:
+        """imports the submissions of the subreddits that contain at least one of the keywords (all submissions without keywords).
+        The subreddits and keywords default to those of the scraper entity"""
+        if scraper_entity is not None:
+            subreddits = subreddits or scraper_entity.subreddits
+            keywords = keywords or scraper_entity.keywords
+        if not subreddits:
+            raise Exception("the import needs the subreddits to import")
+
+        report = RedditDumpImportReport()
+        # the subreddit names as written in the scraper entity, by their lowercase name in the dump
+        subreddit_names = {subreddit.lower(): subreddit for subreddit in subreddits}
+        keyword_matcher = KeywordMatcher(keywords) if keywords else None
+        spill = _DumpSpill(spill_directory)
+        try:
+            for path in submission_paths:
+                logger.info(f"[import_dumps] Reading submissions from {path}")
+                for record in iter_dump_records(path, report):
+                    report.submissions_read += 1
+                    subreddit = subreddit_names.get(str(record.get("subreddit", "")).lower())
+                    if subreddit is None or "id" not in record:
+                        continue
+                    matched_keywords = keyword_matcher.match(f"{record.get('title', '')}\n{record.get('selftext', '')}") if keyword_matcher else []
+                    if keyword_matcher and not matched_keywords:
+                        continue
+                    spill.add_post(record, subreddit, matched_keywords)
+
+            post_ids = spill.post_ids()
+            report.posts_matched = len(post_ids)
+            logger.info(f"[import_dumps] {report.posts_matched} of {report.submissions_read} submissions matched")
+
+            for path in comment_paths:
+                logger.info(f"[import_dumps] Reading comments from {path}")
+                comment_rows: List[Tuple[str, str, str]] = list()
+                for record in iter_dump_records(path, report):
+                    report.comments_read += 1
+                    post_id = str(record.get("link_id", "")).removeprefix("t3_")
+                    if post_id not in post_ids or "id" not in record:
+                        continue
+                    comment_rows.append((record["id"], post_id, json.dumps(record)))
+                    if len(comment_rows) >= 10_000:
+                        spill.add_comments(comment_rows)
+                        report.comments_matched += len(comment_rows)
+                        comment_rows = list()
+                spill.add_comments(comment_rows)
+                report.comments_matched += len(comment_rows)
+            spill.index_comments()
+
+            batch: List[Tuple[PostEntity, str, List[str]]] = list()
+            for record, subreddit, matched_keywords in spill.iter_posts():
+                try:
+                    post_entity = post_entity_from_submission(record, build_comment_entities(record["id"], spill.post_comments(record["id"])))
+                except (ValidationError, ValueError, TypeError) as error:
+                    logger.warning(f"[import_dumps] Skipping submission {record['id']}: {error}")
+                    report.posts_invalid += 1
+                    continue
+                batch.append((post_entity, subreddit, matched_keywords))
+                if len(batch) >= batch_size:
+                    RedditDumpImportService._insert_batch(batch, scraper_entity, report)
+                    batch = list()
+            if batch:
+                RedditDumpImportService._insert_batch(batch, scraper_entity, report)
+        finally:
+            spill.close()
+
+        logger.info(f"[import_dumps] Done: {report.model_dump()}")
+        return report
+
+    @staticmethod
+    def _insert_batch(batch: List[Tuple[PostEntity, str, List[str]]], scraper_entity: Optional[ScraperEntity], report: RedditDumpImportReport) -> None:
+        existing_post_entity_ids, existing_reddit_ids = get_post_repository().find_existing_post_entities_from_reddit_post_ids([post.reddit_id for post, _, _ in batch])
+        post_entity_ids: Dict[str, PyObjectId] = dict(zip(existing_reddit_ids, existing_post_entity_ids))
+        new_posts = [post for post, _, _ in batch if post.reddit_id not in post_entity_ids]
+        report.posts_existing += len(batch) - len(new_posts)
+
+        failed_reddit_ids: Set[str] = set()
+        if new_posts:
+            try:
+                get_post_repository().insert_list_entities(new_posts, ordered=False)
+            except BulkWriteError as error:
+                failed_reddit_ids = {new_posts[write_error["index"]].reddit_id for write_error in error.details.get("writeErrors", [])}
+                logger.warning(f"[_insert_batch] {len(failed_reddit_ids)} of {len(new_posts)} posts were not inserted")
+        report.posts_inserted += len(new_posts) - len(failed_reddit_ids)
+        post_entity_ids.update({post.reddit_id: post.id for post in new_posts if post.reddit_id not in failed_reddit_ids})
+
+        if scraper_entity is None:
+            return
+        post_ids_per_keyword_search: Dict[Tuple[str, str], List[PyObjectId]] = defaultdict(list)
+        keyword_subreddit_searches = scraper_entity.keyword_search_objective.keyword_subreddit_searches
+        for post, subreddit, matched_keywords in batch:
+            post_entity_id = post_entity_ids.get(post.reddit_id)
+            for keyword in matched_keywords:
+                # only the (subreddit, keyword) searches of the scraper are extended, not the extra subreddits or keywords of the import
+                keyword_search = keyword_subreddit_searches[subreddit].keyword_searches.get(keyword) if subreddit in keyword_subreddit_searches else None
+                if keyword_search is not None and post_entity_id is not None and post_entity_id not in keyword_search.found_post_ids:
+                    keyword_search.found_post_ids.append(post_entity_id)
+                    post_ids_per_keyword_search[(subreddit, keyword)].append(post_entity_id)
+        get_scraper_repository().append_postids_to_keyword_searches(scraper_entity.id, post_ids_per_keyword_search)
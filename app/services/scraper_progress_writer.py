@@ -0,0 +1,111 @@
+import time
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from app.database import get_post_repository, get_scraper_repository
+from app.database.entities.base_entity import PyObjectId
+from app.database.entities.post_entity import PostEntity
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class ScraperProgressWriter:
+    """write-behind buffer for the progress of a scraper instance.
+    The scraped posts and the post ids found per (subreddit, keyword) search are kept in memory and written together:
+    the posts with one unordered insert_many and the post ids with one $push $each update on the scraper.
+    The buffer is flushed when max_buffered_posts posts are buffered, when the oldest buffered write is older than
+    max_buffer_seconds, and always by the caller before the scraper is paused or the keyword search is completed.
+    Used as a context manager the buffer is also flushed when the scraping raises"""
+
+    def __init__(self, scraper_entity_id: PyObjectId, max_buffered_posts: int = 25, max_buffer_seconds: float = 30.0, pause_check_seconds: float = 5.0):
+        self.scraper_entity_id = scraper_entity_id
+        self.max_buffered_posts = max_buffered_posts
+        self.max_buffer_seconds = max_buffer_seconds
+        self.pause_check_seconds = pause_check_seconds
+
+        self._posts: List[PostEntity] = list()
+        self._post_ids_per_keyword_search: Dict[Tuple[str, str], List[PyObjectId]] = defaultdict(list)
+        self._post_keyword_searches: Dict[PyObjectId, List[Tuple[str, str]]] = dict()
+        self._oldest_write_time: float | None = None
+        self._last_pause_check_time: float | None = None
+        self._paused = False
+
+    def __enter__(self) -> "ScraperProgressWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    @property
+    def buffered_posts(self) -> int:
+        return len(self._posts)
+
+    def add_post(self, subreddit: str, keyword: str, post_entity: PostEntity) -> None:
+        """buffers a newly scraped post, its id is appended to the keyword search once the post is inserted"""
+        self.add_post_of_keyword_searches([(subreddit, keyword)], post_entity)
+
+    def add_post_of_keyword_searches(self, keyword_searches: List[Tuple[str, str]], post_entity: PostEntity) -> None:
+        """buffers a newly scraped post that was found by several (subreddit, keyword) searches,
+        its id is appended to each of them once the post is inserted"""
+        self._posts.append(post_entity)
+        self._post_keyword_searches[post_entity.id] = list(keyword_searches)
+        self._start_buffer_timer()
+        self._flush_if_needed()
+
+    def add_existing_post_ids(self, subreddit: str, keyword: str, post_entity_ids: List[PyObjectId]) -> None:
+        """buffers the ids of posts that are already in the database for the keyword search"""
+        if not post_entity_ids:
+            return
+        self._post_ids_per_keyword_search[(subreddit, keyword)].extend(post_entity_ids)
+        self._start_buffer_timer()
+        self._flush_if_needed()
+
+    def flush(self) -> None:
+        """inserts the buffered posts, then appends the ids of the inserted posts and the existing posts to their keyword searches"""
+        if self._posts:
+            failed_post_ids = self._insert_posts(self._posts)
+            for post_entity in self._posts:
+                if post_entity.id not in failed_post_ids:
+                    for keyword_search in self._post_keyword_searches[post_entity.id]:
+                        self._post_ids_per_keyword_search[keyword_search].append(post_entity.id)
+
+        if self._post_ids_per_keyword_search:
+            get_scraper_repository().append_postids_to_keyword_searches(self.scraper_entity_id, self._post_ids_per_keyword_search)
+
+        self._posts = list()
+        self._post_ids_per_keyword_search = defaultdict(list)
+        self._post_keyword_searches = dict()
+        self._oldest_write_time = None
+
+    def is_paused(self) -> bool:
+        """the status of the scraper is read at most once every pause_check_seconds, a paused scraper stays paused"""
+        now = time.monotonic()
+        if not self._paused and (self._last_pause_check_time is None or now - self._last_pause_check_time >= self.pause_check_seconds):
+            self._last_pause_check_time = now
+            scraper = get_scraper_repository().find_by_id(self.scraper_entity_id, fields=["status"])
+            self._paused = scraper is not None and scraper.get("status") == "paused"
+        return self._paused
+
+    def _insert_posts(self, posts: List[PostEntity]) -> Set[PyObjectId]:
+        """returns the ids of the posts that could not be inserted, those are not added to the keyword search"""
+        try:
+            get_post_repository().insert_list_entities(posts, ordered=False)
+        except BulkWriteError as error:
+            write_errors = error.details.get("writeErrors", [])
+            logger.warning(f"[_insert_posts] {len(write_errors)} of {len(posts)} posts were not inserted for scraper {self.scraper_entity_id}")
+            return {posts[write_error["index"]].id for write_error in write_errors}
+        return set()
+
+    def _start_buffer_timer(self) -> None:
+        if self._oldest_write_time is None:
+            self._oldest_write_time = time.monotonic()
+
+    def _flush_if_needed(self) -> None:
+        if len(self._posts) >= self.max_buffered_posts:
+            self.flush()
+        elif self._oldest_write_time is not None and time.monotonic() - self._oldest_write_time >= self.max_buffer_seconds:
+            self.flush()
@@ -1,18 +1,30 @@
 
 
 from collections import defaultdict
-from typing import Dict, List
+from datetime import timedelta
+from typing import Dict, List, Tuple
 from flask import jsonify
 from pydantic import BaseModel
 from app.database.entities.base_entity import PyObjectId
 from app.database.entities.scraper_entity import KeyWordSearchObjective, ScraperEntity, KeyWordSearchSubreddit, KeyWordSearch
-from app.database import get_post_repository, get_scraper_repository
+from app.database import get_post_repository, get_reddit_search_repository, get_scraper_repository
+from app.database.entities.reddit_search_entity import RedditSearchListing
 from app.requests.scraper_requests import CreateScraperRequest
 from app.responses.get_keyword_searches import GetKeywordSearches
-from app.responses.reddit_post_comments_response import RedditPost
+from app.responses.reddit_post_comments_response import RedditComment, RedditPost
 from app.services.post_service import PostService
+from app.services.scraper_progress_writer import ScraperProgressWriter
+from app.utils import utc_timestamp
+from app.utils.logging_config import get_logger
 from app.utils.reddit_scraper_api import RedditAPIManager
 
+
+logger = get_logger(__name__)
+
+# a claimed keyword search that is still ongoing after this long was left by a run that crashed, and can be claimed again
+KEYWORD_SEARCH_CLAIM_TIMEOUT = timedelta(hours=1)
+
+
 class ScrapingMessage(BaseModel):
     message: str
     processed: int = 0
@@ -37,70 +49,52 @@ class ScraperService(BaseModel):
         return scraper_entity
     
     @staticmethod
-    def get_posts_from_ids(reddit_posts: List[RedditPost]):
+    def get_posts_from_ids(reddit_post_ids: List[str]):
         """we look whether the post has been scraped before in the past, regardless of user_id"""
-        post_ids = [post.id for post in reddit_posts]
-        post_entity_ids, reddit_post_ids = get_post_repository().find_existing_post_entities_from_reddit_post_ids(post_ids)
+        post_entity_ids, reddit_post_ids = get_post_repository().find_existing_post_entities_from_reddit_post_ids(reddit_post_ids)
         return post_entity_ids, reddit_post_ids
 
-    
     @staticmethod
-    def execute_subreddit_search_instance(scraper_entity: ScraperEntity):
-        """finds the next keyword to search for in a specific subreddit, 
-        then it searches for the posts that relate to the keyword through reddit api
-        then it checks whether some of the posts have been retrieved before
-        if so, it adds the post_entity ids to the scraper entity 
-        for the new ones, it retrieves the posts and its comments, updates the post collection & scraper instance collection
-
-        """
-        reddit_scraper_manager = RedditAPIManager(scraper_entity.posts_per_keyword)
+    def find_post_listings_of_keyword_searches(reddit_scraper_manager: RedditAPIManager,
+                                               keyword_searches: List[Tuple[str, str]],
+                                               age: str,
+                                               filter: str) -> Dict[Tuple[str, str], List[RedditSearchListing]]:
+        """the posts of each (subreddit, keyword) search, the searches that are not cached are sent to reddit concurrently.
+        The results are cached for REDDIT_SEARCH_CACHE_TTL_SECONDS, so the scrapers of other users and projects that repeat a search
+        do not spend the reddit quota on it. A search that failed is missing in the result"""
+        limit = reddit_scraper_manager.number_posts_per_keyword
+        listings_per_keyword_search: Dict[Tuple[str, str], List[RedditSearchListing]] = dict()
+        for subreddit, keyword in keyword_searches:
+            listings = get_reddit_search_repository().find_search(subreddit, keyword, filter, age, limit)
+            if listings is not None:
+                listings_per_keyword_search[(subreddit, keyword)] = listings
+
+        uncached_keyword_searches = [keyword_search for keyword_search in keyword_searches if keyword_search not in listings_per_keyword_search]
+        logger.info(f"[find_post_listings_of_keyword_searches] {len(listings_per_keyword_search)} searches are cached, {len(uncached_keyword_searches)} are sent to reddit")
+        if uncached_keyword_searches:
+            reddit_posts_per_keyword_search = reddit_scraper_manager.find_related_posts_to_keywords(uncached_keyword_searches, age=age, filter=filter)
+            for (subreddit, keyword), reddit_posts in reddit_posts_per_keyword_search.items():
+                listings = [RedditSearchListing(reddit_id=reddit_post.id, permalink=reddit_post.permalink) for reddit_post in reddit_posts]
+                get_reddit_search_repository().save_search(subreddit, keyword, filter, age, limit, listings)
+                listings_per_keyword_search[(subreddit, keyword)] = listings
+        return listings_per_keyword_search
 
-        print(scraper_entity.status)
-        if scraper_entity.status != "initialized" and scraper_entity.status != "ongoing":
-            raise Exception("scraper instance does not have correct status")
-        
-        next_subreddit, next_keyword = scraper_entity.get_next_keyword()
-        # update keyword search status
-        get_scraper_repository().update_keyword_search_status(scraper_entity.id, next_subreddit.subreddit, next_keyword)
-        # update subreddit search status
-        get_scraper_repository().update_subreddit_status(scraper_entity.id, next_subreddit)
-
-        found_reddit_posts = reddit_scraper_manager.find_related_posts_to_keyword(
-            subreddit=next_subreddit.subreddit,
-            keyword=next_keyword.keyword,
-            age=scraper_entity.age,
-            filter=scraper_entity.filter)
+    @staticmethod
+    def claim_keyword_searches(scraper_entity: ScraperEntity) -> List[Tuple[str, str]]:
+        """claims the (subreddit, keyword) searches of the scraper that are not done and not claimed by another scraping run"""
+        stale_claim_before = utc_timestamp() - KEYWORD_SEARCH_CLAIM_TIMEOUT
+        claimed_keyword_searches = list()
+        for subreddit, keyword_search_subreddit in scraper_entity.keyword_search_objective.keyword_subreddit_searches.items():
+            for keyword, keyword_search in keyword_search_subreddit.keyword_searches.items():
+                if keyword_search.status != "done" and get_scraper_repository().claim_keyword_search(scraper_entity.id, subreddit, keyword, stale_claim_before):
+                    claimed_keyword_searches.append((subreddit, keyword))
+        return claimed_keyword_searches
 
-        post_entity_ids, reddit_post_ids = ScraperService.get_posts_from_ids(found_reddit_posts)
-        # scraper_entity.keyword_search_objective[next_subreddit]
-        next_keyword.found_post_ids.extend(post_entity_ids)
-        if post_entity_ids:
-            post_entity_ids_not_yet_added = [post_entity_id for post_entity_id in post_entity_ids if post_entity_id not in next_keyword.found_post_ids]
-            get_scraper_repository().append_postid_to_subreddit_keyword_search(scraper_entity.id, next_subreddit.subreddit, next_keyword.keyword, post_entity_ids_not_yet_added)
-
-        for i, reddit_post in enumerate(found_reddit_posts):
-            print("processing reddit_id ", reddit_post.id)
-            if i % 5 == 0:  # only check every 5 posts
-                if ScraperService.check_whether_scraped_is_paused(scraper_entity.id):
-                    return {"message": "scraper is paused"}
-            # skip the posts that are already scraped
-            if reddit_post.id in reddit_post_ids:
-                continue
-            full_reddit_post, reddit_comments = reddit_scraper_manager.scrape_comments_of_post(reddit_post.permalink)
-            post_entity = PostService().create_reddit_post_entity(full_reddit_post, reddit_comments)
-            
-            PostService().insert_into_db(post_entity)
-            next_keyword.found_post_ids.append(post_entity.id)
-            get_scraper_repository().append_postid_to_subreddit_keyword_search(scraper_entity.id, next_subreddit.subreddit, next_keyword.keyword, post_entity.id)
-        
-        # we must update the status of the keyword 
-        next_keyword.status = "done"
-        get_scraper_repository().update_keyword_search(scraper_entity.id, next_subreddit.subreddit, next_keyword)
-
-        # update the status subreddit when there are no keywords left
-        if not next_subreddit.find_next_keyword():
-            next_subreddit.status = "done"
-            get_scraper_repository().update_subreddit_status(scraper_entity.id, next_subreddit)
+    @staticmethod
+    def count_done_keyword_searches(scraper_entity: ScraperEntity) -> int:
+        return sum(keyword_search.status == "done"
+                   for keyword_search_subreddit in scraper_entity.keyword_search_objective.keyword_subreddit_searches.values()
+                   for keyword_search in keyword_search_subreddit.keyword_searches.values())
 
     @staticmethod
     def check_whether_scraped_is_paused(scraper_entity_id: str) -> bool:
@@ -113,18 +107,78 @@ class ScraperService(BaseModel):
 
     @staticmethod
     def scrape_all_subreddits_keywords(scraper_entity: ScraperEntity) -> ScrapingMessage:
-        """ calculates total possible searches (keywords * subreddits), then excutes the subreddit search each time"""
+        """fans the subreddits x keywords searches of the scraper out at once instead of one search after the other:
+        the searches are claimed atomically on the scraper (so a second run never repeats them), the uncached searches are sent to reddit concurrently,
+        a post found by several searches is scraped once and its id is added to each of them, and the comments of all new posts are scraped concurrently.
+        The searches and the comment scraping share the rate limit governor, so the scrape spends the whole quota of the window.
+        A paused scraper puts its claimed searches back to pending, a failed search is put back to pending to be retried by the next run"""
         total_keyword_searches = len(scraper_entity.subreddits) * len(scraper_entity.keywords)
-        for index in range(total_keyword_searches):
-            print("scrape word index = ",  index)
-            if ScraperService.check_whether_scraped_is_paused(scraper_entity.id):
-                return ScrapingMessage(message="scraper is paused", processed=index, total=total_keyword_searches, paused=True)
-            if scraper_entity.has_unscraped_keywords():
-                ScraperService.execute_subreddit_search_instance(scraper_entity)
-        scraper_entity.status = "completed"
-        get_scraper_repository().update(scraper_entity.id, {"status": scraper_entity.status})
-
-        return ScrapingMessage(message="successfully scraped the scraper instance on reddit", processed=index+1, total=total_keyword_searches, paused=False)
+        if scraper_entity.status != "initialized" and scraper_entity.status != "ongoing":
+            raise Exception("scraper instance does not have correct status")
+        if ScraperService.check_whether_scraped_is_paused(scraper_entity.id):
+            return ScrapingMessage(message="scraper is paused", processed=ScraperService.count_done_keyword_searches(scraper_entity), total=total_keyword_searches, paused=True)
+
+        reddit_scraper_manager = RedditAPIManager(scraper_entity.posts_per_keyword)
+        claimed_keyword_searches = ScraperService.claim_keyword_searches(scraper_entity)
+        listings_per_keyword_search = ScraperService.find_post_listings_of_keyword_searches(
+            reddit_scraper_manager,
+            claimed_keyword_searches,
+            age=scraper_entity.age,
+            filter=scraper_entity.filter)
+        failed_keyword_searches = [keyword_search for keyword_search in claimed_keyword_searches if keyword_search not in listings_per_keyword_search]
+
+        # a post that several keywords found is looked up and scraped once
+        keyword_searches_per_reddit_id: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        permalinks_per_reddit_id: Dict[str, str] = dict()
+        for keyword_search, listings in listings_per_keyword_search.items():
+            for listing in listings:
+                if keyword_search not in keyword_searches_per_reddit_id[listing.reddit_id]:
+                    keyword_searches_per_reddit_id[listing.reddit_id].append(keyword_search)
+                permalinks_per_reddit_id[listing.reddit_id] = listing.permalink
+        post_entity_ids, reddit_post_ids = ScraperService.get_posts_from_ids(list(keyword_searches_per_reddit_id))
+        existing_post_entity_ids: Dict[str, PyObjectId] = dict(zip(reddit_post_ids, post_entity_ids))
+
+        # the post ids a previous (paused) run already added are not added again
+        keyword_subreddit_searches = get_scraper_repository().find_by_id(scraper_entity.id).keyword_search_objective.keyword_subreddit_searches
+        with ScraperProgressWriter(scraper_entity.id) as progress_writer:
+            for (subreddit, keyword), listings in listings_per_keyword_search.items():
+                found_post_ids = set(keyword_subreddit_searches[subreddit].keyword_searches[keyword].found_post_ids)
+                post_entity_ids_not_yet_added = list(dict.fromkeys(
+                    existing_post_entity_ids[listing.reddit_id] for listing in listings
+                    if listing.reddit_id in existing_post_entity_ids and existing_post_entity_ids[listing.reddit_id] not in found_post_ids))
+                progress_writer.add_existing_post_ids(subreddit, keyword, post_entity_ids_not_yet_added)
+
+            def add_scraped_post(full_reddit_post: RedditPost, reddit_comments: List[RedditComment]):
+                post_entity = PostService.create_reddit_post_entity(full_reddit_post, reddit_comments)
+                progress_writer.add_post_of_keyword_searches(keyword_searches_per_reddit_id[full_reddit_post.id], post_entity)
+
+            permalinks = [permalink for reddit_id, permalink in permalinks_per_reddit_id.items() if reddit_id not in existing_post_entity_ids]
+            logger.info(f"[scrape_all_subreddits_keywords] {len(listings_per_keyword_search)} searches found {len(permalinks_per_reddit_id)} distinct posts, "
+                        f"{len(permalinks)} are new and scraped for scraper {scraper_entity.id}")
+            completed = reddit_scraper_manager.scrape_comments_of_posts(permalinks, add_scraped_post, progress_writer.is_paused)
+
+        if not completed:
+            get_scraper_repository().release_keyword_searches(scraper_entity.id, claimed_keyword_searches)
+            return ScrapingMessage(message="scraper is paused", processed=ScraperService.count_done_keyword_searches(scraper_entity), total=total_keyword_searches, paused=True)
+
+        done_keyword_searches = set(listings_per_keyword_search)
+        done_subreddits = [subreddit for subreddit, keyword_search_subreddit in keyword_subreddit_searches.items()
+                           if all(keyword_search.status == "done" or (subreddit, keyword) in done_keyword_searches
+                                  for keyword, keyword_search in keyword_search_subreddit.keyword_searches.items())]
+        get_scraper_repository().complete_keyword_searches(scraper_entity.id, list(listings_per_keyword_search), done_subreddits)
+        get_scraper_repository().release_keyword_searches(scraper_entity.id, failed_keyword_searches)
+
+        # the searches claimed by another run are completed by that run, the last run to finish completes the scraper
+        processed = ScraperService.count_done_keyword_searches(get_scraper_repository().find_by_id(scraper_entity.id))
+        if failed_keyword_searches:
+            scraper_entity.status = "error"
+            get_scraper_repository().update(scraper_entity.id, {"status": scraper_entity.status})
+            return ScrapingMessage(message=f"{len(failed_keyword_searches)} searches failed, scrape again to retry them", processed=processed, total=total_keyword_searches, paused=False)
+        if processed == total_keyword_searches:
+            scraper_entity.status = "completed"
+            get_scraper_repository().update(scraper_entity.id, {"status": scraper_entity.status})
+
+        return ScrapingMessage(message="successfully scraped the scraper instance on reddit", processed=processed, total=total_keyword_searches, paused=False)
 
     @staticmethod
     def get_all_post_ids_for_keyword_searches(scraper_entity: ScraperEntity) -> GetKeywordSearches:
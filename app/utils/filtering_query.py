@@ -0,0 +1,101 @@
+from typing import Any, Dict, List, Optional
+
+from app.database.entities.filtering_entity import FilterMisc, FilteringFields, LabelTemplateFilter
+
+
+# (field of the cluster unit, min attribute, max attribute) of the FilterMisc bounds
+_MISC_BOUNDS = [
+    ("upvotes", "min_upvotes", "max_upvotes"),
+    ("downvotes", "min_downvotes", "max_downvotes"),
+    ("depth", "min_depth", "max_depth"),
+    ("total_nested_replies", "min_total_nested_replies", "max_total_nested_replies"),
+]
+
+
+def compile_filter_misc(filter_misc: Optional[FilterMisc]) -> Dict[str, Any]:
+    """the mongodb filter on the cluster unit documents with the same result as FilteringService.apply_filtering_misc"""
+    if filter_misc is None:
+        return dict()
+
+    query: Dict[str, Any] = dict()
+    for field_name, min_attribute, max_attribute in _MISC_BOUNDS:
+        bounds = dict()
+        if getattr(filter_misc, min_attribute) is not None:
+            bounds["$gte"] = getattr(filter_misc, min_attribute)
+        if getattr(filter_misc, max_attribute) is not None:
+            bounds["$lte"] = getattr(filter_misc, max_attribute)
+        if bounds:
+            query[field_name] = bounds
+
+    created_utc_bounds = dict()
+    if filter_misc.min_date is not None:
+        created_utc_bounds["$gte"] = filter_misc.min_date.timestamp()
+    if filter_misc.max_date is not None:
+        created_utc_bounds["$lte"] = filter_misc.max_date.timestamp()
+    if created_utc_bounds:
+        query["created_utc"] = created_utc_bounds
+
+    if filter_misc.reddit_message_type in ("post", "comment"):
+        query["type"] = filter_misc.reddit_message_type
+    return query
+
+
+def compile_label_template_filter(label_template_filter: LabelTemplateFilter, value_expression: str) -> Optional[Any]:
+    """the aggregation expression of LabelTemplateFilter.verify_projection_label_field on the label value at value_expression
+    (e.g. "$$run.labels_prediction.values.<label>.value"). A missing value never matches. Returns None if the filter cannot be translated"""
+    if label_template_filter.label_type in ("boolean", "category", "string"):
+        return {"$in": [value_expression, {"$literal": list(label_template_filter.allowed_values or [])}]}
+
+    if label_template_filter.label_type in ("float", "integer"):
+        min_label_value = label_template_filter.min_label_value
+        max_label_value = label_template_filter.max_label_value
+        # with both bounds the python filter is exclusive, with a single bound inclusive
+        if min_label_value is not None and max_label_value is not None:
+            bounds = [{"$gt": [value_expression, min_label_value]}, {"$lt": [value_expression, max_label_value]}]
+        elif min_label_value is not None:
+            bounds = [{"$gte": [value_expression, min_label_value]}]
+        elif max_label_value is not None:
+            bounds = [{"$lte": [value_expression, max_label_value]}]
+        else:
+            return False
+        # missing and null sort before numbers in mongodb, so the value must be a number before it is compared
+        return {"$and": [{"$isNumber": value_expression}] + bounds}
+
+    return None
+
+
+def compile_label_filters(label_filters: Dict[str, LabelTemplateFilter], values_expression: str, operator: str) -> Optional[Any]:
+    """combines the label filters with $and / $or, the values of a run are at values_expression"""
+    expressions: List[Any] = list()
+    for label_name, label_template_filter in label_filters.items():
+        expression = compile_label_template_filter(label_template_filter, f"{values_expression}.{label_name}.value")
+        if expression is None:
+            return None
+        expressions.append(expression)
+    return {operator: expressions}
+
+
+def compile_run_filters(filtering_fields: FilteringFields, values_expression: str) -> Optional[List[Any]]:
+    """the expressions a single run must match, one for the AND filters and one for the OR filters when they are set.
+    Returns None if one of the label filters cannot be translated"""
+    run_filters: List[Any] = list()
+    if filtering_fields.label_template_filter_and:
+        and_expression = compile_label_filters(filtering_fields.label_template_filter_and, values_expression, "$and")
+        if and_expression is None:
+            return None
+        run_filters.append(and_expression)
+    if filtering_fields.label_template_filter_or:
+        or_expression = compile_label_filters(filtering_fields.label_template_filter_or, values_expression, "$or")
+        if or_expression is None:
+            return None
+        run_filters.append(or_expression)
+    return run_filters
+
+
+def embedded_runs_expression(experiment_id: str, run_filters: List[Any], min_matching_runs: int) -> Dict[str, Any]:
+    """$expr on cluster unit documents with the predictions still embedded: every run filter must match in at least min_matching_runs runs"""
+    runs_path = f"$predicted_category.{experiment_id}.predicted_categories"
+    return {"$expr": {"$and": [
+        {"$gte": [{"$size": {"$filter": {"input": {"$ifNull": [runs_path, []]}, "as": "run", "cond": run_filter}}}, min_matching_runs]}
+        for run_filter in run_filters
+    ]}}
@@ -0,0 +1,152 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.database.entities.experiment_entity import PrevelanceUnitDistribution
+
+
+# Cell codes of the packed prediction/truth arrays: code = 2 * predicted + truth
+TN_CODE, FN_CODE, FP_CODE, TP_CODE = 0, 1, 2, 3
+
+
+def pack_prediction_truth_arrays(individual_prediction_truth_label_list: List[PrevelanceUnitDistribution],
+                                 user_threshold: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """packs the individual predictions of a label into two boolean arrays (predicted, truth) and the unit of every row.
+    Uses the same rules as ExperimentService.calculate_confusion_matrix, so that the point estimate of the
+    packed arrays is exactly the confusion matrix shown to the user. Values that are not True/False are skipped.
+    A unit whose runs disagree has a row per predicted value, its rows share a unit code (0 .. n_units - 1).
+    Rows stored without unit_index are a unit of their own"""
+    value_keys = np.array([str(unit.value_key) for unit in individual_prediction_truth_label_list], dtype=object)
+    runs_predicted = np.array([unit.runs_predicted for unit in individual_prediction_truth_label_list], dtype=np.int64)
+    truth = np.array([unit.is_ground_truth for unit in individual_prediction_truth_label_list], dtype=bool)
+    # rows without unit_index get a negative key, so they never share a unit with another row
+    unit_keys = np.array([unit.unit_index if unit.unit_index is not None else -1 - position
+                          for position, unit in enumerate(individual_prediction_truth_label_list)], dtype=np.int64)
+
+    is_true_key = value_keys == str(True)
+    is_false_key = value_keys == str(False)
+    valid = is_true_key | is_false_key
+    predicted = is_true_key & (runs_predicted >= user_threshold)
+    _, units = np.unique(unit_keys[valid], return_inverse=True)
+
+    return predicted[valid], truth[valid], units.astype(np.int64)
+
+
+def confusion_counts(cell_counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """splits an (..., 4) array of cell counts into tp, fp, fn, tn"""
+    return cell_counts[..., TP_CODE], cell_counts[..., FP_CODE], cell_counts[..., FN_CODE], cell_counts[..., TN_CODE]
+
+
+def accuracy_from_counts(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray, tn: np.ndarray) -> np.ndarray:
+    """vectorized version of ConfusionMatrix.get_accuracy"""
+    total = tp + fp + fn + tn
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = (tp + tn) / total
+    return np.where(total == 0, 0.0, accuracy)
+
+
+def cohens_kappa_from_counts(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray, tn: np.ndarray) -> np.ndarray:
+    """vectorized version of ConfusionMatrix.get_cohens_kappa, works on arrays of any shape"""
+    tp, fp, fn, tn = (np.asarray(count, dtype=np.float64) for count in (tp, fp, fn, tn))
+    total = tp + fp + fn + tn
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed_agreement = (tp + tn) / total
+        expected_positive = ((tp + fn) * (tp + fp)) / total
+        expected_negative = ((tn + fp) * (tn + fn)) / total
+        expected_agreement = (expected_positive + expected_negative) / total
+        kappa = (observed_agreement - expected_agreement) / (1 - expected_agreement)
+
+    kappa = np.where(expected_agreement == 1, np.where(observed_agreement == 1, 1.0, 0.0), kappa)
+    return np.where(total == 0, 0.0, kappa)
+
+
+def bootstrap_accuracy_kappa(predicted: np.ndarray,
+                             truth: np.ndarray,
+                             units: Optional[np.ndarray] = None,
+                             n_resamples: int = 2000,
+                             confidence_level: float = 0.95,
+                             batch_size: int = 500,
+                             seed: Optional[int] = 0) -> Dict[str, Dict[str, float]]:
+    """bootstraps the accuracy and cohens kappa over the units: a drawn unit brings all of its rows (units are the unit codes
+    of pack_prediction_truth_arrays, every row is a unit of its own if None), so the interval keeps the correlation of the rows of a unit.
+    Each batch of resamples is a single matrix operation: an index matrix of (batch_size, n_units) is drawn, counted per resample
+    with one bincount and multiplied with the confusion cells of every unit. Returns the point estimate and the percentile interval for both metrics"""
+    cell_codes = predicted.astype(np.int64) * 2 + truth.astype(np.int64)
+    if units is None:
+        units = np.arange(cell_codes.shape[0])
+    _, units = np.unique(units, return_inverse=True)
+    n_units = int(units.max()) + 1 if units.size else 0
+    unit_cell_counts = np.bincount(units * 4 + cell_codes, minlength=n_units * 4).reshape(n_units, 4).astype(np.float64)
+    point_counts = np.bincount(cell_codes, minlength=4)
+    point_accuracy = float(accuracy_from_counts(*confusion_counts(point_counts)))
+    point_kappa = float(cohens_kappa_from_counts(*confusion_counts(point_counts)))
+
+    if n_units == 0 or n_resamples <= 0:
+        return {
+            "accuracy": {"estimate": point_accuracy, "lower": point_accuracy, "upper": point_accuracy},
+            "kappa": {"estimate": point_kappa, "lower": point_kappa, "upper": point_kappa},
+        }
+
+    rng = np.random.default_rng(seed)
+    accuracies = np.empty(n_resamples, dtype=np.float64)
+    kappas = np.empty(n_resamples, dtype=np.float64)
+    for batch_start in range(0, n_resamples, batch_size):
+        current_batch_size = min(batch_size, n_resamples - batch_start)
+        resample_indices = rng.integers(0, n_units, size=(current_batch_size, n_units))
+        # offset every row by n_units so one flat bincount gives how often each resample drew each unit
+        row_offsets = (np.arange(current_batch_size) * n_units)[:, None]
+        draw_counts = np.bincount((resample_indices + row_offsets).ravel(),
+                                  minlength=current_batch_size * n_units).reshape(current_batch_size, n_units)
+        cell_counts = draw_counts @ unit_cell_counts
+        tp, fp, fn, tn = confusion_counts(cell_counts)
+        accuracies[batch_start:batch_start + current_batch_size] = accuracy_from_counts(tp, fp, fn, tn)
+        kappas[batch_start:batch_start + current_batch_size] = cohens_kappa_from_counts(tp, fp, fn, tn)
+
+    alpha = (1 - confidence_level) / 2
+    accuracy_lower, accuracy_upper = np.quantile(accuracies, [alpha, 1 - alpha])
+    kappa_lower, kappa_upper = np.quantile(kappas, [alpha, 1 - alpha])
+    return {
+        "accuracy": {"estimate": point_accuracy, "lower": float(accuracy_lower), "upper": float(accuracy_upper)},
+        "kappa": {"estimate": point_kappa, "lower": float(kappa_lower), "upper": float(kappa_upper)},
+    }
+
+
+def bootstrap_label_worker(arguments: Tuple[str, np.ndarray, np.ndarray, np.ndarray, int, float, Optional[int]]) -> Tuple[str, Dict[str, Dict[str, float]]]:
+    """top level function so that it can be pickled to a process pool. Bootstraps a single label"""
+    label_name, predicted, truth, units, n_resamples, confidence_level, seed = arguments
+    return label_name, bootstrap_accuracy_kappa(predicted=predicted,
+                                                truth=truth,
+                                                units=units,
+                                                n_resamples=n_resamples,
+                                                confidence_level=confidence_level,
+                                                seed=seed)
+
+
+def pairwise_agreement_tensor(predicted: np.ndarray, available: np.ndarray) -> Dict[str, np.ndarray]:
+    """computes the pairwise agreement between N experiments for L labels over U shared units.
+    predicted and available are (N, L, U) boolean arrays, available marks whether the experiment has a prediction for that unit/label.
+    All four cells of the 2x2 table of every pair are computed with one einsum each, resulting in (N, N, L) arrays.
+    n_10 is the number of units where experiment i predicts True and experiment j predicts False (McNemar b), n_01 the reverse (McNemar c)"""
+    positive = (predicted & available).astype(np.int64)
+    negative = (~predicted & available).astype(np.int64)
+
+    n_11 = np.einsum("ilu,jlu->ijl", positive, positive)
+    n_10 = np.einsum("ilu,jlu->ijl", positive, negative)
+    n_01 = np.einsum("ilu,jlu->ijl", negative, positive)
+    n_00 = np.einsum("ilu,jlu->ijl", negative, negative)
+    compared = n_11 + n_10 + n_01 + n_00
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent_agreement = np.where(compared == 0, np.nan, (n_11 + n_00) / compared)
+        discordant = n_10 + n_01
+        mcnemar_statistic = np.where(discordant == 0, 0.0, (n_10 - n_01) ** 2 / discordant)
+    kappa = np.where(compared == 0, np.nan, cohens_kappa_from_counts(tp=n_11, fp=n_10, fn=n_01, tn=n_00))
+
+    return {
+        "compared_unit_count": compared,
+        "percent_agreement": percent_agreement,
+        "kappa": kappa,
+        "mcnemar_b": n_10,
+        "mcnemar_c": n_01,
+        "mcnemar_statistic": mcnemar_statistic,
+    }
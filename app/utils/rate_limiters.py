@@ -1,8 +1,9 @@
 # app/utils/rate_limiter.py
 import asyncio
+import threading
 import time
 from collections import deque
-from typing import Dict, Optional
+from typing import Dict, Mapping, Optional
 from dataclasses import dataclass
 
 from app.utils.logging_config import get_logger
@@ -183,6 +184,112 @@ class OpenRouterRateLimiter:
         }
     
 
+class RedditRateLimitGovernor:
+    """
+    Paces the requests to the reddit OAuth API on the rate limit headers of its responses, shared by all coroutines of a client id.
+    Reddit returns the requests left in the current window (X-Ratelimit-Remaining) and the seconds until the window resets
+    (X-Ratelimit-Reset). A request is let through as long as the remaining requests minus the requests in flight stay above
+    reserve, after that the requests wait for the reset. So we use the whole quota of a window, but never go above it.
+    Until the first response of a window is seen, at most unknown_window_concurrency requests are in flight.
+    One governor is shared by every thread of the process (each flask request runs its own event loop with asyncio.run),
+    so the counters are read and updated under a threading.Lock, which is never held while waiting
+    """
+    _governors: Dict[str, "RedditRateLimitGovernor"] = {}
+    _governors_lock = threading.Lock()
+
+    def __init__(self, reserve: int = 2, unknown_window_concurrency: int = 4, poll_seconds: float = 0.05):
+        self.reserve = reserve
+        self.unknown_window_concurrency = unknown_window_concurrency
+        self.poll_seconds = poll_seconds
+        self.remaining: Optional[float] = None
+        self.reset_at: Optional[float] = None # time.monotonic() of the reset of the current window
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.total_requests = 0
+        self.throttled_count = 0
+        self.rate_limited_count = 0
+        self.total_wait_time = 0.0
+
+    @classmethod
+    def get_governor(cls, client_id: str) -> "RedditRateLimitGovernor":
+        """the quota of reddit is per OAuth client, so is the governor"""
+        with cls._governors_lock:
+            if client_id not in cls._governors:
+                cls._governors[client_id] = cls()
+            return cls._governors[client_id]
+
+    def _wait_seconds(self, now: float) -> float:
+        """0 if a request may start now, otherwise how long to wait before trying again"""
+        if self.reset_at is not None and now >= self.reset_at:
+            # a new window started, its quota is unknown until the next response
+            self.remaining = None
+            self.reset_at = None
+
+        if self.remaining is None:
+            return 0 if self.in_flight < self.unknown_window_concurrency else self.poll_seconds
+        if self.remaining - self.in_flight > self.reserve:
+            return 0
+        if self.reset_at is None:
+            return self.poll_seconds
+        return max(self.reset_at - now, self.poll_seconds)
+
+    async def acquire(self) -> float:
+        """waits until a request may be sent, the caller must call release with the response headers afterwards. Returns the waited seconds"""
+        start_time = time.monotonic()
+        throttled = False
+        while True:
+            with self._lock:
+                wait_seconds = self._wait_seconds(time.monotonic())
+                if wait_seconds <= 0:
+                    self.in_flight += 1
+                    self.total_requests += 1
+                    waited = time.monotonic() - start_time
+                    if throttled:
+                        self.throttled_count += 1
+                        self.total_wait_time += waited
+                    return waited
+            throttled = True
+            await asyncio.sleep(wait_seconds)
+
+    def release(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        """the request is done, the rate limit headers of its response update the quota of the window"""
+        remaining = headers.get("x-ratelimit-remaining") if headers else None
+        reset = headers.get("x-ratelimit-reset") if headers else None
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if remaining is None or reset is None:
+                return
+            reset_at = time.monotonic() + float(reset)
+            if self.reset_at is None or reset_at > self.reset_at + 1:
+                # the first response of a new window
+                self.remaining = float(remaining)
+            else:
+                # responses of the same window can arrive out of order, the lowest remaining is the latest
+                self.remaining = min(self.remaining if self.remaining is not None else float(remaining), float(remaining))
+            self.reset_at = reset_at
+
+    def rate_limited(self, retry_after_seconds: float) -> None:
+        """a 429 response: nothing is sent until the window resets"""
+        with self._lock:
+            self.rate_limited_count += 1
+            self.remaining = 0
+            self.reset_at = time.monotonic() + retry_after_seconds
+        logger.warning(f"Reddit rate limit hit. Waiting {retry_after_seconds:.1f}s until the window resets")
+
+    def get_metrics(self) -> Dict:
+        """Get current metrics"""
+        return {
+            'total_requests': self.total_requests,
+            'throttled_count': self.throttled_count,
+            'rate_limited_count': self.rate_limited_count,
+            'avg_wait_time': self.total_wait_time / max(1, self.total_requests),
+            'remaining': self.remaining,
+            'in_flight': self.in_flight,
+        }
+
+
 
 import backoff
 import re
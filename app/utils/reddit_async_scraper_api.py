@@ -0,0 +1,121 @@
+# utils/reddit_async_scraper_api.py
+import asyncio
+import os
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+import httpx
+
+from app.responses.reddit_post_comments_response import RedditComment, RedditPost, RedditResponse
+from app.utils.logging_config import get_logger
+from app.utils.rate_limiters import RedditRateLimitGovernor
+from app.utils.reddit_scraper_api import MoreCommentsExpander, RedditScraperAPI
+from app.utils.reddit_token_provider import RedditTokenProvider
+
+
+logger = get_logger(__name__)
+
+
+class AsyncRedditScraperAPI:
+    """async counterpart of RedditScraperAPI for fetching many comment trees at once.
+    All requests go through one pooled httpx.AsyncClient (keep-alive connections, at most max_connections open) and through the
+    RedditRateLimitGovernor of the OAuth client, which spends the quota of the rate limit window the responses report instead of sleeping a fixed time.
+    The 'more' stubs of a comment tree are expanded by the MoreCommentsExpander, in concurrent batches.
+    Use as an async context manager, the bearer token comes from the token provider that RedditScraperAPI shares"""
+    def __init__(self,
+                 token_provider: RedditTokenProvider,
+                 max_connections: Optional[int] = None,
+                 governor: Optional[RedditRateLimitGovernor] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.token_provider = token_provider
+        self.base_url = os.getenv("REDDIT_OAUTH_BASE_URL", "https://oauth.reddit.com")
+        self.max_connections = max_connections or int(os.getenv("REDDIT_SCRAPER_CONCURRENCY", "8"))
+        self.governor = governor or RedditRateLimitGovernor.get_governor(os.getenv("CLIENT_ID") or "default")
+        self.transport = transport # only set to replace the network, e.g. httpx.MockTransport
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "AsyncRedditScraperAPI":
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(30.0),
+            transport=self.transport)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.client.aclose()
+        self.client = None
+
+    async def _get_headers(self) -> Dict[str, str]:
+        # requesting a new token blocks, so it is done in a thread instead of in the event loop
+        if self.token_provider.needs_refresh():
+            return await asyncio.to_thread(self.token_provider.get_headers)
+        return self.token_provider.get_headers()
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None, max_attempts: int = 3) -> Any:
+        """a GET within the rate limit, a 429 response waits for the window to reset and is retried, at most max_attempts requests in total.
+        A 401 response invalidates the token and is retried once with a new token, this retry is not one of the max_attempts"""
+        token_retried = False
+        attempt = 0
+        while True:
+            headers = await self._get_headers()
+            await self.governor.acquire()
+            response_headers = None
+            try:
+                response = await self.client.get(path, params=params, headers=headers)
+                response_headers = response.headers
+            finally:
+                self.governor.release(response_headers)
+
+            if response.status_code == 401 and not token_retried:
+                token_retried = True
+                self.token_provider.invalidate(headers)
+                continue
+            if response.status_code == 429 and attempt < max_attempts - 1:
+                attempt += 1
+                retry_after = response.headers.get("retry-after") or response.headers.get("x-ratelimit-reset") or "1"
+                self.governor.rate_limited(float(retry_after))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def search(self,
+                     subreddit: str,
+                     query: str,
+                     age: Literal["hour", "day", "week", "month", "year", "all"] = "all",
+                     limit= 25,
+                     filter: Literal["new", "hot", "top", "rising"] = "top"
+                     ) -> List[RedditPost]:
+        """see RedditScraperAPI.search"""
+        params = {
+            "q": query,
+            "restrict_sr": 1,
+            "limit": limit,
+            "sort": filter,
+            "t": age,
+            "type": "link",
+        }
+        data = await self._get(f"/r/{subreddit}/search", params=params)
+        return RedditResponse.model_validate(data).get_posts()
+
+    async def get_post_comments(self, permalink: str) -> Tuple[RedditPost, List[RedditComment]]:
+        """retrieves the post and its whole comment tree, with the 'more' placeholders replaced by their comments"""
+        permalink = permalink.lstrip('/')
+        response_data = await self._get(f"/{permalink}", params={'raw_json': 1, 'limit': 100})
+        full_post = RedditResponse.model_validate(response_data[0]).get_posts()[0]
+        comments_response = RedditResponse.model_validate(response_data[1])
+        link_id = RedditScraperAPI._extract_link_id(permalink)
+        expander = MoreCommentsExpander(lambda comment_ids: self._fetch_more_things(comment_ids, link_id), max_concurrency=self.max_connections)
+        comments = await expander.expand(comments_response.data.children)
+        return full_post, comments
+
+    async def _fetch_more_things(self, comment_ids: List[str], link_id: str, limit: int = 100) -> List[dict]:
+        """the raw things of the comment ids from the /api/morechildren endpoint"""
+        params = {
+            'api_type': 'json',
+            'children': ','.join(comment_ids),
+            'link_id': link_id,
+            'limit': limit,
+            'sort': 'best'
+        }
+        data = await self._get("/api/morechildren", params=params)
+        return data.get('json', {}).get('data', {}).get('things', [])
@@ -1,46 +1,48 @@
 # utils/reddit_scraper_api.py
 from __future__ import annotations # needed so that we can use the nested structure of replies
 from enum import Enum
+import asyncio
 import json
 import os
-import time
 from pydantic import BaseModel
 import requests
-from typing import List, Literal, Optional, Tuple
+from typing import Awaitable, Callable, Dict, List, Literal, Optional, Tuple
 from dotenv import load_dotenv
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from app.responses.reddit_post_comments_response import RedditComment, RedditPost, RedditResponse
+from app.responses.reddit_post_comments_response import RedditChild, RedditComment, RedditCommentChild, RedditDataResponse, RedditPost, RedditResponse
+from app.utils.logging_config import get_logger
+from app.utils.reddit_token_provider import RedditTokenProvider
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
 
 
 class RedditScraperAPI:
     """The system that calls the reddit API with the correct information"""
-    def __init__(self):
-        REDDIT_SECRET_KEY = os.getenv("REDDIT_SECRET_KEY")
-        CLIENT_ID = os.getenv("CLIENT_ID")
-        
-        self.auth = requests.auth.HTTPBasicAuth(CLIENT_ID,REDDIT_SECRET_KEY)
-        self.headers = self.get_requests_headers_bearer()
-    
+    def __init__(self, token_provider: Optional[RedditTokenProvider] = None):
+        # the bearer token is cached and refreshed by the provider that all scrapers of the process share
+        self.token_provider = token_provider or RedditTokenProvider.get_provider()
+        self.base_url = os.getenv("REDDIT_OAUTH_BASE_URL", "https://oauth.reddit.com")
+
+    @property
+    def headers(self):
+        return self.token_provider.get_headers()
+
     def get_requests_headers_bearer(self):
-        login_data = {
-            'grant_type' : 'password',
-            'username' : os.getenv("REDDIT_USERNAME"),
-            'password' : os.getenv("REDDIT_PASSWORD")
-        }
-        headers = {'User-Agent': 'DeafHHApp/0.0.1'}
-        REDDIT_SECRET_KEY = os.getenv("REDDIT_SECRET_KEY")
-        CLIENT_ID = os.getenv("CLIENT_ID")
-        auth = requests.auth.HTTPBasicAuth(CLIENT_ID,REDDIT_SECRET_KEY)
-        response = requests.post('https://www.reddit.com/api/v1/access_token',auth=auth,data=login_data, headers=headers)
-        
-        print("response = \n", response.json())
-        token = response.json()['access_token']
-        headers = {**headers, **{'Authorization': f'bearer {token}'}}
-        return headers        
+        return self.token_provider.get_headers()
+
+    def _get(self, url: str, params: Optional[dict] = None) -> requests.Response:
+        """a GET with the bearer token, a 401 response invalidates the token and is retried once with a new token.
+        The response of the retry is returned as it is, also when it is a 401 again"""
+        headers = self.headers
+        response = requests.get(url, headers=headers, params=params)
+        if response.status_code == 401:
+            self.token_provider.invalidate(headers)
+            response = requests.get(url, headers=self.headers, params=params)
+        return response
 
 
     def search(self, 
@@ -61,7 +63,7 @@ class RedditScraperAPI:
         ---
         Search posts in a subreddit using Reddit's OAuth API.
         """
-        url = f"https://oauth.reddit.com/r/{subreddit}/search"
+        url = f"{self.base_url}/r/{subreddit}/search"
         params = {
             "q": query,          # the actual search query
             "restrict_sr": 1,    # search within this subreddit only
@@ -71,7 +73,7 @@ class RedditScraperAPI:
             "type": "link",      # optional: only posts (exclude comments)
         }
 
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self._get(url, params=params)
         response.raise_for_status()  # surface HTTP errors early
 
         data = response.json()
@@ -81,146 +83,39 @@ class RedditScraperAPI:
         # Remove leading slash if present
         if permalink.startswith('/'):
             permalink = permalink[1:]
-        response = requests.get(f"https://oauth.reddit.com/{permalink}?raw_json=1", headers=self.headers, params={'limit': 100})
+        response = self._get(f"{self.base_url}/{permalink}", params={'raw_json': 1, 'limit': 100})
         response.raise_for_status()
         response_data = response.json()
         full_submission_post =  response_data[0] # this is the post of the permalink that is connected to it, it is exactly the same as the post
-        with open("data/comments_result_full_submission_post.json", "w") as f:
-            f.write(json.dumps(full_submission_post, indent=4))
         full_post = RedditResponse.model_validate(full_submission_post).get_posts()[0]
         comments_data = response_data[1]
-        print(f"Fetching comments for permalink: {permalink}")
-        print(comments_data.keys())
-        with open("data/comments_result.json", "w") as f:
-            f.write(json.dumps(comments_data, indent=4))
-        
-        
-        
-         # Parse comments and handle 'more' recursively
-        comments = self._process_comments_recursively(comments_data, permalink)
-        #return RedditResponse.model_validate(comments).get_comments()
+
+        # Parse comments and replace the 'more' stubs by their comments
+        comments = self._expand_comments(comments_data, permalink)
         return full_post, comments
-    def _fetch_more_comments(self, comment_ids: List[str], base_permalink: str, 
-                           parent_id: str = None, limit: int = 100) -> List[RedditComment]:
-        """
-        Fetch additional comments using the /api/morechildren endpoint.
-        """
-        if not comment_ids:
-            return []
-        
-        # Reddit API has a limit on how many IDs can be fetched at once
-        batch_size = 100
-        all_comments = []
-        
-        for i in range(0, len(comment_ids), batch_size):
-            batch_ids = comment_ids[i:i + batch_size]
-            
-            # Use the morechildren API endpoint
-            url = "https://oauth.reddit.com/api/morechildren"
-            params = {
-                'api_type': 'json',
-                'children': ','.join(batch_ids),
-                'link_id': self._extract_link_id(base_permalink),
-                'limit': limit,
-                'sort': 'best'
-            }
-            
-            try:
-                response = requests.get(url, headers=self.headers, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
-                if 'json' in data and 'data' in data['json']:
-                    things = data['json']['data'].get('things', [])
-                    
-                    for thing in things:
-                        if thing['kind'] == 't1':  # Comment
-                            comment_data = thing['data']
-                            # Convert the raw data to RedditComment
-                            comment = self._raw_to_comment(comment_data)
-                            
-                            # Process nested replies if they exist
-                            if 'replies' in comment_data and comment_data['replies']:
-                                if isinstance(comment_data['replies'], dict):
-                                    comment.replies = self._process_replies(
-                                        RedditResponse.model_validate(comment_data['replies']),
-                                        base_permalink
-                                    )
-                            
-                            all_comments.append(comment)
-                
-                # Add small delay to avoid rate limiting
-                time.sleep(0.5)
-                
-            except Exception as e:
-                print(f"Error fetching more comments: {e}")
-                continue
-        
-        return all_comments
 
-    def _process_comments_recursively(self, comments_data: dict, base_permalink: str) -> List[RedditComment]:
-        """
-        Process comments data and handle 'more' comments by drilling down.
-        """
-        reddit_response = RedditResponse.model_validate(comments_data)
-        processed_comments = []
-
-        for child in reddit_response.data.children:
-            if child.kind == "t1":  # Regular comment
-                comment = child.data
-                # Process replies recursively if they exist
-                if comment.replies and not isinstance(comment.replies, str):
-                    comment.replies = self._process_replies(comment.replies, base_permalink)
-                processed_comments.append(comment)
-                
-            elif child.kind == "more":  # More comments to load
-                more_data = child.data
-                # Fetch the additional comments
-                more_comments = self._fetch_more_comments(
-                    more_data.children, 
-                    base_permalink,
-                    more_data.parent_id
-                )
-                processed_comments.extend(more_comments)
-        
-        return processed_comments
-    
-    def _process_replies(self, replies_response: RedditResponse, base_permalink: str) -> RedditResponse:
-        """
-        Process nested replies, handling 'more' comments within reply chains.
-        """
-        processed_children = []
-        
-        for child in replies_response.data.children:
-            if child.kind == "t1":  # Regular comment
-                comment = child.data
-                # Recursively process nested replies
-                if comment.replies and not isinstance(comment.replies, str):
-                    comment.replies = self._process_replies(comment.replies, base_permalink)
-                processed_children.append(child)
-                
-            elif child.kind == "more":  # More replies to load
-                more_data = child.data
-                # Fetch additional replies
-                more_comments = self._fetch_more_comments(
-                    more_data.children,
-                    base_permalink, 
-                    more_data.parent_id
-                )
-                # Convert comments to child format for consistency
-                for comment in more_comments:
-                    processed_children.append(
-                        type('obj', (object,), {
-                            'kind': 't1',
-                            'data': comment
-                        })()
-                    )
-        
-        # Update the response with processed children
-        replies_response.data.children = processed_children
-        return replies_response
+    def _expand_comments(self, comments_data: dict, base_permalink: str) -> List[RedditComment]:
+        """the comment tree with all 'more' stubs expanded, the morechildren batches are fetched concurrently in threads"""
+        link_id = self._extract_link_id(base_permalink)
+        expander = MoreCommentsExpander(lambda comment_ids: asyncio.to_thread(self._fetch_more_things, comment_ids, link_id))
+        return asyncio.run(expander.expand(RedditResponse.model_validate(comments_data).data.children))
+
+    def _fetch_more_things(self, comment_ids: List[str], link_id: str, limit: int = 100) -> List[dict]:
+        """the raw things of the comment ids from the /api/morechildren endpoint"""
+        params = {
+            'api_type': 'json',
+            'children': ','.join(comment_ids),
+            'link_id': link_id,
+            'limit': limit,
+            'sort': 'best'
+        }
+        response = self._get(f"{self.base_url}/api/morechildren", params=params)
+        response.raise_for_status()
+        data = response.json()
+        return data.get('json', {}).get('data', {}).get('things', [])
 
-    def _extract_link_id(self, permalink: str) -> str:
+    @staticmethod
+    def _extract_link_id(permalink: str) -> str:
         """
         Extract the link ID (post ID) from a permalink.
         Example: '/r/deaf/comments/1mg82a6/...' -> 't3_1mg82a6'
@@ -231,7 +126,8 @@ class RedditScraperAPI:
                 return f"t3_{parts[i + 1]}" # TODO I am not sure about the t3 part here
         return ""
     
-    def _raw_to_comment(self, data: dict) -> RedditComment:
+    @staticmethod
+    def _raw_to_comment(data: dict) -> RedditComment:
         """
         Convert raw comment data from API to RedditComment model.
         """
@@ -259,6 +155,106 @@ class RedditScraperAPI:
         return full_post, comments
 
 
+class MoreCommentsExpander:
+    """
+    Replaces the 'more' stubs of a comment tree by the comments they stand for, in three phases instead of a request per stub:
+    1. collects the comment ids of all 'more' stubs in the whole tree (and removes the stubs),
+    2. fetches the ids in batches of batch_size (the maximum of /api/morechildren) with at most max_concurrency batches at a time,
+    3. splices the fetched comments into the replies of their parent_id in a single pass over the results.
+    /api/morechildren returns the comments flat and parents before their replies, and can return 'more' stubs of its own,
+    so the phases repeat for those until no stubs are left (at most max_rounds times).
+    fetch_things returns the raw 'things' of a batch of ids, a batch that raises is logged and skipped
+    """
+    def __init__(self,
+                 fetch_things: Callable[[List[str]], Awaitable[List[dict]]],
+                 batch_size: int = 100,
+                 max_concurrency: int = 4,
+                 max_rounds: int = 10):
+        self.fetch_things = fetch_things
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_rounds = max_rounds
+
+    async def expand(self, children: List[RedditChild]) -> List[RedditComment]:
+        """the top level comments of children, with every 'more' stub in the tree replaced by its comments"""
+        comments_by_name: Dict[str, RedditComment] = dict()
+        more_ids: List[str] = list()
+        comments = [child.data for child in self._collect(children, comments_by_name, more_ids)]
+
+        for _ in range(self.max_rounds):
+            if not more_ids:
+                break
+            things = await self._fetch_all(more_ids)
+            more_ids = self._splice(things, comments, comments_by_name)
+        if more_ids:
+            logger.warning(f"[expand] {len(more_ids)} more comments were not expanded after {self.max_rounds} rounds")
+        return comments
+
+    def _collect(self, children: List[RedditChild], comments_by_name: Dict[str, RedditComment], more_ids: List[str]) -> List[RedditCommentChild]:
+        """indexes the comments of children and their replies by fullname and strips the 'more' stubs into more_ids. Returns the comment children"""
+        comment_children = self._strip_more_stubs(children, more_ids)
+        # iterative walk, so deep threads do not hit the recursion limit
+        stack = list(comment_children)
+        while stack:
+            comment = stack.pop().data
+            comments_by_name[f"t1_{comment.id}"] = comment
+            if comment.replies and not isinstance(comment.replies, str):
+                comment.replies.data.children = self._strip_more_stubs(comment.replies.data.children, more_ids)
+                stack.extend(comment.replies.data.children)
+        return comment_children
+
+    @staticmethod
+    def _strip_more_stubs(children: List[RedditChild], more_ids: List[str]) -> List[RedditCommentChild]:
+        comment_children = list()
+        for child in children:
+            if child.kind == "more":
+                # a 'continue this thread' stub has no children, its comments come with the stubs of their siblings
+                more_ids.extend(child.data.children)
+            elif child.kind == "t1":
+                comment_children.append(child)
+        return comment_children
+
+    async def _fetch_all(self, comment_ids: List[str]) -> List[dict]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_batch(batch_ids: List[str]) -> List[dict]:
+            async with semaphore:
+                try:
+                    return await self.fetch_things(batch_ids)
+                except Exception as e:
+                    logger.exception(f"[_fetch_all] Error fetching more comments: {e}")
+                    return []
+
+        batches = await asyncio.gather(*(fetch_batch(comment_ids[i:i + self.batch_size]) for i in range(0, len(comment_ids), self.batch_size)))
+        return [thing for batch in batches for thing in batch]
+
+    def _splice(self, things: List[dict], comments: List[RedditComment], comments_by_name: Dict[str, RedditComment]) -> List[str]:
+        """adds the fetched comments to the replies of their parent, or to comments for a reply to the post. Returns the ids of the new 'more' stubs"""
+        more_ids: List[str] = list()
+        for thing in things:
+            if thing['kind'] == 'more':
+                more_ids.extend(thing['data'].get('children', []))
+                continue
+            if thing['kind'] != 't1':
+                continue
+            comment_data = thing['data']
+            comment = RedditScraperAPI._raw_to_comment({**comment_data, 'replies': ''})
+            comments_by_name[f"t1_{comment.id}"] = comment
+            if isinstance(comment_data.get('replies'), dict):
+                replies = RedditResponse.model_validate(comment_data['replies'])
+                replies.data.children = self._collect(replies.data.children, comments_by_name, more_ids)
+                comment.replies = replies
+
+            parent_comment = comments_by_name.get(comment_data.get('parent_id', ''))
+            if parent_comment is None:
+                comments.append(comment)
+                continue
+            if not parent_comment.replies or isinstance(parent_comment.replies, str):
+                parent_comment.replies = RedditResponse(kind="Listing", data=RedditDataResponse(after=None, dist=None, modhash=None, before=None, children=[]))
+            parent_comment.replies.data.children.append(RedditCommentChild(kind="t1", data=comment))
+        return more_ids
+
+
 class RedditAPIManager:
     """This class manages to send all of the searches that need to be searched in the subreddit. It also makes sure to limit the number of responses send
     
@@ -288,6 +284,39 @@ class RedditAPIManager:
                                     filter=filter)
         return reddit_posts
     
+    def find_related_posts_to_keywords(
+            self,
+            keyword_searches: List[Tuple[str, str]],
+            age: Literal["hour", "day", "week", "month", "year", "all"] = "all",
+            filter: Literal["new", "hot", "top", "rising"] = "top") -> Dict[Tuple[str, str], List[RedditPost]]:
+        """runs the (subreddit, keyword) searches concurrently with the async scraper, at most REDDIT_SCRAPER_CONCURRENCY at a time,
+        under the rate limit governor that the comment scraping shares. A search that fails is logged and left out of the result"""
+        return asyncio.run(self._find_related_posts_to_keywords(keyword_searches, age, filter))
+
+    async def _find_related_posts_to_keywords(self,
+                                              keyword_searches: List[Tuple[str, str]],
+                                              age: Literal["hour", "day", "week", "month", "year", "all"],
+                                              filter: Literal["new", "hot", "top", "rising"]) -> Dict[Tuple[str, str], List[RedditPost]]:
+        from app.utils.reddit_async_scraper_api import AsyncRedditScraperAPI
+
+        concurrency = int(os.getenv("REDDIT_SCRAPER_CONCURRENCY", "8"))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async with AsyncRedditScraperAPI(self.scraper.token_provider, max_connections=concurrency) as async_scraper:
+            async def search(subreddit: str, keyword: str) -> List[RedditPost]:
+                async with semaphore:
+                    return await async_scraper.search(subreddit=subreddit, query=keyword, age=age, limit=self.number_posts_per_keyword, filter=filter)
+
+            results = await asyncio.gather(*(search(subreddit, keyword) for subreddit, keyword in keyword_searches), return_exceptions=True)
+
+        reddit_posts_per_keyword_search: Dict[Tuple[str, str], List[RedditPost]] = dict()
+        for keyword_search, result in zip(keyword_searches, results):
+            if isinstance(result, Exception):
+                logger.error(f"[find_related_posts_to_keywords] Error searching keyword={keyword_search[1]} in subreddit={keyword_search[0]}: {result}", exc_info=result)
+                continue
+            reddit_posts_per_keyword_search[keyword_search] = result
+        return reddit_posts_per_keyword_search
+
     def get_comments_drilled_down(self, reddit_comments: List[RedditComment]):
         """the api of reddit, drills up the comments that have a high depth. 
         So we have to re exucte the search for these comments"""
@@ -303,6 +332,48 @@ class RedditAPIManager:
 
         return full_post, comments
 
+    def scrape_comments_of_posts(self,
+                                 permalinks: List[str],
+                                 on_post_scraped: Callable[[RedditPost, List[RedditComment]], None],
+                                 should_stop: Callable[[], bool] = lambda: False) -> bool:
+        """scrapes the comments of the posts concurrently with the async scraper, at most REDDIT_SCRAPER_CONCURRENCY posts at a time.
+        on_post_scraped is called with every post and its comments as soon as they are scraped (in the order they complete).
+        A post that fails is logged and skipped. Returns False when should_stop returned True and the scraping stopped early"""
+        return asyncio.run(self._scrape_comments_of_posts(permalinks, on_post_scraped, should_stop))
+
+    async def _scrape_comments_of_posts(self,
+                                        permalinks: List[str],
+                                        on_post_scraped: Callable[[RedditPost, List[RedditComment]], None],
+                                        should_stop: Callable[[], bool]) -> bool:
+        from app.utils.reddit_async_scraper_api import AsyncRedditScraperAPI
+
+        if should_stop():
+            return False
+        concurrency = int(os.getenv("REDDIT_SCRAPER_CONCURRENCY", "8"))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async with AsyncRedditScraperAPI(self.scraper.token_provider, max_connections=concurrency) as async_scraper:
+            async def scrape(permalink: str):
+                async with semaphore:
+                    return await async_scraper.get_post_comments(permalink)
+
+            tasks = [asyncio.create_task(scrape(permalink)) for permalink in permalinks]
+            try:
+                for next_completed in asyncio.as_completed(tasks):
+                    try:
+                        full_post, comments = await next_completed
+                    except Exception as e:
+                        logger.exception(f"[scrape_comments_of_posts] Error scraping the comments of a post: {e}")
+                        continue
+                    on_post_scraped(full_post, comments)
+                    if should_stop():
+                        return False
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return True
+
 if __name__ == "__main__":
 
     redditScaper= RedditScraperAPI()
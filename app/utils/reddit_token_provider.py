@@ -0,0 +1,94 @@
+# utils/reddit_token_provider.py
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from app.utils.logging_config import get_logger
+
+
+logger = get_logger(__name__)
+
+REDDIT_USER_AGENT = 'DeafHHApp/0.0.1'
+
+
+class RedditTokenProvider:
+    """
+    Process-wide cache of the OAuth bearer token of reddit, shared by every RedditScraperAPI and AsyncRedditScraperAPI of the same account.
+    The token is requested with the password grant on first use and requested again refresh_margin_seconds before its expires_in runs out,
+    so a long scrape never sends an expired token. A 401 response means the token was revoked early: the caller invalidates it and retries once.
+    Thread safe, the flask request threads share the providers.
+    """
+    _providers: Dict[Tuple[str, str], "RedditTokenProvider"] = {}
+    _providers_lock = threading.Lock()
+
+    def __init__(self,
+                 client_id: Optional[str],
+                 secret_key: Optional[str],
+                 username: Optional[str],
+                 password: Optional[str],
+                 refresh_margin_seconds: float = 60.0):
+        self.client_id = client_id
+        self.secret_key = secret_key
+        self.username = username
+        self.password = password
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.token_url = f"{os.getenv('REDDIT_WWW_BASE_URL', 'https://www.reddit.com')}/api/v1/access_token"
+
+        self._token: Optional[str] = None
+        self._expires_at: float = 0.0 # time.monotonic() at which the token expires
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.token_requests = 0
+
+    @classmethod
+    def get_provider(cls) -> "RedditTokenProvider":
+        """the provider of the reddit account of the environment variables"""
+        client_id, username = os.getenv("CLIENT_ID"), os.getenv("REDDIT_USERNAME")
+        with cls._providers_lock:
+            if (client_id, username) not in cls._providers:
+                cls._providers[(client_id, username)] = cls(client_id, os.getenv("REDDIT_SECRET_KEY"), username, os.getenv("REDDIT_PASSWORD"))
+            return cls._providers[(client_id, username)]
+
+    def needs_refresh(self) -> bool:
+        return self._token is None or time.monotonic() >= self._expires_at - self.refresh_margin_seconds
+
+    def get_token(self) -> str:
+        """the cached token, a new one is requested when there is none or it expires within refresh_margin_seconds"""
+        with self._lock:
+            if self.needs_refresh():
+                self._token, self._expires_at = self._request_token()
+            return self._token
+
+    def get_headers(self) -> Dict[str, str]:
+        return {'User-Agent': REDDIT_USER_AGENT, 'Authorization': f'bearer {self.get_token()}'}
+
+    def invalidate(self, headers: Dict[str, str]) -> None:
+        """drops the token of headers after a 401 response. A token that was already replaced by another thread is left alone,
+        so a burst of 401 responses requests a single new token"""
+        with self._lock:
+            if self._token is not None and headers.get('Authorization') == f'bearer {self._token}':
+                logger.warning("[invalidate] Reddit rejected the OAuth token, a new token is requested on the next request")
+                self._token = None
+                self._expires_at = 0.0
+
+    def _request_token(self) -> Tuple[str, float]:
+        login_data = {
+            'grant_type' : 'password',
+            'username' : self.username,
+            'password' : self.password
+        }
+        auth = requests.auth.HTTPBasicAuth(self.client_id, self.secret_key)
+        response = requests.post(self.token_url, auth=auth, data=login_data, headers={'User-Agent': REDDIT_USER_AGENT})
+        response.raise_for_status()
+        response_data = response.json()
+        if 'access_token' not in response_data:
+            raise Exception(f"reddit did not return an access token: {response_data.get('error', response_data)}")
+
+        self.token_requests += 1
+        expires_in = float(response_data.get('expires_in', 3600))
+        logger.info(f"[_request_token] Requested a new reddit OAuth token, expires in {expires_in:.0f}s")
+        return response_data['access_token'], time.monotonic() + expires_in
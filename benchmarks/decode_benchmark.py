@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Compares model_validate with the trusted decoder for cluster unit documents
+Run this from the project root: python -m benchmarks.decode_benchmark [nr_units] [nr_experiments] [runs_per_unit]
+"""
+import sys
+import time
+from typing import Any, Callable, Dict, List, Mapping
+
+from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitEntityPredictedCategory, PredictionCategoryTokens, TokenUsageAttempt
+from app.database.entities.label_template import LabelTemplateLLMProjection, LabelTemplateTruthProjection, LabelValueField, ProjectionLabelField
+from app.database.trusted_decode import get_trusted_decoder
+
+LABEL_NAMES = ["problem_description", "frustration_expression", "solution_seeking", "solution_attempted", "solution_proposing"]
+
+
+def create_cluster_unit_document(unit_index: int, nr_experiments: int, runs_per_unit: int) -> Mapping[str, Any]:
+    """a cluster unit as it is stored by dump_for_database, with the predictions of nr_experiments experiments embedded"""
+    predicted_category: Dict[str, ClusterUnitEntityPredictedCategory] = dict()
+    for experiment_index in range(nr_experiments):
+        experiment_id = f"experiment_{experiment_index}"
+        predictions = list()
+        for run_index in range(runs_per_unit):
+            values = {label_name: ProjectionLabelField(label=label_name,
+                                                       value=(unit_index + run_index + label_index) % 2 == 0,
+                                                       type="boolean",
+                                                       per_label_details=[LabelValueField(label="reason", value="because of the text", type="string")])
+                      for label_index, label_name in enumerate(LABEL_NAMES)}
+            tokens_used = {"prompt_tokens": 900, "completion_tokens": 120, "total_tokens": 1020}
+            predictions.append(PredictionCategoryTokens(labels_prediction=LabelTemplateLLMProjection(label_template_id="template", experiment_id=experiment_id, values=values),
+                                                        tokens_used=tokens_used,
+                                                        all_attempts_token_usage=[TokenUsageAttempt(tokens_used=tokens_used, attempt_number=1, success=True)],
+                                                        total_tokens_all_attempts=tokens_used))
+        predicted_category[experiment_id] = ClusterUnitEntityPredictedCategory(experiment_id=experiment_id, predicted_categories=predictions)
+
+    ground_truth = {"template": LabelTemplateTruthProjection(label_template_id="template",
+                                                             values={label_name: LabelValueField(label=label_name, value=True, type="boolean") for label_name in LABEL_NAMES})}
+    return ClusterUnitEntity(cluster_entity_id="cluster",
+                             post_id=f"post_{unit_index // 20}",
+                             comment_post_id=f"comment_{unit_index}",
+                             type="comment",
+                             reddit_id=f"reddit_{unit_index}",
+                             author="author",
+                             usertag=None,
+                             upvotes=unit_index,
+                             downvotes=0,
+                             created_utc=1700000000 + unit_index,
+                             thread_path_text=["post text", "comment text"],
+                             thread_path_author=["author_a", "author_b"],
+                             predicted_category=predicted_category,
+                             ground_truth=ground_truth,
+                             text="the text of the comment " * 10,
+                             enriched_comment_thread_text=None,
+                             subreddit="subreddit").dump_for_database()
+
+
+def time_decode(name: str, decode: Callable[[Mapping[str, Any]], ClusterUnitEntity], documents: List[Mapping[str, Any]], repeats: int = 3) -> float:
+    best_seconds = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for document in documents:
+            decode(document)
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    print(f"{name:<16} {best_seconds * 1000:10.1f} ms   {best_seconds / len(documents) * 1e6:10.1f} us/unit")
+    return best_seconds
+
+
+if __name__ == "__main__":
+    nr_units = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nr_experiments = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    runs_per_unit = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    print(f"decoding {nr_units} cluster units with {nr_experiments} experiments of {runs_per_unit} runs\n")
+    documents = [create_cluster_unit_document(unit_index, nr_experiments, runs_per_unit) for unit_index in range(nr_units)]
+
+    trusted_decoder = get_trusted_decoder(ClusterUnitEntity)
+    assert all(ClusterUnitEntity.model_validate(document) == trusted_decoder(document) for document in documents[:10]), "the trusted decoder differs from model_validate"
+
+    validate_seconds = time_decode("model_validate", ClusterUnitEntity.model_validate, documents)
+    trusted_seconds = time_decode("trusted decode", trusted_decoder, documents)
+    print(f"\nspeedup: {validate_seconds / trusted_seconds:.1f}x")
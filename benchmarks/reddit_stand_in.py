@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+A local HTTP stand-in of the reddit endpoints the scraper calls, so the scraper can be measured without reddit.com:
+the OAuth token, /r/{subreddit}/search, the comment pages of the permalinks and /api/morechildren.
+The recorded fixtures in data/ are served as they were recorded (the post of comments_result_full_submission_post.json with the
+comments of comments_result.json), every other post gets a generated comment tree whose depth and breadth are configurable.
+Every response waits latency_seconds and carries the x-ratelimit headers of a fixed window, a request over the limit gets a 429.
+Point the scraper at it with REDDIT_OAUTH_BASE_URL and REDDIT_WWW_BASE_URL = base_url.
+Run this from the project root to serve it on its own: python -m benchmarks.reddit_stand_in [port] [latency_ms]
+"""
+import json
+import math
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+def load_concatenated_json(path: str) -> List[Any]:
+    """the objects of a file with json objects written one after the other, like data/search_result.json"""
+    with open(path) as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    objects, index = list(), 0
+    while index < len(text):
+        if text[index].isspace():
+            index += 1
+            continue
+        obj, index = decoder.raw_decode(text, index)
+        objects.append(obj)
+    return objects
+
+
+def listing(children: List[dict]) -> dict:
+    return {"kind": "Listing", "data": {"after": None, "dist": len(children), "modhash": None, "geo_filter": "", "children": children, "before": None}}
+
+
+class SyntheticThread:
+    """a generated comment tree of a post: top_level comments that each have `breadth` replies, down to `depth` levels of comments"""
+    def __init__(self, post_id: str, top_level: int, breadth: int, depth: int):
+        self.post_id = post_id
+        self.children: Dict[str, List[str]] = dict() # the ids of the replies by the fullname of their parent
+        self.parents: Dict[str, str] = dict() # the fullname of the parent by comment id
+        self.depths: Dict[str, int] = dict()
+
+        level = [(f"t3_{post_id}", top_level)]
+        for comment_depth in range(depth):
+            next_level = list()
+            for parent_name, nr_replies in level:
+                reply_ids = [f"{post_id}x{len(self.depths) + index}" for index in range(nr_replies)]
+                for reply_id in reply_ids:
+                    self.depths[reply_id] = comment_depth
+                    self.parents[reply_id] = parent_name
+                    next_level.append((f"t1_{reply_id}", breadth))
+                self.children[parent_name] = reply_ids
+            level = next_level
+
+    @property
+    def number_of_comments(self) -> int:
+        return len(self.depths)
+
+
+class RedditStandIn:
+    """
+    The stand-in server, use as a context manager or with start() and stop().
+    A comment page shows initial_top_level comments and initial_breadth replies per comment down to initial_depth levels,
+    the other comments are behind 'more' stubs. /api/morechildren returns the requested comments flat, with a 'more' stub
+    for the replies of each of them, so a deep thread needs a round of /api/morechildren per level below initial_depth.
+    The search of a keyword returns posts of a pool of search_pool_size posts per subreddit, so keywords overlap like real searches do
+    """
+    def __init__(self,
+                 port: int = 0,
+                 latency_seconds: float = 0.0,
+                 rate_limit: int = 1000,
+                 rate_limit_window_seconds: float = 600.0,
+                 top_level: int = 20,
+                 breadth: int = 2,
+                 depth: int = 5,
+                 initial_top_level: int = 10,
+                 initial_breadth: int = 1,
+                 initial_depth: int = 3,
+                 search_pool_size: int = 200,
+                 fixture_directory: str = "data"):
+        self.latency_seconds = latency_seconds
+        self.rate_limit = rate_limit
+        self.rate_limit_window_seconds = rate_limit_window_seconds
+        self.top_level = top_level
+        self.breadth = breadth
+        self.depth = depth
+        self.initial_top_level = initial_top_level
+        self.initial_breadth = initial_breadth
+        self.initial_depth = initial_depth
+        self.search_pool_size = search_pool_size
+
+        self.recorded_post_templates = load_concatenated_json(f"{fixture_directory}/search_result.json")
+        with open(f"{fixture_directory}/comments_result_full_submission_post.json") as f:
+            recorded_submission = json.load(f)
+        with open(f"{fixture_directory}/comments_result.json") as f:
+            recorded_comments = json.load(f)
+        self.comment_template = {key: value for key, value in recorded_comments["data"]["children"][0]["data"].items() if key != "replies"}
+        recorded_permalink = recorded_submission["data"]["children"][0]["data"]["permalink"]
+        self.recorded_pages: Dict[str, list] = {recorded_permalink.strip("/"): [recorded_submission, recorded_comments]}
+
+        self._lock = threading.Lock()
+        self._window_started_at = time.monotonic()
+        self._window_used = 0
+        self._threads: Dict[str, SyntheticThread] = dict()
+        self.requests: Counter = Counter() # the number of requests by endpoint
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "RedditStandIn":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "RedditStandIn":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def reset_metrics(self) -> None:
+        with self._lock:
+            self.requests = Counter()
+
+    def thread(self, post_id: str) -> SyntheticThread:
+        """the generated comment tree of the post, the same on every request"""
+        with self._lock:
+            if post_id not in self._threads:
+                self._threads[post_id] = SyntheticThread(post_id, self.top_level, self.breadth, self.depth)
+            return self._threads[post_id]
+
+    def _take_rate_limit(self) -> Tuple[bool, Dict[str, str]]:
+        """counts the request in the fixed window, returns whether it is within the limit and the rate limit headers"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started_at >= self.rate_limit_window_seconds:
+                self._window_started_at, self._window_used = now, 0
+            allowed = self._window_used < self.rate_limit
+            if allowed:
+                self._window_used += 1
+            reset = math.ceil(self.rate_limit_window_seconds - (now - self._window_started_at))
+            headers = {"x-ratelimit-used": str(self._window_used),
+                       "x-ratelimit-remaining": str(self.rate_limit - self._window_used),
+                       "x-ratelimit-reset": str(reset)}
+            if not allowed:
+                headers["retry-after"] = str(reset)
+            return allowed, headers
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def _post(self, subreddit: str, post_id: str) -> dict:
+        template = self.recorded_post_templates[zlib.crc32(post_id.encode()) % len(self.recorded_post_templates)]
+        post = {**template, "id": post_id, "name": f"t3_{post_id}", "subreddit": subreddit,
+                "permalink": f"/r/{subreddit}/comments/{post_id}/synthetic_post/", "num_comments": self.thread(post_id).number_of_comments}
+        return {"kind": "t3", "data": post}
+
+    def _comment(self, thread: SyntheticThread, comment_id: str, parent_name: str, replies: Any) -> dict:
+        comment = {**self.comment_template, "id": comment_id, "name": f"t1_{comment_id}", "parent_id": parent_name,
+                   "link_id": f"t3_{thread.post_id}", "depth": thread.depths[comment_id], "body": f"synthetic comment {comment_id}",
+                   "permalink": f"/r/synthetic/comments/{thread.post_id}/synthetic_post/{comment_id}/", "replies": replies}
+        return {"kind": "t1", "data": comment}
+
+    @staticmethod
+    def _more(parent_name: str, depth: int, comment_ids: List[str]) -> dict:
+        return {"kind": "more", "data": {"count": len(comment_ids), "name": f"t1_{comment_ids[0]}", "id": comment_ids[0],
+                                         "parent_id": parent_name, "depth": depth, "children": comment_ids}}
+
+    def _render_replies(self, thread: SyntheticThread, parent_name: str, depth: int) -> List[dict]:
+        reply_ids = thread.children.get(parent_name, [])
+        nr_shown = 0 if depth >= self.initial_depth else (self.initial_top_level if depth == 0 else self.initial_breadth)
+        children = list()
+        for reply_id in reply_ids[:nr_shown]:
+            replies = self._render_replies(thread, f"t1_{reply_id}", depth + 1)
+            children.append(self._comment(thread, reply_id, parent_name, listing(replies) if replies else ""))
+        if reply_ids[nr_shown:]:
+            children.append(self._more(parent_name, depth, reply_ids[nr_shown:]))
+        return children
+
+    def comment_page(self, permalink: str) -> list:
+        recorded_page = self.recorded_pages.get(permalink.strip("/"))
+        if recorded_page is not None:
+            return recorded_page
+        parts = permalink.strip("/").split("/")
+        subreddit, post_id = parts[1], parts[3]
+        thread = self.thread(post_id)
+        return [listing([self._post(subreddit, post_id)]), listing(self._render_replies(thread, f"t3_{post_id}", 0))]
+
+    def more_children(self, link_id: str, comment_ids: List[str]) -> dict:
+        thread = self.thread(link_id.removeprefix("t3_"))
+        things = list()
+        for comment_id in comment_ids[:100]:
+            if comment_id not in thread.depths:
+                continue
+            things.append(self._comment(thread, comment_id, thread.parents[comment_id], ""))
+            reply_ids = thread.children.get(f"t1_{comment_id}")
+            if reply_ids:
+                things.append(self._more(f"t1_{comment_id}", thread.depths[comment_id] + 1, reply_ids))
+        return {"json": {"errors": [], "data": {"things": things}}}
+
+    def search(self, subreddit: str, query: str, limit: int) -> dict:
+        seed = zlib.crc32(query.lower().encode())
+        post_ids = list(dict.fromkeys(f"{subreddit.lower()}{(seed + index * 7) % self.search_pool_size}" for index in range(limit)))
+        return listing([self._post(subreddit, post_id) for post_id in post_ids])
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like reddit
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _respond(self, status: int, body: Any, headers: Dict[str, str]) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stand_in._count("token")
+                self._respond(200, {"access_token": "stand-in-token", "token_type": "bearer", "expires_in": 3600, "scope": "*"}, {})
+
+            def do_GET(self) -> None:
+                if stand_in.latency_seconds:
+                    time.sleep(stand_in.latency_seconds)
+                url = urlparse(self.path)
+                params = {name: values[0] for name, values in parse_qs(url.query).items()}
+                allowed, headers = stand_in._take_rate_limit()
+                if not allowed:
+                    stand_in._count("rate_limited")
+                    self._respond(429, {"message": "Too Many Requests", "error": 429}, headers)
+                    return
+
+                parts = url.path.strip("/").split("/")
+                if url.path == "/api/morechildren":
+                    stand_in._count("morechildren")
+                    body = stand_in.more_children(params.get("link_id", ""), params.get("children", "").split(","))
+                elif len(parts) == 3 and parts[0] == "r" and parts[2] == "search":
+                    stand_in._count("search")
+                    body = stand_in.search(parts[1], params.get("q", ""), int(params.get("limit", 25)))
+                elif len(parts) >= 4 and parts[0] == "r" and parts[2] == "comments":
+                    stand_in._count("comments")
+                    body = stand_in.comment_page(url.path)
+                else:
+                    stand_in._count("not_found")
+                    self._respond(404, {"message": "Not Found", "error": 404}, headers)
+                    return
+                self._respond(200, body, headers)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+
+    with RedditStandIn(port=port, latency_seconds=latency_ms / 1000) as stand_in:
+        print(f"serving the reddit stand-in on {stand_in.base_url}, set REDDIT_OAUTH_BASE_URL and REDDIT_WWW_BASE_URL to it. Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Measures the scraper against the local reddit stand-in (benchmarks/reddit_stand_in.py): posts/sec, comments/sec and requests per post of
+RedditScraperAPI (one post after the other), RedditAPIManager.scrape_comments_of_posts (concurrent) and ScraperService.scrape_all_subreddits_keywords.
+Changes to the comment expansion should report these numbers before and after, the expanded comments have to stay equal to the generated comments.
+Run this from the project root: python -m benchmarks.scraper_benchmark [nr_posts] [latency_ms] [depth] [concurrency]
+"""
+import os
+import sys
+import time
+from collections import Counter
+from typing import List
+
+from flask import Flask, g
+
+from benchmarks.reddit_stand_in import RedditStandIn
+
+
+def count_comments(comments: List) -> int:
+    """the number of comments in the trees, works for RedditComment and CommentEntity"""
+    nr_comments, stack = 0, list(comments)
+    while stack:
+        comment = stack.pop()
+        nr_comments += 1
+        if isinstance(comment.replies, list):
+            stack.extend(comment.replies)
+        elif comment.replies:
+            stack.extend(child.data for child in comment.replies.data.children)
+    return nr_comments
+
+
+def report(name: str, seconds: float, nr_posts: int, nr_comments: int, expected_comments: int, requests: Counter) -> None:
+    nr_requests = sum(count for endpoint, count in requests.items() if endpoint != "token")
+    breakdown = ", ".join(f"{endpoint}={count}" for endpoint, count in sorted(requests.items()))
+    print(f"{name:<18} {nr_posts / seconds:8.1f} posts/s {nr_comments / seconds:10.0f} comments/s {nr_requests / max(nr_posts, 1):6.2f} requests/post"
+          f"   {nr_comments}/{expected_comments} comments   ({breakdown})")
+
+
+def benchmark_sequential(stand_in: RedditStandIn, permalinks: List[str]) -> None:
+    from app.utils.reddit_scraper_api import RedditScraperAPI
+
+    scraper = RedditScraperAPI()
+    stand_in.reset_metrics()
+    start = time.perf_counter()
+    nr_comments = sum(count_comments(scraper.get_post_comments(permalink)[1]) for permalink in permalinks)
+    seconds = time.perf_counter() - start
+    report("RedditScraperAPI", seconds, len(permalinks), nr_comments, expected_comments(stand_in, permalinks), stand_in.requests)
+
+
+def benchmark_concurrent(stand_in: RedditStandIn, permalinks: List[str]) -> None:
+    from app.utils.reddit_scraper_api import RedditAPIManager
+
+    manager = RedditAPIManager(number_posts_per_keyword=len(permalinks))
+    scraped = {"posts": 0, "comments": 0}
+    def on_post_scraped(full_post, comments):
+        scraped["posts"] += 1
+        scraped["comments"] += count_comments(comments)
+
+    stand_in.reset_metrics()
+    start = time.perf_counter()
+    manager.scrape_comments_of_posts(permalinks, on_post_scraped)
+    seconds = time.perf_counter() - start
+    report("RedditAPIManager", seconds, scraped["posts"], scraped["comments"], expected_comments(stand_in, permalinks), stand_in.requests)
+
+
+def benchmark_scraper_service(stand_in: RedditStandIn, subreddits: List[str], keywords: List[str], posts_per_keyword: int) -> None:
+    from app.database import get_post_repository, get_scraper_repository
+    from app.database.storage import InMemoryDatabase
+    from app.requests.scraper_requests import CreateScraperRequest
+    from app.services.scraper_service import ScraperService
+
+    with Flask(__name__).app_context():
+        g._database = InMemoryDatabase()
+        scraper_entity = ScraperService.create_scraper_entity(CreateScraperRequest(scraper_cluster_id="benchmark", keywords=keywords, subreddits=subreddits), "benchmark")
+        scraper_entity.posts_per_keyword = posts_per_keyword
+        scraper_entity.status = "ongoing"
+        get_scraper_repository().insert(scraper_entity)
+
+        stand_in.reset_metrics()
+        start = time.perf_counter()
+        ScraperService.scrape_all_subreddits_keywords(scraper_entity)
+        seconds = time.perf_counter() - start
+
+        posts = [get_post_repository().find_by_id_with_comments(post.id) for post in get_post_repository().find({})]
+        nr_comments = sum(count_comments(post.comments) for post in posts)
+        expected = sum(stand_in.thread(post.reddit_id).number_of_comments for post in posts)
+        report("ScraperService", seconds, len(posts), nr_comments, expected, stand_in.requests)
+
+
+def expected_comments(stand_in: RedditStandIn, permalinks: List[str]) -> int:
+    return sum(stand_in.thread(permalink.strip("/").split("/")[3]).number_of_comments for permalink in permalinks)
+
+
+if __name__ == "__main__":
+    nr_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50.0
+    depth = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    concurrency = sys.argv[4] if len(sys.argv) > 4 else "8"
+
+    with RedditStandIn(latency_seconds=latency_ms / 1000, depth=depth, search_pool_size=max(200, 4 * nr_posts)) as stand_in:
+        os.environ.update({"REDDIT_OAUTH_BASE_URL": stand_in.base_url, "REDDIT_WWW_BASE_URL": stand_in.base_url, "REDDIT_SCRAPER_CONCURRENCY": concurrency,
+                           "CLIENT_ID": "benchmark", "REDDIT_SECRET_KEY": "benchmark", "REDDIT_USERNAME": "benchmark", "REDDIT_PASSWORD": "benchmark",
+                           "REDDIT_SEARCH_CACHE_TTL_SECONDS": "0"})
+        from app.utils.reddit_scraper_api import RedditScraperAPI
+
+        print(f"scraping {nr_posts} posts of {stand_in.thread('example').number_of_comments} comments (depth {depth}), "
+              f"{latency_ms:.0f} ms latency, concurrency {concurrency}\n")
+        permalinks = [post.permalink for post in RedditScraperAPI().search("deaf", "sign", limit=nr_posts)]
+        benchmark_sequential(stand_in, permalinks)
+        benchmark_concurrent(stand_in, permalinks)
+        keywords = ["sign", "hearing", "captions", "interpreter", "cochlear"]
+        benchmark_scraper_service(stand_in, ["deaf", "hoh"], keywords, posts_per_keyword=max(1, nr_posts // len(keywords)))
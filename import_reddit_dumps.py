@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Imports posts from offline reddit dumps (NDJSON, optionally zstd compressed) instead of scraping them through the reddit API
+Run this from the project root:
+    python import_reddit_dumps.py --submissions RS_2023-01.zst --comments RC_2023-01.zst --subreddits deaf HardOfHearing --keywords "sign language" captions
+    python import_reddit_dumps.py --submissions RS_2023-01.zst --comments RC_2023-01.zst --scraper-id <scraper_id>   # the subreddits and keywords of the scraper
+"""
+import argparse
+import json
+import os
+
+from flask import Flask, g
+from pymongo import MongoClient
+
+from app.database import DATABASE_NAME, get_scraper_repository
+from app.services.reddit_dump_import_service import RedditDumpImportService
+from app.utils.configuration import Configuration
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import reddit submission and comment dumps")
+    parser.add_argument("--submissions", nargs="+", required=True, help="the submission dump files")
+    parser.add_argument("--comments", nargs="*", default=[], help="the comment dump files")
+    parser.add_argument("--subreddits", nargs="*", default=None)
+    parser.add_argument("--keywords", nargs="*", default=None, help="only the submissions with one of the keywords, all submissions if not given")
+    parser.add_argument("--scraper-id", default=None, help="adds the posts to the keyword searches of the scraper")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--spill-directory", default=None, help="where the temporary spill file is written, the system temp directory by default")
+    arguments = parser.parse_args()
+
+    Configuration()  # loads the env files
+    mongo_db_url = os.getenv("MONGODB_URL").replace("<db_password>", os.getenv("MONGODB_PASSWORD"))
+
+    with Flask(__name__).app_context():
+        g._database = MongoClient(mongo_db_url)[DATABASE_NAME]
+        scraper_entity = get_scraper_repository().find_by_id(arguments.scraper_id) if arguments.scraper_id else None
+        if arguments.scraper_id and scraper_entity is None:
+            raise Exception(f"no scraper with id {arguments.scraper_id}")
+
+        report = RedditDumpImportService.import_dumps(arguments.submissions, arguments.comments, arguments.subreddits, arguments.keywords,
+                                                      scraper_entity, arguments.batch_size, arguments.spill_directory)
+    print(json.dumps(report.model_dump(), indent=4))
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Applies the index registry (app/database/indexes.py) to the database and reports missing, undeclared and unused indexes
+Run this from the project root:
+    python migrate_indexes.py                     # create the missing indexes and print the report
+    python migrate_indexes.py --report            # only print the report
+    python migrate_indexes.py --drop-undeclared   # also drop the indexes that are not declared anymore
+"""
+import json
+import os
+import sys
+
+from pymongo import MongoClient
+
+from app.database import DATABASE_NAME
+from app.database.indexes import apply_indexes, report_indexes
+from app.utils.configuration import Configuration
+
+if __name__ == "__main__":
+    Configuration()  # loads the env files
+    mongo_db_url = os.getenv("MONGODB_URL").replace("<db_password>", os.getenv("MONGODB_PASSWORD"))
+    database = MongoClient(mongo_db_url)[DATABASE_NAME]
+
+    if "--report" not in sys.argv:
+        apply_indexes(database, drop_undeclared="--drop-undeclared" in sys.argv)
+
+    print(json.dumps(report_indexes(database), indent=4))
@@ -18,6 +18,9 @@ from app.routes.models_routes import models_bp
 from app.routes.label_template_routes import label_template_bp
 from app.routes.filtering_routes import filtering_bp
 
+from app.database import DATABASE_NAME, get_storage_backend
+from app.database.storage import get_memory_database
+from app.database.indexes import apply_indexes
 from app.utils.configuration import get_env_variable, is_production_environment
 from app.utils.extensions import mongo
 from app.utils.logging_config import LoggingConfig
@@ -38,9 +41,18 @@ def start_app():
     LoggingConfig(app)
 
     # Configuration can be added here
-    mongo_db_url = os.getenv("MONGODB_URL").replace("<db_password>", os.getenv("MONGODB_PASSWORD"))
-    app.config["MONGO_URI"] = mongo_db_url
-    mongo.init_app(app)  # bind to the real app
+    if get_storage_backend() == "memory":
+        # everything is stored in the process, e.g. for benchmarks and tests without a MongoDB server
+        database = get_memory_database()
+    else:
+        mongo_db_url = os.getenv("MONGODB_URL").replace("<db_password>", os.getenv("MONGODB_PASSWORD"))
+        app.config["MONGO_URI"] = mongo_db_url
+        mongo.init_app(app)  # bind to the real app
+        database = mongo.cx[DATABASE_NAME]
+
+    # Create the missing indexes once, instead of in the repositories that are created for every request
+    if get_env_variable("APPLY_INDEXES_ON_STARTUP", bool, True):
+        apply_indexes(database)
 
     app.config["JWT_SECRET_KEY"] = get_env_variable("JWT_SECRET_KEY", str)
     app.config["JWT_TOKEN_LOCATION"] = ["headers"]
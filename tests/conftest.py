@@ -0,0 +1,44 @@
+"""Shared fixtures and entity factories of the tests"""
+from typing import Dict, List, Optional
+
+import pytest
+from flask import Flask, g
+
+from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitEntityPredictedCategory, PredictionCategoryTokens
+from app.database.entities.label_template import LabelTemplateLLMProjection, ProjectionLabelField
+from app.database.entities.post_entity import CommentEntity, PostEntity
+from app.database.storage import InMemoryDatabase
+
+
+@pytest.fixture
+def in_memory_db():
+    """an app context whose repositories (get_*_repository) use a fresh in-memory database"""
+    with Flask(__name__).app_context():
+        g._database = InMemoryDatabase()
+        yield g._database
+
+
+def make_comment(reddit_id: str, depth: int = 0, replies: Optional[List[CommentEntity]] = None, upvotes: int = 1) -> CommentEntity:
+    return CommentEntity(reddit_id=reddit_id, text=f"text {reddit_id}", author="author", upvotes=upvotes, downvotes=0, user_tag=None,
+                         created_utc=1700000000, controversiality=0, depth=depth, replies=replies or [])
+
+
+def make_post(reddit_id: str, comments: Optional[List[CommentEntity]] = None, upvotes: int = 1) -> PostEntity:
+    return PostEntity(reddit_id=reddit_id, text="post text", author="author", upvotes=upvotes, downvotes=0, user_tag=None, created_utc=1700000000,
+                      title="title", subreddit="deaf", send_replies=True, permalink=f"/r/deaf/comments/{reddit_id}/", upvote_ratio=1.0, comments=comments or [])
+
+
+def make_cluster_unit(upvotes: int = 1, **fields) -> ClusterUnitEntity:
+    """a comment cluster unit of the cluster 'cluster', fields overrides the defaults (e.g. ground_truth, depth or type)"""
+    defaults = dict(cluster_entity_id="cluster", post_id="post", comment_post_id="comment", type="comment", reddit_id=f"reddit_{upvotes}",
+                    author="author", usertag=None, upvotes=upvotes, downvotes=0, created_utc=1700000000, thread_path_text=["post text"],
+                    thread_path_author=["author"], text=f"text {upvotes}", enriched_comment_thread_text=None, subreddit="deaf")
+    return ClusterUnitEntity(**{**defaults, **fields})
+
+
+def make_predicted_category(experiment_id: str, runs: List[Dict[str, ProjectionLabelField]]) -> ClusterUnitEntityPredictedCategory:
+    """the runs of an experiment on a cluster unit of the label template 'template', a run is given by its predicted label values"""
+    predicted_categories = [PredictionCategoryTokens(labels_prediction=LabelTemplateLLMProjection(label_template_id="template", experiment_id=experiment_id, values=values),
+                                                     tokens_used={"total_tokens": 10})
+                            for values in runs]
+    return ClusterUnitEntityPredictedCategory(experiment_id=experiment_id, predicted_categories=predicted_categories)
@@ -0,0 +1,45 @@
+"""Tests for the batched preparation of the cluster units of a scrape"""
+import pytest
+
+from app.database import get_cluster_repository, get_cluster_unit_repository, get_post_repository
+from app.database.entities.cluster_entity import ClusterEntity, ClusterTextThreadModeType
+from app.database.entities.post_entity import PostEntity
+from app.database.entities.scraper_cluster_entity import ScraperClusterEntity
+from app.services.cluster_prep_service import ClusterPrepService
+from app.utils.types import MediaStrategySkipType, StatusType
+from tests.conftest import make_comment, make_post
+
+
+def _post(reddit_id: str) -> PostEntity:
+    return make_post(reddit_id, [make_comment(f"{reddit_id}_a", 0, [make_comment(f"{reddit_id}_a1", 1, [make_comment(f"{reddit_id}_a1x", 2)])]),
+                                 make_comment(f"{reddit_id}_b")])
+
+
+@pytest.mark.parametrize("comments_layout,max_workers", [("nested", 1), ("flat", 1), ("nested", 2)])
+def test_posts_are_prepared_in_batches_and_checkpointed(in_memory_db, comments_layout, max_workers, monkeypatch):
+    """Test every post that is not converted yet gets its cluster units in thread order, in batches and in the process pool,
+    an already converted post is only checkpointed and a second run creates nothing"""
+    monkeypatch.setenv("POST_COMMENTS_LAYOUT", comments_layout)
+    monkeypatch.setattr(ClusterPrepService, "_min_posts_for_process_pool", 1)
+    posts = [_post(f"post{index}") for index in range(5)]
+    get_post_repository().insert_list_entities(posts)
+    cluster_entity = ClusterEntity(scraper_entity_id="scraper", text_thread_mode=ClusterTextThreadModeType.PlainText, status=StatusType.Ongoing,
+                                   post_entity_ids_prep_status={post.id: StatusType.Initialized for post in posts}, media_strategy_skip_type=MediaStrategySkipType.Ignore)
+    get_cluster_repository().insert(cluster_entity)
+    scraper_cluster_entity = ScraperClusterEntity(user_id="user", cluster_entity_id=cluster_entity.id)
+    ClusterPrepService.prepare_post_batch(cluster_entity, [posts[0].id])
+
+    cluster_unit_count = ClusterPrepService.start_preparing_clustering(scraper_cluster_entity, MediaStrategySkipType.Ignore, batch_size=2, max_workers=max_workers)
+
+    assert cluster_unit_count == 5 * 5
+    stored_cluster_entity = get_cluster_repository().find_by_id(cluster_entity.id)
+    assert stored_cluster_entity.cluster_unit_count == 25
+    assert set(stored_cluster_entity.post_entity_ids_prep_status.values()) == {StatusType.Completed}
+
+    cluster_units = get_cluster_unit_repository().find({"post_id": posts[3].id})
+    reddit_ids = {cluster_unit.id: cluster_unit.reddit_id for cluster_unit in cluster_units}
+    assert sorted((cluster_unit.reddit_id, reddit_ids.get(cluster_unit.replied_to_cluster_unit_id), cluster_unit.total_nested_replies) for cluster_unit in cluster_units) == [
+        ("post3", None, 4), ("post3_a", "post3", 2), ("post3_a1", "post3_a", 1), ("post3_a1x", "post3_a1", 0), ("post3_b", "post3", 0)]
+
+    assert ClusterPrepService.start_preparing_clustering(scraper_cluster_entity, MediaStrategySkipType.Ignore, batch_size=2, max_workers=max_workers) == 25
+    assert get_cluster_unit_repository().count_by_cluster_entity_id(cluster_entity.id) == 25
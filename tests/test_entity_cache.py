@@ -0,0 +1,46 @@
+"""Tests for the read-through entity cache of the repositories"""
+import time
+
+from app.database.entities.user_entity import UserEntity
+from app.database.entity_cache import EntityCache
+from app.database.storage import InMemoryDatabase
+from app.database.user_repository import UserRepository
+
+
+def test_find_by_id_is_cached_and_invalidated_by_writes():
+    """Test a cached user is served without a database read, and the update paths invalidate it"""
+    repository = UserRepository(InMemoryDatabase())
+    user = UserEntity(email="user@example.com", password=b"hash")
+    repository.insert(user)
+    hits = UserRepository.cache.hits
+
+    repository.find_by_id(user.id).favorite_models.append("changed by the caller")
+    repository.collection.update_one({"_id": user.id}, {"$set": {"email": "changed@example.com"}})  # bypasses the invalidation
+    cached_user = repository.find_by_id(user.id)
+    assert UserRepository.cache.hits == hits + 1
+    assert (cached_user.email, cached_user.favorite_models) == ("user@example.com", [])
+
+    repository.insert_list_element({"_id": user.id}, "favorite_models", "model")
+    assert repository.find_by_id(user.id).favorite_models == ["model"]
+    assert repository.find_by_id(user.id).email == "changed@example.com"
+
+    repository.delete(user.id)
+    assert repository.find_by_id(user.id) is None
+
+
+def test_lru_eviction_and_ttl_expiry():
+    """Test the least recently used entry is evicted above max_size, and entries expire after the ttl"""
+    cache = EntityCache("test", max_size=2, ttl_seconds=60)
+    cache.set("a", {"_id": "a"})
+    cache.set("b", {"_id": "b"})
+    cache.get("a")
+    cache.set("c", {"_id": "c"})
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ({"_id": "a"}, None, {"_id": "c"})
+    assert cache.stats()["evictions"] == 1
+
+    expiring_cache = EntityCache("expiring", max_size=2, ttl_seconds=0.01)
+    expiring_cache.set("a", {"_id": "a"})
+    time.sleep(0.02)
+    assert expiring_cache.get("a") is None
+    assert expiring_cache.stats()["expirations"] == 1
@@ -0,0 +1,29 @@
+"""Tests for the projected entity views"""
+from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitPostIdView, ClusterUnitSummaryView
+
+
+def test_view_projection_uses_database_field_names():
+    """Test the projection of a view contains _id and only the fields of the view"""
+    assert ClusterUnitPostIdView.projection() == {"_id": 1, "post_id": 1}
+    assert "predicted_category" not in ClusterUnitSummaryView.projection()
+    assert "text" not in ClusterUnitSummaryView.projection()
+
+
+def test_view_validates_projected_document():
+    """Test a view validates a projected document and every view field exists on the entity"""
+    view = ClusterUnitPostIdView.model_validate({"_id": "abc", "post_id": "post"})
+
+    assert view.id == "abc" and view.post_id == "post"
+    assert set(ClusterUnitSummaryView.model_fields) <= set(ClusterUnitEntity.model_fields)
+
+
+def test_decoded_batches_keep_order_with_decode_workers():
+    """Test the pipelined decoding yields the views in the order of the batches"""
+    from app.database.base_repository import BaseRepository
+
+    repository = BaseRepository.__new__(BaseRepository)
+    batches = [[{"_id": f"{batch}-{index}", "post_id": "post"} for index in range(3)] for batch in range(5)]
+
+    views = list(repository._iter_decoded_batches(iter(batches), ClusterUnitPostIdView, decode_workers=2))
+
+    assert [view.id for view in views] == [document["_id"] for batch in batches for document in batch]
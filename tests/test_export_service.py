@@ -0,0 +1,77 @@
+"""Tests for the Parquet / Arrow exports"""
+import os
+from typing import List
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from app.database import get_cluster_unit_repository, get_prediction_repository
+from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitEntityPredictedCategory
+from app.database.entities.experiment_entity import ExperimentEntity
+from app.database.entities.label_template import LabelTemplateEntity, LabelTemplateTruthProjection, LabelValueField, ProjectionLabelField
+from app.services.export_service import ExportService
+from tests.conftest import make_cluster_unit, make_predicted_category
+
+
+def _cluster_unit(upvotes: int, problem) -> ClusterUnitEntity:
+    return make_cluster_unit(upvotes, ground_truth={"template": LabelTemplateTruthProjection(
+        label_template_id="template", values={"problem": LabelValueField(label="problem", value=problem, type="boolean")})})
+
+
+def _predicted_category(experiment_id: str, problems: List[bool]) -> ClusterUnitEntityPredictedCategory:
+    return make_predicted_category(experiment_id, [{"problem": ProjectionLabelField(label="problem", value=problem, type="boolean")} for problem in problems])
+
+
+def test_export_cluster_units_in_row_groups(in_memory_db, tmp_path, monkeypatch):
+    """Test the selected columns and the ground truth are written, with a row group per batch"""
+    monkeypatch.setenv("EXPORT_DIRECTORY", str(tmp_path))
+    label_template_entity = LabelTemplateEntity.model_construct(id="template", ground_truth_field=LabelTemplateTruthProjection(
+        label_template_id="template", values={"problem": LabelValueField(label="problem", value=None, type="boolean")}))
+    get_cluster_unit_repository().insert_list_entities([_cluster_unit(upvotes, upvotes % 2 == 0 if upvotes < 4 else None) for upvotes in range(5)])
+
+    export_path = ExportService.export_cluster_units("cluster", columns=["upvotes", "thread_path_text"], label_template_entity=label_template_entity, batch_size=2)
+
+    parquet_file = pq.ParquetFile(export_path)
+    assert parquet_file.metadata.num_row_groups == 3
+    table = pq.read_table(export_path, memory_map=True)
+    assert table.column_names == ["_id", "upvotes", "thread_path_text", "ground_truth.problem"]
+    assert table.column("upvotes").to_pylist() == [0, 1, 2, 3, 4]
+    assert table.column("ground_truth.problem").to_pylist() == [True, False, True, False, None]
+    assert table.column("thread_path_text").to_pylist()[0] == ["post text"]
+
+
+def test_unknown_column_is_rejected():
+    """Test a column that is not a cluster unit column is refused instead of exported as nulls"""
+    with pytest.raises(Exception, match="unknown cluster unit columns"):
+        ExportService.cluster_unit_schema(["upvotes", "not_a_column"])
+
+
+def test_export_predictions_of_the_prediction_collection_and_of_legacy_embedded_predictions(in_memory_db, tmp_path, monkeypatch):
+    """Test every run is exported with its label values, for an experiment in the prediction collection and for an experiment
+    whose runs are still embedded in predicted_category, and the file is removed after it is sent"""
+    monkeypatch.setenv("EXPORT_DIRECTORY", str(tmp_path))
+    label_template_entity = LabelTemplateEntity.model_construct(id="template", ground_truth_field=LabelTemplateTruthProjection(
+        label_template_id="template", values={"problem": LabelValueField(label="problem", value=None, type="boolean")}))
+    cluster_units = [_cluster_unit(upvotes, None) for upvotes in range(3)]
+    for cluster_unit in cluster_units[:2]:
+        cluster_unit.predicted_category = {"legacy": _predicted_category("legacy", [cluster_unit.upvotes == 0, True])}
+    get_cluster_unit_repository().insert_list_entities(cluster_units)
+    get_prediction_repository().upsert_predicted_categories("collection", {cluster_units[2].id: _predicted_category("collection", [False, True, False])})
+
+    collection_path = ExportService.export_predictions(ExperimentEntity.model_construct(id="collection"), label_template_entity)
+    legacy_path = ExportService.export_predictions(ExperimentEntity.model_construct(id="legacy"), label_template_entity, file_format="arrow")
+
+    collection_rows = pq.read_table(collection_path).to_pylist()
+    assert sorted((row["cluster_unit_id"], row["experiment_id"], row["run_index"], row["problem"]) for row in collection_rows) == [
+        (cluster_units[2].id, "collection", 0, False), (cluster_units[2].id, "collection", 1, True), (cluster_units[2].id, "collection", 2, False)]
+
+    with pa.memory_map(legacy_path) as source:
+        legacy_rows = pa.ipc.open_file(source).read_all().to_pylist()
+    assert sorted((row["cluster_unit_id"], row["experiment_id"], row["run_index"], row["problem"]) for row in legacy_rows) == sorted([
+        (cluster_units[0].id, "legacy", 0, True), (cluster_units[0].id, "legacy", 1, True),
+        (cluster_units[1].id, "legacy", 0, False), (cluster_units[1].id, "legacy", 1, True)])
+
+    ExportService.remove_export_file(collection_path)
+    assert not os.path.exists(collection_path)
@@ -0,0 +1,107 @@
+"""Tests for translating the filtering fields into mongodb queries"""
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from app.database import get_cluster_repository, get_cluster_unit_repository, get_experiment_repository, get_prediction_repository
+from app.database.entities.cluster_entity import ClusterEntity, ClusterTextThreadModeType
+from app.database.entities.cluster_unit_entity import ClusterUnitEntityPredictedCategory
+from app.database.entities.experiment_entity import ExperimentEntity, ExperimentInput
+from app.database.entities.filtering_entity import FilterMisc, FilteringFields, LabelTemplateFilter
+from app.database.entities.label_template import ProjectionLabelField
+from app.database.entities.prompt_entity import PromptCategory
+from app.services.experiment_service import ExperimentService
+from app.services.filtering_service import FilteringService
+from app.utils.filtering_query import compile_filter_misc, compile_label_template_filter, compile_run_filters, embedded_runs_expression
+from app.utils.types import MediaStrategySkipType, StatusType
+from tests.conftest import make_cluster_unit, make_predicted_category
+
+
+def test_compile_filter_misc():
+    """Test the misc bounds become inclusive range filters and "all" does not filter the message type"""
+    min_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    query = compile_filter_misc(FilterMisc(min_upvotes=5, max_depth=2, min_date=min_date, reddit_message_type="all"))
+
+    assert query == {"upvotes": {"$gte": 5}, "depth": {"$lte": 2}, "created_utc": {"$gte": min_date.timestamp()}}
+    assert compile_filter_misc(FilterMisc(reddit_message_type="comment")) == {"type": "comment"}
+    assert compile_filter_misc(None) == {}
+
+
+def test_compile_numeric_label_filter_bounds():
+    """Test both bounds are exclusive like verify_projection_label_field, a single bound is inclusive"""
+    both_bounds = compile_label_template_filter(LabelTemplateFilter(label_name="score", label_type="integer", min_label_value=1, max_label_value=5), "$value")
+    min_bound = compile_label_template_filter(LabelTemplateFilter(label_name="score", label_type="integer", min_label_value=1), "$value")
+
+    assert both_bounds == {"$and": [{"$isNumber": "$value"}, {"$gt": ["$value", 1]}, {"$lt": ["$value", 5]}]}
+    assert min_bound == {"$and": [{"$isNumber": "$value"}, {"$gte": ["$value", 1]}]}
+
+
+def test_compile_run_filters_and_embedded_expression():
+    """Test the AND and OR label filters become one run expression each, counted over the embedded runs"""
+    filtering_fields = FilteringFields(label_template_id="template", input_id="experiment", input_type="experiment",
+                                       label_template_filter_and={"problem": LabelTemplateFilter(label_name="problem", label_type="boolean", allowed_values=[True])},
+                                       label_template_filter_or={"tone": LabelTemplateFilter(label_name="tone", label_type="category", allowed_values=["$angry"])})
+
+    run_filters = compile_run_filters(filtering_fields, "$$run.labels_prediction.values")
+
+    assert run_filters == [{"$and": [{"$in": ["$$run.labels_prediction.values.problem.value", {"$literal": [True]}]}]},
+                           {"$or": [{"$in": ["$$run.labels_prediction.values.tone.value", {"$literal": ["$angry"]}]}]}]
+    expression = embedded_runs_expression("experiment", run_filters, min_matching_runs=3)
+    assert len(expression["$expr"]["$and"]) == 2
+    assert expression["$expr"]["$and"][0]["$gte"][1] == 3
+
+
+def _random_runs(rng: random.Random, experiment_id: str) -> ClusterUnitEntityPredictedCategory:
+    return make_predicted_category(experiment_id, [{"problem": ProjectionLabelField(label="problem", value=rng.random() < 0.5, type="boolean"),
+                                                    "tone": ProjectionLabelField(label="tone", value=rng.choice(["angry", "neutral", "happy"]), type="string"),
+                                                    "score": ProjectionLabelField(label="score", value=rng.randint(0, 5), type="integer")}
+                                                   for _ in range(3)])
+
+
+def _experiment(experiment_id: str) -> ExperimentEntity:
+    return ExperimentEntity(id=experiment_id, user_id="user", scraper_cluster_id="scraper_cluster", prompt_id="prompt", label_template_id="template",
+                            input=ExperimentInput(input_id="cluster", input_type="cluster", cluster_unit_count=12), model_id="model",
+                            experiment_type=PromptCategory.Classify_cluster_units, runs_per_unit=2)
+
+
+FILTERING_CASES = [
+    dict(label_template_filter_and={"problem": LabelTemplateFilter(label_name="problem", label_type="boolean", allowed_values=[True])}),
+    dict(label_template_filter_or={"tone": LabelTemplateFilter(label_name="tone", label_type="string", allowed_values=["angry", "happy"]),
+                                   "score": LabelTemplateFilter(label_name="score", label_type="integer", min_label_value=1, max_label_value=4)}),
+    dict(label_template_filter_and={"score": LabelTemplateFilter(label_name="score", label_type="integer", min_label_value=2)},
+         filter_misc=FilterMisc(min_upvotes=3, reddit_message_type="comment")),
+    dict(filter_misc=FilterMisc(max_depth=1)),
+]
+
+
+@pytest.mark.parametrize("experiment_id", ["collection", "legacy"])
+@pytest.mark.parametrize("filtering_case", range(len(FILTERING_CASES)))
+def test_compiled_query_selects_what_filter_cluster_units_selects(in_memory_db, experiment_id, filtering_case):
+    """Test the compiled query and the counts of count_filtered_cluster_units match filter_cluster_units in python, for runs in the
+    prediction collection and for runs embedded in predicted_category of the cluster units"""
+    rng = random.Random(filtering_case)
+    cluster_units = [make_cluster_unit(rng.randint(0, 6), reddit_id=f"reddit_{index}", depth=rng.randint(0, 2), type=rng.choice(["post", "comment"]),
+                                       predicted_category={"legacy": _random_runs(rng, "legacy")})
+                     for index in range(12)]
+    # inserted against the _id order, so that the order of the input differs from the order of the pages
+    get_cluster_unit_repository().insert_list_entities(cluster_units[::-1])
+    get_prediction_repository().upsert_predicted_categories("collection", {cluster_unit.id: _random_runs(rng, "collection") for cluster_unit in cluster_units})
+    get_cluster_repository().insert(ClusterEntity(id="cluster", scraper_entity_id="scraper", text_thread_mode=ClusterTextThreadModeType.PlainText,
+                                                  status=StatusType.Completed, post_entity_ids_prep_status=dict(), media_strategy_skip_type=MediaStrategySkipType.Ignore))
+    experiment_entity = _experiment(experiment_id)
+    get_experiment_repository().insert(experiment_entity)
+    filtering_fields = FilteringFields(label_template_id="template", input_id=experiment_id, input_type="experiment", **FILTERING_CASES[filtering_case])
+
+    expected_units = FilteringService.filter_cluster_units(ExperimentService.get_input_cluster_unit_entities_from_expertiment(experiment_entity), filtering_fields, experiment_entity)
+    expected_ids = {cluster_unit.id for cluster_unit in expected_units}
+    filtering_query = FilteringService.compile_filtering_query(filtering_fields, experiment_entity)
+
+    assert filtering_query is not None
+    assert set(get_cluster_unit_repository().find_ids({"$and": [{"cluster_entity_id": "cluster"}, filtering_query]})) == expected_ids
+    assert FilteringService.count_filtered_cluster_units(filtering_fields) == (12, len(expected_ids))
+    page, _ = FilteringService.find_filtered_cluster_units_page(filtering_fields, limit=100)
+    assert {cluster_unit.id for cluster_unit in page} == expected_ids
+    # without pagination the matches keep the order of the input
+    assert [cluster_unit.id for cluster_unit in FilteringService.find_filtered_cluster_units(filtering_fields)] == [cluster_unit.id for cluster_unit in expected_units]
+    assert [cluster_unit.id for cluster_unit in FilteringService.find_filtered_cluster_units(filtering_fields, limit=2)] == [cluster_unit.id for cluster_unit in expected_units[:2]]
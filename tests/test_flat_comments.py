@@ -0,0 +1,60 @@
+"""Tests for the flat comments layout of the posts"""
+import pytest
+
+from app.database import get_cluster_unit_repository, get_post_repository
+from app.database.entities.cluster_entity import ClusterEntity, ClusterTextThreadModeType
+from app.database.entities.comment_row_entity import flatten_comment_subtree
+from app.database.entities.post_entity import PostEntity
+from app.services.cluster_prep_service import ClusterPrepService
+from app.utils.types import MediaStrategySkipType, StatusType
+from tests.conftest import make_comment, make_post
+
+
+def _post() -> PostEntity:
+    return make_post("post", [make_comment("a", 0, [make_comment("a1", 1, [make_comment("a1x", 2)]), make_comment("a2", 1)]), make_comment("b")])
+
+
+def test_flat_layout_round_trips_the_comment_tree(in_memory_db, monkeypatch):
+    """Test a post with the flat layout is stored without comments and is reassembled into the same tree"""
+    monkeypatch.setenv("POST_COMMENTS_LAYOUT", "flat")
+    post = _post()
+    get_post_repository().insert(post)
+
+    assert get_post_repository().find_by_id(post.id).comments == []
+    assert get_post_repository().find_by_id_with_comments(post.id).comments == post.comments
+    subtree_rows = get_post_repository().comment_repository.find_subtree_rows(post.id, "00000.00000")
+    assert [row.reddit_id for row in subtree_rows] == ["a1", "a1x"]
+
+
+def test_replace_subtree_only_touches_the_subtree(in_memory_db, monkeypatch):
+    """Test a refreshed subtree replaces only the rows below its comment"""
+    monkeypatch.setenv("POST_COMMENTS_LAYOUT", "flat")
+    post = _post()
+    get_post_repository().insert(post)
+    comment_repository = get_post_repository().comment_repository
+    comment_a = comment_repository.find_subtree_rows(post.id, "00000")[0]
+
+    refreshed_comment = make_comment("a", 0, [make_comment("a3", 1)])
+    refreshed_comment.id = comment_a.id
+    comment_repository.replace_subtree_rows(post.id, comment_a.path, flatten_comment_subtree(post.id, refreshed_comment, None, comment_a.path))
+
+    assert [row.reddit_id for row in comment_repository.find_post_rows(post.id)] == ["a", "a3", "b"]
+
+
+@pytest.mark.parametrize("comments_layout", ["nested", "flat"])
+def test_cluster_units_are_the_same_for_both_layouts(in_memory_db, comments_layout, monkeypatch):
+    """Test cluster prep gives the same cluster units, replies, nested reply counts and threads for the nested and the flat layout"""
+    monkeypatch.setenv("POST_COMMENTS_LAYOUT", comments_layout)
+    post = _post()
+    get_post_repository().insert(post)
+    cluster_entity = ClusterEntity(scraper_entity_id="scraper", text_thread_mode=ClusterTextThreadModeType.PlainText, status=StatusType.Ongoing,
+                                   post_entity_ids_prep_status={post.id: StatusType.Ongoing}, media_strategy_skip_type=MediaStrategySkipType.Ignore)
+    ClusterPrepService.prepare_post_batch(cluster_entity, [post.id])
+
+    cluster_units = get_cluster_unit_repository().find({})
+    reddit_ids = {cluster_unit.id: cluster_unit.reddit_id for cluster_unit in cluster_units}
+    post_text = "post_title: title\npost text"
+    assert [(cluster_unit.reddit_id, reddit_ids.get(cluster_unit.replied_to_cluster_unit_id), cluster_unit.total_nested_replies, cluster_unit.thread_path_text)
+            for cluster_unit in cluster_units] == [
+        ("post", None, 5, []), ("a", "post", 3, [post_text]), ("a1", "a", 1, [post_text, "text a"]), ("a1x", "a1", 0, [post_text, "text a", "text a1"]),
+        ("a2", "a", 0, [post_text, "text a"]), ("b", "post", 0, [post_text])]
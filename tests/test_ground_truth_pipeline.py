@@ -0,0 +1,27 @@
+"""Tests for the pipeline updates of the ground truth values"""
+from app.database.cluster_unit_repository import ClusterUnitRepository
+
+
+def test_set_none_pipeline_uses_default_per_label():
+    """Test the None defaults are picked per label, without setting any label"""
+    pipeline = ClusterUnitRepository.ground_truth_values_pipeline(label_template_id="template", none_default_values={"problem": False, "tone": "neutral"})
+
+    updated_values = pipeline[0]["$set"]["ground_truth.template.values"]
+    label_map = updated_values["$arrayToObject"]["$map"]
+    assert label_map["input"] == {"$objectToArray": {"$ifNull": ["$ground_truth.template.values", {}]}}
+    new_value = label_map["in"]["v"]["$cond"][1]["$mergeObjects"][1]["value"]
+    none_default = new_value["$cond"][1]
+    assert none_default["$switch"]["branches"] == [{"case": {"$eq": ["$$label.k", "problem"]}, "then": {"$literal": False}},
+                                                   {"case": {"$eq": ["$$label.k", "tone"]}, "then": {"$literal": "neutral"}}]
+    assert none_default["$switch"]["default"] == {"$literal": None}
+
+
+def test_set_value_pipeline_creates_missing_label():
+    """Test a set value is applied to the existing label and also creates the label when it does not exist"""
+    pipeline = ClusterUnitRepository.ground_truth_values_pipeline(label_template_id="template", set_values={"problem": "$not_a_field"}, none_default_value=False)
+
+    updated_values = pipeline[0]["$set"]["ground_truth.template.values"]["$mergeObjects"]
+    assert updated_values[0] == {"problem": {"value": {"$literal": "$not_a_field"}}}
+    new_value = updated_values[1]["$arrayToObject"]["$map"]["in"]["v"]["$cond"][1]["$mergeObjects"][1]["value"]
+    assert new_value["$switch"]["branches"] == [{"case": {"$eq": ["$$label.k", "problem"]}, "then": {"$literal": "$not_a_field"}}]
+    assert new_value["$switch"]["default"]["$cond"][1] == {"$literal": False}
@@ -0,0 +1,70 @@
+"""Tests for the in-memory storage backend and the repositories on top of it"""
+from pymongo import ReplaceOne, UpdateOne
+
+from app.database.cluster_unit_repository import ClusterUnitRepository
+from app.database.entities.label_template import LabelTemplateTruthProjection, LabelValueField
+from app.database.storage import InMemoryDatabase
+from tests.conftest import make_cluster_unit
+
+
+def test_query_and_update_operators():
+    """Test the filters, update operators and pipeline updates that the repositories use"""
+    collection = InMemoryDatabase().get_collection("documents")
+    collection.insert_many([{"_id": "a", "tags": ["x"], "nested": {"count": 1}}, {"_id": "b", "tags": [], "nested": None}])
+
+    collection.update_one({"_id": "a"}, {"$push": {"tags": {"$each": ["y", "z"]}}, "$set": {"nested.count": 2, "nested.new.field": True}})
+    collection.update_many({}, [{"$set": {"merged": {"$mergeObjects": ["$nested", {"$literal": {"extra": "$not_a_field"}}]}}}])
+
+    document = collection.find_one({"tags": "y"})
+    assert document["tags"] == ["x", "y", "z"]
+    assert document["merged"] == {"count": 2, "new": {"field": True}, "extra": "$not_a_field"}
+    assert collection.find_one({"_id": "b"})["merged"] == {"extra": "$not_a_field"}
+    assert [document["_id"] for document in collection.find({"nested.count": {"$in": [2, 3]}})] == ["a"]
+    assert collection.count_documents({"missing_field": None}) == 2
+
+
+def test_bulk_write_upserts_and_returns_copies():
+    """Test bulk upserts take the equality fields of the filter, and returned documents cannot change the stored ones"""
+    collection = InMemoryDatabase().get_collection("documents")
+
+    result = collection.bulk_write([UpdateOne({"key": 1}, {"$set": {"value": "a"}, "$setOnInsert": {"_id": "one"}}, upsert=True),
+                                    UpdateOne({"key": 1}, {"$set": {"value": "b"}, "$setOnInsert": {"_id": "other"}}, upsert=True),
+                                    ReplaceOne({"_id": "two"}, {"value": "c"}, upsert=True)], ordered=False)
+
+    assert (result.upserted_count, result.modified_count) == (2, 1)
+    assert collection.find_one({"_id": "one"}) == {"_id": "one", "key": 1, "value": "b"}
+    collection.find_one({"_id": "two"})["value"] = "changed"
+    assert collection.find_one({"_id": "two"})["value"] == "c"
+
+
+def test_repository_ground_truth_pipeline_updates():
+    """Test the pipeline ground truth updates of the cluster unit repository without a MongoDB server"""
+    repository = ClusterUnitRepository(InMemoryDatabase())
+    cluster_units = [make_cluster_unit(upvotes) for upvotes in range(3)]
+    repository.insert_list_entities(cluster_units)
+    cluster_unit_ids = [cluster_unit.id for cluster_unit in cluster_units]
+    ground_truth_field = LabelTemplateTruthProjection(label_template_id="template",
+                                                      values={label: LabelValueField(label=label, value=None, type="boolean") for label in ("problem", "solution")})
+
+    assert repository.initialize_ground_truths(cluster_unit_ids, "template", ground_truth_field) == 3
+    repository.update_ground_truth_category(cluster_unit_ids[0], "template", "problem", True)
+    assert repository.set_none_ground_truths_to_false(cluster_unit_ids, "template", {"problem": False, "solution": False}) == 2
+
+    values = [repository.find_by_id(cluster_unit_id).ground_truth["template"].values for cluster_unit_id in cluster_unit_ids]
+    assert [(unit_values["problem"].value, unit_values["solution"].value) for unit_values in values] == [(True, False), (False, False), (False, False)]
+
+
+def test_repository_keyset_pages():
+    """Test the keyset pages follow each other without gaps or repeats"""
+    repository = ClusterUnitRepository(InMemoryDatabase())
+    repository.insert_list_entities([make_cluster_unit(upvotes % 3) for upvotes in range(7)])
+
+    upvotes, after = list(), None
+    while True:
+        page = repository.find_after({"cluster_entity_id": "cluster"}, sort_field="upvotes", direction=-1, after=after, size=3)
+        upvotes.extend(cluster_unit.upvotes for cluster_unit in page.content)
+        after = page.next_after
+        if after is None:
+            break
+
+    assert upvotes == [2, 2, 1, 1, 0, 0, 0]
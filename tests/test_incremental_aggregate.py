@@ -0,0 +1,36 @@
+"""Tests for the running counters of the aggregate result"""
+import random
+
+from app.database.entities.cluster_unit_entity import LabelPredictionCounter
+from app.database.entities.experiment_entity import PredictionResult
+from app.services.experiment_service import ExperimentService
+
+
+def test_confusion_counts_per_threshold_match_full_pass():
+    """Test the running confusion counts equal the confusion matrix computed over all units"""
+    random.seed(3)
+    runs_per_unit = 3
+    prediction_result = PredictionResult()
+    for _ in range(100):
+        true_runs = random.randint(0, runs_per_unit)
+        value_counter = {"True": true_runs, "False": runs_per_unit - true_runs}
+        value_counter = {value_key: count for value_key, count in value_counter.items() if count > 0}
+        label_prediction_counter = LabelPredictionCounter(label_name="problem_description", value_counter=value_counter)
+        prediction_result.insert_cluster_unit_label_prediction_counter(label_prediction_counter,
+                                                                       ground_truth_value=random.random() < 0.5,
+                                                                       runs_per_unit=runs_per_unit)
+
+    for threshold in range(runs_per_unit + 1):
+        full_pass = ExperimentService.calculate_confusion_matrix(prediction_result=prediction_result, user_threshold=threshold)
+        running_counts = prediction_result.get_confusion_counts(threshold)
+        assert (running_counts.tp, running_counts.fp, running_counts.fn, running_counts.tn) == (full_pass.tp, full_pass.fp, full_pass.fn, full_pass.tn)
+
+
+def test_inter_run_agreement():
+    """Test unanimous units and the majority share are tracked per label"""
+    prediction_result = PredictionResult()
+    prediction_result.insert_cluster_unit_label_prediction_counter(LabelPredictionCounter(label_name="a", value_counter={"True": 3}), True)
+    prediction_result.insert_cluster_unit_label_prediction_counter(LabelPredictionCounter(label_name="a", value_counter={"True": 2, "False": 1}), True)
+
+    assert prediction_result.inter_run_agreement.get_unanimous_rate() == 0.5
+    assert prediction_result.inter_run_agreement.get_mean_majority_share() == 5 / 6
@@ -0,0 +1,22 @@
+"""Tests for the declarative index registry"""
+from app.database.base_repository import BaseRepository
+from app.database.indexes import REGISTERED_REPOSITORIES
+
+
+def test_every_repository_is_registered():
+    """Test all repositories are in the registry, so their indexes are applied at startup"""
+    import app.database as database_module
+
+    repository_classes = {value for value in vars(database_module).values() if isinstance(value, type) and issubclass(value, BaseRepository)}
+
+    assert repository_classes <= set(REGISTERED_REPOSITORIES)
+
+
+def test_soft_delete_indexes_end_with_deleted_at():
+    """Test the declared index names are unique per collection and soft delete indexes end with deleted_at"""
+    for repository_class in REGISTERED_REPOSITORIES:
+        names = [index_model.document["name"] for index_model in repository_class.indexes]
+        assert len(names) == len(set(names))
+        for index_model in repository_class.indexes:
+            if "deleted_at" in index_model.document["key"]:
+                assert list(index_model.document["key"])[-1] == "deleted_at"
@@ -0,0 +1,40 @@
+"""Tests for the after tokens of keyset pagination"""
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from app.database import get_cluster_unit_repository
+from app.database.base_repository import InvalidPageToken, decode_after_token, encode_after_token
+from app.requests.cluster_prep_requests import GetClusterUnitsRequest
+from app.requests.filtering_requests import FilteringRequest
+
+
+def test_after_token_round_trip():
+    """Test the sort value and _id survive the token, also for dates"""
+    created_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+    assert decode_after_token(encode_after_token(42, "65f0c0ffee")) == (42, "65f0c0ffee")
+    sort_value, last_id = decode_after_token(encode_after_token(created_at, "65f0c0ffee"))
+    assert sort_value.replace(tzinfo=timezone.utc) == created_at
+    assert last_id == "65f0c0ffee"
+
+
+def test_invalid_after_token(in_memory_db):
+    """Test a token that was not created by encode_after_token is rejected with InvalidPageToken, also by find_after"""
+    with pytest.raises(InvalidPageToken, match="invalid pagination token"):
+        decode_after_token("not a token")
+    with pytest.raises(InvalidPageToken):
+        get_cluster_unit_repository().find_after({}, after="not a token")
+
+
+@pytest.mark.parametrize("page_size", [0, -1, 1001])
+def test_page_size_is_bounded(in_memory_db, page_size):
+    """Test an empty, negative (unlimited in mongodb) or too large page is rejected by the requests and by find_after"""
+    with pytest.raises(ValidationError):
+        GetClusterUnitsRequest(scraper_cluster_id="scraper_cluster", page_size=page_size)
+    with pytest.raises(ValidationError):
+        FilteringRequest(label_template_id="template", input_id="cluster", input_type="cluster", limit=page_size)
+    if page_size < 1:
+        with pytest.raises(ValueError, match="page size"):
+            get_cluster_unit_repository().find_after({}, size=page_size)
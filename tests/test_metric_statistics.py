@@ -0,0 +1,108 @@
+"""Tests for the vectorized metric statistics"""
+import numpy as np
+
+from app.database.entities.cluster_unit_entity import LabelPredictionCounter
+from app.database.entities.experiment_entity import PredictionResult, PrevelanceUnitDistribution
+from app.responses.get_experiments_response import ConfusionMatrix
+from app.utils.metric_statistics import bootstrap_accuracy_kappa, cohens_kappa_from_counts, pack_prediction_truth_arrays, pairwise_agreement_tensor
+
+
+def test_pack_prediction_truth_arrays_applies_threshold():
+    """Test packing uses the same threshold rules as the confusion matrix"""
+    individual_predictions = [
+        PrevelanceUnitDistribution(value_key="True", runs_predicted=3, is_ground_truth=True),
+        PrevelanceUnitDistribution(value_key="True", runs_predicted=1, is_ground_truth=True),
+        PrevelanceUnitDistribution(value_key="False", runs_predicted=2, is_ground_truth=False),
+        PrevelanceUnitDistribution(value_key="other", runs_predicted=3, is_ground_truth=True),
+    ]
+
+    predicted, truth, units = pack_prediction_truth_arrays(individual_predictions, user_threshold=2)
+
+    assert predicted.tolist() == [True, False, False]
+    assert truth.tolist() == [True, True, False]
+    assert len(set(units.tolist())) == 3
+
+
+def test_pack_prediction_truth_arrays_groups_the_rows_of_a_unit():
+    """Test the rows of a unit whose runs disagree share a unit code"""
+    individual_predictions = [
+        PrevelanceUnitDistribution(value_key="True", runs_predicted=2, is_ground_truth=True, unit_index=0),
+        PrevelanceUnitDistribution(value_key="False", runs_predicted=1, is_ground_truth=False, unit_index=0),
+        PrevelanceUnitDistribution(value_key="True", runs_predicted=3, is_ground_truth=True, unit_index=1),
+    ]
+
+    _, _, units = pack_prediction_truth_arrays(individual_predictions, user_threshold=2)
+
+    assert units.tolist() == [0, 0, 1]
+
+    prediction_result = PredictionResult()
+    prediction_result.insert_cluster_unit_label_prediction_counter(LabelPredictionCounter(label_name="label", value_counter={"True": 2, "False": 1}), True)
+    prediction_result.insert_cluster_unit_label_prediction_counter(LabelPredictionCounter(label_name="label", value_counter={"True": 3}), True)
+    assert [row.unit_index for row in prediction_result.individual_prediction_truth_label_list] == [0, 0, 1]
+
+
+def test_cohens_kappa_matches_confusion_matrix():
+    """Test the vectorized kappa equals ConfusionMatrix.get_cohens_kappa"""
+    for tp, fp, fn, tn in [(10, 2, 3, 15), (5, 0, 0, 5), (0, 0, 0, 7), (4, 4, 4, 4), (0, 0, 0, 0)]:
+        expected = ConfusionMatrix(tp=tp, fp=fp, fn=fn, tn=tn).get_cohens_kappa()
+        assert np.isclose(float(cohens_kappa_from_counts(tp, fp, fn, tn)), expected)
+
+
+def test_bootstrap_interval_contains_point_estimate():
+    """Test the bootstrap interval brackets the point estimate and is reproducible"""
+    rng = np.random.default_rng(42)
+    truth = rng.random(300) < 0.4
+    predicted = np.where(rng.random(300) < 0.8, truth, ~truth)
+
+    result = bootstrap_accuracy_kappa(predicted, truth, n_resamples=1000, batch_size=128, seed=1)
+
+    expected_accuracy = float(np.mean(predicted == truth))
+    assert np.isclose(result["accuracy"]["estimate"], expected_accuracy)
+    assert result["accuracy"]["lower"] <= expected_accuracy <= result["accuracy"]["upper"]
+    assert result["kappa"]["lower"] <= result["kappa"]["estimate"] <= result["kappa"]["upper"]
+    assert result == bootstrap_accuracy_kappa(predicted, truth, n_resamples=1000, batch_size=128, seed=1)
+
+
+def test_bootstrap_resamples_units_with_all_of_their_rows():
+    """Test a unit is drawn with all of its rows: doubling every unit into two identical rows gives the interval of the single rows,
+    while resampling the doubled rows independently gives a narrower one"""
+    rng = np.random.default_rng(7)
+    truth = rng.random(200) < 0.5
+    predicted = np.where(rng.random(200) < 0.7, truth, ~truth)
+    doubled_predicted, doubled_truth, doubled_units = np.repeat(predicted, 2), np.repeat(truth, 2), np.repeat(np.arange(200), 2)
+
+    row_result = bootstrap_accuracy_kappa(predicted, truth, n_resamples=500, seed=3)
+    unit_result = bootstrap_accuracy_kappa(doubled_predicted, doubled_truth, doubled_units, n_resamples=500, seed=3)
+    independent_result = bootstrap_accuracy_kappa(doubled_predicted, doubled_truth, n_resamples=500, seed=3)
+
+    assert unit_result == row_result
+    row_width = row_result["accuracy"]["upper"] - row_result["accuracy"]["lower"]
+    assert independent_result["accuracy"]["upper"] - independent_result["accuracy"]["lower"] < row_width
+
+
+def test_bootstrap_without_units():
+    """Test an empty label returns a zero width interval"""
+    result = bootstrap_accuracy_kappa(np.array([], dtype=bool), np.array([], dtype=bool))
+
+    assert result["accuracy"] == {"estimate": 0.0, "lower": 0.0, "upper": 0.0}
+
+
+def test_pairwise_agreement_tensor():
+    """Test the pairwise counts, agreement and kappa of the agreement tensor"""
+    predicted = np.array([
+        [[True, True, False, False]],
+        [[True, False, False, True]],
+    ])
+    available = np.ones(predicted.shape, dtype=bool)
+    available[1, 0, 3] = False
+
+    agreement = pairwise_agreement_tensor(predicted, available)
+
+    assert agreement["percent_agreement"].shape == (2, 2, 1)
+    assert agreement["compared_unit_count"][0, 1, 0] == 3
+    assert agreement["mcnemar_b"][0, 1, 0] == 1
+    assert agreement["mcnemar_c"][0, 1, 0] == 0
+    assert np.isclose(agreement["percent_agreement"][0, 1, 0], 2 / 3)
+    assert np.isclose(agreement["percent_agreement"][0, 0, 0], 1.0)
+    expected_kappa = ConfusionMatrix(tp=1, fp=1, fn=0, tn=1).get_cohens_kappa()
+    assert np.isclose(agreement["kappa"][0, 1, 0], expected_kappa)
@@ -0,0 +1,82 @@
+"""Tests for the two-phase expansion of the 'more' stubs of a reddit comment tree"""
+import asyncio
+from typing import List
+
+from app.responses.reddit_post_comments_response import RedditResponse
+from app.utils.reddit_scraper_api import MoreCommentsExpander
+
+
+def _comment_data(id: str, parent_id: str, replies=None) -> dict:
+    return {"id": id, "subreddit": "deaf", "ups": 1, "downs": 0, "send_replies": True, "permalink": f"/r/deaf/comments/post/{id}/",
+            "author_flair_text": None, "author": "author", "created_utc": 1700000000, "body": f"body {id}", "controversiality": 0,
+            "depth": 0, "parent_id": parent_id, "replies": _listing(replies) if replies else ""}
+
+
+def _comment(id: str, parent_id: str, replies=None) -> dict:
+    return {"kind": "t1", "data": _comment_data(id, parent_id, replies)}
+
+
+def _more(id: str, children: List[str], parent_id: str) -> dict:
+    return {"kind": "more", "data": {"count": len(children), "name": f"t1_{id}", "id": id, "parent_id": parent_id, "depth": 0, "children": children}}
+
+
+def _listing(children: list) -> dict:
+    return {"kind": "Listing", "data": {"after": None, "dist": None, "modhash": None, "before": None, "children": children}}
+
+
+def _reply_ids(comment) -> List[str]:
+    return [child.data.id for child in comment.replies.data.children] if comment.replies else []
+
+
+def test_stubs_of_the_whole_tree_are_fetched_in_one_batch_per_round():
+    """Test all stubs are collected into maximal batches, the results are spliced under their parent and new stubs get another round"""
+    # the tree: a -> a1 -> (more: a11), a -> (more: a2), (more: b)
+    tree = _listing([
+        _comment("a", "t3_post", replies=[
+            _comment("a1", "t1_a", replies=[_more("m3", ["a11"], "t1_a1")]),
+            _more("m2", ["a2"], "t1_a"),
+        ]),
+        _more("m1", ["b"], "t3_post"),
+    ])
+    fetched = {
+        "a11": [_comment("a11", "t1_a1")],
+        "a2": [_comment("a2", "t1_a"), _comment("a21", "t1_a2"), _more("m4", ["a22"], "t1_a2")],
+        "b": [_comment("b", "t3_post")],
+        "a22": [_comment("a22", "t1_a2")],
+    }
+    batches = []
+
+    async def fetch_things(comment_ids: List[str]) -> List[dict]:
+        batches.append(sorted(comment_ids))
+        return [thing for comment_id in comment_ids for thing in fetched[comment_id]]
+
+    comments = asyncio.run(MoreCommentsExpander(fetch_things).expand(RedditResponse.model_validate(tree).data.children))
+
+    assert batches == [["a11", "a2", "b"], ["a22"]]
+    assert [comment.id for comment in comments] == ["a", "b"]
+    a = comments[0]
+    assert _reply_ids(a) == ["a1", "a2"]
+    assert _reply_ids(a.replies.data.children[0].data) == ["a11"]
+    assert _reply_ids(a.replies.data.children[1].data) == ["a21", "a22"]
+
+
+def test_batches_are_bounded_and_failures_skipped():
+    """Test the ids are split in batches of batch_size with bounded concurrency, and a failing batch only loses its own comments"""
+    stub_ids = [f"c{index}" for index in range(7)]
+    tree = _listing([_more("m1", stub_ids, "t3_post")])
+    state = {"in_flight": 0, "max_in_flight": 0}
+
+    async def fetch_things(comment_ids: List[str]) -> List[dict]:
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.01)
+        state["in_flight"] -= 1
+        if "c0" in comment_ids:
+            raise Exception("reddit is down")
+        return [_comment(comment_id, "t3_post") for comment_id in comment_ids]
+
+    expander = MoreCommentsExpander(fetch_things, batch_size=2, max_concurrency=2)
+    comments = asyncio.run(expander.expand(RedditResponse.model_validate(tree).data.children))
+
+    assert [comment.id for comment in comments] == ["c2", "c3", "c4", "c5", "c6"]
+    assert state["max_in_flight"] == 2
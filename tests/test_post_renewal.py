@@ -0,0 +1,99 @@
+"""Tests for the incremental renewal of the stored posts"""
+from datetime import timedelta
+from typing import List
+
+import bson
+import pytest
+
+from app.database import get_post_repository
+from app.database.entities.post_entity import CommentEntity
+from app.responses.reddit_post_comments_response import MediaMetaData
+from app.services.post_renewal_service import PostRenewalReport, PostRenewalService
+from app.utils import utc_timestamp
+from tests.conftest import make_comment, make_post
+
+
+def _stored_comments() -> List[CommentEntity]:
+    return [make_comment("a", 0, [make_comment("a1", 1, [])]), make_comment("b", 0, [])]
+
+
+def _renewed_comments() -> List[CommentEntity]:
+    """a1 got upvotes, a2 and b1 are new replies"""
+    return [make_comment("a", 0, [make_comment("a1", 1, [], upvotes=5), make_comment("a2", 1, [])]), make_comment("b", 0, [make_comment("b1", 1, [])])]
+
+
+@pytest.mark.parametrize("comments_layout", ["nested", "flat"])
+def test_only_changes_are_written_and_comment_ids_are_kept(in_memory_db, comments_layout, monkeypatch):
+    """Test the renewal keeps the _id of the stored comments, updates their scores, adds the new comments after the stored replies
+    and schedules the next renewal, for both comment layouts"""
+    monkeypatch.setenv("POST_COMMENTS_LAYOUT", comments_layout)
+    stored_post = make_post("post", _stored_comments())
+    get_post_repository().insert(stored_post)
+    stored_ids = {row.reddit_id: row.id for row in get_post_repository().find_comment_rows(get_post_repository().find_by_id(stored_post.id))}
+
+    report = PostRenewalReport()
+    renewed_post = make_post("post", _renewed_comments(), upvotes=3)
+    PostRenewalService.renew_posts([get_post_repository().find_by_id(stored_post.id)], {"post": renewed_post}, report)
+
+    assert report.model_dump() == {"renewed": 1, "changed_posts": 1, "changed_comments": 1, "new_comments": 2, "failed": 0}
+    post = get_post_repository().find_by_id_with_comments(stored_post.id)
+    assert post.upvotes == 3
+    assert post.last_renewed_at is not None and post.next_renewal_at > post.last_renewed_at
+    a, b = post.comments
+    assert [a.id, a.replies[0].id, b.id] == [stored_ids["a"], stored_ids["a1"], stored_ids["b"]]
+    assert [reply.reddit_id for reply in a.replies] == ["a1", "a2"]
+    assert a.replies[0].upvotes == 5
+    assert [reply.reddit_id for reply in b.replies] == ["b1"]
+    rows = get_post_repository().find_comment_rows(post)
+    assert {row.reddit_id: row.path for row in rows}["a2"] == "00000.00001"
+
+
+def test_unchanged_and_failed_posts_are_only_rescheduled(in_memory_db):
+    """Test a post without changes only gets a new schedule, a post that could not be fetched is retried later and the posts that are not due are skipped"""
+    unchanged_post, failed_post, later_post = make_post("unchanged", _stored_comments()), make_post("failed", []), make_post("later", [])
+    later_post.next_renewal_at = utc_timestamp() + timedelta(days=1)
+    get_post_repository().insert_list_entities([unchanged_post, failed_post, later_post])
+
+    due_posts = get_post_repository().find_due_for_renewal(utc_timestamp(), limit=10)
+    assert sorted(post.reddit_id for post in due_posts) == ["failed", "unchanged"]
+
+    report = PostRenewalReport()
+    PostRenewalService.renew_posts(due_posts, {"unchanged": make_post("unchanged", _stored_comments())}, report)
+
+    assert report.model_dump() == {"renewed": 1, "changed_posts": 0, "changed_comments": 0, "new_comments": 0, "failed": 1}
+    assert get_post_repository().find_by_id(unchanged_post.id).updated_at is None
+    assert get_post_repository().find_due_for_renewal(utc_timestamp(), limit=10) == []
+
+
+def test_changed_media_metadata_is_written_as_bson_documents(in_memory_db):
+    """Test a post and a comment whose media changed on reddit give update documents that mongodb can encode"""
+    stored_post = make_post("post", _stored_comments())
+    get_post_repository().insert(stored_post)
+    stored_post = get_post_repository().find_by_id(stored_post.id)
+    media_metadata = {"media": MediaMetaData(id="media", status="valid", e="Image")}
+    renewed_post = make_post("post", _stored_comments())
+    renewed_post.media_metadata = media_metadata
+    renewed_post.comments[1].media_metadata = media_metadata
+
+    diff = PostRenewalService.diff_post(stored_post, get_post_repository().find_comment_rows(stored_post), renewed_post)
+
+    assert diff.post_changes == {"media_metadata": {"media": media_metadata["media"].model_dump(by_alias=True)}}
+    assert list(diff.changed_rows.values()) == [diff.post_changes]
+    for to_update in [diff.post_changes, *diff.changed_rows.values()]:
+        bson.encode({"$set": to_update})
+    assert {row.reddit_id: row.media_metadata for row in diff.rows}["b"] == media_metadata
+
+    PostRenewalService.renew_posts([stored_post], {"post": renewed_post}, PostRenewalReport())
+    post = get_post_repository().find_by_id_with_comments(stored_post.id)
+    assert post.media_metadata == media_metadata and post.comments[1].media_metadata == media_metadata
+
+
+def test_renewal_interval_follows_age_and_activity():
+    """Test young and active posts are renewed more often than old and quiet posts, within the bounds"""
+    now = utc_timestamp()
+    one_day_old = (now - timedelta(days=1)).timestamp()
+    one_year_old = (now - timedelta(days=365)).timestamp()
+
+    assert PostRenewalService.renewal_interval(one_day_old, 0, now) == PostRenewalService.MIN_RENEWAL_INTERVAL
+    assert PostRenewalService.renewal_interval(one_year_old, 0, now) == PostRenewalService.MAX_RENEWAL_INTERVAL
+    assert PostRenewalService.renewal_interval(one_year_old, 20, now) < PostRenewalService.renewal_interval(one_year_old, 1, now)
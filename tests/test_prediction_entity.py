@@ -0,0 +1,22 @@
+"""Tests for splitting the embedded predictions into prediction documents"""
+from app.database.entities.cluster_unit_entity import ClusterUnitEntityPredictedCategory, PredictionCategoryTokens
+from app.database.entities.label_template import LabelTemplateLLMProjection
+from app.database.entities.prediction_entity import PredictionEntity
+
+
+def _prediction(run: int) -> PredictionCategoryTokens:
+    return PredictionCategoryTokens(labels_prediction=LabelTemplateLLMProjection(label_template_id="template", experiment_id="experiment"),
+                                    tokens_used={"run": run})
+
+
+def test_predicted_category_round_trip():
+    """Test a predicted category split per run is grouped back in run order, with the errors kept once"""
+    predicted_category = ClusterUnitEntityPredictedCategory(experiment_id="experiment",
+                                                            predicted_categories=[_prediction(0), _prediction(1), _prediction(2)],
+                                                            errors=["timeout"])
+
+    prediction_entities = PredictionEntity.from_predicted_category(cluster_unit_id="unit", predicted_category=predicted_category)
+
+    assert [prediction_entity.run_index for prediction_entity in prediction_entities] == [0, 1, 2]
+    assert [prediction_entity.errors for prediction_entity in prediction_entities] == [["timeout"], None, None]
+    assert PredictionEntity.to_predicted_category("experiment", list(reversed(prediction_entities))) == predicted_category
@@ -0,0 +1,182 @@
+"""Tests for the async reddit scraper and the rate limit governor driven by the reddit response headers"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from app.utils.rate_limiters import RedditRateLimitGovernor
+from app.utils.reddit_async_scraper_api import AsyncRedditScraperAPI
+from app.utils.reddit_token_provider import RedditTokenProvider
+
+
+def _token_provider() -> RedditTokenProvider:
+    token_provider = RedditTokenProvider("client", "secret", "user", "password")
+    token_provider._request_token = lambda: ("token", time.monotonic() + 3600)
+    return token_provider
+
+
+def _message(id: str) -> dict:
+    return {"id": id, "subreddit": "deaf", "ups": 1, "downs": 0, "send_replies": True, "permalink": f"/r/deaf/comments/post/{id}/",
+            "author_flair_text": None, "author": "author", "created_utc": 1700000000}
+
+
+def _comment(id: str, replies=None, depth: int = 0, parent_id: str = "t3_post") -> dict:
+    data = {**_message(id), "body": f"body {id}", "controversiality": 0, "depth": depth, "parent_id": parent_id, "replies": _listing(replies) if replies else ""}
+    return {"kind": "t1", "data": data}
+
+
+def _more(id: str, children: list, parent_id: str, depth: int = 0) -> dict:
+    return {"kind": "more", "data": {"count": len(children), "name": f"t1_{id}", "id": id, "parent_id": parent_id, "depth": depth, "children": children}}
+
+
+def _listing(children: list) -> dict:
+    return {"kind": "Listing", "data": {"after": None, "dist": None, "modhash": None, "before": None, "children": children}}
+
+
+def _post_listing(id: str) -> dict:
+    post = {**_message(id), "title": "title", "upvote_ratio": 1.0, "selftext": "text", "link_flair_text": None, "selftext_html": None}
+    return _listing([{"kind": "t3", "data": post}])
+
+
+def test_governor_waits_for_the_reset_when_the_quota_is_spent():
+    """Test the governor lets requests through down to the reserve and then waits until the window resets"""
+    async def run():
+        governor = RedditRateLimitGovernor(reserve=1)
+        await governor.acquire()
+        governor.release({"x-ratelimit-remaining": "3", "x-ratelimit-reset": "0.3"})
+
+        start_time = time.monotonic()
+        await governor.acquire()
+        await governor.acquire()
+        assert time.monotonic() - start_time < 0.1
+        assert governor.in_flight == 2
+
+        # 3 remaining - 2 in flight = the reserve, the next request waits for the new window
+        await governor.acquire()
+        assert time.monotonic() - start_time >= 0.25
+        assert governor.get_metrics()["throttled_count"] == 1
+
+    asyncio.run(run())
+
+
+def test_governor_is_shared_by_the_event_loops_of_several_threads():
+    """Test the event loops of concurrent flask requests, each in its own thread, together never have more requests in flight than allowed"""
+    governor = RedditRateLimitGovernor(unknown_window_concurrency=3, poll_seconds=0.001)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    state_lock = threading.Lock()
+
+    async def run():
+        for _ in range(20):
+            await governor.acquire()
+            with state_lock:
+                state["in_flight"] += 1
+                state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            await asyncio.sleep(0.001)
+            with state_lock:
+                state["in_flight"] -= 1
+            governor.release()
+
+    threads = [threading.Thread(target=asyncio.run, args=(run(),)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["max_in_flight"] <= 3
+    assert governor.in_flight == 0
+    assert governor.get_metrics()["total_requests"] == 120
+
+
+def test_comment_tree_with_more_placeholders_is_fetched():
+    """Test the 'more' placeholders at the top level and in the replies are replaced by their comments in thread order"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        headers = {"x-ratelimit-remaining": "500", "x-ratelimit-reset": "300"}
+        if request.url.path == "/api/morechildren":
+            children = request.url.params["children"].split(",")
+            assert request.url.params["link_id"] == "t3_post"
+            things = [_comment(child, parent_id="t1_a" if child.startswith("a") else "t3_post") for child in children]
+            return httpx.Response(200, json={"json": {"data": {"things": things}}}, headers=headers)
+        comments = _listing([
+            _comment("a", replies=[_comment("a1", depth=1), _more("m2", ["a2", "a3"], "t1_a", depth=1)]),
+            _more("m1", ["b", "c"], "t3_post"),
+        ])
+        return httpx.Response(200, json=[_post_listing("post"), comments], headers=headers)
+
+    async def run():
+        async with AsyncRedditScraperAPI(_token_provider(), governor=RedditRateLimitGovernor(), transport=httpx.MockTransport(handler)) as scraper:
+            return await scraper.get_post_comments("/r/deaf/comments/post/title/")
+
+    full_post, comments = asyncio.run(run())
+    assert full_post.id == "post"
+    assert [comment.id for comment in comments] == ["a", "b", "c"]
+    assert [child.data.id for child in comments[0].replies.data.children] == ["a1", "a2", "a3"]
+
+
+def test_posts_are_fetched_concurrently_within_the_quota():
+    """Test the comment trees are fetched concurrently, but never with more requests than the quota the headers report"""
+    state = {"in_flight": 0, "max_in_flight": 0, "remaining": 6, "requests": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state["requests"] += 1
+        state["remaining"] -= 1
+        assert state["remaining"] >= 0, "the quota of the window was exceeded"
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.02)
+        state["in_flight"] -= 1
+        headers = {"x-ratelimit-remaining": str(state["remaining"]), "x-ratelimit-reset": "0.2"}
+        return httpx.Response(200, json=[_post_listing("post"), _listing([_comment("a")])], headers=headers)
+
+    async def run():
+        governor = RedditRateLimitGovernor(reserve=1, unknown_window_concurrency=2)
+        async with AsyncRedditScraperAPI(_token_provider(), max_connections=4, governor=governor, transport=httpx.MockTransport(handler)) as scraper:
+            results = await asyncio.gather(*(scraper.get_post_comments(f"/r/deaf/comments/post{index}/") for index in range(5)))
+            # the quota of the window is spent, the reset gives a new one
+            state["remaining"] = 6
+            results += await asyncio.gather(*(scraper.get_post_comments(f"/r/deaf/comments/post{index}/") for index in range(2)))
+        return results
+
+    results = asyncio.run(run())
+    assert len(results) == 7
+    assert state["max_in_flight"] > 1
+    assert state["requests"] == 7
+
+
+def test_rejected_token_is_refreshed_and_the_request_retried():
+    """Test a 401 response requests a new token and retries the request once with it"""
+    tokens = iter(["expired", "fresh"])
+    token_provider = RedditTokenProvider("client", "secret", "user", "password")
+    token_provider._request_token = lambda: (next(tokens), time.monotonic() + 3600)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.headers["Authorization"] == "bearer expired":
+            return httpx.Response(401)
+        return httpx.Response(200, json=[_post_listing("post"), _listing([])])
+
+    async def run():
+        async with AsyncRedditScraperAPI(token_provider, governor=RedditRateLimitGovernor(), transport=httpx.MockTransport(handler)) as scraper:
+            return await scraper.get_post_comments("/r/deaf/comments/post/title/")
+
+    full_post, comments = asyncio.run(run())
+    assert full_post.id == "post"
+    assert token_provider.get_headers()["Authorization"] == "bearer fresh"
+
+
+def test_rejected_token_after_the_rate_limit_retries_is_retried():
+    """Test a 401 on the last rate limit attempt still gets its token retry instead of ending without a response"""
+    statuses = iter([429, 429, 401, 200])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        status = next(statuses)
+        if status == 200:
+            return httpx.Response(200, json=[_post_listing("post"), _listing([])])
+        return httpx.Response(status, headers={"retry-after": "0.01"})
+
+    async def run():
+        async with AsyncRedditScraperAPI(_token_provider(), governor=RedditRateLimitGovernor(), transport=httpx.MockTransport(handler)) as scraper:
+            return await scraper.get_post_comments("/r/deaf/comments/post/title/")
+
+    full_post, comments = asyncio.run(run())
+    assert full_post.id == "post"
@@ -0,0 +1,94 @@
+"""Tests for the import of offline reddit dump files"""
+import json
+from typing import List
+
+import pytest
+
+from app.database import get_post_repository, get_scraper_repository
+from app.database.entities.scraper_entity import KeyWordSearch, KeyWordSearchObjective, KeyWordSearchSubreddit, ScraperEntity
+from app.services.reddit_dump_import_service import RedditDumpImportService
+
+
+def _submission(id: str, subreddit: str, title: str) -> dict:
+    return {"id": id, "subreddit": subreddit, "title": title, "selftext": "text", "author": "author", "score": 3, "created_utc": "1700000000",
+            "permalink": f"/r/{subreddit}/comments/{id}/", "upvote_ratio": 0.9, "link_flair_text": None}
+
+
+def _dump_comment(id: str, link_id: str, parent_id: str, score: int = 1) -> dict:
+    return {"id": id, "link_id": f"t3_{link_id}", "parent_id": parent_id, "body": f"body {id}", "author": "author", "score": score,
+            "created_utc": 1700000000, "controversiality": 0, "author_flair_text": None}
+
+
+def _write_dump(path, records: List[dict]) -> str:
+    path.write_text("\n".join(json.dumps(record) for record in records) + "\n{not json\n")
+    return str(path)
+
+
+def _dumps(tmp_path):
+    submissions = _write_dump(tmp_path / "RS.ndjson", [
+        _submission("p1", "deaf", "Learning sign language"),
+        _submission("p2", "Deaf", "Captions at the cinema"),
+        _submission("p3", "deaf", "Nothing to see"),
+        _submission("p4", "gaming", "sign language in games"),
+    ])
+    comments = _write_dump(tmp_path / "RC.ndjson", [
+        _dump_comment("c1", "p1", "t3_p1", score=1),
+        _dump_comment("c2", "p1", "t3_p1", score=5),
+        _dump_comment("c3", "p1", "t1_c1"),
+        _dump_comment("c4", "p1", "t1_c3"),
+        _dump_comment("c5", "p1", "t1_removed"),
+        _dump_comment("c6", "p3", "t3_p3"),
+        _dump_comment("c7", "p4", "t3_p4"),
+    ])
+    return submissions, comments
+
+
+def test_matching_submissions_are_imported_with_their_comment_trees(in_memory_db, tmp_path):
+    """Test the subreddit and keyword filters, the reassembled comment tree and that a second import skips the stored posts"""
+    submissions, comments = _dumps(tmp_path)
+    report = RedditDumpImportService.import_dumps([submissions], [comments], subreddits=["deaf"], keywords=["sign language", "captions"], batch_size=1)
+
+    assert report.model_dump() == {"submissions_read": 4, "posts_matched": 2, "comments_read": 7, "comments_matched": 5, "posts_inserted": 2,
+                                   "posts_existing": 0, "posts_invalid": 0, "malformed_lines": 2}
+    posts = {post.reddit_id: post for post in get_post_repository().find({})}
+    assert sorted(posts) == ["p1", "p2"]
+    # ordered by score, the comment with a removed parent becomes a reply to the post
+    c2, c1, c5 = posts["p1"].comments
+    assert [c2.reddit_id, c1.reddit_id, c5.reddit_id] == ["c2", "c1", "c5"]
+    assert c1.replies[0].reddit_id == "c3" and c1.replies[0].replies[0].reddit_id == "c4"
+    assert c1.replies[0].replies[0].depth == 2
+    assert posts["p2"].comments == []
+
+    second_report = RedditDumpImportService.import_dumps([submissions], [comments], subreddits=["deaf"], keywords=["sign language", "captions"])
+    assert (second_report.posts_inserted, second_report.posts_existing) == (0, 2)
+    assert get_post_repository().collection.count_documents({}) == 2
+
+
+def test_import_extends_the_keyword_searches_of_a_scraper(in_memory_db, tmp_path):
+    """Test the posts are added once to the keyword searches of the scraper that they match"""
+    submissions, comments = _dumps(tmp_path)
+    keyword_searches = {keyword: KeyWordSearch(keyword=keyword) for keyword in ("sign language", "captions")}
+    scraper_entity = ScraperEntity(user_id="user", keywords=list(keyword_searches), subreddits=["deaf"],
+                                   keyword_search_objective=KeyWordSearchObjective(keyword_subreddit_searches={"deaf": KeyWordSearchSubreddit(subreddit="deaf", keyword_searches=keyword_searches)}))
+    get_scraper_repository().insert(scraper_entity)
+
+    RedditDumpImportService.import_dumps([submissions], [comments], scraper_entity=scraper_entity)
+    RedditDumpImportService.import_dumps([submissions], [comments], scraper_entity=get_scraper_repository().find_by_id(scraper_entity.id))
+
+    post_ids = {post.reddit_id: post.id for post in get_post_repository().find({})}
+    stored_keyword_searches = get_scraper_repository().find_by_id(scraper_entity.id).keyword_search_objective.keyword_subreddit_searches["deaf"].keyword_searches
+    assert stored_keyword_searches["sign language"].found_post_ids == [post_ids["p1"]]
+    assert stored_keyword_searches["captions"].found_post_ids == [post_ids["p2"]]
+
+
+def test_zstd_compressed_dumps_are_streamed(in_memory_db, tmp_path):
+    """Test a zstd compressed dump (with the long window of the reddit dumps) is read like a plain one"""
+    zstandard = pytest.importorskip("zstandard")
+    submissions, comments = _dumps(tmp_path)
+    compressor = zstandard.ZstdCompressor(level=3, write_content_size=False)
+    for path in (submissions, comments):
+        with open(path, "rb") as plain_file, open(path + ".zst", "wb") as compressed_file:
+            compressor.copy_stream(plain_file, compressed_file)
+
+    report = RedditDumpImportService.import_dumps([submissions + ".zst"], [comments + ".zst"], subreddits=["deaf"], keywords=["sign language"])
+    assert (report.posts_inserted, report.comments_matched) == (1, 5)
@@ -0,0 +1,87 @@
+"""Tests for the cache of the reddit search results"""
+from datetime import timedelta
+from typing import List
+
+from app.database import get_reddit_search_repository
+from app.database.entities.reddit_search_entity import RedditSearchListing
+from app.services.scraper_service import ScraperService
+from app.utils import utc_timestamp
+
+
+class _RedditPost:
+    def __init__(self, id: str):
+        self.id = id
+        self.permalink = f"/r/deaf/comments/{id}/"
+
+
+class _SearchingManager:
+    """stands in for RedditAPIManager, counts the searches that would go to reddit"""
+    def __init__(self, number_posts_per_keyword: int, found_posts: int = 10):
+        self.number_posts_per_keyword = number_posts_per_keyword
+        self.found_posts = found_posts
+        self.searches: List[tuple] = list()
+
+    def find_related_posts_to_keywords(self, keyword_searches, age="all", filter="top"):
+        self.searches.extend((subreddit, keyword, age, filter) for subreddit, keyword in keyword_searches)
+        return {(subreddit, keyword): [_RedditPost(f"{keyword}_{index}") for index in range(min(self.number_posts_per_keyword, self.found_posts))]
+                for subreddit, keyword in keyword_searches}
+
+
+def _find_post_listings(manager: _SearchingManager, subreddit: str, keyword: str, age: str, filter: str) -> List[RedditSearchListing]:
+    return ScraperService.find_post_listings_of_keyword_searches(manager, [(subreddit, keyword)], age, filter)[(subreddit, keyword)]
+
+
+def test_repeated_searches_are_served_from_the_cache(in_memory_db, monkeypatch):
+    """Test the same search (in any case) is only sent to reddit once, a lower limit is served from a higher one and a higher limit searches again"""
+    monkeypatch.setenv("REDDIT_SEARCH_CACHE_TTL_SECONDS", "3600")
+    manager = _SearchingManager(number_posts_per_keyword=5)
+
+    listings = _find_post_listings(manager, "deaf", "sign", "all", "top")
+    cached_listings = _find_post_listings(manager, "Deaf", "Sign ", "all", "top")
+    assert cached_listings == listings
+    assert [listing.reddit_id for listing in listings] == [f"sign_{index}" for index in range(5)]
+    assert len(manager.searches) == 1
+
+    assert len(_find_post_listings(_SearchingManager(number_posts_per_keyword=3), "deaf", "sign", "all", "top")) == 3
+    _find_post_listings(manager, "deaf", "sign", "all", "new")
+    assert len(manager.searches) == 2
+
+    higher_limit_manager = _SearchingManager(number_posts_per_keyword=8)
+    _find_post_listings(higher_limit_manager, "deaf", "sign", "all", "top")
+    assert len(higher_limit_manager.searches) == 1
+    assert get_reddit_search_repository().collection.count_documents({}) == 2
+
+
+def test_exhausted_searches_serve_higher_limits_and_expired_searches_are_refreshed(in_memory_db, monkeypatch):
+    """Test a search that found fewer posts than its limit serves any limit, and an expired search goes to reddit again"""
+    monkeypatch.setenv("REDDIT_SEARCH_CACHE_TTL_SECONDS", "3600")
+    _find_post_listings(_SearchingManager(number_posts_per_keyword=5, found_posts=2), "deaf", "rare", "all", "top")
+    manager = _SearchingManager(number_posts_per_keyword=50, found_posts=2)
+    assert len(_find_post_listings(manager, "deaf", "rare", "all", "top")) == 2
+    assert manager.searches == []
+
+    get_reddit_search_repository().collection.update_many({}, {"$set": {"expires_at": utc_timestamp() - timedelta(seconds=1)}})
+    _find_post_listings(manager, "deaf", "rare", "all", "top")
+    assert len(manager.searches) == 1
+
+
+def test_only_the_uncached_searches_are_sent_to_reddit(in_memory_db, monkeypatch):
+    """Test a batch of searches serves the cached searches from the cache and sends the others to reddit in one call"""
+    monkeypatch.setenv("REDDIT_SEARCH_CACHE_TTL_SECONDS", "3600")
+    manager = _SearchingManager(number_posts_per_keyword=5)
+    _find_post_listings(manager, "deaf", "sign", "all", "top")
+
+    listings_per_keyword_search = ScraperService.find_post_listings_of_keyword_searches(manager, [("deaf", "sign"), ("deaf", "asl"), ("hoh", "sign")], "all", "top")
+    assert list(listings_per_keyword_search) == [("deaf", "sign"), ("deaf", "asl"), ("hoh", "sign")]
+    assert manager.searches == [("deaf", "sign", "all", "top"), ("deaf", "asl", "all", "top"), ("hoh", "sign", "all", "top")]
+    assert get_reddit_search_repository().collection.count_documents({}) == 3
+
+
+def test_cache_is_disabled_with_a_zero_ttl(in_memory_db, monkeypatch):
+    """Test every search goes to reddit when the TTL is 0"""
+    monkeypatch.setenv("REDDIT_SEARCH_CACHE_TTL_SECONDS", "0")
+    manager = _SearchingManager(number_posts_per_keyword=5)
+    _find_post_listings(manager, "deaf", "sign", "all", "top")
+    _find_post_listings(manager, "deaf", "sign", "all", "top")
+    assert len(manager.searches) == 2
+    assert get_reddit_search_repository().collection.count_documents({}) == 0
@@ -0,0 +1,35 @@
+"""Tests for the scraper against the local reddit stand-in of the benchmarks"""
+import requests
+
+from app.utils.reddit_scraper_api import RedditScraperAPI
+from app.utils.reddit_token_provider import RedditTokenProvider
+from benchmarks.reddit_stand_in import RedditStandIn
+from benchmarks.scraper_benchmark import count_comments
+
+
+def test_deep_threads_are_expanded_completely(monkeypatch):
+    """Test the scraper finds every generated comment of a thread that is deeper than the comment page, and the recorded post is served as recorded"""
+    with RedditStandIn(depth=6, initial_depth=2) as stand_in:
+        monkeypatch.setenv("REDDIT_OAUTH_BASE_URL", stand_in.base_url)
+        monkeypatch.setenv("REDDIT_WWW_BASE_URL", stand_in.base_url)
+        scraper = RedditScraperAPI(RedditTokenProvider("client", "secret", "user", "password"))
+
+        posts = scraper.search("deaf", "sign", limit=3)
+        assert len(posts) == 3
+        full_post, comments = scraper.get_post_comments(posts[0].permalink)
+        assert full_post.id == posts[0].id
+        assert count_comments(comments) == stand_in.thread(posts[0].id).number_of_comments
+        assert stand_in.requests["morechildren"] > 0
+
+        recorded_permalink = next(iter(stand_in.recorded_pages))
+        _, recorded_comments = scraper.get_post_comments(recorded_permalink)
+        assert len(recorded_comments) == 3
+
+
+def test_requests_over_the_rate_limit_get_a_429():
+    """Test the rate limit headers count down in the window and a request over the limit is refused"""
+    with RedditStandIn(rate_limit=2) as stand_in:
+        responses = [requests.get(f"{stand_in.base_url}/r/deaf/search", params={"q": "sign"}) for _ in range(3)]
+        assert [response.status_code for response in responses] == [200, 200, 429]
+        assert [response.headers["x-ratelimit-remaining"] for response in responses] == ["1", "0", "0"]
+        assert stand_in.requests["rate_limited"] == 1
@@ -0,0 +1,91 @@
+"""Tests for the process-wide cache of the reddit OAuth token"""
+import time
+
+import pytest
+
+from app.utils import reddit_scraper_api, reddit_token_provider
+from app.utils.reddit_scraper_api import RedditScraperAPI
+from app.utils.reddit_token_provider import RedditTokenProvider
+
+
+class _Response:
+    def __init__(self, status_code: int, data: dict):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"status {self.status_code}")
+
+
+def _token_endpoint(monkeypatch, expires_in: float = 3600):
+    token_requests = []
+
+    def post(url, auth=None, data=None, headers=None):
+        token_requests.append(data)
+        return _Response(200, {"access_token": f"token_{len(token_requests)}", "expires_in": expires_in})
+
+    monkeypatch.setattr(reddit_token_provider.requests, "post", post)
+    return token_requests
+
+
+def test_token_is_cached_across_scrapers(monkeypatch):
+    """Test the scrapers of the same account share one token, requested once"""
+    token_requests = _token_endpoint(monkeypatch)
+    monkeypatch.setenv("CLIENT_ID", "client_cached")
+    monkeypatch.setenv("REDDIT_USERNAME", "user")
+
+    headers = [RedditScraperAPI().headers for _ in range(3)]
+
+    assert len(token_requests) == 1
+    assert token_requests[0]["grant_type"] == "password"
+    assert all(header["Authorization"] == "bearer token_1" for header in headers)
+
+
+def test_token_is_refreshed_ahead_of_expiry(monkeypatch):
+    """Test a token that expires within the refresh margin is replaced before it is used"""
+    token_requests = _token_endpoint(monkeypatch, expires_in=0.2)
+    token_provider = RedditTokenProvider("client", "secret", "user", "password", refresh_margin_seconds=0.1)
+
+    assert token_provider.get_token() == "token_1"
+    assert token_provider.get_token() == "token_1"
+    time.sleep(0.15)
+    assert token_provider.get_token() == "token_2"
+    assert len(token_requests) == 2
+
+
+def test_unauthorized_request_is_retried_once_with_a_new_token(monkeypatch):
+    """Test a 401 invalidates the token and the request is retried with a new one, a stale 401 does not drop the new token"""
+    _token_endpoint(monkeypatch)
+    token_provider = RedditTokenProvider("client", "secret", "user", "password")
+    sent_tokens = []
+
+    def get(url, headers=None, params=None):
+        sent_tokens.append(headers["Authorization"])
+        return _Response(401 if len(sent_tokens) == 1 else 200, {"kind": "Listing", "data": {"after": None, "dist": None, "modhash": None, "before": None, "children": []}})
+
+    monkeypatch.setattr(reddit_scraper_api.requests, "get", get)
+    assert RedditScraperAPI(token_provider).search("deaf", "sign") == []
+    assert sent_tokens == ["bearer token_1", "bearer token_2"]
+
+    token_provider.invalidate({"Authorization": "bearer token_1"})
+    assert token_provider.get_token() == "token_2"
+
+
+def test_permanently_rejected_credential_is_retried_only_once(monkeypatch):
+    """Test a second 401 is not retried again but raised, and no listing is parsed from it"""
+    token_requests = _token_endpoint(monkeypatch)
+    sent_tokens = []
+
+    def get(url, headers=None, params=None):
+        sent_tokens.append(headers["Authorization"])
+        return _Response(401, {"message": "Unauthorized"})
+
+    monkeypatch.setattr(reddit_scraper_api.requests, "get", get)
+    with pytest.raises(Exception, match="status 401"):
+        RedditScraperAPI(RedditTokenProvider("client", "secret", "user", "password")).search("deaf", "sign")
+    assert sent_tokens == ["bearer token_1", "bearer token_2"]
+    assert len(token_requests) == 2
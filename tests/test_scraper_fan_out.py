@@ -0,0 +1,97 @@
+"""Tests for the concurrent subreddit x keyword fan-out of the scraper"""
+from datetime import timedelta
+from typing import List
+
+from app.database import get_post_repository, get_scraper_repository
+from app.requests.scraper_requests import CreateScraperRequest
+from app.responses.reddit_post_comments_response import RedditPost
+from app.services import scraper_service
+from app.services.scraper_service import ScraperService
+from app.utils import utc_timestamp
+from tests.conftest import make_post
+
+
+def _reddit_post(id: str) -> RedditPost:
+    return RedditPost.model_validate({"id": id, "subreddit": "deaf", "ups": 1, "downs": 0, "send_replies": True, "permalink": f"/r/deaf/comments/{id}/",
+                                      "author_flair_text": None, "author": "author", "created_utc": 1700000000, "title": "title", "upvote_ratio": 1.0,
+                                      "selftext": "text", "link_flair_text": None, "selftext_html": None})
+
+
+class _FanOutManager:
+    """stands in for RedditAPIManager, every keyword finds the posts 'shared' and '<keyword>' and the keyword 'broken' fails"""
+    instances: List["_FanOutManager"] = list()
+    pause_after = None # the number of posts after which the scraper is paused
+
+    def __init__(self, number_posts_per_keyword: int):
+        self.number_posts_per_keyword = number_posts_per_keyword
+        self.searches: List[tuple] = list()
+        self.scraped_permalinks: List[str] = list()
+        _FanOutManager.instances.append(self)
+
+    def find_related_posts_to_keywords(self, keyword_searches, age="all", filter="top"):
+        self.searches.extend(keyword_searches)
+        return {(subreddit, keyword): [_reddit_post("shared"), _reddit_post(f"{subreddit}_{keyword}")]
+                for subreddit, keyword in keyword_searches if keyword != "broken"}
+
+    def scrape_comments_of_posts(self, permalinks, on_post_scraped, should_stop=lambda: False):
+        for permalink in permalinks:
+            if self.pause_after is not None and len(self.scraped_permalinks) == self.pause_after:
+                return False
+            self.scraped_permalinks.append(permalink)
+            on_post_scraped(_reddit_post(permalink.rstrip("/").rsplit("/", 1)[-1]), [])
+        return True
+
+
+def _scraper(subreddits: List[str], keywords: List[str]):
+    scraper_entity = ScraperService.create_scraper_entity(CreateScraperRequest(scraper_cluster_id="cluster", keywords=keywords, subreddits=subreddits), "user")
+    scraper_entity.status = "ongoing"
+    get_scraper_repository().insert(scraper_entity)
+    return scraper_entity
+
+
+def test_posts_found_by_several_keywords_are_scraped_once(in_memory_db, monkeypatch):
+    """Test all searches are sent at once, a post that several searches found is scraped once and added to each search, and the scraper completes"""
+    monkeypatch.setattr(scraper_service, "RedditAPIManager", _FanOutManager)
+    get_post_repository().insert(make_post("deaf_sign"))
+    scraper_entity = _scraper(["deaf", "hoh"], ["sign", "hearing"])
+
+    message = ScraperService.scrape_all_subreddits_keywords(scraper_entity)
+
+    manager = _FanOutManager.instances[-1]
+    assert sorted(manager.searches) == [("deaf", "hearing"), ("deaf", "sign"), ("hoh", "hearing"), ("hoh", "sign")]
+    assert sorted(manager.scraped_permalinks) == sorted(f"/r/deaf/comments/{id}/" for id in ("shared", "deaf_hearing", "hoh_hearing", "hoh_sign"))
+    assert (message.processed, message.total, message.paused) == (4, 4, False)
+
+    scraper_entity = get_scraper_repository().find_by_id(scraper_entity.id)
+    assert scraper_entity.status == "completed"
+    shared_post_id = get_post_repository().find_one({"reddit_id": "shared"}).id
+    for keyword_search_subreddit in scraper_entity.keyword_search_objective.keyword_subreddit_searches.values():
+        assert keyword_search_subreddit.status == "done"
+        for keyword_search in keyword_search_subreddit.keyword_searches.values():
+            assert keyword_search.status == "done"
+            assert len(keyword_search.found_post_ids) == 2 and shared_post_id in keyword_search.found_post_ids
+    assert get_post_repository().collection.count_documents({}) == 5
+
+
+def test_claims_are_exclusive_and_unfinished_searches_go_back_to_pending(in_memory_db, monkeypatch):
+    """Test a claimed search is not claimed twice until its claim is stale, a failed search is retried by the next run and a paused run releases its claims"""
+    monkeypatch.setattr(scraper_service, "RedditAPIManager", _FanOutManager)
+    scraper_entity = _scraper(["deaf"], ["sign", "broken"])
+    now = utc_timestamp()
+    assert get_scraper_repository().claim_keyword_search(scraper_entity.id, "deaf", "sign", now - timedelta(hours=1))
+    assert not get_scraper_repository().claim_keyword_search(scraper_entity.id, "deaf", "sign", now - timedelta(hours=1))
+    assert get_scraper_repository().claim_keyword_search(scraper_entity.id, "deaf", "sign", now + timedelta(seconds=1))
+    get_scraper_repository().release_keyword_searches(scraper_entity.id, [("deaf", "sign")])
+
+    message = ScraperService.scrape_all_subreddits_keywords(scraper_entity)
+    keyword_searches = get_scraper_repository().find_by_id(scraper_entity.id).keyword_search_objective.keyword_subreddit_searches["deaf"].keyword_searches
+    assert (keyword_searches["sign"].status, keyword_searches["broken"].status) == ("done", "pending")
+    assert message.processed == 1
+    assert get_scraper_repository().find_by_id(scraper_entity.id).status == "error"
+
+    paused_scraper_entity = _scraper(["hoh"], ["sign", "hearing"])
+    monkeypatch.setattr(_FanOutManager, "pause_after", 1)
+    message = ScraperService.scrape_all_subreddits_keywords(paused_scraper_entity)
+    assert message.paused
+    keyword_searches = get_scraper_repository().find_by_id(paused_scraper_entity.id).keyword_search_objective.keyword_subreddit_searches["hoh"].keyword_searches
+    assert all(keyword_search.status == "pending" and keyword_search.claimed_at is None for keyword_search in keyword_searches.values())
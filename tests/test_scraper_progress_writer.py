@@ -0,0 +1,46 @@
+"""Tests for the write-behind buffer of the scraper progress"""
+from app.database import get_post_repository, get_scraper_repository
+from app.database.entities.scraper_entity import KeyWordSearch, KeyWordSearchObjective, KeyWordSearchSubreddit, ScraperEntity
+from app.services.scraper_progress_writer import ScraperProgressWriter
+from tests.conftest import make_post
+
+
+def _scraper() -> ScraperEntity:
+    keyword_searches = {keyword: KeyWordSearch(keyword=keyword) for keyword in ("sign", "hearing")}
+    return ScraperEntity(user_id="user", keywords=list(keyword_searches), subreddits=["deaf"],
+                         keyword_search_objective=KeyWordSearchObjective(keyword_subreddit_searches={"deaf": KeyWordSearchSubreddit(subreddit="deaf", keyword_searches=keyword_searches)}))
+
+
+def test_writes_are_batched_until_flush(in_memory_db):
+    """Test the posts and post ids are only written on a flush, and then all in the right keyword searches"""
+    scraper_entity = _scraper()
+    get_scraper_repository().insert(scraper_entity)
+
+    with ScraperProgressWriter(scraper_entity.id, max_buffered_posts=100) as progress_writer:
+        progress_writer.add_existing_post_ids("deaf", "sign", ["existing"])
+        posts = [make_post(f"post_{index}") for index in range(3)]
+        for post in posts:
+            progress_writer.add_post("deaf", "sign" if post.reddit_id != "post_2" else "hearing", post)
+        assert get_post_repository().collection.count_documents({}) == 0
+
+    keyword_searches = get_scraper_repository().find_by_id(scraper_entity.id).keyword_search_objective.keyword_subreddit_searches["deaf"].keyword_searches
+    assert keyword_searches["sign"].found_post_ids == ["existing", posts[0].id, posts[1].id]
+    assert keyword_searches["hearing"].found_post_ids == [posts[2].id]
+    assert get_post_repository().collection.count_documents({}) == 3
+
+
+def test_flushes_by_count_and_skips_failed_inserts(in_memory_db):
+    """Test the buffer flushes when it is full, and a post that fails to insert is not added to the keyword search"""
+    scraper_entity = _scraper()
+    get_scraper_repository().insert(scraper_entity)
+    duplicate_post = make_post("duplicate")
+    get_post_repository().insert(duplicate_post)
+
+    progress_writer = ScraperProgressWriter(scraper_entity.id, max_buffered_posts=2)
+    new_post = make_post("new")
+    progress_writer.add_post("deaf", "sign", duplicate_post)
+    progress_writer.add_post("deaf", "sign", new_post)
+
+    assert progress_writer.buffered_posts == 0
+    keyword_searches = get_scraper_repository().find_by_id(scraper_entity.id).keyword_search_objective.keyword_subreddit_searches["deaf"].keyword_searches
+    assert keyword_searches["sign"].found_post_ids == [new_post.id]
@@ -0,0 +1,74 @@
+"""Tests for the trusted decode path of entities read from the database"""
+from typing import List
+
+from pydantic import BaseModel, model_validator
+from pydantic._internal._model_construction import ModelMetaclass
+
+from app.database.entities.cluster_unit_entity import ClusterUnitEntity, ClusterUnitEntityPredictedCategory, PredictionCategoryTokens
+from app.database.entities.label_template import LabelTemplateLLMProjection, LabelValueField, ProjectionLabelField
+from app.database.trusted_decode import decode_trusted, get_trusted_decoder
+
+
+def _cluster_unit_document():
+    values = {"problem_description": ProjectionLabelField(label="problem_description", value=True, type="boolean",
+                                                          per_label_details=[LabelValueField(label="reason", value="text", type="string")])}
+    prediction = PredictionCategoryTokens(labels_prediction=LabelTemplateLLMProjection(label_template_id="template", experiment_id="experiment", values=values),
+                                          tokens_used={"total_tokens": 10})
+    return ClusterUnitEntity(cluster_entity_id="cluster", post_id="post", comment_post_id="comment", type="comment", reddit_id="reddit",
+                             author="author", usertag=None, upvotes=1, downvotes=0, created_utc=1700000000, thread_path_text=["text"],
+                             thread_path_author=["author"], text="text", enriched_comment_thread_text=None, subreddit="subreddit",
+                             predicted_category={"experiment": ClusterUnitEntityPredictedCategory(experiment_id="experiment", predicted_categories=[prediction])}
+                             ).dump_for_database()
+
+
+def test_trusted_decode_equals_model_validate():
+    """Test the trusted decoder returns the same entity as model_validate for a stored document"""
+    document = _cluster_unit_document()
+
+    assert decode_trusted(ClusterUnitEntity, document, verify_rate=1.0) == ClusterUnitEntity.model_validate(document)
+
+
+def test_trusted_decode_skips_after_validators():
+    """Test the python validators of nested models are skipped while model_validate still runs them"""
+    document = {"label": "label", "value": [True], "type": "boolean"}
+
+    assert get_trusted_decoder(LabelValueField)(document).value == [True]
+    assert LabelValueField.model_validate(document).value is True
+    assert ClusterUnitEntity.__pydantic_complete__ and LabelValueField.__pydantic_complete__
+
+
+class _RecordingMetaclass(ModelMetaclass):
+    """records the attributes that are set on the model classes after they are created"""
+    set_attributes: List[str] = list()
+
+    def __setattr__(cls, name, value):
+        _RecordingMetaclass.set_attributes.append(f"{cls.__name__}.{name}")
+        super().__setattr__(name, value)
+
+
+class _Label(BaseModel, metaclass=_RecordingMetaclass):
+    value: List[bool] | bool
+
+    @model_validator(mode="after")
+    def delist_value(self):
+        if isinstance(self.value, list):
+            self.value = self.value[0]
+        return self
+
+
+class _Run(BaseModel, metaclass=_RecordingMetaclass):
+    labels: List[_Label]
+
+
+def test_compiling_a_decoder_leaves_the_model_classes_untouched():
+    """Test the decoder is compiled without setting anything on the model classes (that other threads validate with at the same time),
+    and still returns instances of the model classes"""
+    _RecordingMetaclass.set_attributes.clear()
+
+    run = get_trusted_decoder(_Run)({"labels": [{"value": [True]}]})
+
+    assert _RecordingMetaclass.set_attributes == []
+    assert type(run) is _Run and type(run.labels[0]) is _Label
+    assert run.labels[0].value == [True]
+    assert run == _Run.model_construct(labels=[_Label.model_construct(value=[True])])
+    assert _Run.model_validate({"labels": [{"value": [True]}]}).labels[0].value is True